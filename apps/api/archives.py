@@ -0,0 +1,755 @@
+'''
+归档文件(tar/zip)上传，服务端解压为存储桶目录下的多个对象：
+中间目录逐个创建(需要目录id)，对象元数据按批bulk_create插入桶表；
+对象数据在插入元数据前写入，此时还没有对象id，不能使用对象key，小对象内联或打包存储，其他对象数据写入独立的rados key，
+对象数据布局为RelocatedLayout；
+
+目录打包下载，遍历目录树流式生成tar或zip，见build_dir_archive_response()
+'''
+import zlib
+import uuid
+import logging
+import struct
+import hashlib
+import zipfile
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.utils.http import urlquote
+from django.http import StreamingHttpResponse
+from rest_framework import status
+
+from buckets.utils import BucketFileManagement
+from buckets.packs import append_to_pack, get_pack_max_object_size
+from utils.oss import HarborObject, RadosError
+from utils.oss.pyrados import get_new_object_layout, RelocatedLayout
+from .harbor import HarborManager, HarborError, get_inline_max_size
+
+
+debug_logger = logging.getLogger('debug')
+
+ARCHIVE_FORMATS = ('tar', 'zip')
+
+
+def get_archive_upload_conf():
+    '''
+    归档文件上传配置，settings.ARCHIVE_UPLOAD
+
+    :return: dict
+    '''
+    conf = getattr(settings, 'ARCHIVE_UPLOAD', None)
+    return conf if conf else {}
+
+
+def normalize_entry_name(name: str):
+    '''
+    归档条目名称规范化为相对路径，去除开头的'/'和'.'路径
+
+    :return:
+        str
+        None    # 无效的名称，为空、包含'..'或名称过长
+    '''
+    parts = [p for p in name.replace('\\', '/').split('/') if p not in ('', '.')]
+    if not parts or '..' in parts or any(len(p) > 255 for p in parts):
+        return None
+
+    return '/'.join(parts)
+
+
+def iter_tar_entries(stream):
+    '''
+    流式读取tar(包括gzip、bz2、xz压缩的tar)的条目，不需要随机访问
+
+    :return: generator
+        ('dir', name, 0, None)
+        ('file', name, size, fileobj)
+        ('other', name, 0, None)     # 链接、设备等不支持的条目
+    :raises: tarfile.TarError
+    '''
+    with tarfile.open(fileobj=stream, mode='r|*') as tf:
+        for member in tf:
+            if member.isdir():
+                yield 'dir', member.name, 0, None
+            elif member.isfile():
+                yield 'file', member.name, member.size, tf.extractfile(member)
+            else:
+                yield 'other', member.name, 0, None
+
+
+def iter_zip_entries(stream, spool_size: int = 64 * 1024 ** 2, max_size: int = None):
+    '''
+    读取zip的条目；zip的目录在文件末尾，请求体先写入临时文件(小于spool_size时在内存中)
+
+    :param max_size: 请求体大小上限，None不限制
+    :return: generator, 同iter_tar_entries()
+    :raises: zipfile.BadZipFile, HarborError(413)
+    '''
+    with tempfile.SpooledTemporaryFile(max_size=spool_size) as f:
+        size = 0
+        while True:
+            data = stream.read(8 * 1024 ** 2)
+            if not data:
+                break
+
+            size += len(data)
+            if max_size is not None and size > max_size:
+                raise HarborError(code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, msg='zip归档文件过大')
+            f.write(data)
+
+        f.seek(0)
+        with zipfile.ZipFile(f) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    yield 'dir', info.filename, 0, None
+                else:
+                    with zf.open(info) as entry:
+                        yield 'file', info.filename, info.file_size, entry
+
+
+class ArchiveUploader:
+    '''
+    归档文件解压到存储桶目录
+
+    不大于memory_max_size的文件条目数据读入内存，累积一批后，一次查询同名冲突，由线程池并行写入rados(最多workers个)，
+    再bulk_create插入这一批对象元数据；更大的文件条目顺序流式写入rados后单独插入元数据；
+    已存在同名对象或目录的条目不覆盖，在结果清单中返回错误
+    '''
+    memory_max_size = 16 * 1024 ** 2    # 读入内存并行写入的条目大小上限
+    batch_max_bytes = 128 * 1024 ** 2   # 一批缓存的数据量上限
+    read_size = 8 * 1024 ** 2           # 流式写入时每次读取的数据大小
+
+    def __init__(self, bucket, dir_path: str, workers: int = 8, batch_size: int = 500, max_entries: int = 100000):
+        '''
+        :param bucket: 存储桶
+        :param dir_path: 解压到的目录路径，空字符串为桶根目录
+        :param workers: 并行写入rados的线程数
+        :param batch_size: 每批插入元数据的对象数
+        :param max_entries: 条目数上限，之后的条目不处理
+        :raises: HarborError    # 目录不存在
+        '''
+        self.bucket = bucket
+        self.pool_name = bucket.get_pool_name()
+        self.dir_path = dir_path.strip('/')
+        self.workers = max(workers, 1)
+        self.batch_size = max(batch_size, 1)
+        self.max_entries = max_entries
+        self.layout = get_new_object_layout(pool_name=self.pool_name, bucket_name=bucket.name)
+        self.inline_max_size = get_inline_max_size()
+        self.pack_max_size = get_pack_max_object_size()
+
+        self.bfm = BucketFileManagement(path=self.dir_path, collection_name=bucket.get_bucket_table_name())
+        self.model_class = self.bfm.get_obj_model_class()
+        try:
+            ok, did = self.bfm.get_cur_dir_id()
+        except Exception as e:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg=f'查询目录错误，{str(e)}')
+        if not ok:
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='目录路径不存在')
+
+        self._dirs = {self.dir_path: did}     # {目录全路径: 目录id}
+        self._seen = set()                  # 归档中已处理的对象全路径
+        self._batch = []                    # [(result, row, data)]
+        self._batch_bytes = 0
+        self.results = []
+
+    def _full_path(self, rel_path: str):
+        return f'{self.dir_path}/{rel_path}' if self.dir_path else rel_path
+
+    def _result(self, name: str, type_: str):
+        result = {'name': name, 'type': type_, 'ok': False, 'size': 0, 'md5': '', 'msg': ''}
+        self.results.append(result)
+        return result
+
+    def ensure_dir(self, path: str):
+        '''
+        目录不存在时创建，包括中间目录
+
+        :param path: 目录全路径
+        :return: 目录id
+        :raises: HarborError
+        '''
+        did = self._dirs.get(path, None)
+        if did is not None:
+            return did
+
+        parent, _, name = path.rpartition('/')
+        parent_id = self.ensure_dir(parent)
+        try:
+            obj = self.bfm.get_obj(path=path)
+        except Exception as e:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg=str(e))
+
+        if obj is not None:
+            if not obj.is_dir():
+                raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg=f'"{path}"已存在同名的对象')
+            did = obj.id
+        else:
+            obj = self.model_class(na=path, name=name, fod=False, did=parent_id)
+            try:
+                obj.save(force_insert=True)
+            except Exception as e:
+                raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg=f'创建目录"{path}"失败，{str(e)}')
+
+            # 父目录在查询后开始移动时，新目录的全路径不会被改写
+            if HarborManager._is_dir_moving(self.model_class, parent_id):
+                obj.delete()
+                raise HarborError(code=status.HTTP_409_CONFLICT, msg=f'"{parent}"目录正在移动中')
+            did = obj.id
+
+        self._dirs[path] = did
+        return did
+
+    def extract(self, entries):
+        '''
+        解压所有条目
+
+        :param entries: iter_tar_entries()或iter_zip_entries()
+        :return:
+            [{'name': str, 'type': 'file' or 'dir', 'ok': bool, 'size': int, 'md5': str, 'msg': str}, ]
+        :raises: tarfile.TarError, zipfile.BadZipFile, OSError    # 归档文件格式错误或读取请求数据错误
+        '''
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            self._executor = executor
+            count = 0
+            for type_, name, size, fileobj in entries:
+                count += 1
+                if count > self.max_entries:
+                    self._result(name, type_)['msg'] = f'超过条目数上限{self.max_entries}，之后的条目未处理'
+                    break
+
+                rel_path = normalize_entry_name(name)
+                if rel_path is None:
+                    self._result(name, type_)['msg'] = '无效的条目名称'
+                elif type_ == 'dir':
+                    self._add_dir(name, rel_path)
+                elif type_ == 'file':
+                    self._add_file(name, rel_path, size, fileobj)
+                else:
+                    self._result(name, type_)['msg'] = '不支持的条目类型'
+
+            self.flush()
+
+        return self.results
+
+    def _add_dir(self, name: str, rel_path: str):
+        result = self._result(name, 'dir')
+        try:
+            self.ensure_dir(self._full_path(rel_path))
+        except HarborError as e:
+            result['msg'] = e.msg
+            return
+
+        result['ok'] = True
+
+    def _add_file(self, name: str, rel_path: str, size: int, fileobj):
+        result = self._result(name, 'file')
+        full_path = self._full_path(rel_path)
+        if full_path in self._seen:
+            result['msg'] = '归档中有重复的条目'
+            return
+
+        self._seen.add(full_path)
+        parent, _, filename = full_path.rpartition('/')
+        try:
+            did = self.ensure_dir(parent)
+        except HarborError as e:
+            result['msg'] = e.msg
+            return
+
+        row = self.model_class(na=full_path, name=filename, fod=True, did=did, si=size, upt=timezone.now())
+        row.reset_na_md5()
+        if size > self.memory_max_size:
+            self.flush()
+            self._save_large(result, row, fileobj)
+            return
+
+        data = fileobj.read()
+        if len(data) != size:
+            result['msg'] = '条目数据不完整'
+            return
+
+        self._batch.append((result, row, data))
+        self._batch_bytes += size
+        if len(self._batch) >= self.batch_size or self._batch_bytes >= self.batch_max_bytes:
+            self.flush()
+
+    def _new_data_layout(self):
+        '''
+        对象数据写入的独立rados key和布局
+
+        :return: (data_key, RelocatedLayout())
+        '''
+        data_key = f'a_{uuid.uuid1().hex}'
+        layout = RelocatedLayout(data_key=data_key, inner=self.layout)
+        if len(str(layout)) > 64:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='数据布局字符串过长')
+
+        return data_key, layout
+
+    def _store(self, row, data: bytes):
+        '''
+        写入一个小对象的数据，内联、打包或写入独立的rados key，线程池中执行
+
+        :raises: HarborError
+        '''
+        size = len(data)
+        row.md5 = hashlib.md5(data).hexdigest()
+        if size == 0 or size <= self.inline_max_size:
+            row.inl = data
+            return
+
+        try:
+            if size <= self.pack_max_size:
+                row.lay = str(append_to_pack(pool_name=self.pool_name, data=data))
+                return
+
+            data_key, layout = self._new_data_layout()
+            ho = HarborObject(pool_name=self.pool_name, obj_id=data_key, layout=self.layout)
+            ok, msg = ho.write(data_block=data, offset=0)
+            if not ok:
+                raise RadosError(msg)
+            row.lay = str(layout)
+        except RadosError as e:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg=f'写入对象数据失败，{str(e)}')
+        finally:
+            # 线程池中打包写入可能创建了数据库连接
+            connection.close()
+
+    def _delete_data(self, row):
+        '''
+        删除元数据插入失败的对象写入独立rados key的数据；内联数据随元数据，pack中的数据由pack压缩回收
+        '''
+        if row.lay.startswith('v5:'):
+            HarborObject(pool_name=self.pool_name, obj_id='', obj_size=row.si, layout=row.lay).delete()
+
+    def _existing_names(self, rows):
+        '''
+        已存在的同名对象或目录
+
+        :return: set([(did, name), ])
+        '''
+        dids = {row.did for row in rows}
+        names = {row.name for row in rows}
+        qs = self.model_class.objects.filter(did__in=dids, name__in=names).values_list('did', 'name')
+        return set(qs)
+
+    def flush(self):
+        '''
+        并行写入一批对象数据，再批量插入元数据
+        '''
+        batch, self._batch, self._batch_bytes = self._batch, [], 0
+        if not batch:
+            return
+
+        try:
+            existing = self._existing_names([row for _, row, _ in batch])
+        except Exception as e:
+            for result, _, _ in batch:
+                result['msg'] = f'查询对象错误，{str(e)}'
+            return
+
+        futures = []
+        for result, row, data in batch:
+            if (row.did, row.name) in existing:
+                result['msg'] = '已存在同名的对象或目录'
+                continue
+
+            futures.append((result, row, self._executor.submit(self._store, row, data)))
+
+        rows = []
+        for result, row, future in futures:
+            try:
+                future.result()
+            except HarborError as e:
+                result['msg'] = e.msg
+                continue
+
+            rows.append((result, row))
+
+        self._insert_rows(rows)
+
+    def _insert_rows(self, rows):
+        '''
+        批量插入对象元数据，失败时(如并发创建了同名对象)逐个插入
+        '''
+        if not rows:
+            return
+
+        try:
+            self.model_class.objects.bulk_create([row for _, row in rows])
+        except Exception:
+            for result, row in rows:
+                self._insert_one(result, row)
+            return
+
+        rows = self._discard_in_moving_dirs(rows)
+        for result, row in rows:
+            self._set_ok(result, row)
+
+    def _insert_one(self, result, row):
+        try:
+            row.save(force_insert=True)
+        except Exception as e:
+            self._delete_data(row)
+            result['msg'] = f'插入对象元数据失败，{str(e)}'
+            return
+
+        if self._discard_in_moving_dirs([(result, row)]):
+            self._set_ok(result, row)
+
+    def _discard_in_moving_dirs(self, rows):
+        '''
+        插入后检查对象所在目录是否正在移动中，所在目录在插入前开始移动时可能已查询过其下的元数据，
+        新对象的全路径不会被改写，删除这些对象的元数据和数据，见HarborManager._move_rename_dir()
+
+        :param rows: 已插入的[(result, row), ]
+        :return: 所在目录没有移动的[(result, row), ]
+        '''
+        moving = self.model_class.NA_MD5_MOVING
+        dids = {row.did for _, row in rows if row.did}
+        try:
+            moving_dids = set(self.model_class.objects.filter(id__in=dids, na_md5=moving).values_list('id', flat=True))
+        except Exception as e:
+            moving_dids = dids      # 无法确认时按移动中处理
+            debug_logger.error(f'failed to check moving dirs when extracting archive, {str(e)}')
+
+        if not moving_dids:
+            return rows
+
+        kept = []
+        discarded = {}     # {did: [(result, row), ]}
+        for result, row in rows:
+            if row.did in moving_dids:
+                discarded.setdefault(row.did, []).append((result, row))
+            else:
+                kept.append((result, row))
+
+        for did, items in discarded.items():
+            try:
+                self.model_class.objects.filter(did=did, name__in=[row.name for _, row in items]).delete()
+            except Exception as e:
+                debug_logger.error(f'failed to delete objects in moving dir id={did}, {str(e)}')
+                for result, _ in items:
+                    result['msg'] = f'所在目录正在移动中，删除已插入的对象元数据失败，{str(e)}'
+                continue
+
+            for result, row in items:
+                self._delete_data(row)
+                result['msg'] = '所在目录正在移动中'
+
+        return kept
+
+    @staticmethod
+    def _set_ok(result, row):
+        result['ok'] = True
+        result['size'] = row.si
+        result['md5'] = row.md5
+
+    def _save_large(self, result, row, fileobj):
+        '''
+        大对象数据从归档中顺序读取，流式写入独立的rados key后插入元数据
+        '''
+        try:
+            if self._existing_names([row]):
+                result['msg'] = '已存在同名的对象或目录'
+                return
+        except Exception as e:
+            result['msg'] = f'查询对象错误，{str(e)}'
+            return
+
+        try:
+            data_key, layout = self._new_data_layout()
+        except HarborError as e:
+            result['msg'] = e.msg
+            return
+
+        ho = HarborObject(pool_name=self.pool_name, obj_id=data_key, layout=self.layout)
+        md5_hash = hashlib.md5()
+        pos = 0
+        writer = None
+        try:
+            writer = ho.get_aio_writer()
+            while pos < row.si:
+                data = fileobj.read(min(self.read_size, row.si - pos))
+                if not data:
+                    break
+
+                writer.write(data, offset=pos)
+                md5_hash.update(data)
+                pos += len(data)
+
+            writer.flush()
+        except RadosError as e:
+            if writer is not None:
+                writer.abort()
+            ho.delete(obj_size=row.si)
+            result['msg'] = f'写入对象数据失败，{str(e)}'
+            return
+        except (OSError, EOFError, tarfile.TarError, zipfile.BadZipFile) as e:
+            # 读取归档数据出错，删除已写入的数据，由upload_archive()中止解压
+            if writer is not None:
+                writer.abort()
+            ho.delete(obj_size=row.si)
+            raise e
+
+        if pos != row.si:
+            ho.delete(obj_size=row.si)
+            result['msg'] = '条目数据不完整'
+            return
+
+        row.lay = str(layout)
+        row.md5 = md5_hash.hexdigest()
+        self._insert_one(result, row)
+
+
+def upload_archive(bucket_name: str, dir_path: str, stream, archive_format: str, size: int = None, user=None):
+    '''
+    上传归档文件解压到存储桶的目录下
+
+    :param dir_path: 目录路径，空字符串为桶根目录
+    :param stream: 请求体流，有read(size)方法
+    :param archive_format: 'tar'(包括压缩的tar) or 'zip'
+    :param size: 请求体大小(Content-Length)，zip需要先写入临时文件，超过settings.ARCHIVE_UPLOAD['ZIP_MAX_SIZE']时拒绝
+    :return:
+        [{'name': str, 'type': 'file' or 'dir', 'ok': bool, 'size': int, 'md5': str, 'msg': str}, ]
+    :raises: HarborError
+    '''
+    if archive_format not in ARCHIVE_FORMATS:
+        raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg='不支持的归档文件格式')
+
+    bucket = HarborManager().get_bucket(bucket_name, user=user)
+    if not bucket:
+        raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='存储桶不存在')
+
+    conf = get_archive_upload_conf()
+    zip_max_size = conf.get('ZIP_MAX_SIZE', None)
+    if archive_format == 'zip' and zip_max_size is not None and size is not None and size > zip_max_size:
+        raise HarborError(code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, msg='zip归档文件过大')
+
+    uploader = ArchiveUploader(bucket=bucket, dir_path=dir_path, workers=conf.get('WORKERS', 8),
+                               batch_size=conf.get('BATCH_SIZE', 500), max_entries=conf.get('MAX_ENTRIES', 100000))
+    if archive_format == 'zip':
+        entries = iter_zip_entries(stream, max_size=zip_max_size)
+    else:
+        entries = iter_tar_entries(stream)
+
+    try:
+        return uploader.extract(entries)
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError) as e:
+        raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg=f'归档文件格式有误，{str(e)}',
+                          results=uploader.results)
+    except OSError as e:
+        raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg=f'读取归档文件数据错误，{str(e)}',
+                          results=uploader.results)
+
+
+def iter_dir_tree(model_class, did: int, path: str = '', per_num: int = 500):
+    '''
+    深度优先遍历目录树，每个目录的子目录和对象按id分批查询(keyset分页)，内存占用只和目录深度有关，和目录树大小无关；
+    忽略标记为删除的(等待递归删除任务删除的目录子树)
+
+    :param model_class: 桶表模型类
+    :param did: 目录id
+    :param path: 目录在归档中的路径
+    :return: generator
+        (path, obj)     # 子目录或对象在归档中的路径
+    '''
+    last_id = 0
+    while True:
+        objs = list(model_class.objects.filter(did=did, id__gt=last_id, sds=False).order_by('id')[:per_num])
+        if not objs:
+            return
+
+        for obj in objs:
+            obj_path = f'{path}/{obj.name}' if path else obj.name
+            yield obj_path, obj
+            if obj.is_dir():
+                yield from iter_dir_tree(model_class, did=obj.id, path=obj_path, per_num=per_num)
+
+        last_id = objs[-1].id
+
+
+def _read_exactly(read, obj):
+    '''
+    读取对象数据，数据长度和对象大小不一致时抛出错误，中止归档流
+    '''
+    size = 0
+    for data in read(obj):
+        size += len(data)
+        yield data
+
+    if size != obj.si:
+        raise IOError(f'object "{obj.na}" size mismatch')
+
+
+def tar_stream(entries, read):
+    '''
+    流式生成tar(PAX格式，支持长文件名和大文件)
+
+    :param entries: generator, (path, obj)
+    :param read: 读取对象数据的函数，read(obj)返回bytes的可迭代对象
+    :return: generator
+    '''
+    for path, obj in entries:
+        mtime = obj.upt if obj.upt else obj.ult
+        info = tarfile.TarInfo(name=path)
+        info.mtime = int(mtime.timestamp()) if mtime else 0
+        if obj.is_dir():
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            yield info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8')
+            continue
+
+        info.size = obj.si
+        info.mode = 0o644
+        yield info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8')
+        yield from _read_exactly(read, obj)
+        if obj.si % tarfile.BLOCKSIZE:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - obj.si % tarfile.BLOCKSIZE)
+
+    yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FLAGS = 0x08 | 0x800        # 数据描述符记录CRC和大小；文件名UTF-8编码
+
+
+def _dos_date_time(obj):
+    '''
+    对象修改时间的DOS日期时间，zip不能表示1980年之前的时间
+
+    :return: (dos_time, dos_date)
+    '''
+    mtime = obj.upt if obj.upt else obj.ult
+    dt = timezone.localtime(mtime).timetuple()[:6] if mtime else (1980, 1, 1, 0, 0, 0)
+    if dt[0] < 1980:
+        dt = (1980, 1, 1, 0, 0, 0)
+
+    return (dt[3] << 11) | (dt[4] << 5) | (dt[5] // 2), ((dt[0] - 1980) << 9) | (dt[1] << 5) | dt[2]
+
+
+def _zip_local_header(name: bytes, dos_time: int, dos_date: int, zip64: bool):
+    if zip64:   # 大小在数据描述符中，本地头ZIP64扩展字段的大小为0
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0)
+        size = ZIP64_LIMIT
+    else:
+        extra = b''
+        size = 0
+
+    return struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, ZIP_FLAGS, zipfile.ZIP_STORED,
+                       dos_time, dos_date, 0, size, size, len(name), len(extra)) + name + extra
+
+
+def _zip_central_header(entry):
+    name, offset, crc, size, dos_time, dos_date, is_dir = entry
+    fields = []
+    if size >= ZIP64_LIMIT:
+        fields += [size, size]
+    if offset >= ZIP64_LIMIT:
+        fields.append(offset)
+
+    extra = struct.pack(f'<HH{len(fields)}Q', 1, 8 * len(fields), *fields) if fields else b''
+    zip64 = bool(fields)
+    external_attr = ((0o40755 << 16) | 0x10) if is_dir else (0o100644 << 16)
+    return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | 45, 45 if zip64 else 20, ZIP_FLAGS,
+                       zipfile.ZIP_STORED, dos_time, dos_date, crc, min(size, ZIP64_LIMIT),
+                       min(size, ZIP64_LIMIT), len(name), len(extra), 0, 0, 0, external_attr,
+                       min(offset, ZIP64_LIMIT)) + name + extra
+
+
+def _zip_end_records(count: int, cd_offset: int, cd_size: int):
+    '''
+    中央目录结束记录，条目数或偏移量超过限制时先写ZIP64结束记录和定位符
+    '''
+    data = b''
+    if count >= 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        zip64_offset = cd_offset + cd_size
+        data += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset)
+        data += struct.pack('<IIQI', 0x07064b50, 0, zip64_offset, 1)
+
+    data += struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                        min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0)
+    return data
+
+
+def zip_stream(entries, read):
+    '''
+    流式生成不压缩(stored)的zip，每个条目的CRC边读边计算，写在数据后的数据描述符中，大文件和条目过多时使用ZIP64；
+    zip的中央目录在文件末尾，需要记录所有条目，每个条目只保存(名称, 偏移量, CRC, 大小, 时间)的紧凑元组，
+    内存随条目数线性增长(每个条目约百余字节)，条目非常多的目录树建议使用tar，tar的内存占用和条目数无关
+
+    :param entries: generator, (path, obj)
+    :param read: 读取对象数据的函数，read(obj)返回bytes的可迭代对象
+    :return: generator
+    '''
+    central = []
+    offset = 0
+    for path, obj in entries:
+        dos_time, dos_date = _dos_date_time(obj)
+        is_dir = obj.is_dir()
+        name = (path + '/' if is_dir else path).encode('utf-8')
+        size = 0 if is_dir else obj.si
+        zip64 = size >= ZIP64_LIMIT
+        header = _zip_local_header(name, dos_time, dos_date, zip64=zip64)
+        yield header
+
+        crc = 0
+        if not is_dir:
+            for data in _read_exactly(read, obj):
+                crc = zlib.crc32(data, crc)
+                yield data
+
+        if zip64:
+            descriptor = struct.pack('<IIQQ', 0x08074b50, crc, size, size)
+        else:
+            descriptor = struct.pack('<IIII', 0x08074b50, crc, size, size)
+        yield descriptor
+
+        central.append((name, offset, crc, size, dos_time, dos_date, is_dir))
+        offset += len(header) + size + len(descriptor)
+
+    cd_size = 0
+    for entry in central:
+        data = _zip_central_header(entry)
+        cd_size += len(data)
+        yield data
+
+    yield _zip_end_records(len(central), cd_offset=offset, cd_size=cd_size)
+
+
+def build_dir_archive_response(bucket, dir_id: int, name: str, archive_type: str = 'tar'):
+    '''
+    目录打包下载的响应，边遍历目录树边读取对象数据流式生成tar或zip，不缓存整个文件；
+    归档中的路径以目录名name开头
+
+    :param bucket: 存储桶
+    :param dir_id: 目录id，桶根目录为BucketFileManagement.ROOT_DIR_ID
+    :param name: 目录名，下载的文件名为name.tar或name.zip
+    :param archive_type: 'tar' or 'zip'
+    :return:
+        StreamingHttpResponse()
+    :raises: HarborError
+    '''
+    if archive_type not in ARCHIVE_FORMATS:
+        raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg='不支持的归档文件格式')
+
+    model_class = BucketFileManagement(collection_name=bucket.get_bucket_table_name()).get_obj_model_class()
+    entries = iter_dir_tree(model_class, did=dir_id, path=name)
+    hManager = HarborManager()
+    read_ahead = get_archive_upload_conf().get('EXPORT_READ_AHEAD', 2)
+
+    def read(obj):
+        return hManager._get_obj_generator(bucket=bucket, obj=obj, read_ahead=read_ahead)
+
+    if archive_type == 'zip':
+        response = StreamingHttpResponse(zip_stream(entries, read), content_type='application/zip')
+    else:
+        response = StreamingHttpResponse(tar_stream(entries, read), content_type='application/x-tar')
+
+    filename = urlquote(f'{name}.{archive_type}')
+    response['Content-Disposition'] = f"attachment;filename*=utf-8''{filename}"
+    return response
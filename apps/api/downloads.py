@@ -0,0 +1,197 @@
+import os
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import urlquote, http_date, parse_etags, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+from utils.http_range import parse_range_header, if_range_match, RangeNotSatisfiable, MultipartByteranges
+from utils.oss.cache import build_cache_key
+from utils.oss.staging import get_staging_area, get_staging_conf
+from .harbor import HarborManager
+
+
+def get_obj_last_modified(obj):
+    '''
+    对象最后修改时间，没有修改过时为上传时间
+    '''
+    return obj.upt if obj.upt else obj.ult
+
+
+def get_obj_etag(obj):
+    '''
+    对象的强ETag，由修改时间(微秒)和大小生成；
+    分片写入不更新对象元数据md5，md5可能不是当前数据的，不能作为ETag
+
+    :return: str, 如'"5b1f3c2a9e7d0-1000"'
+    '''
+    mtime = get_obj_last_modified(obj)
+    us = int(mtime.timestamp() * 1000000) if mtime else 0
+    return f'"{us:x}-{obj.si:x}"'
+
+
+def get_cache_control(bucket):
+    '''
+    对象下载响应的Cache-Control，由桶的访问权限决定，见settings.DOWNLOAD_CACHE_CONTROL
+    '''
+    conf = getattr(settings, 'DOWNLOAD_CACHE_CONTROL', {})
+    if bucket.is_public_permission():
+        return conf.get('PUBLIC', 'public, max-age=3600')
+
+    return conf.get('PRIVATE', 'private, no-cache')
+
+
+def is_not_modified(request, etag: str, last_modified):
+    '''
+    条件请求(RFC 7232)验证对象是否未修改：有If-None-Match时只按ETag弱比较，否则按If-Modified-Since比较
+
+    :return: True(未修改，应返回304); False
+    '''
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        if '*' in etags:
+            return True
+
+        def weak(tag):
+            return tag[2:] if tag.startswith('W/') else tag
+
+        return weak(etag) in [weak(tag) for tag in etags]
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and last_modified is not None:
+        ts = parse_http_date_safe(if_modified_since)
+        return ts is not None and int(last_modified.timestamp()) <= ts
+
+    return False
+
+
+def build_offload_response(staging, obj_key: str, key: str, path: str, ranged: bool):
+    '''
+    暂存文件交给前端web服务器或uwsgi offload线程发送的响应，见settings.DOWNLOAD_STAGING['OFFLOAD']：
+    'nginx'(X-Accel-Redirect)和'sendfile'(X-Sendfile)由web服务器处理Range；
+    'uwsgi'通过wsgi.file_wrapper发送文件(uwsgi需配置offload-threads)，不处理Range
+
+    :param ranged: 是否是有效的范围请求
+    :return:
+        HttpResponse() or FileResponse()
+        None    # 不能发送此请求
+    '''
+    conf = get_staging_conf()
+    mode = conf.get('OFFLOAD', 'nginx')
+    if mode == 'nginx':
+        response = HttpResponse()
+        location = conf.get('NGINX_LOCATION', '/_staging/')
+        response['X-Accel-Redirect'] = location.rstrip('/') + '/' + staging.relpath(obj_key=obj_key, key=key)
+    elif mode == 'sendfile':
+        response = HttpResponse()
+        response['X-Sendfile'] = path
+    elif mode == 'uwsgi' and not ranged:
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return None
+        response = FileResponse(f)
+        response['Content-Length'] = os.fstat(f.fileno()).st_size
+    else:
+        return None
+
+    response['Content-Type'] = 'application/octet-stream'
+    return response
+
+
+def build_download_response(request, bucket, obj, use_cache=True):
+    '''
+    下载对象的响应，支持Range(RFC 7233)：单个范围返回206和Content-Range，多个范围返回206和multipart/byteranges，
+    后缀范围'bytes=-N'，If-Range和对象当前版本不匹配时忽略Range；没有可满足的范围返回416；
+    支持条件请求：响应带ETag、Last-Modified和Cache-Control，If-None-Match或If-Modified-Since验证未修改时返回304，
+    只查询元数据，不读取对象数据；
+    公共权限桶的热点对象数据暂存到本地磁盘，由web服务器或uwsgi offload发送，见build_offload_response()
+
+    :param request: 请求
+    :param bucket: 存储桶实例
+    :param obj: 对象实例
+    :param use_cache: True(通过热点对象缓存读取)
+    :return:
+        FileResponse()
+        HttpResponseNotModified()   # 304
+        Response()                  # 416
+    '''
+    etag = get_obj_etag(obj)
+    last_modified = get_obj_last_modified(obj)
+    validators = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified.timestamp()),
+        'Cache-Control': get_cache_control(bucket)
+    }
+    if is_not_modified(request, etag=etag, last_modified=last_modified):
+        response = HttpResponseNotModified()
+        for k, v in validators.items():
+            response[k] = v
+        return response
+
+    hManager = HarborManager()
+    filesize = obj.si
+    ranges = None
+    h_range = request.headers.get('range')
+    if h_range and if_range_match(request.headers.get('if-range'), etag=etag, last_modified=last_modified):
+        try:
+            ranges = parse_range_header(h_range, size=filesize)
+        except RangeNotSatisfiable:
+            response = Response(data={'code': 416, 'code_text': 'Header Range is invalid'},
+                                status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{filesize}'
+            return response
+
+    # 下载暂存层，公共权限桶的热点对象
+    staging = get_staging_area() if bucket.is_public_permission() and obj.inl is None else None
+    if staging is not None and not staging.stageable(filesize):
+        staging = None
+
+    response = None
+    if staging is not None:
+        obj_key = obj.get_obj_key(bucket.id)
+        key = build_cache_key(obj_key=obj_key, upt=obj.upt, size=filesize)
+        path = staging.lookup(obj_key=obj_key, key=key, size=filesize)
+        if path is not None:
+            response = build_offload_response(staging=staging, obj_key=obj_key, key=key, path=path,
+                                              ranged=bool(ranges))
+            if response is not None and not h_range:
+                obj.download_cound_increase()
+
+    if response is None:
+        if not ranges:
+            generator = hManager._get_obj_generator(bucket=bucket, obj=obj, use_cache=use_cache)
+            # 热点对象完整下载时写入暂存文件
+            if staging is not None and staging.is_hot(key):
+                generator = staging.stage_generator(obj_key=obj_key, key=key, size=filesize, generator=generator)
+            response = FileResponse(generator)
+            response['Content-Length'] = filesize
+            response['Content-Type'] = 'application/octet-stream'  # 注意格式
+
+            # 增加一次下载次数
+            obj.download_cound_increase()
+        elif len(ranges) == 1:
+            offset, end = ranges[0]
+            generator = hManager._get_obj_generator(bucket=bucket, obj=obj, offset=offset, end=end, use_cache=use_cache)
+            response = FileResponse(generator, status=status.HTTP_206_PARTIAL_CONTENT)
+            response['Content-Range'] = f'bytes {offset}-{end}/{filesize}'
+            response['Content-Length'] = end - offset + 1
+            response['Content-Type'] = 'application/octet-stream'
+        else:
+            def read(start, end):
+                return hManager._get_obj_generator(bucket=bucket, obj=obj, offset=start, end=end, use_cache=use_cache)
+
+            body = MultipartByteranges(ranges=ranges, size=filesize, read=read)
+            response = FileResponse(body, status=status.HTTP_206_PARTIAL_CONTENT)
+            response['Content-Length'] = body.content_length
+            response['Content-Type'] = body.content_type
+
+    for k, v in validators.items():
+        response[k] = v
+
+    filename = urlquote(obj.name)  # 中文文件名需要
+    response['Accept-Ranges'] = 'bytes'  # 接受类型，支持断点续传
+    response['Content-Disposition'] = f"attachment;filename*=utf-8''{filename}"  # 注意filename 这个是下载后的名字
+    return response
@@ -1,14 +1,24 @@
+import uuid
 import logging
+import hashlib
 
 from django.utils import timezone
-from django.db.models import Case, Value, When, F
-from django.db import close_old_connections
+from django.conf import settings
+from django.db.models import Case, Value, When, F, Max, Func, CharField, TextField
+from django.db.models.functions import Concat, Substr
+from django.db import close_old_connections, transaction, router
 from rest_framework import status
 
-from buckets.models import Bucket
+from buckets.models import Bucket, MultipartUpload, MultipartPart, DirDeleteJob, get_str_hexMD5
 from buckets.utils import BucketFileManagement
+from buckets.packs import append_to_pack, get_pack_max_object_size
+from buckets.dedup import get_dedup_config, get_dedup_min_size, acquire_blob, add_blob_ref, create_blob, release_blob
 from utils.storagers import PathParser
-from utils.oss import HarborObject, get_size
+from utils.oss import HarborObject, RadosError, get_size
+from utils.oss.pyrados import get_new_object_layout, DedupLayout, CompressedLayout, RelocatedLayout
+from utils.oss.compress import CODECS
+from utils.oss.cache import get_object_cache, build_cache_key
+from utils.oss.staging import invalidate_staged
 from .paginations import BucketFileLimitOffsetPagination
 from utils.log.decorators import log_op_info
 from utils.md5 import FileMD5Handler
@@ -17,6 +27,49 @@ from utils.md5 import FileMD5Handler
 debug_logger = logging.getLogger('debug')#这里的日志记录器要和setting中的loggers选项对应，不能随意给参
 
 
+def get_inline_max_size():
+    '''
+    内联存储在元数据中的小对象大小上限，0不内联
+    '''
+    return getattr(settings, 'INLINE_OBJECT_MAX_SIZE', 0)
+
+
+def get_upload_buffer_size():
+    '''
+    上传时缓存在内存中的小对象大小上限，上传完成后内联存储或打包存储，0不缓存
+    '''
+    return max(get_inline_max_size(), get_pack_max_object_size())
+
+
+def get_compress_block_size():
+    '''
+    对象数据分块压缩的块大小，settings.CEPH_RADOS['COMPRESS_BLOCK_SIZE']
+    '''
+    return max(settings.CEPH_RADOS.get('COMPRESS_BLOCK_SIZE', 1024 ** 2), 64 * 1024)
+
+
+def get_bulk_delete_conf():
+    '''
+    批量删除配置，settings.BULK_DELETE
+
+    :return: dict
+    '''
+    conf = getattr(settings, 'BULK_DELETE', None)
+    return conf if conf else {}
+
+
+def get_upload_layout(bucket, obj):
+    '''
+    上传对象数据使用的数据布局，桶启用了压缩时为分块压缩布局，内层为对象当前的布局
+
+    :return: str
+    '''
+    if bucket.compress not in CODECS:
+        return obj.lay
+
+    return str(CompressedLayout(codec=bucket.compress, block_size=get_compress_block_size(), inner=obj.lay))
+
+
 def ftp_close_old_connections(func):
     def wrapper(*args, **kwargs):
         close_old_connections()
@@ -339,6 +392,126 @@ class HarborManager:
 
         return True
 
+    def rmdir_recursive(self, bucket_name: str, dirpath: str, user=None):
+        '''
+        递归删除目录，提交后台删除任务：目录子树的元数据标记为删除，目录从父目录中摘除，
+        子树中的对象和目录由manage.py rmdirjobs后台删除，见DirDeleteJob
+
+        :param bucket_name: 桶名
+        :param dirpath: 目录全路径
+        :param user: 用户，默认为None，如果给定用户只删除属于此用户的目录（只查找此用户的存储桶）
+        :return:
+            DirDeleteJob()
+
+        :raise HarborError()
+        '''
+        path, dir_name = PathParser(filepath=dirpath).get_path_and_filename()
+        if not bucket_name or not dir_name:
+            raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg='参数无效')
+
+        bucket = self.get_bucket(bucket_name, user=user)
+        if not isinstance(bucket, Bucket):
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='存储桶不存在')
+
+        dir = self._get_obj_or_dir(table_name=bucket.get_bucket_table_name(), path=path, name=dir_name)
+        if not dir or dir.is_file():
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='目录不存在')
+
+        job = DirDeleteJob(user=user, bucket_id=bucket.id, bucket_name=bucket.name, dir_id=dir.id, dir_path=dir.na)
+        try:
+            job.save()
+        except Exception as e:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg=f'创建目录删除任务失败，{str(e)}')
+
+        model = dir._meta.model
+        try:
+            with transaction.atomic(using=router.db_for_write(model)):
+                # 目录的父节点id设为负数，从父目录中摘除，允许立即创建同名目录
+                r = model.objects.filter(id=dir.id, sds=False).update(sds=True, did=-dir.id, upt=timezone.now())
+                if r > 0:
+                    model.objects.filter(na__startswith=job.prefix, sds=False).update(sds=True)
+        except Exception as e:
+            job.delete()
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg=f'标记删除目录失败，{str(e)}')
+
+        if r == 0:      # 目录已被删除
+            job.delete()
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='目录不存在')
+
+        return job
+
+    def run_rmdir_job(self, job, batch_size: int = 1000, max_inflight: int = 32):
+        '''
+        执行目录删除任务，先按批删除子树中标记删除的对象，再按id倒序按批删除子目录，最后删除目录本身；
+        每批删除后保存任务进度(同时是执行中任务的心跳)；
+        删除只依据元数据的删除标记和路径前缀，不依赖删除顺序，中断后重新执行即可继续；
+        有对象rados数据删除失败时保留目录，任务失败，重新执行时重试
+
+        :param job: DirDeleteJob()，状态为执行中
+        :param batch_size: 每批删除的元数据数
+        :param max_inflight: 同时在途的rados异步删除数
+        :return:
+            DirDeleteJob()
+        '''
+        bucket = Bucket.objects.filter(id=job.bucket_id).first()
+        if bucket is None:      # 桶已删除，元数据随桶表删除
+            return self._finish_rmdir_job(job, status_code=DirDeleteJob.STATUS_DONE, msg='存储桶已删除')
+
+        model_class = BucketFileManagement(collection_name=bucket.get_bucket_table_name()).get_obj_model_class()
+        progress_fields = ['deleted_objs', 'deleted_dirs', 'deleted_size', 'failed_objs', 'modified_time']
+        job.failed_objs = 0
+        try:
+            last_id = 0
+            while True:
+                objs = list(model_class.objects.filter(
+                    fod=True, sds=True, na__startswith=job.prefix, id__gt=last_id).order_by('id')[:batch_size])
+                if not objs:
+                    break
+
+                last_id = objs[-1].id
+                results = self._delete_objs_batch(bucket, [(obj.na, obj) for obj in objs], max_inflight=max_inflight)
+                for obj, result in zip(objs, results):
+                    if result['ok']:
+                        job.deleted_objs += 1
+                        job.deleted_size += obj.si
+                    else:
+                        job.failed_objs += 1
+
+                job.save(update_fields=progress_fields)
+
+            if job.failed_objs > 0:
+                return self._finish_rmdir_job(job, status_code=DirDeleteJob.STATUS_FAILED,
+                                              msg=f'{job.failed_objs}个对象删除失败')
+
+            while True:
+                ids = list(model_class.objects.filter(
+                    fod=False, sds=True, na__startswith=job.prefix).order_by('-id').values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+
+                model_class.objects.filter(id__in=ids).delete()
+                job.deleted_dirs += len(ids)
+                job.save(update_fields=progress_fields)
+
+            deleted, _rows = model_class.objects.filter(id=job.dir_id, sds=True).delete()
+            job.deleted_dirs += deleted
+        except Exception as e:
+            return self._finish_rmdir_job(job, status_code=DirDeleteJob.STATUS_FAILED, msg=str(e))
+
+        return self._finish_rmdir_job(job, status_code=DirDeleteJob.STATUS_DONE)
+
+    @staticmethod
+    def _finish_rmdir_job(job, status_code: int, msg: str = ''):
+        job.status = status_code
+        job.msg = msg[:255]
+        try:
+            job.save(update_fields=['status', 'msg', 'deleted_objs', 'deleted_dirs', 'deleted_size', 'failed_objs',
+                                    'modified_time'])
+        except Exception as e:
+            debug_logger.error(f'failed to save dir delete job {job.job_id}, {str(e)}')
+
+        return job
+
     def _list_dir_queryset(self, bucket_name:str, path:str, user=None):
         '''
         获取目录下的文件列表信息
@@ -443,15 +616,15 @@ class HarborManager:
 
     def move_rename(self, bucket_name:str, obj_path:str, rename=None, move=None, user=None):
         '''
-        移动或重命名对象
+        移动或重命名对象或目录
 
         :param bucket_name: 桶名
-        :param obj_path: 对象全路径
+        :param obj_path: 对象或目录全路径
         :param rename: 重命名新名称，默认为None不重命名
         :param move: 移动到move路径下，默认为None不移动
         :param user: 用户，默认为None，如果给定用户只操作属于此用户的对象（只查找此用户的存储桶）
         :return:
-            success: (object, bucket)     # 移动后的对象实例
+            success: (object, bucket)     # 移动后的对象或目录实例
             failed : raise HarborError
 
         :raise HarborError
@@ -466,12 +639,15 @@ class HarborManager:
 
         # 存储桶验证和获取桶对象
         try:
-            bucket, obj = self.get_bucket_and_obj(bucket_name=bucket_name, obj_path=obj_path, user=user)
+            bucket, obj = self.get_bucket_and_obj_or_dir(bucket_name=bucket_name, path=obj_path, user=user)
         except HarborError as e:
             raise e
 
         if obj is None:
-            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='文件对象不存在')
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='文件对象或目录不存在')
+
+        if obj.is_dir():
+            return self._move_rename_dir(bucket=bucket, dir=obj, move_to=move_to, rename=rename)
 
         return self._move_rename_obj(bucket=bucket, obj=obj, move_to=move_to, rename=rename)
 
@@ -511,16 +687,301 @@ class HarborManager:
 
         if move_to is not None:     # 移动对象或重命名
             _, did = bfm.get_cur_dir_id()
-            obj.did = did
+        else:
+            did = obj.did
+
+        model = obj._meta.model
+        if self._is_dir_moving(model, obj.did) or self._is_dir_moving(model, did):
+            raise HarborError(code=status.HTTP_409_CONFLICT, msg='对象所在目录或目标目录正在移动中')
 
+        # 按旧全路径条件更新，所在目录并发移动已改写了对象全路径时不会写回旧路径
+        new_na_md5 = get_str_hexMD5(new_na)
+        try:
+            r = model.objects.filter(id=obj.id, na=obj.na).update(na=new_na, na_md5=new_na_md5, name=new_obj_name,
+                                                                  did=did)
+        except Exception:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='移动对象操作失败')
+
+        if r == 0:
+            raise HarborError(code=status.HTTP_409_CONFLICT, msg='对象所在目录正在移动中')
+
+        # 目标目录在检查后开始移动时，可能已查询过其下的元数据，撤销移动
+        if did != obj.did and self._is_dir_moving(model, did):
+            model.objects.filter(id=obj.id, na=new_na).update(na=obj.na, na_md5=obj.na_md5, name=obj.name, did=obj.did)
+            raise HarborError(code=status.HTTP_409_CONFLICT, msg='目标目录正在移动中')
+
+        obj.did = did
         obj.na = new_na
         obj.name = new_obj_name
-        obj.reset_na_md5()
-        if not obj.do_save():
-            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg= '移动对象操作失败')
-
+        obj.na_md5 = new_na_md5
         return obj, bucket
 
+    @staticmethod
+    def _is_dir_moving(model, did):
+        '''
+        目录是否正在移动中，移动中的目录子树下不能创建、覆盖或移动对象
+
+        :param did: 目录id，根目录不会移动
+        '''
+        if not did:
+            return False
+
+        return model.objects.filter(id=did, na_md5=model.NA_MD5_MOVING).exists()
+
+    def _move_rename_dir(self, bucket, dir, move_to, rename, batch_size: int = 1000):
+        '''
+        移动重命名目录，目录子树中所有元数据的全路径na和na_md5需要改写：
+        先按读取时的全路径把目录的na_md5设为NA_MD5_MOVING，目录已在移动中或已被移动时返回409；
+        再逐层锁定并把所有子目录的na_md5设为NA_MD5_MOVING，子树中有目录已在移动中时撤销并返回409；
+        子目录按路径查找不到，子树下不能再创建对象和目录；
+        对象的na_md5不变，仍可按路径读取，创建、覆盖和移动对象时检查所在目录是否移动中(见_is_dir_moving())，移动中时返回409；
+        再按批用一条UPDATE语句改写子树中元数据的na(对象同时改写na_md5)；
+        最后在一个事务中恢复子目录的na_md5，修改目录本身的名称、全路径和父目录；出错时撤销已改写的元数据
+
+        :param bucket: 目录所在桶
+        :param dir: 目录
+        :param move_to: 移动目标路径
+        :param rename: 重命名的新名称
+        :param batch_size: 每批改写的元数据数
+        :return:
+            success: (dir, bucket)
+            failed : raise HarborError
+
+        :raise HarborError
+        '''
+        table_name = bucket.get_bucket_table_name()
+        new_name = rename if rename else dir.name
+        old_na = dir.na
+        if move_to is not None and (move_to == old_na or move_to.startswith(old_na + '/')):
+            raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg='不能移动目录到自身或其子目录下')
+
+        try:
+            if move_to is None:     # 仅仅重命名目录，不移动
+                path, _ = PathParser(filepath=old_na).get_path_and_filename()
+                new_na = path + '/' + new_name if path else new_name
+                bfm = BucketFileManagement(path=path, collection_name=table_name)
+                target = bfm.get_obj(path=new_na)
+                did = dir.did
+            else:
+                bfm = BucketFileManagement(path=move_to, collection_name=table_name)
+                target = bfm.get_dir_or_obj_exists(name=new_name)
+                new_na = bfm.build_dir_full_name(new_name)
+                _, did = bfm.get_cur_dir_id()
+        except Exception:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='移动目录操作失败, 查询是否已存在同名对象或子目录时发生错误')
+
+        if target:
+            raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg='无法完成目录的移动操作，指定的目标路径下已存在同名的对象或目录')
+
+        model = dir._meta.model
+        using = router.db_for_write(model)
+        moving = model.NA_MD5_MOVING
+        try:
+            r = model.objects.filter(id=dir.id, na=old_na).exclude(na_md5=moving).update(na_md5=moving)
+        except Exception as e:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='移动目录操作失败，' + str(e))
+
+        if r == 0:
+            raise HarborError(code=status.HTTP_409_CONFLICT, msg='目录正在移动中或已被移动')
+
+        dir_ids = [dir.id]
+        try:
+            self._mark_subdirs_moving(model, dir_ids, batch_size=batch_size)
+            self._rewrite_subtree_na(model, dir_ids, old_prefix=old_na + '/', new_prefix=new_na + '/',
+                                     batch_size=batch_size)
+        except HarborError:
+            self._undo_move_dir(model, dir_ids, old_prefix=old_na + '/', new_prefix=new_na + '/', batch_size=batch_size)
+            raise
+        except Exception as e:
+            self._undo_move_dir(model, dir_ids, old_prefix=old_na + '/', new_prefix=new_na + '/', batch_size=batch_size)
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='移动目录操作失败，' + str(e))
+
+        try:
+            with transaction.atomic(using=using):
+                self._reset_dirs_na_md5(model, dir_ids[1:], batch_size=batch_size)
+                model.objects.filter(id=dir.id).update(na=new_na, name=new_name, did=did,
+                                                        na_md5=get_str_hexMD5(new_na))
+        except Exception as e:
+            self._undo_move_dir(model, dir_ids, old_prefix=old_na + '/', new_prefix=new_na + '/', batch_size=batch_size)
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='移动目录操作失败，' + str(e))
+
+        dir.na = new_na
+        dir.name = new_name
+        dir.did = did
+        dir.reset_na_md5()
+        return dir, bucket
+
+    @staticmethod
+    def _mark_subdirs_moving(model, dir_ids, batch_size: int = 1000):
+        '''
+        逐层把目录的所有子目录设为移动中，目录设置后再查询其子目录，不会遗漏设置前新建的子目录；
+        每批子目录加行锁后检查，已在移动中(其他移动操作的目录)时不修改
+
+        :param dir_ids: [要移动的目录id]，设置的子目录id追加在其后，出错时由调用者按其撤销
+        :raises: HarborError(409)   # 子树中有目录已在移动中
+        '''
+        moving = model.NA_MD5_MOVING
+        using = router.db_for_write(model)
+        level = list(dir_ids)
+        while level:
+            children = []
+            for start in range(0, len(level), batch_size):
+                with transaction.atomic(using=using):
+                    rows = list(model.objects.select_for_update().filter(
+                        did__in=level[start:start + batch_size], fod=False).values_list('id', 'na_md5'))
+                    if any(na_md5 == moving for _, na_md5 in rows):
+                        raise HarborError(code=status.HTTP_409_CONFLICT, msg='目录下的子目录正在移动中')
+
+                    ids = [i for i, _ in rows]
+                    for i in range(0, len(ids), batch_size):
+                        model.objects.filter(id__in=ids[i:i + batch_size]).update(na_md5=moving)
+
+                dir_ids += ids
+                children += ids
+
+            level = children
+
+    @staticmethod
+    def _rewrite_subtree_na(model, dir_ids, old_prefix: str, new_prefix: str, batch_size: int = 1000):
+        '''
+        改写目录子树中元数据的全路径前缀，每批一个事务，改写后的元数据不再匹配旧前缀，可重复执行；
+        子目录的na_md5保持NA_MD5_MOVING，由调用者最后恢复
+
+        :param dir_ids: 子树中所有目录的id，改写父目录在其中的元数据
+        '''
+        new_na = Concat(Value(new_prefix), Substr('na', len(old_prefix) + 1), output_field=TextField())
+        new_na_md5 = Func(new_na, function='MD5', output_field=CharField())
+        using = router.db_for_write(model)
+        for start in range(0, len(dir_ids), batch_size):
+            parents = dir_ids[start:start + batch_size]
+            while True:
+                rows = list(model.objects.filter(did__in=parents, na__startswith=old_prefix).values_list(
+                    'id', 'fod')[:batch_size])
+                if not rows:
+                    break
+
+                with transaction.atomic(using=using):
+                    file_ids = [i for i, fod in rows if fod]
+                    sub_dir_ids = [i for i, fod in rows if not fod]
+                    if file_ids:
+                        model.objects.filter(id__in=file_ids).update(na=new_na, na_md5=new_na_md5)
+                    if sub_dir_ids:
+                        model.objects.filter(id__in=sub_dir_ids).update(na=new_na)
+
+    @staticmethod
+    def _reset_dirs_na_md5(model, dir_ids, batch_size: int = 1000):
+        '''
+        按目录的na重新计算na_md5
+        '''
+        na_md5 = Func(F('na'), function='MD5', output_field=CharField())
+        for start in range(0, len(dir_ids), batch_size):
+            model.objects.filter(id__in=dir_ids[start:start + batch_size]).update(na_md5=na_md5)
+
+    def _undo_move_dir(self, model, dir_ids, old_prefix: str, new_prefix: str, batch_size: int = 1000):
+        '''
+        撤销移动目录，已改写的元数据改回旧全路径，恢复目录的na_md5；失败只记录日志
+        '''
+        try:
+            self._rewrite_subtree_na(model, dir_ids, old_prefix=new_prefix, new_prefix=old_prefix,
+                                     batch_size=batch_size)
+            self._reset_dirs_na_md5(model, dir_ids, batch_size=batch_size)
+        except Exception as e:
+            debug_logger.error(f'failed to undo moving dir {old_prefix} to {new_prefix}, dir id={dir_ids[0]}, {str(e)}')
+
+    def copy_object(self, bucket_name: str, obj_path: str, to_bucket_name: str, to_path: str, user=None):
+        '''
+        复制对象，对象数据在服务端复制，不经过客户端；目标对象已存在时覆盖
+
+        :param bucket_name: 源对象所在桶名
+        :param obj_path: 源对象全路径
+        :param to_bucket_name: 目标桶名，为空时为源对象所在的桶
+        :param to_path: 目标对象全路径
+        :param user: 用户，默认为None，如果给定用户只操作属于此用户的对象（只查找此用户的存储桶）
+        :return:
+            (obj, bucket, created)  # 目标对象和所在桶，created==True表示目标对象是新建的
+            raise HarborError
+
+        :raise HarborError
+        '''
+        if not to_path:
+            raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg='请提交目标对象路径参数to_path')
+
+        bucket, src = self.get_bucket_and_obj(bucket_name=bucket_name, obj_path=obj_path, user=user)
+        if src is None:
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='文件对象不存在')
+
+        to_bucket_name = to_bucket_name if to_bucket_name else bucket.name
+        to_bucket, obj, created = self.create_empty_obj(bucket_name=to_bucket_name, obj_path=to_path, user=user)
+        if to_bucket.id == bucket.id and obj.id == src.id:
+            raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg='目标对象和源对象相同')
+
+        src_ho = HarborObject(pool_name=bucket.get_pool_name(), obj_id=src.get_obj_key(bucket.id), obj_size=src.si,
+                              layout=src.lay, inline=src.inl, cindex=src.cidx)
+        dst = HarborObject(pool_name=to_bucket.get_pool_name(), obj_id=obj.get_obj_key(to_bucket.id), obj_size=obj.si,
+                           layout=obj.lay, inline=obj.inl, cindex=obj.cidx)
+        try:
+            if created is False:
+                self._pre_reset_upload(obj=obj, rados=dst)
+            self._copy_obj_data(src=src, src_ho=src_ho, obj=obj, dst=dst)
+        except HarborError as e:
+            if created is True:
+                obj.do_delete()
+            raise e
+
+        obj.si = src.si
+        obj.md5 = src.md5
+        obj.upt = timezone.now()
+        if not obj.do_save(update_fields=['si', 'md5', 'upt', 'inl', 'lay']):
+            dst.reset_obj_id_and_size(obj_size=obj.si, layout=obj.lay)
+            dst.delete()
+            if dst.is_deduped():
+                self._release_blob(pool_name=dst.get_pool_name(), layout=dst.get_layout())
+            if created is True:
+                obj.do_delete()
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='修改对象元数据失败')
+
+        return obj, to_bucket, created
+
+    def _copy_obj_data(self, src, src_ho, obj, dst):
+        '''
+        复制对象数据到空的目标对象：内联的数据直接复制；同一pool中去重的对象增加blob引用，不复制数据；
+        小对象内联或打包存储；其他对象在服务端读写复制，可跨pool
+
+        :param src: 源对象元数据
+        :param src_ho: 源对象HarborObject()
+        :param obj: 目标对象元数据，只修改obj实例，由调用者保存元数据inl和lay
+        :param dst: 目标对象HarborObject()
+        :return:
+            正常：True
+            错误：raise HarborError
+        '''
+        if src.inl is not None and len(src.inl) <= get_inline_max_size():
+            obj.inl = bytes(src.inl)
+            return True
+
+        if src_ho.is_deduped() and src_ho.get_pool_name() == dst.get_pool_name():
+            try:
+                if add_blob_ref(src_ho.get_layout()):
+                    obj.lay = src.lay
+                    dst.reset_obj_id_and_size(layout=obj.lay)
+                    return True
+            except Exception as e:
+                debug_logger.error(f'failed to add reference of dedup blob, {str(e)}')
+
+        if src.si <= get_upload_buffer_size():
+            ok, data = src_ho.read(offset=0, size=src.si)
+            if not ok:
+                raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='读取源对象数据失败:' + data)
+
+            return self.store_buffered_data(obj=obj, rados=dst, data=bytes(data))
+
+        ok, msg = src_ho.copy_to(dst)
+        if not ok:
+            dst.delete(obj_size=src.si)
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='复制对象数据失败:' + msg)
+
+        return True
+
     def _validate_move_rename_params(self, move_to, rename):
         '''
         校验移动或重命名参数
@@ -600,7 +1061,7 @@ class HarborManager:
         bucket, obj, created = self.create_empty_obj(bucket_name=bucket_name, obj_path=obj_path, user=user)
         obj_key = obj.get_obj_key(bucket.id)
         pool_name = bucket.get_pool_name()
-        rados = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.si)
+        rados = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.si, layout=obj.lay, inline=obj.inl, cindex=obj.cidx)
         if created is False:  # 对象已存在，不是新建的
             if reset:  # 重置对象大小
                 self._pre_reset_upload(obj=obj, rados=rados)
@@ -618,6 +1079,66 @@ class HarborManager:
 
         return created
 
+    def prepare_write_stream(self, bucket_name: str, obj_path: str, offset: int, size: int, reset: bool = False,
+                             user=None):
+        '''
+        接收数据前准备向对象流式写入一块数据，数据由调用者边接收边直接写入rados：
+        创建(或获取)对象，先更新元数据中对象大小和修改时间，写入失败时由调用者通过rollback_write_stream()回滚；
+        写入后的小对象数据需要内联或打包存储时不能流式写入，返回stream=False，由调用者接收数据后通过_save_one_file()写入
+
+        :param offset: 写入对象偏移量
+        :param size: 数据块大小
+        :param reset: 为True时，先重置对象大小为0后再写入数据；
+        :return:
+            (bucket, obj, rados, created, stream)
+            raise HarborError
+        '''
+        bucket, obj, created = self.create_empty_obj(bucket_name=bucket_name, obj_path=obj_path, user=user)
+        rados = HarborObject(pool_name=bucket.get_pool_name(), obj_id=obj.get_obj_key(bucket.id), obj_size=obj.si,
+                             layout=obj.lay, inline=obj.inl, cindex=obj.cidx)
+        try:
+            if created is False and reset:
+                self._pre_reset_upload(obj=obj, rados=rados)
+
+            new_size = offset + size
+            if self._can_inline(obj, new_size) or self._can_pack(obj=obj, rados=rados, offset=offset, size=size):
+                return bucket, obj, rados, created, False
+
+            if obj.inl is not None:
+                self._promote_inline(obj=obj, rados=rados)
+
+            if rados.is_read_only():
+                self._unshare_object(obj=obj, rados=rados)
+
+            if not self._update_obj_metadata(obj, size=new_size):
+                raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='修改对象元数据失败')
+        except HarborError as e:
+            if created is True:
+                obj.do_delete()
+            raise e
+
+        return bucket, obj, rados, created, True
+
+    def rollback_write_stream(self, obj, rados, created: bool, end: int):
+        '''
+        流式写入失败时，回滚prepare_write_stream()更新的对象元数据，新创建的对象删除已写入的数据和元数据；
+        prepare_write_stream()更新元数据时不修改obj实例，obj中仍是更新前的对象大小和修改时间，据此恢复；
+        对象大小已被其他并发写入改变时不回滚
+
+        :param end: 数据块写入后的对象大小
+        '''
+        if created is True:
+            rados.delete(obj_size=end)
+            obj.do_delete()
+            return
+
+        old_si = obj.si if obj.si else 0
+        model = obj._meta.model
+        try:
+            model.objects.filter(id=obj.id, si=max(end, old_si)).update(si=old_si, upt=obj.upt)
+        except Exception as e:
+            debug_logger.error(f'failed to rollback metadata of object {obj.id}, {str(e)}')
+
     def create_empty_obj(self, bucket_name: str, obj_path: str, user):
         """
         创建一个空对象
@@ -646,16 +1167,18 @@ class HarborManager:
             raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='存储桶不存在')
 
         collection_name = bucket.get_bucket_table_name()
-        obj, created = self._get_obj_and_check_limit_or_create(collection_name, path, filename)
+        layout = get_new_object_layout(pool_name=bucket.get_pool_name(), bucket_name=bucket.name)
+        obj, created = self._get_obj_and_check_limit_or_create(collection_name, path, filename, layout=layout)
         return bucket, obj, created
 
-    def _get_obj_and_check_limit_or_create(self, table_name, path, filename):
+    def _get_obj_and_check_limit_or_create(self, table_name, path, filename, layout: str = ''):
         '''
         获取文件对象, 验证存储桶对象和目录数量上限，不存在并且验证通过则创建
 
         :param table_name: 桶对应的数据库表名
         :param path: 文件对象所在的父路径
         :param filename: 文件对象名称
+        :param layout: 新建对象的数据布局，已存在的对象保持原布局
         :return:
                 (obj, False) # 对象已存在
                 (obj, True)  # 对象不存在，创建一个新对象
@@ -672,6 +1195,8 @@ class HarborManager:
 
         # 文件对象已存在
         if obj and obj.is_file():
+            if self._is_dir_moving(obj._meta.model, obj.did):
+                raise HarborError(code=status.HTTP_409_CONFLICT, msg='对象所在目录正在移动中')
             return obj, False
 
         # 已存在同名的目录
@@ -692,7 +1217,8 @@ class HarborManager:
         bfinfo = BucketFileClass(na=full_filename,  # 全路径文件名
                                  name=filename, #  文件名
                                  fod=True,  # 文件
-                                 si=0, upt=timezone.now())  # 文件大小
+                                 si=0, upt=timezone.now(),  # 文件大小
+                                 lay=layout)  # 数据布局
         # 有父节点
         if did:
             bfinfo.did = did
@@ -703,6 +1229,11 @@ class HarborManager:
         except:
             raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='新建对象元数据失败，数据库错误')
 
+        # 父目录在查询后开始移动时，可能已查询过其下的元数据，新对象的全路径不会被改写
+        if self._is_dir_moving(BucketFileClass, did):
+            obj.do_delete()
+            raise HarborError(code=status.HTTP_409_CONFLICT, msg='对象所在目录正在移动中')
+
         return obj, True
 
     def _pre_reset_upload(self, obj, rados):
@@ -718,24 +1249,706 @@ class HarborManager:
         # 先更新元数据，后删除rados数据（如果删除失败，恢复元数据）
         # 更新文件上传时间
         old_ult = obj.ult
+        old_upt = obj.upt
         old_size = obj.si
         old_md5 = obj.md5
+        old_inl = obj.inl
+        old_lay = obj.lay
+        old_cidx = obj.cidx
 
         obj.ult = timezone.now()
+        obj.upt = obj.ult   # 修改时间变化，下载缓存key和ETag随之改变，同大小覆盖也不会命中旧数据
         obj.si = 0
         obj.md5 = ''
-        if not obj.do_save(update_fields=['ult', 'si', 'md5']):
+        obj.inl = None
+        obj.cidx = None
+        # 打包、去重或压缩的布局是只读的，改用新布局，pack中的旧数据由压缩任务回收，blob按引用计数回收；
+        # 数据在其他rados key下的也改回新布局
+        old_layout = rados.get_layout()
+        if rados.is_read_only() or rados.is_relocated():
+            obj.lay = get_new_object_layout(pool_name=rados.get_pool_name())
+        if not obj.do_save(update_fields=['ult', 'upt', 'si', 'md5', 'inl', 'lay', 'cidx']):
             raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='修改对象元数据失败')
 
         ok, _ = rados.delete()
         if not ok:
             # 恢复元数据
             obj.ult = old_ult
+            obj.upt = old_upt
             obj.si = old_size
             obj.md5 = old_md5
-            obj.do_save(update_fields=['ult', 'si', 'md5'])
+            obj.inl = old_inl
+            obj.lay = old_lay
+            obj.cidx = old_cidx
+            obj.do_save(update_fields=['ult', 'upt', 'si', 'md5', 'inl', 'lay', 'cidx'])
             raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='rados文件对象删除失败')
 
+        if rados.is_deduped():
+            self._release_blob(pool_name=rados.get_pool_name(), layout=old_layout)
+
+        invalidate_staged(rados.get_obj_id())
+        rados.reset_obj_id_and_size(layout=obj.lay)
+        return True
+
+    @staticmethod
+    def _can_inline(obj, size: int):
+        '''
+        对象写入后大小为size时，数据是否可以内联存储在元数据中：
+        不超过内联大小上限，并且对象数据已内联或对象为空
+        '''
+        if size > get_inline_max_size():
+            return False
+
+        return obj.inl is not None or not obj.si
+
+    def _save_inline(self, obj, offset: int, data: bytes, md5: str = ''):
+        '''
+        写入数据到内联在元数据中的对象数据
+
+        :param obj: 对象元数据
+        :param offset: 写入偏移量
+        :param data: 数据
+        :param md5: 更新对象元数据MD5值，默认为空忽略
+        :return:
+            True    # 已写入内联数据
+            False   # 不满足内联条件，需要写入rados
+            raise HarborError
+        '''
+        new_size = offset + len(data)
+        if not self._can_inline(obj, new_size):
+            return False
+
+        model = obj._meta.model
+        upt = timezone.now()
+        try:
+            # 行锁，读-改-写内联数据
+            with transaction.atomic(using=router.db_for_write(model)):
+                row = model.objects.select_for_update().only('id', 'si', 'inl').get(id=obj.id)
+                if not self._can_inline(row, new_size):
+                    return False
+
+                buf = bytearray(row.inl) if row.inl is not None else bytearray()
+                if len(buf) < offset:
+                    buf.extend(bytes(offset - len(buf)))
+                buf[offset:new_size] = data
+                inl = bytes(buf)
+
+                kwargs = {'inl': inl, 'si': len(inl), 'upt': upt}
+                if md5 and len(md5) == 32:
+                    kwargs['md5'] = md5
+                model.objects.filter(id=obj.id).update(**kwargs)
+        except Exception as e:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg=f'修改对象元数据失败，{str(e)}')
+
+        obj.inl = inl
+        obj.si = len(inl)
+        obj.upt = upt
+        return True
+
+    def _promote_inline(self, obj, rados):
+        '''
+        内联对象增大超过内联大小上限时，内联数据转存到rados
+
+        :param obj: 对象元数据
+        :param rados: rados接口
+        :return:
+            正常：True
+            错误：raise HarborError
+        '''
+        model = obj._meta.model
+        try:
+            with transaction.atomic(using=router.db_for_write(model)):
+                row = model.objects.select_for_update().only('id', 'inl').get(id=obj.id)
+                if row.inl is not None:
+                    if len(row.inl) > 0:
+                        ok, msg = rados.write(offset=0, data_block=bytes(row.inl))
+                        if not ok:
+                            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='内联数据rados写入失败:' + msg)
+
+                    model.objects.filter(id=obj.id).update(inl=None)
+        except HarborError as e:
+            raise e
+        except Exception as e:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg=f'修改对象元数据失败，{str(e)}')
+
+        obj.inl = None
+        rados.set_inline(None)
+        return True
+
+    @staticmethod
+    def _can_pack(obj, rados, offset: int, size: int):
+        '''
+        空对象首次写入数据时，数据是否可以打包写入pack文件
+        '''
+        if offset != 0 or obj.si or obj.inl is not None or rados.is_packed():
+            return False
+
+        return 0 < size <= get_pack_max_object_size()
+
+    def _save_packed(self, obj, rados, offset: int, data: bytes, md5: str = ''):
+        '''
+        空对象首次写入的小对象数据打包写入pack文件
+
+        :param obj: 对象元数据
+        :param rados: rados接口
+        :param offset: 写入偏移量
+        :param data: 数据
+        :param md5: 更新对象元数据MD5值，默认为空忽略
+        :return:
+            True    # 已打包写入
+            False   # 不满足打包条件或打包写入失败，需要按对象布局写入rados
+            raise HarborError
+        '''
+        if not self._can_pack(obj=obj, rados=rados, offset=offset, size=len(data)):
+            return False
+
+        try:
+            layout = append_to_pack(pool_name=rados.get_pool_name(), data=data)
+        except RadosError as e:
+            debug_logger.error(f'failed to write packed object, {str(e)}')
+            return False
+
+        model = obj._meta.model
+        upt = timezone.now()
+        kwargs = {'lay': str(layout), 'si': len(data), 'upt': upt}
+        if md5 and len(md5) == 32:
+            kwargs['md5'] = md5
+        try:
+            # 对象仍为空时才更新，否则pack中已写入的数据作废
+            r = model.objects.filter(id=obj.id, si=0, inl__isnull=True).update(**kwargs)
+        except Exception as e:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg=f'修改对象元数据失败，{str(e)}')
+
+        if r == 0:
+            return False
+
+        obj.lay = str(layout)
+        obj.si = len(data)
+        obj.upt = upt
+        rados.reset_obj_id_and_size(obj_size=obj.si, layout=layout)
+        return True
+
+    def _unshare_object(self, obj, rados):
+        '''
+        写入打包、去重或压缩的对象前，对象只读布局的数据(pack文件、blob或压缩数据)复制(解压)到独占的rados对象
+
+        :param obj: 对象元数据
+        :param rados: rados接口
+        :return:
+            正常：True
+            错误：raise HarborError
+        '''
+        old_lay = obj.lay
+        old_layout = rados.get_layout()
+        src = HarborObject(pool_name=rados.get_pool_name(), obj_id=rados.get_obj_id(), obj_size=obj.si,
+                           layout=old_layout, cindex=obj.cidx)
+        new_lay = get_new_object_layout(pool_name=rados.get_pool_name())
+        rados.reset_obj_id_and_size(layout=new_lay)
+        ok, msg = src.copy_to(rados)
+        if not ok:
+            rados.delete(obj_size=obj.si)
+            rados.reset_obj_id_and_size(layout=old_lay, cindex=obj.cidx)
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='复制共享的对象数据失败:' + msg)
+
+        model = obj._meta.model
+        try:
+            r = model.objects.filter(id=obj.id, lay=old_lay).update(lay=new_lay, cidx=None)
+        except Exception:
+            r = 0
+
+        if r == 0:
+            rados.delete(obj_size=obj.si)
+            rados.reset_obj_id_and_size(layout=old_lay, cindex=obj.cidx)
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='修改对象元数据失败')
+
+        obj.lay = new_lay
+        obj.cidx = None
+        if isinstance(old_layout, DedupLayout):
+            self._release_blob(pool_name=rados.get_pool_name(), layout=old_layout)
+        elif isinstance(old_layout, CompressedLayout):
+            # 删除压缩数据失败只记录日志
+            ok, msg = src.delete()
+            if not ok:
+                debug_logger.error(f'failed to delete compressed data of object {rados.get_obj_id()}, {msg}')
+
+        return True
+
+    @staticmethod
+    def _release_blob(pool_name: str, layout):
+        '''
+        释放对象对去重blob的引用，失败只记录日志
+        '''
+        try:
+            release_blob(pool_name=pool_name, layout=layout)
+        except Exception as e:
+            debug_logger.error(f'failed to release dedup blob {layout.blob_key}, {str(e)}')
+
+    @staticmethod
+    def _same_data(ho1, ho2, size: int, block_size: int = 4 * 1024 ** 2):
+        '''
+        比较两个对象的数据是否相同
+        '''
+        for offset in range(0, size, block_size):
+            ok1, d1 = ho1.read(offset=offset, size=block_size)
+            ok2, d2 = ho2.read(offset=offset, size=block_size)
+            if not (ok1 and ok2) or d1 != d2:
+                return False
+
+        return True
+
+    def dedup_object(self, obj, rados, md5: str):
+        '''
+        上传完成的对象去重，同一pool中已存在MD5和大小相同的数据(blob)时，对象改为引用blob并删除自己的rados数据，
+        否则对象的数据复制到独立rados key的新blob，对象改为引用此blob；去重失败不影响对象，对象保持独占数据；
+        blob不使用对象的rados key，对象之后覆盖写入或删除自己的rados数据时不会破坏blob
+
+        :param obj: 对象元数据，对象数据已完整写入rados
+        :param rados: rados接口
+        :param md5: 对象数据MD5
+        :return:
+            True    # 已去重，对象引用blob
+            False   # 未去重
+        '''
+        size = obj.si
+        min_size = get_dedup_min_size()
+        if min_size <= 0 or size < min_size or not md5 or len(md5) != 32:
+            return False
+
+        if obj.inl is not None or rados.is_read_only():
+            return False
+
+        pool_name = rados.get_pool_name()
+        old_lay = obj.lay
+        model = obj._meta.model
+        rados.reset_obj_id_and_size(obj_size=size)
+        try:
+            layout = acquire_blob(pool_name=pool_name, md5=md5, size=size)
+            if layout is None:
+                layout = self._create_blob_from_object(rados=rados, md5=md5, size=size)
+                if layout is None:
+                    return False
+
+                if model.objects.filter(id=obj.id, lay=old_lay).update(lay=str(layout)) == 0:
+                    self._release_blob(pool_name=pool_name, layout=layout)
+                    return False
+            else:
+                verify = get_dedup_config().get('VERIFY', True)
+                blob = HarborObject(pool_name=pool_name, obj_id='', obj_size=size, layout=layout)
+                if (verify and not self._same_data(rados, blob, size=size)) or \
+                        model.objects.filter(id=obj.id, lay=old_lay).update(lay=str(layout)) == 0:
+                    self._release_blob(pool_name=pool_name, layout=layout)
+                    return False
+        except Exception as e:
+            debug_logger.error(f'failed to dedup object, {str(e)}')
+            return False
+
+        # 删除对象自己的rados数据
+        ok, msg = rados.delete(obj_size=size)
+        if not ok:
+            debug_logger.error(f'failed to delete rados data of deduplicated object, {msg}')
+
+        obj.lay = str(layout)
+        rados.reset_obj_id_and_size(obj_size=size, layout=layout)
+        return True
+
+    @staticmethod
+    def _create_blob_from_object(rados, md5: str, size: int):
+        '''
+        对象数据复制到一个独立rados key，登记为引用数为1的blob；失败时删除已复制的数据
+
+        :param rados: 对象的rados接口，对象数据已完整写入
+        :return:
+            DedupLayout()   # 引用新blob的对象数据布局
+            None            # 复制失败，或已被并发登记了数据相同的blob
+        '''
+        pool_name = rados.get_pool_name()
+        layout = DedupLayout(blob_key=f'b_{uuid.uuid1().hex}', inner=get_new_object_layout(pool_name=pool_name))
+        if len(str(layout)) > 64:
+            return None
+
+        blob = HarborObject(pool_name=pool_name, obj_id=layout.blob_key, obj_size=size, layout=layout.inner)
+        ok, msg = rados.copy_to(blob)
+        if not ok:
+            debug_logger.error(f'failed to copy object data to dedup blob {layout.blob_key}, {msg}')
+            blob.delete()
+            return None
+
+        try:
+            created = create_blob(pool_name=pool_name, md5=md5, size=size, blob_key=layout.blob_key,
+                                  layout=layout.inner)
+        except Exception as e:
+            blob.delete()
+            raise e
+
+        if created is None:
+            blob.delete()
+            return None
+
+        return layout
+
+    def create_obj_from_blob(self, bucket_name: str, obj_path: str, md5: str, size: int, user=None):
+        '''
+        存储中已存在MD5和大小相同的数据时，不需要上传数据，直接创建(或覆盖)一个引用此数据的对象
+
+        :return:
+            created             # created==True表示对象是新建的；created==False表示对象不是新建的
+            raise HarborError   # 不存在相同的数据(404)，或其他错误
+        '''
+        min_size = get_dedup_min_size()
+        if min_size <= 0 or not get_dedup_config().get('ALLOW_UPFRONT', False):
+            raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg='未启用去重秒传')
+
+        if size < min_size or not md5 or len(md5) != 32:
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='存储中不存在相同的数据，请上传对象数据')
+
+        bucket = self.get_bucket(bucket_name, user=user)
+        if not bucket:
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='存储桶不存在')
+
+        pool_name = bucket.get_pool_name()
+        try:
+            layout = acquire_blob(pool_name=pool_name, md5=md5, size=size)
+        except Exception as e:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg=f'查询去重数据错误，{str(e)}')
+
+        if layout is None:
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='存储中不存在相同的数据，请上传对象数据')
+
+        try:
+            bucket, obj, created = self.create_empty_obj(bucket_name=bucket_name, obj_path=obj_path, user=user)
+            rados = HarborObject(pool_name=pool_name, obj_id=obj.get_obj_key(bucket.id), obj_size=obj.si,
+                                 layout=obj.lay, inline=obj.inl, cindex=obj.cidx)
+            if created is False:
+                self._pre_reset_upload(obj=obj, rados=rados)
+        except HarborError as e:
+            self._release_blob(pool_name=pool_name, layout=layout)
+            raise e
+
+        obj.lay = str(layout)
+        obj.si = size
+        obj.md5 = md5
+        obj.upt = timezone.now()
+        if not obj.do_save(update_fields=['lay', 'si', 'md5', 'upt']):
+            self._release_blob(pool_name=pool_name, layout=layout)
+            if created:
+                obj.do_delete()
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='修改对象元数据失败')
+
+        return created
+
+    def create_multipart_upload(self, bucket_name: str, obj_path: str, part_size: int, user=None):
+        '''
+        初始化一个分片上传，对象在完成上传时才创建
+
+        :param bucket_name: 桶名
+        :param obj_path: 对象全路径
+        :param part_size: 分片大小，除最后一个分片外，每个分片的大小都必须等于part_size
+        :param user: 用户，默认为None，如果给定用户只操作属于此用户的存储桶
+        :return:
+            MultipartUpload()
+            raise HarborError
+        '''
+        path, filename = PathParser(filepath=obj_path).get_path_and_filename()
+        if not bucket_name or not filename:
+            raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg='参数有误')
+
+        if len(filename) > 255:
+            raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg='对象名称长度最大为255字符')
+
+        if not (MultipartUpload.MIN_PART_SIZE <= part_size <= MultipartUpload.MAX_PART_SIZE):
+            raise HarborError(code=status.HTTP_400_BAD_REQUEST,
+                              msg=f'分片大小必须在{MultipartUpload.MIN_PART_SIZE}和{MultipartUpload.MAX_PART_SIZE}字节之间')
+
+        bucket = self.get_bucket(bucket_name, user=user)
+        if not bucket:
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='存储桶不存在')
+
+        pool_name = bucket.get_pool_name()
+        upload = MultipartUpload(user=bucket.user, bucket_id=bucket.id, bucket_name=bucket.name, pool_name=pool_name,
+                                 obj_path=self._normalize_obj_path(obj_path), part_size=part_size,
+                                 lay=get_new_object_layout(pool_name=pool_name, bucket_name=bucket.name))
+        if len(str(RelocatedLayout(data_key=upload.data_key, inner=upload.lay))) > 64:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='数据布局字符串过长')
+
+        try:
+            upload.save()
+        except Exception as e:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg=f'创建分片上传记录失败，{str(e)}')
+
+        return upload
+
+    @staticmethod
+    def _normalize_obj_path(obj_path: str):
+        path, filename = PathParser(filepath=obj_path).get_path_and_filename()
+        return f'{path}/{filename}' if path else filename
+
+    def get_multipart_upload(self, bucket_name: str, obj_path: str, upload_id: str, user=None):
+        '''
+        获取存储桶中对象的一个分片上传
+
+        :return:
+            MultipartUpload()
+            raise HarborError   # 存储桶或分片上传不存在
+        '''
+        bucket = self.get_bucket(bucket_name, user=user)
+        if not bucket:
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='存储桶不存在')
+
+        upload = MultipartUpload.objects.filter(upload_id=upload_id, bucket_id=bucket.id).first()
+        if upload is None or upload.obj_path != self._normalize_obj_path(obj_path):
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='分片上传不存在')
+
+        return upload
+
+    @staticmethod
+    def _lock_uploading(upload):
+        '''
+        在事务中锁定上传中的分片上传记录
+
+        :return: MultipartUpload()
+        :raises: HarborError    # 分片上传已不是上传中
+        '''
+        u = MultipartUpload.objects.select_for_update().filter(id=upload.id).first()
+        if u is None:
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='分片上传不存在')
+        if u.status != MultipartUpload.STATUS_UPLOADING:
+            raise HarborError(code=status.HTTP_409_CONFLICT, msg='分片上传正在完成或取消')
+
+        return u
+
+    def upload_multipart_part(self, bucket_name: str, obj_path: str, upload_id: str, part_num: int, stream,
+                              size: int, md5: str = '', user=None, read_size: int = 8 * 1024 ** 2):
+        '''
+        上传一个分片，数据从stream读取，直接写入上传数据中此分片的偏移量处；同一编号的分片重复上传时覆盖，
+        不同分片可以并行上传
+
+        :param part_num: 分片编号，从1开始
+        :param stream: 分片数据流，有read(size)方法，如request
+        :param size: 分片数据长度
+        :param md5: 分片数据的16进制MD5，不为空时校验
+        :param read_size: 每次从stream读取的数据大小
+        :return:
+            MultipartPart()
+            raise HarborError
+        '''
+        upload = self.get_multipart_upload(bucket_name=bucket_name, obj_path=obj_path, upload_id=upload_id, user=user)
+        if not (1 <= part_num <= MultipartUpload.MAX_PART_NUM):
+            raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg=f'分片编号必须在1和{MultipartUpload.MAX_PART_NUM}之间')
+
+        if not (0 < size <= upload.part_size):
+            raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg=f'分片大小必须在1和{upload.part_size}字节之间')
+
+        # 登记分片正在上传，完成上传时有正在上传的分片会失败
+        with transaction.atomic(using=router.db_for_write(MultipartUpload)):
+            self._lock_uploading(upload)
+            MultipartPart.objects.update_or_create(upload=upload, part_num=part_num, defaults={'size': -1, 'md5': ''})
+
+        def discard(msg, code=status.HTTP_400_BAD_REQUEST):
+            MultipartPart.objects.filter(upload=upload, part_num=part_num).delete()
+            return HarborError(code=code, msg=msg)
+
+        ho = HarborObject(pool_name=upload.pool_name, obj_id=upload.data_key, layout=upload.lay)
+        offset = upload.part_offset(part_num)
+        md5_hash = hashlib.md5()
+        pos = 0
+        writer = None
+        try:
+            writer = ho.get_aio_writer()
+            while pos < size:
+                data = stream.read(min(read_size, size - pos))
+                if not data:
+                    break
+
+                writer.write(data, offset=offset + pos)
+                md5_hash.update(data)
+                pos += len(data)
+
+            writer.flush()
+        except RadosError as e:
+            if writer is not None:
+                writer.abort()
+            raise discard(msg=f'分片数据写入失败，{str(e)}', code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except OSError as e:    # 读取请求数据错误，如客户端断开
+            if writer is not None:
+                writer.abort()
+            raise discard(msg=f'读取分片数据失败，{str(e)}')
+
+        # 写入期间分片上传被取消时，取消操作可能已先删除了上传数据，删除此次写入的数据，防止残留
+        upload_status = MultipartUpload.objects.filter(id=upload.id).values_list('status', flat=True).first()
+        if upload_status is None or upload_status == MultipartUpload.STATUS_ABORTING:
+            ok, msg = ho.delete(obj_size=offset + size)
+            if not ok:
+                debug_logger.error(f'failed to delete part data of aborted multipart upload {upload.upload_id}, {msg}')
+            raise HarborError(code=status.HTTP_409_CONFLICT, msg='分片上传已取消')
+
+        if pos != size:
+            raise discard(msg='分片数据不完整')
+
+        hex_md5 = md5_hash.hexdigest()
+        if md5 and md5.lower() != hex_md5:
+            raise discard(msg='分片数据MD5校验失败')
+
+        part = MultipartPart.objects.filter(upload=upload, part_num=part_num).first()
+        if part is None:
+            raise HarborError(code=status.HTTP_409_CONFLICT, msg='分片上传已取消')
+
+        part.size = size
+        part.md5 = hex_md5
+        part.save(update_fields=['size', 'md5', 'modified_time'])
+        return part
+
+    def list_multipart_parts(self, bucket_name: str, obj_path: str, upload_id: str, user=None):
+        '''
+        分片上传的所有分片
+
+        :return:
+            (MultipartUpload(), [MultipartPart(), ])
+            raise HarborError
+        '''
+        upload = self.get_multipart_upload(bucket_name=bucket_name, obj_path=obj_path, upload_id=upload_id, user=user)
+        return upload, list(MultipartPart.objects.filter(upload=upload).order_by('part_num'))
+
+    @staticmethod
+    def _set_upload_status(upload, status_code: int):
+        MultipartUpload.objects.filter(id=upload.id).update(status=status_code)
+
+    def complete_multipart_upload(self, bucket_name: str, obj_path: str, upload_id: str, parts=None, md5: str = '',
+                                  user=None):
+        '''
+        完成分片上传，创建(或覆盖)对象，对象数据直接使用上传数据(RelocatedLayout)，不复制数据；
+        分片编号必须从1连续，除最后一个分片外大小必须等于part_size
+
+        :param parts: [(part_num, md5), ] 客户端记录的分片列表，不为None时校验和已上传的分片一致
+        :param md5: 整个对象数据的MD5，不为空时保存为对象的MD5；服务器不读取数据计算MD5
+        :return:
+            (bucket, obj, created, etag)    # etag是各分片MD5拼接后的MD5和分片数，如'xxx-3'
+            raise HarborError
+        '''
+        upload = self.get_multipart_upload(bucket_name=bucket_name, obj_path=obj_path, upload_id=upload_id, user=user)
+        if md5 and len(md5) != 32:
+            raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg='对象MD5格式有误')
+
+        with transaction.atomic(using=router.db_for_write(MultipartUpload)):
+            self._lock_uploading(upload)
+            db_parts = list(MultipartPart.objects.filter(upload=upload).order_by('part_num'))
+            if not db_parts:
+                raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg='没有已上传的分片')
+
+            for i, part in enumerate(db_parts, start=1):
+                if part.is_uploading():
+                    raise HarborError(code=status.HTTP_409_CONFLICT, msg=f'分片{part.part_num}正在上传')
+                if part.part_num != i:
+                    raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg=f'缺少分片{i}')
+                if i < len(db_parts) and part.size != upload.part_size:
+                    raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg=f'分片{i}大小不等于分片大小')
+
+            if parts is not None:
+                if [(int(n), m.lower()) for n, m in parts] != [(p.part_num, p.md5) for p in db_parts]:
+                    raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg='分片列表和已上传的分片不一致')
+
+            self._set_upload_status(upload, MultipartUpload.STATUS_COMPLETING)
+
+        size = sum(p.size for p in db_parts)
+        etag = hashlib.md5(b''.join(bytes.fromhex(p.md5) for p in db_parts)).hexdigest() + f'-{len(db_parts)}'
+        try:
+            bucket, obj, created = self.create_empty_obj(bucket_name=bucket_name, obj_path=upload.obj_path, user=user)
+            if created is False:
+                rados = HarborObject(pool_name=bucket.get_pool_name(), obj_id=obj.get_obj_key(bucket.id),
+                                     obj_size=obj.si, layout=obj.lay, inline=obj.inl, cindex=obj.cidx)
+                self._pre_reset_upload(obj=obj, rados=rados)
+        except HarborError as e:
+            self._set_upload_status(upload, MultipartUpload.STATUS_UPLOADING)
+            raise e
+
+        obj.lay = str(RelocatedLayout(data_key=upload.data_key, inner=upload.lay))
+        obj.si = size
+        obj.md5 = md5.lower()
+        obj.upt = timezone.now()
+        obj.inl = None
+        obj.cidx = None
+        if not obj.do_save(update_fields=['lay', 'si', 'md5', 'upt', 'inl', 'cidx']):
+            if created:
+                obj.do_delete()
+            self._set_upload_status(upload, MultipartUpload.STATUS_UPLOADING)
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='修改对象元数据失败')
+
+        # 上传数据已属于对象
+        upload.delete()
+        return bucket, obj, created, etag
+
+    def abort_multipart_upload(self, bucket_name: str, obj_path: str, upload_id: str, user=None):
+        '''
+        取消分片上传，先标记为取消中，再删除已上传的分片数据和上传记录；
+        取消时仍在写入的分片，写入完成后检查到取消标记，删除自己写入的数据
+
+        :return:
+            True
+            raise HarborError
+        '''
+        upload = self.get_multipart_upload(bucket_name=bucket_name, obj_path=obj_path, upload_id=upload_id, user=user)
+        with transaction.atomic(using=router.db_for_write(MultipartUpload)):
+            u = MultipartUpload.objects.select_for_update().filter(id=upload.id).first()
+            if u is None:
+                raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='分片上传不存在')
+            if u.status == MultipartUpload.STATUS_COMPLETING:
+                raise HarborError(code=status.HTTP_409_CONFLICT, msg='分片上传正在完成')
+
+            self._set_upload_status(upload, MultipartUpload.STATUS_ABORTING)
+
+        self.delete_multipart_data(upload)
+        upload.delete()
+        return True
+
+    @staticmethod
+    def delete_multipart_data(upload):
+        '''
+        删除分片上传的数据，删除范围按最大的分片编号计算
+
+        :raises: HarborError
+        '''
+        max_num = MultipartPart.objects.filter(upload=upload).aggregate(m=Max('part_num'))['m'] or 1
+        ho = HarborObject(pool_name=upload.pool_name, obj_id=upload.data_key, obj_size=max_num * upload.part_size,
+                          layout=upload.lay)
+        ok, msg = ho.delete()
+        if not ok:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg=f'删除分片上传数据失败，{msg}')
+
+    def store_buffered_data(self, obj, rados, data):
+        '''
+        保存上传时缓存在内存中未写入rados的小对象数据，不超过内联大小上限的内联存储在元数据中，
+        否则打包写入pack文件，未启用打包或打包写入失败时写入rados；只修改obj实例，由调用者保存元数据inl和lay
+
+        :param obj: 空对象的元数据
+        :param rados: rados接口
+        :param data: bytes; None表示数据已写入rados
+        :return:
+            正常：True
+            错误：raise HarborError
+        '''
+        if data is None:
+            return True
+
+        size = len(data)
+        inline_max_size = get_inline_max_size()
+        if inline_max_size > 0 and size <= inline_max_size:
+            obj.inl = data
+            return True
+
+        if self._can_pack(obj=obj, rados=rados, offset=0, size=size):
+            try:
+                layout = append_to_pack(pool_name=rados.get_pool_name(), data=data)
+            except RadosError as e:
+                debug_logger.error(f'failed to write packed object, {str(e)}')
+            else:
+                obj.lay = str(layout)
+                rados.reset_obj_id_and_size(layout=layout)
+                return True
+
+        if size > 0:
+            ok, msg = rados.write(offset=0, data_block=data)
+            if not ok:
+                raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='文件rados写入失败:' + msg)
+
         return True
 
     def _save_one_chunk(self, obj, rados, offset:int, chunk:bytes, md5: str = ''):
@@ -751,6 +1964,20 @@ class HarborManager:
             成功：True
             失败：raise HarborError
         '''
+        # 小对象数据内联存储在元数据中
+        if self._save_inline(obj=obj, offset=offset, data=chunk, md5=md5):
+            return True
+
+        if obj.inl is not None:
+            self._promote_inline(obj=obj, rados=rados)
+
+        # 小对象打包存储在pack文件中
+        if self._save_packed(obj=obj, rados=rados, offset=offset, data=chunk, md5=md5):
+            return True
+
+        if rados.is_read_only():
+            self._unshare_object(obj=obj, rados=rados)
+
         # 先更新元数据，后写rados数据
         # 更新文件修改时间和对象大小
         new_size = offset + len(chunk) # 分片数据写入后 对象偏移量大小
@@ -791,6 +2018,26 @@ class HarborManager:
             raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg='输入必须是一个文件')
 
         new_size = offset + file_size # 分片数据写入后 对象偏移量大小
+        # 小对象数据内联存储在元数据中，或打包存储在pack文件中
+        if self._can_inline(obj, new_size) or self._can_pack(obj=obj, rados=rados, offset=offset, size=file_size):
+            try:
+                file.seek(0)
+                data = bytes(file.read())
+            except Exception as e:
+                raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg=f'读取文件错误，{str(e)}')
+
+            if self._save_inline(obj=obj, offset=offset, data=data):
+                return True
+            if self._save_packed(obj=obj, rados=rados, offset=offset, data=data):
+                return True
+            file.seek(0)
+
+        if obj.inl is not None:
+            self._promote_inline(obj=obj, rados=rados)
+
+        if rados.is_read_only():
+            self._unshare_object(obj=obj, rados=rados)
+
         if not self._update_obj_metadata(obj, size=new_size):
             raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='修改对象元数据失败')
 
@@ -877,7 +2124,8 @@ class HarborManager:
             raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='删除对象原数据时错误')
 
         pool_name = bucket.get_pool_name()
-        ho = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=fileobj.si)
+        ho = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=fileobj.si, layout=fileobj.lay,
+                          inline=fileobj.inl, cindex=fileobj.cidx)
         ok, _ = ho.delete()
         if not ok:
             # 恢复元数据
@@ -885,8 +2133,149 @@ class HarborManager:
             fileobj.do_save(force_insert=True)  # 仅尝试创建文档，不修改已存在文档
             raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='删除对象rados数据时错误')
 
+        # 去重的对象释放对blob的引用
+        if ho.is_deduped():
+            self._release_blob(pool_name=pool_name, layout=ho.get_layout())
+
+        invalidate_staged(obj_key)
         return True
 
+    def delete_objects(self, bucket_name: str, paths=None, prefix: str = '', user=None):
+        '''
+        批量删除对象，每批对象元数据一次查询(na_md5 IN)、一次删除，rados数据通过有限并发的aio_remove删除，
+        rados数据删除失败的对象恢复元数据；不删除目录
+
+        :param bucket_name: 桶名
+        :param paths: 对象全路径列表
+        :param prefix: paths为None时，删除全路径以此前缀开头的对象，一次最多删除BULK_DELETE['MAX_KEYS']个
+        :param user: 用户，默认为None，如果给定用户只删除属于此用户的对象（只查找此用户的存储桶）
+        :return:
+            (results, truncated)
+            results: [{'key': str, 'ok': bool, 'code': int, 'msg': str}, ]
+            truncated: 前缀删除时是否还有未删除的对象，需要再次请求
+
+        :raise HarborError
+        '''
+        conf = get_bulk_delete_conf()
+        batch_size = max(conf.get('BATCH_SIZE', 1000), 1)
+        max_keys = conf.get('MAX_KEYS', 10000)
+        if paths is None and not prefix:
+            raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg='参数有误，需要对象路径列表或路径前缀')
+        if paths is not None and len(paths) > max_keys:
+            raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg=f'一次最多删除{max_keys}个对象')
+
+        bucket = self.get_bucket(bucket_name, user=user)
+        if not bucket:
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='存储桶不存在')
+
+        prefix = prefix.lstrip('/') if prefix else ''
+        model_class = BucketFileManagement(collection_name=bucket.get_bucket_table_name()).get_obj_model_class()
+        results = []
+        if paths is not None:
+            for start in range(0, len(paths), batch_size):
+                batch = paths[start:start + batch_size]
+                objs, missing = self._get_objs_by_paths(model_class, batch)
+                for key in missing:
+                    results.append({'key': key, 'ok': False, 'code': 404, 'msg': '文件对象不存在'})
+                results += self._delete_objs_batch(bucket, objs, max_inflight=conf.get('MAX_INFLIGHT', 32))
+
+            return results, False
+
+        last_id = 0
+        deleted = 0
+        while deleted < max_keys:
+            limit = min(batch_size, max_keys - deleted)
+            try:
+                objs = list(model_class.objects.filter(
+                    fod=True, sds=False, na__startswith=prefix, id__gt=last_id).order_by('id')[:limit])
+            except Exception as e:
+                raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg=str(e), results=results)
+
+            if not objs:
+                return results, False
+
+            last_id = objs[-1].id
+            deleted += len(objs)
+            results += self._delete_objs_batch(bucket, [(obj.na, obj) for obj in objs],
+                                               max_inflight=conf.get('MAX_INFLIGHT', 32))
+
+        try:
+            truncated = model_class.objects.filter(fod=True, sds=False, na__startswith=prefix, id__gt=last_id).exists()
+        except Exception:
+            truncated = True
+
+        return results, truncated
+
+    @staticmethod
+    def _get_objs_by_paths(model_class, paths):
+        '''
+        一次查询多个对象元数据；na_md5为空的旧元数据再按na查询一次
+
+        :return: ([(key, obj), ], [key, ])    # 存在的对象和不存在的对象的路径
+        :raises: HarborError
+        '''
+        keys = {}       # {全路径: 请求的路径}
+        for key in paths:
+            path, filename = PathParser(filepath=key).get_path_and_filename()
+            if filename:
+                keys.setdefault(f'{path}/{filename}' if path else filename, key)
+
+        found = {}
+        try:
+            md5s = [get_str_hexMD5(na) for na in keys]
+            for obj in model_class.objects.filter(na_md5__in=md5s, fod=True, sds=False):
+                if obj.na in keys:
+                    found[obj.na] = obj
+
+            left = [na for na in keys if na not in found]
+            if left:
+                for obj in model_class.objects.filter(na_md5__isnull=True, na__in=left, fod=True, sds=False):
+                    found[obj.na] = obj
+        except Exception as e:
+            raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg=str(e))
+
+        objs = [(keys[na], obj) for na, obj in found.items()]
+        found_keys = set(keys[na] for na in found)
+        missing = [key for key in paths if key not in found_keys]
+        return objs, missing
+
+    def _delete_objs_batch(self, bucket, objs, max_inflight: int = 32):
+        '''
+        删除一批对象，先删除元数据，后删除rados数据，rados数据删除失败的对象恢复元数据
+
+        :param objs: [(key, obj), ]
+        :return: [{'key': str, 'ok': bool, 'code': int, 'msg': str}, ]
+        '''
+        if not objs:
+            return []
+
+        model = objs[0][1]._meta.model
+        try:
+            model.objects.filter(id__in=[obj.id for _, obj in objs]).delete()
+        except Exception:
+            return [{'key': key, 'ok': False, 'code': 500, 'msg': '删除对象元数据时错误'} for key, _ in objs]
+
+        pool_name = bucket.get_pool_name()
+        hos = [HarborObject(pool_name=pool_name, obj_id=obj.get_obj_key(bucket.id), obj_size=obj.si, layout=obj.lay,
+                            inline=obj.inl, cindex=obj.cidx) for _, obj in objs]
+        errors = HarborObject.delete_many(hos, max_inflight=max_inflight)
+        results = []
+        for i, (key, obj) in enumerate(objs):
+            ho = hos[i]
+            if i in errors:
+                debug_logger.error(f'failed to delete rados data of object {ho.get_obj_id()}, {errors[i]}')
+                obj.do_save(force_insert=True)  # 恢复元数据
+                results.append({'key': key, 'ok': False, 'code': 500, 'msg': '删除对象rados数据时错误'})
+                continue
+
+            if ho.is_deduped():
+                self._release_blob(pool_name=pool_name, layout=ho.get_layout())
+
+            invalidate_staged(ho.get_obj_id())
+            results.append({'key': key, 'ok': True, 'code': 200, 'msg': ''})
+
+        return results
+
     def read_chunk(self, bucket_name:str, obj_path:str, offset:int, size:int, user=None):
         '''
         从对象读取一个数据块
@@ -920,7 +2309,7 @@ class HarborManager:
 
         obj_key = obj.get_obj_key(bucket.id)
         pool_name = bucket.get_pool_name()
-        rados = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.si)
+        rados = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.si, layout=obj.lay, inline=obj.inl, cindex=obj.cidx)
         ok, chunk = rados.read(offset=offset, size=size)
         if not ok:
             raise HarborError(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg='文件块读取失败')
@@ -931,7 +2320,8 @@ class HarborManager:
 
         return (chunk, obj)
 
-    def get_obj_generator(self, bucket_name:str, obj_path:str, offset:int=0, end:int=None, per_size=10 * 1024 ** 2, user=None, all_public=False):
+    def get_obj_generator(self, bucket_name:str, obj_path:str, offset:int=0, end:int=None, per_size=10 * 1024 ** 2, user=None, all_public=False,
+                          read_ahead=None, use_cache=False):
         '''
         获取一个读取对象的生成器函数
 
@@ -942,6 +2332,8 @@ class HarborManager:
         :param per_size: 每次读取数据块长度；type: int， 默认10Mb
         :param user: 用户，默认为None，如果给定用户只查属于此用户的对象（只查找此用户的存储桶）
         :param all_public: 默认False(忽略); True(查找所有公有权限存储桶);
+        :param read_ahead: 后台预读数据块数，见_get_obj_generator()
+        :param use_cache: True(通过热点对象缓存读取)，见_get_obj_generator()
         :return: (generator, object)
                 for data in generator:
                     do something
@@ -964,10 +2356,12 @@ class HarborManager:
 
         # 增加一次下载次数
         obj.download_cound_increase()
-        generator = self._get_obj_generator(bucket=bucket, obj=obj, offset=offset, end=end, per_size=per_size)
+        generator = self._get_obj_generator(bucket=bucket, obj=obj, offset=offset, end=end, per_size=per_size,
+                                            read_ahead=read_ahead, use_cache=use_cache)
         return  generator, obj
 
-    def _get_obj_generator(self, bucket, obj, offset:int=0, end:int=None, per_size=10 * 1024 ** 2):
+    def _get_obj_generator(self, bucket, obj, offset:int=0, end:int=None, per_size=10 * 1024 ** 2, read_ahead=None,
+                           use_cache=False):
         '''
         获取一个读取对象的生成器函数
 
@@ -976,6 +2370,8 @@ class HarborManager:
         :param offset: 读起始偏移量；type: int
         :param end: 读结束偏移量(包含)；type: int；默认None表示对象结尾；
         :param per_size: 每次读取数据块长度；type: int， 默认10Mb
+        :param read_ahead: 后台预读数据块数，0不预读；默认None使用settings.CEPH_RADOS['READ_AHEAD_DEPTH']
+        :param use_cache: True(通过热点对象缓存读取，见settings.OBJECT_CACHE)
         :return: generator
                 for data in generator:
                     do something
@@ -984,8 +2380,21 @@ class HarborManager:
         # 读取文件对象生成器
         obj_key = obj.get_obj_key(bucket.id)
         pool_name = bucket.get_pool_name()
-        rados = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.si)
-        return rados.read_obj_generator(offset=offset, end=end, block_size=per_size)
+        rados = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.si, layout=obj.lay, inline=obj.inl, cindex=obj.cidx)
+        if read_ahead is None:
+            read_ahead = settings.CEPH_RADOS.get('READ_AHEAD_DEPTH', 0)
+
+        def load(offset, end):
+            return rados.read_obj_generator(offset=offset, end=end, block_size=per_size, read_ahead=read_ahead)
+
+        # 内联对象不需要缓存
+        cache = get_object_cache() if use_cache and obj.inl is None else None
+        if cache is not None and cache.cacheable(obj.si):
+            key = build_cache_key(obj_key=obj_key, upt=obj.upt, size=obj.si)
+            return cache.read_generator(key=key, obj_size=obj.si, load=load, offset=offset, end=end,
+                                        block_size=per_size)
+
+        return load(offset=offset, end=end)
 
     def get_write_generator(self, bucket_name:str, obj_path:str, user=None):
         '''
@@ -1019,13 +2428,14 @@ class HarborManager:
             raise HarborError(code=status.HTTP_404_NOT_FOUND, msg='存储桶不存在')
 
         collection_name = bucket.get_bucket_table_name()
-        obj, created = self._get_obj_and_check_limit_or_create(collection_name, path, filename)
+        layout = get_new_object_layout(pool_name=bucket.get_pool_name(), bucket_name=bucket.name)
+        obj, created = self._get_obj_and_check_limit_or_create(collection_name, path, filename, layout=layout)
         obj_key = obj.get_obj_key(bucket.id)
         pool_name = bucket.get_pool_name()
 
         def generator():
             ok = True
-            rados = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.si)
+            rados = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.si, layout=obj.lay, inline=obj.inl, cindex=obj.cidx)
             if created is False:  # 对象已存在，不是新建的,重置对象大小
                 self._pre_reset_upload(obj=obj, rados=rados)
 
@@ -1242,10 +2652,10 @@ class FtpHarborManager():
     @ftp_close_old_connections
     def ftp_move_rename(self, bucket_name:str, obj_path:str, rename=None, move=None):
         '''
-        移动或重命名对象
+        移动或重命名对象或目录
 
         :param bucket_name: 桶名
-        :param obj_path: 对象全路径
+        :param obj_path: 对象或目录全路径
         :param rename: 重命名新名称，默认为None不重命名
         :param move: 移动到move路径下，默认为None不移动
         :return:
@@ -1259,10 +2669,10 @@ class FtpHarborManager():
     @ftp_close_old_connections
     def ftp_rename(self, bucket_name:str, obj_path:str, rename):
         '''
-        重命名对象
+        重命名对象或目录
 
         :param bucket_name: 桶名
-        :param obj_path: 对象全路径
+        :param obj_path: 对象或目录全路径
         :param rename: 重命名新名称
         :return:
             success: object
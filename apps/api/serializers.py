@@ -5,6 +5,7 @@ from rest_framework import serializers
 from rest_framework.reverse import reverse, replace_query_param
 
 from .models import User, Bucket
+from buckets.models import DirDeleteJob
 from utils.time import to_localtime_string_naive_by_utc
 from utils.log.decorators import log_used_time
 from .validators import DNSStringValidator, bucket_limit_validator
@@ -110,7 +111,7 @@ class BucketSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Bucket
-        fields = ('id', 'name', 'user', 'created_time', 'access_permission', 'ftp_enable', 'ftp_password', 'ftp_ro_password', 'remarks')
+        fields = ('id', 'name', 'user', 'created_time', 'access_permission', 'ftp_enable', 'ftp_password', 'ftp_ro_password', 'remarks', 'compress')
         # depth = 1
 
     def get_user(self, obj):
@@ -280,6 +281,21 @@ class ObjInfoSerializer(serializers.Serializer):
         return gettext('私有')
 
 
+class DirDeleteJobSerializer(serializers.ModelSerializer):
+    '''
+    目录删除任务序列化器
+    '''
+    status = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DirDeleteJob
+        fields = ('job_id', 'bucket_name', 'dir_path', 'status', 'deleted_objs', 'deleted_dirs', 'deleted_size',
+                  'failed_objs', 'msg', 'created_time', 'modified_time')
+
+    def get_status(self, obj):
+        return {'code': obj.status, 'display': obj.get_status_display()}
+
+
 class AuthTokenDumpSerializer(serializers.Serializer):
     key = serializers.CharField()
     user = serializers.SerializerMethodField()
@@ -1,3 +1,423 @@
-from django.test import TestCase
+import io
+import zipfile
+import hashlib
+import contextlib
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.db import transaction
+from django.db.models import F, Func, Value
+from django.db.models.functions import Concat, Substr
+from django.db.models.functions.text import ConcatPair
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from buckets.models import DirDeleteJob, get_str_hexMD5
+from ftpserver.harbor_file_system import HarborFileSystem
+from . import harbor
+from .harbor import HarborManager, HarborError
+from .downloads import get_obj_etag
+from .archives import normalize_entry_name, ArchiveUploader, zip_stream
+from .views import BulkDeleteViewSet
+
+
+class FakeObj:
+    '''
+    只用于测试的对象元数据，do_save不访问数据库
+    '''
+    def __init__(self, size: int):
+        self.ult = self.upt = timezone.now() - timedelta(days=1)
+        self.si = size
+        self.md5 = ''
+        self.inl = None
+        self.lay = ''
+        self.cidx = None
+
+    def do_save(self, **kwargs):
+        return True
+
+
+class FakeRados:
+    def get_layout(self):
+        return None
+
+    def is_read_only(self):
+        return False
+
+    def is_relocated(self):
+        return False
+
+    def is_deduped(self):
+        return False
+
+    def get_pool_name(self):
+        return 'obs_test'
+
+    def get_obj_id(self):
+        return 'test_object'
+
+    def delete(self):
+        return True, None
+
+    def reset_obj_id_and_size(self, **kwargs):
+        pass
+
+
+class TestObjETag(SimpleTestCase):
+    def test_put_overwrite_changes_etag(self):
+        obj = FakeObj(size=1024)
+        etag = get_obj_etag(obj)
+
+        # 相同大小的数据覆盖上传
+        HarborManager()._pre_reset_upload(obj=obj, rados=FakeRados())
+        obj.si = 1024
+        self.assertNotEqual(get_obj_etag(obj), etag)
+
+
+def evaluate(expr, row):
+    '''
+    在内存中计算更新元数据时使用的数据库表达式
+    '''
+    if isinstance(expr, Value):
+        return expr.value
+    if isinstance(expr, F):
+        return getattr(row, expr.name)
+    if isinstance(expr, Substr):
+        s, pos = [evaluate(e, row) for e in expr.get_source_expressions()]
+        return s[pos - 1:]
+    if isinstance(expr, (Concat, ConcatPair)):
+        return ''.join(evaluate(e, row) for e in expr.get_source_expressions())
+    if isinstance(expr, Func) and expr.extra.get('function') == 'MD5':
+        return hashlib.md5(evaluate(expr.get_source_expressions()[0], row).encode('utf-8')).hexdigest()
+
+    return expr
+
+
+class FakeRow(SimpleNamespace):
+    def is_dir(self):
+        return not self.fod
+
+    def reset_na_md5(self):
+        self.na_md5 = get_str_hexMD5(self.na)
+
+
+class FakeQuerySet:
+    '''
+    只用于测试的内存桶表查询，支持移动和删除目录用到的查询条件
+    '''
+    def __init__(self, table, rows):
+        self.table = table
+        self.rows = rows
+
+    @staticmethod
+    def _match(row, lookups):
+        for key, value in lookups.items():
+            field, _, lookup = key.partition('__')
+            v = getattr(row, field)
+            if lookup == 'in':
+                ok = v in value
+            elif lookup == 'startswith':
+                ok = v.startswith(value)
+            elif lookup == 'gt':
+                ok = v > value
+            else:
+                ok = v == value
+            if not ok:
+                return False
+
+        return True
+
+    def filter(self, **lookups):
+        return FakeQuerySet(self.table, [r for r in self.rows if self._match(r, lookups)])
+
+    def exclude(self, **lookups):
+        return FakeQuerySet(self.table, [r for r in self.rows if not self._match(r, lookups)])
+
+    def select_for_update(self):
+        return self
+
+    def order_by(self, field):
+        key = field.lstrip('-')
+        return FakeQuerySet(self.table, sorted(self.rows, key=lambda r: getattr(r, key), reverse=field.startswith('-')))
+
+    def values_list(self, *fields, flat=False):
+        if flat:
+            return [getattr(r, fields[0]) for r in self.rows]
+
+        return [tuple(getattr(r, f) for f in fields) for r in self.rows]
+
+    def exists(self):
+        return bool(self.rows)
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __getitem__(self, item):
+        return self.rows[item]
+
+    def update(self, **kwargs):
+        self.table.before_update()
+        for row in self.rows:
+            values = {k: evaluate(v, row) for k, v in kwargs.items()}
+            for k, v in values.items():
+                setattr(row, k, v)
+
+        return len(self.rows)
+
+    def delete(self):
+        ids = {r.id for r in self.rows}
+        self.table.rows = [r for r in self.table.rows if r.id not in ids]
+        return len(ids), {}
+
+
+class FakeTable:
+    '''
+    只用于测试的内存桶表模型
+    '''
+    NA_MD5_MOVING = 'moving'
+
+    def __init__(self, rows, fail_at_update: int = None):
+        self._meta = SimpleNamespace(app_label='metadata', model=self)
+        self.rows = []
+        self.updates = 0
+        self.fail_at_update = fail_at_update     # 第几次更新时出错
+        for id_, na, fod, did in rows:
+            row = FakeRow(id=id_, na=na, name=na.rpartition('/')[-1], fod=fod, did=did, si=1, sds=False, _meta=self._meta)
+            row.reset_na_md5()
+            self.rows.append(row)
+
+    @property
+    def objects(self):
+        return FakeQuerySet(self, self.rows)
+
+    def before_update(self):
+        self.updates += 1
+        if self.updates == self.fail_at_update:
+            raise Exception('database error')
+
+    def get(self, id_):
+        for row in self.rows:
+            if row.id == id_:
+                return row
+
+    def snapshot(self):
+        return {r.id: (r.na, r.na_md5) for r in self.rows}
+
+
+@contextlib.contextmanager
+def no_transaction(using=None):
+    yield
+
+
+class TestMoveRenameDir(SimpleTestCase):
+    def setUp(self):
+        # 同名前缀的目录ab不在目录a的子树中
+        self.table = FakeTable([
+            (1, 'a', False, 0), (2, 'a/b', False, 1), (3, 'a/b/x.txt', True, 2), (4, 'a/y', True, 1),
+            (5, 'ab', False, 0), (6, 'ab/z', True, 5), (7, 'c', False, 0),
+        ])
+        self.bucket = SimpleNamespace(get_bucket_table_name=lambda: 'bucket_test')
+        bfm = mock.Mock()
+        bfm.get_obj.return_value = None
+        bfm.get_dir_or_obj_exists.return_value = None
+        bfm.build_dir_full_name.side_effect = lambda name: f'c/{name}'
+        bfm.get_cur_dir_id.return_value = (True, 7)
+        patchers = [mock.patch.object(harbor, 'BucketFileManagement', return_value=bfm),
+                    mock.patch.object(transaction, 'atomic', no_transaction)]
+        for p in patchers:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def move(self, dir_id, move_to=None, rename=None):
+        return HarborManager()._move_rename_dir(bucket=self.bucket, dir=self.table.get(dir_id), move_to=move_to,
+                                                rename=rename, batch_size=1)
+
+    def assert_na(self, id_, na):
+        row = self.table.get(id_)
+        self.assertEqual(row.na, na)
+        self.assertEqual(row.na_md5, get_str_hexMD5(na))
+
+    def test_move_rewrites_subtree_prefix(self):
+        dir, _ = self.move(1, move_to='c')
+        self.assertEqual((dir.na, dir.did), ('c/a', 7))
+        self.assert_na(1, 'c/a')
+        self.assert_na(2, 'c/a/b')
+        self.assert_na(3, 'c/a/b/x.txt')
+        self.assert_na(4, 'c/a/y')
+        self.assert_na(5, 'ab')
+        self.assert_na(6, 'ab/z')
+
+    def test_rename(self):
+        self.move(2, rename='d')
+        self.assert_na(2, 'a/d')
+        self.assert_na(3, 'a/d/x.txt')
+        self.assertEqual(self.table.get(2).name, 'd')
+        self.assert_na(4, 'a/y')
+
+    def test_move_into_self(self):
+        for move_to in ('a', 'a/b'):
+            with self.assertRaises(HarborError) as cm:
+                self.move(1, move_to=move_to)
+            self.assertEqual(cm.exception.code, 400)
+
+        self.assertEqual(self.table.updates, 0)
+
+    def test_subtree_moving(self):
+        self.table.get(2).na_md5 = FakeTable.NA_MD5_MOVING
+        with self.assertRaises(HarborError) as cm:
+            self.move(1, move_to='c')
+
+        self.assertEqual(cm.exception.code, 409)
+        self.assert_na(1, 'a')
+        self.assertEqual(self.table.get(2).na_md5, FakeTable.NA_MD5_MOVING)     # 不修改其他移动操作的目录
+        self.assert_na(3, 'a/b/x.txt')
+
+    def test_dir_changed(self):
+        dir = self.table.get(1)
+        dir.na = 'e'    # 读取后已被移动
+        with self.assertRaises(HarborError) as cm:
+            HarborManager()._move_rename_dir(bucket=self.bucket, dir=FakeRow(**{**vars(dir), 'na': 'a'}),
+                                             move_to='c', rename=None)
+
+        self.assertEqual(cm.exception.code, 409)
+
+    def test_undo_on_failure(self):
+        before = self.table.snapshot()
+        self.table.fail_at_update = 4      # 标记目录移动中后，改写部分元数据时出错
+        with self.assertRaises(HarborError) as cm:
+            self.move(1, move_to='c')
+
+        self.assertEqual(cm.exception.code, 500)
+        self.assertEqual(self.table.snapshot(), before)
+
+
+class TestArchiveInsertMovingDir(SimpleTestCase):
+    def test_discard_in_moving_dirs(self):
+        table = FakeTable([(1, 'a', False, 0), (2, 'b', False, 0), (3, 'a/x', True, 1), (4, 'b/y', True, 2)])
+        table.get(2).na_md5 = FakeTable.NA_MD5_MOVING
+        uploader = ArchiveUploader.__new__(ArchiveUploader)
+        uploader.model_class = table
+        uploader._delete_data = mock.Mock()
+        rows = [({'msg': ''}, table.get(3)), ({'msg': ''}, table.get(4))]
+
+        kept = uploader._discard_in_moving_dirs(rows)
+        self.assertEqual([row.id for _, row in kept], [3])
+        self.assertEqual(rows[1][0]['msg'], '所在目录正在移动中')
+        self.assertIsNone(table.get(4))
+        uploader._delete_data.assert_called_once_with(rows[1][1])
+
+
+class TestRmdirJob(SimpleTestCase):
+    def test_resume(self):
+        table = FakeTable([(1, 'a', False, 0), (2, 'a/b', False, 1), (3, 'a/b/x', True, 2), (4, 'a/y', True, 1),
+                           (5, 'ab', False, 0)])
+        for row in table.rows:
+            row.sds = row.na != 'ab'
+
+        failed = {'a/y'}
+
+        def delete_objs_batch(bucket, items, max_inflight):
+            results = []
+            for na, obj in items:
+                ok = na not in failed
+                if ok:
+                    table.objects.filter(id=obj.id).delete()
+                results.append({'ok': ok})
+            return results
+
+        bfm = mock.Mock()
+        bfm.get_obj_model_class.return_value = table
+        bucket = mock.Mock()
+        bucket.get_bucket_table_name.return_value = 'bucket_test'
+        job = DirDeleteJob(bucket_id=1, dir_id=1, dir_path='a', status=DirDeleteJob.STATUS_RUNNING)
+        with mock.patch.object(harbor, 'BucketFileManagement', return_value=bfm), \
+                mock.patch.object(harbor.Bucket.objects, 'filter') as bucket_filter, \
+                mock.patch.object(HarborManager, '_delete_objs_batch', side_effect=delete_objs_batch), \
+                mock.patch.object(DirDeleteJob, 'save'):
+            bucket_filter.return_value.first.return_value = bucket
+            HarborManager().run_rmdir_job(job, batch_size=1)
+            self.assertEqual(job.status, DirDeleteJob.STATUS_FAILED)
+            self.assertEqual((job.deleted_objs, job.failed_objs), (1, 1))
+            self.assertEqual({r.na for r in table.rows}, {'a', 'a/b', 'a/y', 'ab'})     # 对象删除失败时保留目录
+
+            # 重新执行时继续删除
+            failed.clear()
+            HarborManager().run_rmdir_job(job, batch_size=1)
+            self.assertTrue(job.is_finished())
+            self.assertEqual(job.status, DirDeleteJob.STATUS_DONE)
+            self.assertEqual((job.deleted_objs, job.deleted_dirs, job.failed_objs), (2, 2, 0))
+            self.assertEqual({r.na for r in table.rows}, {'ab'})
+
+    def test_prefix(self):
+        job = DirDeleteJob(dir_path='a/b', status=DirDeleteJob.STATUS_DONE)
+        self.assertEqual(job.prefix, 'a/b/')
+        self.assertTrue(job.is_finished())
+
+
+class TestNormalizeEntryName(SimpleTestCase):
+    def test_normalize(self):
+        self.assertEqual(normalize_entry_name('a/b.txt'), 'a/b.txt')
+        self.assertEqual(normalize_entry_name('/a//./b.txt'), 'a/b.txt')
+        self.assertEqual(normalize_entry_name('./a/'), 'a')
+        self.assertEqual(normalize_entry_name('a\\b.txt'), 'a/b.txt')
+
+    def test_invalid(self):
+        for name in ('', '/', './', '../a', 'a/../../b', 'a/..', 'a/' + 'x' * 256):
+            self.assertIsNone(normalize_entry_name(name), msg=name)
+
+
+class TestZipStream(SimpleTestCase):
+    def test_read_by_zipfile(self):
+        table = FakeTable([(1, 'd', False, 0), (2, 'd/a.txt', True, 1), (3, 'd/空.bin', True, 1), (4, 'd/e', True, 1)])
+        data = {2: b'hello', 3: bytes(range(256)) * 12, 4: b''}
+        for row in table.rows:
+            row.si = len(data.get(row.id, b''))
+            row.upt = row.ult = timezone.now()
+
+        def read(obj):
+            return [data[obj.id][:7], data[obj.id][7:]]
+
+        out = b''.join(zip_stream(((row.na, row) for row in table.rows), read))
+        zf = zipfile.ZipFile(io.BytesIO(out))
+        self.assertIsNone(zf.testzip())
+        self.assertEqual(zf.namelist(), ['d/', 'd/a.txt', 'd/空.bin', 'd/e'])
+        self.assertTrue(zf.getinfo('d/').is_dir())
+        for row in table.rows[1:]:
+            self.assertEqual(zf.read(row.na), data[row.id])
+
+
+class TestBulkDeleteParams(SimpleTestCase):
+    def get(self, data):
+        return BulkDeleteViewSet.get_keys_and_prefix(SimpleNamespace(data=data))
+
+    def test_keys_and_prefix(self):
+        self.assertEqual(self.get({'keys': ['a', 'b/c']}), (['a', 'b/c'], ''))
+        self.assertEqual(self.get({'prefix': 'a/'}), (None, 'a/'))
+
+    def test_invalid(self):
+        for data in (None, {}, [], ['a'], 'a', {'keys': 'a'}, {'keys': [1]}, {'prefix': '/'}, {'prefix': 1}):
+            with self.assertRaises(ValueError, msg=str(data)):
+                self.get(data)
+
+
+class TestFtpRename(SimpleTestCase):
+    def rename(self, src, dst):
+        fs = HarborFileSystem.__new__(HarborFileSystem)
+        fs.bucket_name = 'test'
+        fs.client = mock.Mock()
+        fs.rename(src, dst)
+        return fs.client.ftp_move_rename.call_args
+
+    def test_rename_only(self):
+        self.assertEqual(self.rename('/a/b.txt', '/a/c.txt'),
+                         mock.call('test', 'a/b.txt', rename='c.txt', move=None))
+
+    def test_move_only(self):
+        self.assertEqual(self.rename('/a/b.txt', '/d/b.txt'), mock.call('test', 'a/b.txt', rename=None, move='/d'))
+
+    def test_move_and_rename(self):
+        self.assertEqual(self.rename('/a/b.txt', '/c.txt'), mock.call('test', 'a/b.txt', rename='c.txt', move='/'))
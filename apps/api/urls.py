@@ -27,14 +27,21 @@ router.register(r'test', views.TestViewSet, basename='test')
 router.register(r'ftp', views.FtpViewSet, basename='ftp')
 router.register(r'vpn', views.VPNViewSet, basename='vpn')
 router.register(r'obj-rados/(?P<bucket_name>[a-z0-9-_]{3,64})', views.ObjKeyViewSet, basename='obj-rados')
+router.register(r'delete/(?P<bucket_name>[a-z0-9-_]{3,64})', views.BulkDeleteViewSet, basename='bulk-delete')
+router.register(r'dir-job', views.DirDeleteJobViewSet, basename='dir-job')
 
 
 dlp_router = DetailListPostRouter()
 dlp_router.register(r'dir/(?P<bucket_name>[a-z0-9-_]{3,64})', views.DirectoryViewSet, basename='dir')
+dlp_router.register(r'archive/(?P<bucket_name>[a-z0-9-_]{3,64})', views.ArchiveViewSet, basename='archive')
 
 detail_router = DetailPostRouter()
 detail_router.register(r'obj/(?P<bucket_name>[a-z0-9-_]{3,64})', views.ObjViewSet, basename='obj')
 detail_router.register(r'move/(?P<bucket_name>[a-z0-9-_]{3,64})', views.MoveViewSet, basename='move')
+detail_router.register(r'copy/(?P<bucket_name>[a-z0-9-_]{3,64})', views.CopyViewSet, basename='copy')
+detail_router.register(r'multipart/(?P<bucket_name>[a-z0-9-_]{3,64})', views.MultipartUploadViewSet,
+                       basename='multipart')
+detail_router.register(r'export/(?P<bucket_name>[a-z0-9-_]{3,64})', views.DirExportViewSet, basename='export')
 detail_router.register(r'metadata/(?P<bucket_name>[a-z0-9-_]{3,64})', views.MetadataViewSet, basename='metadata')
 detail_router.register(r'refresh-meta/(?P<bucket_name>[a-z0-9-_]{3,64})', views.RefreshMetadataViewSet,
                        basename='refresh-meta')
@@ -1,15 +1,16 @@
 from collections import OrderedDict
 import logging
 import os
+import base64
 import binascii
-from io import BytesIO
+import hashlib
 
-from django.http import StreamingHttpResponse, FileResponse, QueryDict
-from django.utils.http import urlquote
+from django.http import StreamingHttpResponse, QueryDict
 from django.utils.translation import gettext_lazy, gettext as _
 from django.core.validators import validate_email
 from django.core import exceptions
 from django.urls import reverse as django_reverse
+from django.utils import timezone
 from rest_framework import status, mixins
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
@@ -21,11 +22,14 @@ from drf_yasg.utils import swagger_auto_schema, no_body
 from drf_yasg import openapi
 
 from buckets.utils import (BucketFileManagement, create_table_for_model_class, delete_table_for_model_class)
+from buckets.dedup import get_dedup_min_size
+from buckets.models import DirDeleteJob
 from users.views import send_active_url_email
 from users.models import AuthKey
 from users.auth.serializers import AuthKeyDumpSerializer
-from utils.storagers import PathParser, FileUploadToCephHandler
+from utils.storagers import PathParser, FileUploadToCephHandler, ChunkUploadToCephHandler
 from utils.oss import HarborObject, RadosError
+from utils.oss.compress import CODECS
 from utils.log.decorators import log_used_time
 from utils.jwt_token import JWTokenTool2
 from utils.view import CustomGenericViewSet
@@ -36,7 +40,9 @@ from . import serializers
 from . import paginations
 from . import permissions
 from . import throttles
-from .harbor import HarborError, HarborManager
+from .harbor import HarborError, HarborManager, get_upload_buffer_size, get_upload_layout
+from .downloads import build_download_response
+from .archives import upload_archive, build_dir_archive_response
 
 # Create your views here.
 logger = logging.getLogger('django.request')#这里的日志记录器要和setting中的loggers选项对应，不能随意给参
@@ -104,6 +110,36 @@ def str_to_int_or_default(val, default):
         return default
 
 
+def content_md5_to_hex(val: str):
+    '''
+    标头Content-MD5的值转为16进制MD5，值为RFC 1864规定的base64编码，兼容16进制
+
+    :param val: 标头Content-MD5的值
+    :return:
+        str     # 16进制MD5，小写；val为空时返回空字符串
+    :raises: ValueError
+    '''
+    val = val.strip()
+    if not val:
+        return ''
+
+    if len(val) == 32:
+        try:
+            return bytes.fromhex(val).hex()
+        except ValueError:
+            pass
+
+    try:
+        digest = base64.b64decode(val, validate=True)
+    except binascii.Error:
+        digest = b''
+
+    if len(digest) != 16:
+        raise ValueError('invalid Content-MD5')
+
+    return digest.hex()
+
+
 class UserViewSet(CustomGenericViewSet):
     '''
     用户类视图
@@ -695,6 +731,55 @@ class BucketViewSet(CustomGenericViewSet):
         }
         return Response(data=data, status=status.HTTP_200_OK)
 
+    @swagger_auto_schema(
+        operation_summary=gettext_lazy('存储桶数据压缩设置'),
+        request_body=no_body,
+        manual_parameters=DETAIL_BASE_PARAMS + [
+            openapi.Parameter(
+                name='codec', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("压缩算法，zlib、lzma；none为不压缩"),
+                required=True
+            ),
+        ],
+        responses={
+            status.HTTP_200_OK: """
+                    {
+                      "code": 200,
+                      "code_text": "存储桶数据压缩设置成功",
+                      "compress": "zlib"
+                    }
+                """
+        }
+    )
+    @action(methods=['patch'], detail=True, url_path='compress', url_name='compress')
+    def compress(self, request, *args, **kwargs):
+        """
+        存储桶数据压缩设置，之后上传的对象数据分块压缩存储，已存在的对象不变；
+        压缩的对象读取时透明解压，修改对象数据时先解压为未压缩的对象
+        """
+        codec = request.query_params.get('codec', '').lower()
+        if codec == 'none':
+            codec = ''
+        elif codec not in CODECS:
+            return Response(data={'code': 400, 'code_text': _('codec参数有误')}, status=status.HTTP_400_BAD_REQUEST)
+
+        ok, ret = self.get_user_bucket(request=request, kwargs=kwargs)
+        if not ok:
+            return ret
+        bucket = ret
+
+        if not bucket.set_compress(codec=codec):
+            return Response(data={'code': 500, 'code_text': _('设置数据压缩失败，更新数据库数据时错误')},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        data = {
+            'code': 200,
+            'code_text': _('存储桶数据压缩设置成功'),
+            'compress': codec
+        }
+        return Response(data=data, status=status.HTTP_200_OK)
+
     def get_user_bucket(self, request, kwargs):
         """
         :return:
@@ -809,7 +894,10 @@ class ObjViewSet(CustomGenericViewSet):
 
         *注：
         1. offset && size(最大20MB，否则400错误) 参数校验失败时返回状态码400和对应参数错误信息，无误时，返回bytes数据流
-        2. 不带参数时，返回整个文件对象；
+        2. 不带参数时，返回整个文件对象；支持标头Range(RFC 7233)，多个范围时返回multipart/byteranges，
+           支持后缀范围和If-Range，没有可满足的范围时返回416；
+        3. 下载整个对象或范围时，响应带ETag、Last-Modified和Cache-Control，标头If-None-Match或If-Modified-Since
+           验证对象未修改时返回304；
 
     	>>Http Code: 状态码200：
              evhb_obj_size,文件对象总大小信息,通过标头headers传递：自定义读取时：返回指定大小的bytes数据流；
@@ -872,6 +960,24 @@ class ObjViewSet(CustomGenericViewSet):
                 description=gettext_lazy("reset=true时，如果对象已存在，重置对象大小为0"),
                 required=False
             ),
+            openapi.Parameter(
+                name='chunk_offset', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_INTEGER,
+                description=gettext_lazy("文件块偏移量，和chunk_size一起通过查询参数提交时，文件块数据边接收边直接写入存储"),
+                required=False
+            ),
+            openapi.Parameter(
+                name='chunk_size', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_INTEGER,
+                description=gettext_lazy("文件块大小，和chunk_offset一起提交"),
+                required=False
+            ),
+            openapi.Parameter(
+                name='chunk_md5', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("文件块数据的MD5，提交时校验文件块数据"),
+                required=False
+            ),
         ],
         responses={
             status.HTTP_200_OK: """
@@ -885,6 +991,10 @@ class ObjViewSet(CustomGenericViewSet):
         }
     )
     def create_detail(self, request, *args, **kwargs):
+        """
+        向对象写入一块数据；查询参数提交chunk_offset和chunk_size时，文件块数据边接收边直接写入存储，
+        不缓存到本地内存或临时文件，见create_detail_stream()
+        """
         objpath = kwargs.get(self.lookup_field, '')
         bucket_name = kwargs.get('bucket_name', '')
         reset = request.query_params.get('reset', '').lower()
@@ -893,6 +1003,9 @@ class ObjViewSet(CustomGenericViewSet):
         else:
             reset = False
 
+        if 'chunk_offset' in request.query_params or 'chunk_size' in request.query_params:
+            return self.create_detail_stream(request=request, bucket_name=bucket_name, objpath=objpath, reset=reset)
+
         # 数据验证
         try:
             put_data = self.get_data(request)
@@ -930,6 +1043,12 @@ class ObjViewSet(CustomGenericViewSet):
                 description=gettext_lazy("文件对象绝对路径"),
                 required=True
             ),
+            openapi.Parameter(
+                name='size', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_INTEGER,
+                description=gettext_lazy("对象大小，和标头Content-MD5一起提供时尝试秒传，存储中已存在相同数据时不需要上传数据"),
+                required=False
+            ),
         ],
         responses={
             status.HTTP_200_OK: """
@@ -949,14 +1068,44 @@ class ObjViewSet(CustomGenericViewSet):
     def update(self, request, *args, **kwargs):
         """
         上传一个完整对象, 如果同名对象已存在，会覆盖旧对象；
-        上传对象大小限制10GB，超过限制的对象请使用分片上传方式；
-        如果担心上传过程中数据损坏不一致，可以使用标头Content-MD5，当您使用此标头时，将根据提供的MD5值检查对象，如果不匹配，则返回错误。
+        请求体可以是multipart/form-data格式(文件字段file)，或者是对象数据本身(Content-Type: application/octet-stream，
+        必须有标头Content-Length)，后者不经过multipart解析，大对象上传更快；
+        上传对象大小限制10GB，application/octet-stream上传条带布局的对象时不受此限制，超过限制的对象请使用分片上传方式；
+        如果担心上传过程中数据损坏不一致，可以使用标头Content-MD5(base64编码，兼容16进制)，当您使用此标头时，将根据提供的MD5值检查对象，如果不匹配，则返回错误。
         不提供对象锁定，如果同时对同一对象发起多个写请求，会造成数据混乱，损坏数据一致性；
+        秒传：同时提供标头Content-MD5和参数size(不上传数据)，如果存储中已存在MD5和大小相同的数据，直接创建引用此数据的对象，
+        否则返回404，需要正常上传对象数据；
         """
         objpath = kwargs.get(self.lookup_field, '')
         bucket_name = kwargs.get('bucket_name', '')
 
         hManager = HarborManager()
+        size = request.query_params.get('size', None)
+        try:
+            content_md5 = content_md5_to_hex(request.headers.get('Content-MD5', ''))
+        except ValueError:
+            return Response(data={'code': 400, 'code_text': _('标头Content-MD5有误')}, status=status.HTTP_400_BAD_REQUEST)
+
+        if size is not None and content_md5:
+            try:
+                size = int(size)
+                if size < 0:
+                    raise ValueError
+            except ValueError:
+                return Response(data={'code': 400, 'code_text': _('参数size有误')}, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                created = hManager.create_obj_from_blob(bucket_name=bucket_name, obj_path=objpath, md5=content_md5,
+                                                        size=size, user=request.user)
+            except HarborError as e:
+                return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
+
+            return Response({'code': 200, 'created': created}, status=status.HTTP_200_OK)
+
+        if self.is_raw_upload(request) and not request.META.get('CONTENT_LENGTH'):
+            return Response(data={'code': 411, 'code_text': _('缺少标头Content-Length')},
+                            status=status.HTTP_411_LENGTH_REQUIRED)
+
         try:
             bucket, obj, created = hManager.create_empty_obj(bucket_name=bucket_name, obj_path=objpath, user=request.user)
         except HarborError as e:
@@ -965,7 +1114,7 @@ class ObjViewSet(CustomGenericViewSet):
         pool_name = bucket.get_pool_name()
         obj_key = obj.get_obj_key(bucket.id)
 
-        rados = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.si)
+        rados = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.si, layout=obj.lay, inline=obj.inl, cindex=obj.cidx)
         if created is False:  # 对象已存在，不是新建的
             try:
                 hManager._pre_reset_upload(obj=obj, rados=rados)    # 重置对象大小
@@ -974,52 +1123,164 @@ class ObjViewSet(CustomGenericViewSet):
 
         return self.update_handle(request=request, bucket=bucket, obj=obj, rados=rados, created=created)
 
+    def create_detail_stream(self, request, bucket_name, objpath, reset):
+        """
+        流式写入一块数据：接收请求体前准备好对象，文件块数据由ChunkUploadToCephHandler边接收边写入对象chunk_offset处，
+        同时验证大小和计算MD5；写入后是小对象需要内联或打包存储时，按原方式接收数据后写入
+        """
+        try:
+            offset = int(request.query_params.get('chunk_offset', ''))
+            size = int(request.query_params.get('chunk_size', ''))
+            if not (0 <= offset <= 5 * 1024 ** 4) or size <= 0:
+                raise ValueError
+        except ValueError:
+            return Response({'code': 400, 'code_text': _('参数chunk_offset或chunk_size有误')},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        chunk_md5 = request.query_params.get('chunk_md5', '').lower()
+        hManager = HarborManager()
+        try:
+            bucket, obj, rados, created, stream = hManager.prepare_write_stream(
+                bucket_name=bucket_name, obj_path=objpath, offset=offset, size=size, reset=reset, user=request.user)
+        except HarborError as e:
+            return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
+
+        uploader = None
+        if stream:
+            uploader = ChunkUploadToCephHandler(request, rados=rados, offset=offset, size=size)
+            request.upload_handlers = [uploader] + list(request.upload_handlers)
+
+        def rollback():
+            if uploader is not None:
+                uploader.abort_writes()
+                hManager.rollback_write_stream(obj=obj, rados=rados, created=created, end=offset + size)
+            elif created:
+                obj.do_delete()
+
+        try:
+            chunk = self.get_data(request).get('chunk')
+        except Exception as e:
+            rollback()
+            return Response({'code': 400, 'code_text': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = self.get_serializer(data={'chunk_offset': offset, 'chunk_size': size, 'chunk': chunk})
+        if not serializer.is_valid(raise_exception=False):
+            rollback()
+            msg = serializer_error_text(serializer.errors)
+            return Response({'code': 400, 'code_text': msg}, status=status.HTTP_400_BAD_REQUEST)
+
+        file = serializer.validated_data.get('chunk')
+        if chunk_md5:
+            if stream:
+                file_md5 = file.file_md5
+            else:
+                md5_hash = hashlib.md5()
+                for block in file.chunks():
+                    md5_hash.update(block)
+                file_md5 = md5_hash.hexdigest()
+
+            if chunk_md5 != file_md5:
+                rollback()
+                return Response({'code': 400, 'code_text': _('参数chunk_md5和文件块数据的MD5值不一致，数据在上传过程中可能损坏')},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        if not stream:
+            try:
+                hManager._save_one_file(obj=obj, rados=rados, offset=offset, file=file)
+            except HarborError as e:
+                rollback()
+                return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
+
+        data = serializer.data
+        data['created'] = created
+        return Response(data, status=status.HTTP_200_OK)
+
     def update_handle(self, request, bucket, obj, rados, created):
         pool_name = bucket.get_pool_name()
         obj_key = obj.get_obj_key(bucket.id)
-        uploader = FileUploadToCephHandler(request, pool_name=pool_name, obj_key=obj_key)
+        # 桶启用了压缩时，数据分块压缩写入
+        obj_lay = obj.lay
+        upload_lay = get_upload_layout(bucket=bucket, obj=obj)
+        uploader = FileUploadToCephHandler(request, pool_name=pool_name, obj_key=obj_key, layout=upload_lay,
+                                           buffer_max_size=get_upload_buffer_size(),
+                                           compute_md5=get_dedup_min_size() > 0)
         request.upload_handlers = [uploader]
 
         def clean_put(uploader, obj, created):
             # 删除数据和元数据
+            uploader.abort_writes()
             f = getattr(uploader, 'file', None)
             s = f.size if f else 0
             rados.delete(obj_size=s)
+            if upload_lay != obj_lay:
+                HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=s, layout=upload_lay).delete()
             if created:
                 obj.delete()
 
-        # 数据验证
-        try:
-            put_data = self.get_data(request)
-        except Exception as e:
-            clean_put(uploader, obj, created)
-            return Response({
-                'code': 400, 'code_text': str(e),
-            }, status=status.HTTP_400_BAD_REQUEST)
+        if self.is_raw_upload(request):
+            # 请求体是对象数据，直接读取写入ceph
+            try:
+                file = uploader.receive_raw_stream(request.stream, content_length=int(request.META['CONTENT_LENGTH']),
+                                                   file_name=obj.name)
+            except Exception as e:
+                clean_put(uploader, obj, created)
+                return Response({'code': 400, 'code_text': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            # 数据验证
+            try:
+                put_data = self.get_data(request)
+            except Exception as e:
+                clean_put(uploader, obj, created)
+                return Response({
+                    'code': 400, 'code_text': str(e),
+                }, status=status.HTTP_400_BAD_REQUEST)
 
-        serializer = self.get_serializer(data=put_data)
-        if not serializer.is_valid(raise_exception=False):
-            # 删除数据和元数据
+            serializer = self.get_serializer(data=put_data)
+            if not serializer.is_valid(raise_exception=False):
+                # 删除数据和元数据
+                clean_put(uploader, obj, created)
+                msg = serializer_error_text(serializer.errors)
+                return Response({'code': 400, 'code_text': msg}, status=status.HTTP_400_BAD_REQUEST)
+
+            file = serializer.validated_data.get('file')
+
+        try:
+            content_md5 = content_md5_to_hex(self.request.headers.get('Content-MD5', ''))
+        except ValueError:
             clean_put(uploader, obj, created)
-            msg = serializer_error_text(serializer.errors)
-            return Response({'code': 400, 'code_text': msg}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'code': 400, 'code_text': _('标头Content-MD5有误')}, status=status.HTTP_400_BAD_REQUEST)
 
-        file = serializer.validated_data.get('file')
-        content_md5 = self.request.headers.get('Content-MD5', '').lower()
         if content_md5:
             if content_md5 != file.file_md5.lower():
                 # 删除数据和元数据
                 clean_put(uploader, obj, created)
                 return Response({'code': 400, 'code_text': _('标头Content-MD5和上传数据的MD5值不一致，数据在上传过程中可能损坏')}, status=status.HTTP_400_BAD_REQUEST)
 
+        hManager = HarborManager()
         try:
+            # 小对象数据内联在元数据中或打包在pack文件中
+            hManager.store_buffered_data(obj=obj, rados=rados, data=file.buffered_data)
             obj.si = file.size
-            obj.md5 = content_md5
-            obj.save(update_fields=['si', 'md5'])
-        except Exception as e:
+            obj.upt = timezone.now()
+            obj.md5 = content_md5 if content_md5 else file.file_md5.lower()
+            if file.compress_index:
+                obj.lay = upload_lay
+                obj.cidx = file.compress_index
+            obj.save(update_fields=['si', 'upt', 'md5', 'inl', 'lay', 'cidx'])
+        except HarborError as e:
             # 删除数据和元数据
             clean_put(uploader, obj, created)
-            return Response({'code': 400, 'code_text': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'code': e.code, 'code_text': e.msg}, status=e.code)
+        except Exception as e:
+            # 保存元数据的数据库错误，删除数据和元数据
+            clean_put(uploader, obj, created)
+            return Response({'code': 500, 'code_text': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        rados.reset_obj_id_and_size(obj_size=obj.si, layout=obj.lay, cindex=obj.cidx)
+
+        # 相同数据去重
+        if file.buffered_data is None:
+            hManager.dedup_object(obj=obj, rados=rados, md5=obj.md5)
 
         data = {'code': 200, 'created': created}
         return Response(data, status=status.HTTP_200_OK)
@@ -1068,20 +1329,18 @@ class ObjViewSet(CustomGenericViewSet):
 
             return self.wrap_chunk_response(chunk=chunk, obj_size=obj.si)
 
-        # 下载整个文件对象
+        # 下载整个文件对象，或标头Range指定的范围
         hManager = HarborManager()
         try:
-            file_generator, obj = hManager.get_obj_generator(bucket_name=bucket_name, obj_path=objpath,
-                                                                  user=request.user, all_public=True)
+            bucket, obj = hManager.get_bucket_and_obj(bucket_name=bucket_name, obj_path=objpath, user=request.user,
+                                                      all_public=True)
         except HarborError as e:
             return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
 
-        filename = obj.name
-        filename = urlquote(filename)  # 中文文件名需要
-        response = FileResponse(file_generator)
-        response['Content-Type'] = 'application/octet-stream'  # 注意格式
-        response['Content-Length'] = obj.si
-        response['Content-Disposition'] = f"attachment;filename*=utf-8''{filename}"  # 注意filename 这个是下载后的名字
+        if obj is None:
+            return Response(data={'code': 404, 'code_text': _('文件对象不存在')}, status=status.HTTP_404_NOT_FOUND)
+
+        response = build_download_response(request=request, bucket=bucket, obj=obj)
         response['evob_obj_size'] = obj.si
         return response
 
@@ -1243,16 +1502,17 @@ class ObjViewSet(CustomGenericViewSet):
             return None, response
         return validated_data, None
 
-    def wrap_chunk_response(self, chunk:bytes, obj_size:int):
+    def wrap_chunk_response(self, chunk, obj_size:int):
         '''
         文件对象自定义读取response
 
-        :param chunk: 数据块
+        :param chunk: 数据块, bytes or memoryview
         :param size: 文件对象总大小
         :return: HttpResponse
         '''
         c_len = len(chunk)
-        response = StreamingHttpResponse(BytesIO(chunk), status=status.HTTP_200_OK)
+        # chunk可能是memoryview，直接交给response，不经过BytesIO拷贝和按行迭代
+        response = StreamingHttpResponse(iter((chunk,)), status=status.HTTP_200_OK)
         response['Content-Type'] = 'application/octet-stream'  # 注意格式
         response['evob_chunk_size'] = c_len
         response['Content-Length'] = c_len
@@ -1262,6 +1522,13 @@ class ObjViewSet(CustomGenericViewSet):
     def get_data(self, request):
         return request.data
 
+    @staticmethod
+    def is_raw_upload(request):
+        '''
+        请求体是否是对象数据(application/octet-stream)
+        '''
+        return request.content_type.split(';')[0].strip().lower() == 'application/octet-stream'
+
     def get_permissions(self):
         if self.action == 'retrieve':
             return []
@@ -1311,9 +1578,17 @@ class DirectoryViewSet(CustomGenericViewSet):
             }
 
     destroy:
-        删除一个目录, 目录必须为空，否则400错误
+        删除一个目录, 目录必须为空，否则400错误；
+        参数recursive=true时递归删除目录，目录立即不可见，目录下的对象和子目录由后台任务删除，返回任务信息，
+        任务进度通过dir-job接口查询
 
         >>Http Code: 状态码204,成功删除;
+        >>Http Code: 状态码202,已提交递归删除任务;
+            {
+                'code': 202,
+                'code_text': '已提交删除目录任务',
+                'job': {}       //任务信息
+            }
         >>Http Code: 状态码400,参数无效或目录不为空;
             {
                 'code': 400,
@@ -1529,6 +1804,12 @@ class DirectoryViewSet(CustomGenericViewSet):
                 description=gettext_lazy("目录绝对路径"),
                 required=True
             ),
+            openapi.Parameter(
+                name='recursive', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_BOOLEAN,
+                description=gettext_lazy("true: 后台任务递归删除目录和目录下的所有对象和子目录"),
+                required=False
+            ),
         ],
         responses={
             status.HTTP_204_NO_CONTENT: 'NO CONTENT'
@@ -1537,8 +1818,18 @@ class DirectoryViewSet(CustomGenericViewSet):
     def destroy(self, request, *args, **kwargs):
         bucket_name = kwargs.get('bucket_name', '')
         dirpath = kwargs.get(self.lookup_field, '')
+        recursive = request.query_params.get('recursive', '').lower() == 'true'
 
         hManager = HarborManager()
+        if recursive:
+            try:
+                job = hManager.rmdir_recursive(bucket_name=bucket_name, dirpath=dirpath, user=request.user)
+            except HarborError as e:
+                return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
+
+            return Response(data={'code': 202, 'code_text': _('已提交删除目录任务'),
+                                  'job': serializers.DirDeleteJobSerializer(job).data}, status=status.HTTP_202_ACCEPTED)
+
         try:
             ok = hManager.rmdir(bucket_name=bucket_name, dirpath=dirpath, user=request.user)
         except HarborError as e:
@@ -1634,74 +1925,460 @@ class DirectoryViewSet(CustomGenericViewSet):
         return super(DirectoryViewSet, self).paginate_queryset(queryset)
 
 
-class BucketStatsViewSet(CustomGenericViewSet):
+class ArchiveViewSet(CustomGenericViewSet):
     '''
-        retrieve:
-            存储桶资源统计
+    归档文件(tar/zip)上传，一个请求上传大量小文件，服务端解压为多个对象
 
-            统计存储桶对象数量和所占容量，字节
+    create:
+        上传归档文件，解压到存储桶根目录下
 
-            >>Http Code: 状态码200:
-                {
-                    "stats": {
-                      "space": 12500047770969,             # 桶内对象总大小，单位字节
-                      "count": 5000004,                    # 桶内对象总数量
-                    },
-                    "stats_time": "2020-03-04T06:01:50+00:00", # 统计时间
-                    "code": 200,
-                    "bucket_name": "xxx"    # 存储桶名称
-                }
+    create_detail:
+        上传归档文件，解压到存储桶的目录下
 
-            >>Http Code: 状态码404:
-                {
-                    'code': 404,
-                    'code_text': xxx  //错误码描述
-                }
-        '''
+        请求体是归档文件数据，必须有标头Content-Length；参数archive_type指定格式tar(包括gzip、bz2、xz压缩的tar)或zip，
+        默认按Content-Type判断(application/zip为zip，其他为tar)；tar边接收边解压，zip接收完后解压；
+        归档中的目录和中间目录自动创建，已存在同名对象或目录的文件条目不覆盖，返回每个条目的结果清单
+
+        >>Http Code: 状态码200, 解压完成(部分条目可能失败，见结果清单):
+            {
+                "code": 200,
+                "code_text": "上传归档文件完成",
+                "total": 3,             // 条目数
+                "succeeded": 2,         // 成功的条目数
+                "results": [
+                    {"name": "a/b.txt", "type": "file", "ok": true, "size": 12, "md5": "xxx", "msg": ""},
+                    {"name": "a/c.txt", "type": "file", "ok": false, "size": 0, "md5": "", "msg": "已存在同名的对象或目录"}
+                ]
+            }
+        >>Http Code: 状态码400, 请求参数有误，或归档文件格式有误(results为出错前已处理的条目):
+        >>Http Code: 状态码404, bucket桶或目录不存在:
+        >>Http Code: 状态码411, 缺少标头Content-Length:
+        >>Http Code: 状态码413, zip归档文件超过大小上限:
+            {
+                "code": 4xx,
+                "code_text": 'xxxxx'        //错误信息
+            }
+    '''
     queryset = []
     permission_classes = [IsAuthenticated]
-    lookup_field = 'bucket_name'
-    lookup_value_regex = '[a-z0-9-_]{3,64}'
+    lookup_field = 'dirpath'
+    lookup_value_regex = '.+'
 
     @swagger_auto_schema(
-        operation_summary=gettext_lazy('获取一个存储桶资源统计信息'),
+        operation_summary=gettext_lazy('上传归档文件解压到存储桶根目录'),
+        request_body=no_body,
+        manual_parameters=[
+            openapi.Parameter(
+                name='archive_type', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("归档文件格式，tar或zip"),
+                required=False
+            )
+        ],
+        responses={
+            status.HTTP_200_OK: 'OK'
+        }
     )
-    def retrieve(self, request, *args, **kwargs):
-        bucket_name = kwargs.get(self.lookup_field)
+    def create(self, request, *args, **kwargs):
+        return self.upload_archive(request, bucket_name=kwargs.get('bucket_name', ''), dir_path='')
 
-        user = request.user
-        if user.is_superuser:
-            bucket = Bucket.get_bucket_by_name(bucket_name)
-        else:
-            bucket = get_user_own_bucket(bucket_name, request)
+    @swagger_auto_schema(
+        operation_summary=gettext_lazy('上传归档文件解压到目录'),
+        request_body=no_body,
+        manual_parameters=[
+            openapi.Parameter(
+                name='dirpath', in_=openapi.IN_PATH,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("目录绝对路径"),
+                required=True
+            ),
+            openapi.Parameter(
+                name='archive_type', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("归档文件格式，tar或zip"),
+                required=False
+            )
+        ],
+        responses={
+            status.HTTP_200_OK: 'OK'
+        }
+    )
+    def create_detail(self, request, *args, **kwargs):
+        return self.upload_archive(request, bucket_name=kwargs.get('bucket_name', ''),
+                                   dir_path=kwargs.get(self.lookup_field, ''))
 
-        if not bucket:
-            return Response(data={'code': 404, 'code_text': _('bucket_name参数有误，存储桶不存在')},
-                                  status=status.HTTP_404_NOT_FOUND)
+    def upload_archive(self, request, bucket_name: str, dir_path: str):
+        if not request.META.get('CONTENT_LENGTH'):
+            return Response(data={'code': 411, 'code_text': _('缺少标头Content-Length')},
+                            status=status.HTTP_411_LENGTH_REQUIRED)
 
-        data = bucket.get_stats()
-        data.update({
-            'code': 200,
-            'bucket_name': bucket_name,
-        })
+        size = str_to_int_or_default(request.META['CONTENT_LENGTH'], None)
 
-        return Response(data)
+        archive_format = request.query_params.get('archive_type', '').lower()
+        if not archive_format:
+            content_type = request.content_type.split(';')[0].strip().lower()
+            archive_format = 'zip' if content_type in ('application/zip', 'application/x-zip-compressed') else 'tar'
+
+        try:
+            results = upload_archive(bucket_name=bucket_name, dir_path=dir_path, stream=request.stream,
+                                     archive_format=archive_format, size=size, user=request.user)
+        except HarborError as e:
+            return Response(data={'code': e.code, 'code_text': e.msg, 'results': e.data.get('results', [])},
+                            status=e.code)
 
+        return Response(data={'code': 200, 'code_text': _('上传归档文件完成'), 'total': len(results),
+                              'succeeded': len([r for r in results if r['ok']]), 'results': results})
 
-class SecurityViewSet(CustomGenericViewSet):
+    def get_serializer_class(self):
+        """
+        Return the class to use for the serializer.
+        Defaults to using `self.serializer_class`.
+        Custom serializer_class
+        """
+        return Serializer
+
+
+class DirDeleteJobViewSet(CustomGenericViewSet):
     '''
-    安全凭证视图集
+    目录删除任务视图集
 
     retrieve:
-        获取指定用户的安全凭证, 需要超级用户权限
-
-            *注：默认只返回用户Auth Token和JWT(json web token)，如果希望返回内容包含访问密钥对，请显示携带query参数key,服务器不要求key有值
+        查询递归删除目录任务的进度
 
-            >>Http Code: 状态码200:
-                {
-                  "user": {
-                    "id": 3,
-                    "username": "xxx"
+        >>Http Code: 状态码200:
+            {
+                "code": 200,
+                "job": {
+                    "job_id": "xxx",
+                    "bucket_name": "xxx",
+                    "dir_path": "a/b",
+                    "status": {"code": 1, "display": "执行中"},     // 0等待中，1执行中，2完成，3失败
+                    "deleted_objs": 1000,       // 已删除对象数
+                    "deleted_dirs": 0,          // 已删除目录数
+                    "deleted_size": 1024000,    // 已删除对象大小
+                    "failed_objs": 0,           // 删除失败对象数
+                    "msg": "",
+                    "created_time": "xxx",
+                    "modified_time": "xxx"
+                }
+            }
+        >>Http Code: 状态码404, 任务不存在:
+    '''
+    queryset = []
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'job_id'
+    lookup_value_regex = '[0-9a-f]{32}'
+
+    @swagger_auto_schema(
+        operation_summary=gettext_lazy('查询目录删除任务进度'),
+        manual_parameters=[
+            openapi.Parameter(
+                name='job_id', in_=openapi.IN_PATH,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("任务ID"),
+                required=True
+            )
+        ]
+    )
+    def retrieve(self, request, *args, **kwargs):
+        job_id = kwargs.get(self.lookup_field, '')
+        job = DirDeleteJob.objects.filter(job_id=job_id, user=request.user).first()
+        if job is None:
+            return Response(data={'code': 404, 'code_text': _('任务不存在')}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(data={'code': 200, 'job': serializers.DirDeleteJobSerializer(job).data})
+
+    def get_serializer_class(self):
+        """
+        Return the class to use for the serializer.
+        Defaults to using `self.serializer_class`.
+        Custom serializer_class
+        """
+        return Serializer
+
+
+class BulkDeleteViewSet(CustomGenericViewSet):
+    '''
+    批量删除对象视图集
+
+    create:
+        批量删除对象
+
+        提交对象路径列表或路径前缀，不删除目录：
+            {
+                "keys": ["a/b.txt", "c.txt"],      // 对象全路径列表，一次最多settings.BULK_DELETE['MAX_KEYS']个
+                "prefix": "a/"                      // 没有keys时，删除全路径以此前缀开头的对象
+            }
+        前缀删除一次最多删除MAX_KEYS个对象，truncated为true时需要再次请求删除剩余的对象
+
+        >>Http Code: 状态码200, 请求完成，每个对象的删除结果见results:
+            {
+                "code": 200,
+                "code_text": "批量删除完成",
+                "total": 2,
+                "deleted": 1,
+                "truncated": false,
+                "results": [
+                    {"key": "a/b.txt", "ok": true, "code": 200, "msg": ""},
+                    {"key": "c.txt", "ok": false, "code": 404, "msg": "文件对象不存在"}
+                ]
+            }
+        >>Http Code: 状态码400, 请求参数有误:
+        >>Http Code: 状态码404, bucket桶不存在:
+            {
+                "code": 4xx,
+                "code_text": 'xxxxx'        //错误信息
+            }
+    '''
+    queryset = []
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_summary=gettext_lazy('批量删除对象'),
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'keys': openapi.Schema(
+                    type=openapi.TYPE_ARRAY,
+                    items=openapi.Schema(type=openapi.TYPE_STRING),
+                    description=gettext_lazy('对象全路径列表')
+                ),
+                'prefix': openapi.Schema(type=openapi.TYPE_STRING, description=gettext_lazy('对象全路径前缀'))
+            }
+        ),
+        responses={
+            status.HTTP_200_OK: """
+                {
+                  "code": 200,
+                  "code_text": "批量删除完成",
+                  "total": 1,
+                  "deleted": 1,
+                  "truncated": false,
+                  "results": [{"key": "a/b.txt", "ok": true, "code": 200, "msg": ""}]
+                }
+            """
+        }
+    )
+    def create(self, request, *args, **kwargs):
+        bucket_name = kwargs.get('bucket_name', '')
+        try:
+            keys, prefix = self.get_keys_and_prefix(request)
+        except ValueError as e:
+            return Response(data={'code': 400, 'code_text': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        hManager = HarborManager()
+        try:
+            results, truncated = hManager.delete_objects(bucket_name=bucket_name, paths=keys, prefix=prefix,
+                                                         user=request.user)
+        except HarborError as e:
+            return Response(data={'code': e.code, 'code_text': e.msg, 'results': e.data.get('results', [])},
+                            status=e.code)
+
+        return Response(data={'code': 200, 'code_text': _('批量删除完成'), 'total': len(results),
+                              'deleted': len([r for r in results if r['ok']]), 'truncated': truncated,
+                              'results': results})
+
+    @staticmethod
+    def get_keys_and_prefix(request):
+        '''
+        提交的对象路径列表和路径前缀
+
+        :return:
+            (keys, prefix)      # keys: [str, ] or None
+        :raises: ValueError
+        '''
+        data = request.data
+        if not data:
+            raise ValueError(_('需要提交keys或prefix参数'))
+        if not isinstance(data, dict):
+            raise ValueError(_('请求体格式有误'))
+
+        keys = data.get('keys', None)
+        prefix = data.get('prefix', '')
+        if keys is not None:
+            if not isinstance(keys, list) or not all(isinstance(k, str) for k in keys):
+                raise ValueError(_('keys参数有误'))
+            return keys, ''
+
+        if not isinstance(prefix, str) or not prefix.strip('/'):
+            raise ValueError(_('需要提交keys或prefix参数'))
+
+        return None, prefix
+
+    def get_serializer_class(self):
+        """
+        Return the class to use for the serializer.
+        Defaults to using `self.serializer_class`.
+        Custom serializer_class
+        """
+        return Serializer
+
+
+class DirExportViewSet(CustomGenericViewSet):
+    '''
+    目录打包下载，一个请求下载整个目录树
+
+    list:
+        打包下载存储桶根目录
+
+    retrieve:
+        打包下载目录
+
+        参数archive_type指定格式tar(默认)或zip(不压缩)；边遍历目录树边读取对象数据流式生成，响应没有Content-Length；
+        zip的中央目录需要记录所有条目，条目非常多的目录树建议使用tar；归档中的路径以目录名(根目录时为桶名)开头
+
+        >>Http Code: 状态码200: tar或zip数据流
+        >>Http Code: 状态码400, 请求参数有误:
+        >>Http Code: 状态码404, bucket桶或目录不存在:
+            {
+                "code": 4xx,
+                "code_text": 'xxxxx'        //错误信息
+            }
+    '''
+    queryset = []
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'dirpath'
+    lookup_value_regex = '.+'
+
+    @swagger_auto_schema(
+        operation_summary=gettext_lazy('打包下载存储桶根目录'),
+        manual_parameters=[
+            openapi.Parameter(
+                name='archive_type', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("归档文件格式，tar或zip"),
+                required=False
+            )
+        ],
+        responses={
+            status.HTTP_200_OK: "Content-Type: application/x-tar or application/zip"
+        }
+    )
+    def list(self, request, *args, **kwargs):
+        bucket_name = kwargs.get('bucket_name', '')
+        archive_type = request.query_params.get('archive_type', 'tar').lower()
+        hManager = HarborManager()
+        bucket = hManager.get_bucket(bucket_name, user=request.user)
+        if not bucket:
+            return Response(data={'code': 404, 'code_text': _('存储桶不存在')}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            return build_dir_archive_response(bucket=bucket, dir_id=BucketFileManagement.ROOT_DIR_ID,
+                                              name=bucket.name, archive_type=archive_type)
+        except HarborError as e:
+            return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
+
+    @swagger_auto_schema(
+        operation_summary=gettext_lazy('打包下载目录'),
+        manual_parameters=[
+            openapi.Parameter(
+                name='dirpath', in_=openapi.IN_PATH,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("目录绝对路径"),
+                required=True
+            ),
+            openapi.Parameter(
+                name='archive_type', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("归档文件格式，tar或zip"),
+                required=False
+            )
+        ],
+        responses={
+            status.HTTP_200_OK: "Content-Type: application/x-tar or application/zip"
+        }
+    )
+    def retrieve(self, request, *args, **kwargs):
+        bucket_name = kwargs.get('bucket_name', '')
+        dirpath = kwargs.get(self.lookup_field, '')
+        archive_type = request.query_params.get('archive_type', 'tar').lower()
+        hManager = HarborManager()
+        try:
+            bucket, obj = hManager.get_bucket_and_obj_or_dir(bucket_name=bucket_name, path=dirpath, user=request.user)
+            if obj is None or not obj.is_dir():
+                return Response(data={'code': 404, 'code_text': _('目录不存在')}, status=status.HTTP_404_NOT_FOUND)
+
+            return build_dir_archive_response(bucket=bucket, dir_id=obj.id, name=obj.name, archive_type=archive_type)
+        except HarborError as e:
+            return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
+
+    def get_serializer_class(self):
+        """
+        Return the class to use for the serializer.
+        Defaults to using `self.serializer_class`.
+        Custom serializer_class
+        """
+        return Serializer
+
+
+class BucketStatsViewSet(CustomGenericViewSet):
+    '''
+        retrieve:
+            存储桶资源统计
+
+            统计存储桶对象数量和所占容量，字节
+
+            >>Http Code: 状态码200:
+                {
+                    "stats": {
+                      "space": 12500047770969,             # 桶内对象总大小，单位字节
+                      "count": 5000004,                    # 桶内对象总数量
+                    },
+                    "stats_time": "2020-03-04T06:01:50+00:00", # 统计时间
+                    "code": 200,
+                    "bucket_name": "xxx"    # 存储桶名称
+                }
+
+            >>Http Code: 状态码404:
+                {
+                    'code': 404,
+                    'code_text': xxx  //错误码描述
+                }
+        '''
+    queryset = []
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'bucket_name'
+    lookup_value_regex = '[a-z0-9-_]{3,64}'
+
+    @swagger_auto_schema(
+        operation_summary=gettext_lazy('获取一个存储桶资源统计信息'),
+    )
+    def retrieve(self, request, *args, **kwargs):
+        bucket_name = kwargs.get(self.lookup_field)
+
+        user = request.user
+        if user.is_superuser:
+            bucket = Bucket.get_bucket_by_name(bucket_name)
+        else:
+            bucket = get_user_own_bucket(bucket_name, request)
+
+        if not bucket:
+            return Response(data={'code': 404, 'code_text': _('bucket_name参数有误，存储桶不存在')},
+                                  status=status.HTTP_404_NOT_FOUND)
+
+        data = bucket.get_stats()
+        data.update({
+            'code': 200,
+            'bucket_name': bucket_name,
+        })
+
+        return Response(data)
+
+
+class SecurityViewSet(CustomGenericViewSet):
+    '''
+    安全凭证视图集
+
+    retrieve:
+        获取指定用户的安全凭证, 需要超级用户权限
+
+            *注：默认只返回用户Auth Token和JWT(json web token)，如果希望返回内容包含访问密钥对，请显示携带query参数key,服务器不要求key有值
+
+            >>Http Code: 状态码200:
+                {
+                  "user": {
+                    "id": 3,
+                    "username": "xxx"
                   },
                   "token": "xxx",
                   "jwt": "xxx",
@@ -1795,32 +2472,144 @@ class SecurityViewSet(CustomGenericViewSet):
 
         return user
 
-    def validate_username(self, username):
-        '''
-        验证用户名是否是邮箱
+    def validate_username(self, username):
+        '''
+        验证用户名是否是邮箱
+
+        failed: raise ValidationError
+        '''
+        validate_email(username)
+
+
+class MoveViewSet(CustomGenericViewSet):
+    '''
+    对象或目录移动或重命名
+
+    create_detail:
+        移动或重命名一个对象或目录
+
+        参数move_to指定对象移动的目标路径（bucket桶下的目录路径），/或空字符串表示桶下根目录；参数rename指定重命名对象的新名称；
+        请求时至少提交其中一个参数，亦可同时提交两个参数；只提交参数move_to只移动对象，只提交参数rename只重命名对象；
+        路径是目录时移动或重命名整个目录，目录下所有对象和子目录的路径随之改变，移动过程中不能访问此目录下的对象和子目录；
+
+        >>Http Code: 状态码201,成功：
+        >>Http Code: 状态码400, 请求参数有误，已存在同名的对象或目录:
+            {
+                "code": 400,
+                "code_text": 'xxxxx'        //错误信息
+            }
+        >>Http Code: 状态码404, bucket桶、对象或移动目标路径不存在:
+            {
+                "code": 404,
+                "code_text": 'xxxxx'        //错误信息
+            }
+        >>Http Code: 状态码409, 目录、对象所在目录或目标目录正在移动中:
+        >>Http Code: 状态码500, 服务器错误，无法完成操作:
+            {
+                "code": 500,
+                "code_text": 'xxxxx'        //错误信息
+            }
+    '''
+    queryset = []
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'objpath'
+    lookup_value_regex = '.+'
+
+    @swagger_auto_schema(
+        operation_summary=gettext_lazy('移动或重命名一个对象或目录'),
+        operation_id='v1_move_create_detail',
+        request_body=no_body,
+        manual_parameters=[
+            openapi.Parameter(
+                name='objpath', in_=openapi.IN_PATH,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("文件对象或目录绝对路径"),
+                required=True
+            ),
+            openapi.Parameter(
+                name='move_to', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("移动对象到此目录路径下，/或空字符串表示桶下根目录"),
+                required=False
+            ),
+            openapi.Parameter(
+                name='rename', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("重命名对象的新名称"),
+                required=False
+            )
+        ],
+        responses={
+            status.HTTP_201_CREATED: """
+                {
+                  "code": 201,
+                  "code_text": "移动对象操作成功",
+                  "bucket_name": "666",
+                  "dir_path": "d d",
+                  "obj": {                      # 移动操作成功后文件对象详细信息
+                    "na": "d d/data.json2",
+                    "name": "data.json2",
+                    "fod": true,
+                    "did": 6,
+                    "si": 149888,
+                    "ult": "2020-03-03T20:52:04.187179+08:00",
+                    "upt": "2020-03-03T20:52:04.187179+08:00",
+                    "dlc": 1,
+                    "download_url": "http://159.226.91.140:8000/share/obs/666/d%20d/data.json2",
+                    "access_permission": "公有"
+                  }
+                }
+            """
+        }
+    )
+    def create_detail(self, request, *args, **kwargs):
+        bucket_name = kwargs.get('bucket_name', '')
+        objpath = kwargs.get(self.lookup_field, '')
+        move_to = request.query_params.get('move_to', None)
+        rename = request.query_params.get('rename', None)
+
+        hManager = HarborManager()
+        try:
+            obj, bucket = hManager.move_rename(bucket_name=bucket_name, obj_path=objpath, rename=rename, move=move_to, user=request.user)
+        except HarborError as e:
+            return Response(data={'code':e.code, 'code_text': e.msg}, status=e.code)
+
+        context = self.get_serializer_context()
+        context.update({'bucket_name': bucket.name, 'bucket': bucket})
+        return Response(data={'code': 201, 'code_text': _('移动对象操作成功'),
+                              'bucket_name': bucket.name,
+                              'dir_path': obj.get_parent_path(),
+                              'obj': serializers.ObjInfoSerializer(obj, context=context).data},
+                        status=status.HTTP_201_CREATED)
 
-        failed: raise ValidationError
-        '''
-        validate_email(username)
+    def get_serializer_class(self):
+        """
+        Return the class to use for the serializer.
+        Defaults to using `self.serializer_class`.
+        Custom serializer_class
+        """
+        if self.action in ['create_detail']:
+            return Serializer
+        return Serializer
 
 
-class MoveViewSet(CustomGenericViewSet):
+class CopyViewSet(CustomGenericViewSet):
     '''
-    对象移动或重命名
+    对象复制
 
     create_detail:
-        移动或重命名一个对象
+        复制一个对象
 
-        参数move_to指定对象移动的目标路径（bucket桶下的目录路径），/或空字符串表示桶下根目录；参数rename指定重命名对象的新名称；
-        请求时至少提交其中一个参数，亦可同时提交两个参数；只提交参数move_to只移动对象，只提交参数rename只重命名对象；
+        参数to_path指定目标对象全路径；参数to_bucket指定目标桶，不提交时为源对象所在的桶；目标对象已存在时覆盖；
+        对象数据在服务端复制，不经过客户端，可以跨桶复制；
 
         >>Http Code: 状态码201,成功：
-        >>Http Code: 状态码400, 请求参数有误，已存在同名的对象或目录:
+        >>Http Code: 状态码400, 请求参数有误，目标路径已存在同名的目录:
             {
                 "code": 400,
                 "code_text": 'xxxxx'        //错误信息
             }
-        >>Http Code: 状态码404, bucket桶、对象或移动目标路径不存在:
+        >>Http Code: 状态码404, bucket桶、对象或目标路径不存在:
             {
                 "code": 404,
                 "code_text": 'xxxxx'        //错误信息
@@ -1837,8 +2626,8 @@ class MoveViewSet(CustomGenericViewSet):
     lookup_value_regex = '.+'
 
     @swagger_auto_schema(
-        operation_summary=gettext_lazy('移动或重命名一个对象'),
-        operation_id='v1_move_create_detail',
+        operation_summary=gettext_lazy('复制一个对象'),
+        operation_id='v1_copy_create_detail',
         request_body=no_body,
         manual_parameters=[
             openapi.Parameter(
@@ -1848,26 +2637,27 @@ class MoveViewSet(CustomGenericViewSet):
                 required=True
             ),
             openapi.Parameter(
-                name='move_to', in_=openapi.IN_QUERY,
+                name='to_bucket', in_=openapi.IN_QUERY,
                 type=openapi.TYPE_STRING,
-                description=gettext_lazy("移动对象到此目录路径下，/或空字符串表示桶下根目录"),
+                description=gettext_lazy("目标桶名称，默认为源对象所在的桶"),
                 required=False
             ),
             openapi.Parameter(
-                name='rename', in_=openapi.IN_QUERY,
+                name='to_path', in_=openapi.IN_QUERY,
                 type=openapi.TYPE_STRING,
-                description=gettext_lazy("重命名对象的新名称"),
-                required=False
+                description=gettext_lazy("目标对象全路径"),
+                required=True
             )
         ],
         responses={
             status.HTTP_201_CREATED: """
                 {
                   "code": 201,
-                  "code_text": "移动对象操作成功",
+                  "code_text": "复制对象操作成功",
+                  "created": true,              # true: 新建目标对象; false: 覆盖已存在的目标对象
                   "bucket_name": "666",
                   "dir_path": "d d",
-                  "obj": {                      # 移动操作成功后文件对象详细信息
+                  "obj": {                      # 目标对象详细信息
                     "na": "d d/data.json2",
                     "name": "data.json2",
                     "fod": true,
@@ -1886,18 +2676,20 @@ class MoveViewSet(CustomGenericViewSet):
     def create_detail(self, request, *args, **kwargs):
         bucket_name = kwargs.get('bucket_name', '')
         objpath = kwargs.get(self.lookup_field, '')
-        move_to = request.query_params.get('move_to', None)
-        rename = request.query_params.get('rename', None)
+        to_bucket = request.query_params.get('to_bucket', '')
+        to_path = request.query_params.get('to_path', '')
 
         hManager = HarborManager()
         try:
-            obj, bucket = hManager.move_rename(bucket_name=bucket_name, obj_path=objpath, rename=rename, move=move_to, user=request.user)
+            obj, bucket, created = hManager.copy_object(bucket_name=bucket_name, obj_path=objpath,
+                                                        to_bucket_name=to_bucket, to_path=to_path, user=request.user)
         except HarborError as e:
-            return Response(data={'code':e.code, 'code_text': e.msg}, status=e.code)
+            return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
 
         context = self.get_serializer_context()
         context.update({'bucket_name': bucket.name, 'bucket': bucket})
-        return Response(data={'code': 201, 'code_text': _('移动对象操作成功'),
+        return Response(data={'code': 201, 'code_text': _('复制对象操作成功'),
+                              'created': created,
                               'bucket_name': bucket.name,
                               'dir_path': obj.get_parent_path(),
                               'obj': serializers.ObjInfoSerializer(obj, context=context).data},
@@ -1909,8 +2701,351 @@ class MoveViewSet(CustomGenericViewSet):
         Defaults to using `self.serializer_class`.
         Custom serializer_class
         """
-        if self.action in ['create_detail']:
-            return Serializer
+        return Serializer
+
+
+class MultipartUploadViewSet(CustomGenericViewSet):
+    '''
+    分片(multipart)上传，大对象分成多个分片，可多个连接并行上传，全部上传后完成上传时一次创建对象
+
+    create_detail:
+        初始化或完成分片上传
+
+        不提交参数upload_id时，初始化一个分片上传，参数part_size指定分片大小，返回upload_id；
+        提交参数upload_id时，完成此分片上传，创建(或覆盖)对象，分片编号必须从1连续，除最后一个分片外每个分片的大小必须等于
+        part_size；可选提交json数据：
+            {
+                "parts": [{"part_num": 1, "md5": "xxx"}, ],     // 客户端记录的分片列表，提交时校验和已上传的分片一致
+                "md5": "xxx"                                    // 整个对象的MD5，提交时保存为对象的MD5
+            }
+
+        >>Http Code: 状态码200, 初始化成功，返回upload_id:
+        >>Http Code: 状态码201, 完成上传，对象创建成功:
+        >>Http Code: 状态码400, 请求参数有误，缺少分片或分片大小有误:
+        >>Http Code: 状态码404, bucket桶或分片上传不存在:
+        >>Http Code: 状态码409, 有分片正在上传，或分片上传正在完成或取消:
+            {
+                "code": 4xx,
+                "code_text": 'xxxxx'        //错误信息
+            }
+
+    update:
+        上传一个分片
+
+        请求体是分片的原始数据，请求头Content-Length为分片大小；可选请求头Content-MD5(base64编码，兼容16进制)校验分片数据；
+        同一编号的分片重复上传时覆盖
+
+    retrieve:
+        列举分片上传已上传的分片
+
+    destroy:
+        取消分片上传，删除已上传的分片数据
+    '''
+    queryset = []
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'objpath'
+    lookup_value_regex = '.+'
+
+    @swagger_auto_schema(
+        operation_summary=gettext_lazy('初始化或完成分片上传'),
+        operation_id='v1_multipart_create_detail',
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'parts': openapi.Schema(
+                    type=openapi.TYPE_ARRAY,
+                    items=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'part_num': openapi.Schema(type=openapi.TYPE_INTEGER),
+                            'md5': openapi.Schema(type=openapi.TYPE_STRING)
+                        }
+                    ),
+                    description=gettext_lazy('分片列表，完成上传时可选')
+                ),
+                'md5': openapi.Schema(type=openapi.TYPE_STRING, description=gettext_lazy('对象MD5，完成上传时可选'))
+            }
+        ),
+        manual_parameters=[
+            openapi.Parameter(
+                name='objpath', in_=openapi.IN_PATH,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("文件对象绝对路径"),
+                required=True
+            ),
+            openapi.Parameter(
+                name='part_size', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_INTEGER,
+                description=gettext_lazy("分片大小(字节)，初始化时必须提交"),
+                required=False
+            ),
+            openapi.Parameter(
+                name='upload_id', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("分片上传ID，完成上传时提交"),
+                required=False
+            )
+        ],
+        responses={
+            status.HTTP_200_OK: """
+                {
+                  "code": 200,
+                  "code_text": "初始化分片上传成功",
+                  "upload_id": "xxx",
+                  "part_size": 5242880,
+                  "max_part_num": 10000
+                }
+            """,
+            status.HTTP_201_CREATED: """
+                {
+                  "code": 201,
+                  "code_text": "完成分片上传，创建对象成功",
+                  "created": true,              # true: 新建对象; false: 覆盖已存在的对象
+                  "etag": "xxx-3",              # 各分片MD5拼接后的MD5和分片数
+                  "bucket_name": "666",
+                  "dir_path": "d d",
+                  "obj": {}                     # 对象详细信息
+                }
+            """
+        }
+    )
+    def create_detail(self, request, *args, **kwargs):
+        bucket_name = kwargs.get('bucket_name', '')
+        objpath = kwargs.get(self.lookup_field, '')
+        upload_id = request.query_params.get('upload_id', None)
+
+        hManager = HarborManager()
+        if upload_id is None:
+            try:
+                part_size = int(request.query_params.get('part_size', 0))
+            except ValueError:
+                return Response(data={'code': 400, 'code_text': _('part_size参数有误')},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                upload = hManager.create_multipart_upload(bucket_name=bucket_name, obj_path=objpath,
+                                                          part_size=part_size, user=request.user)
+            except HarborError as e:
+                return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
+
+            return Response(data={'code': 200, 'code_text': _('初始化分片上传成功'), 'upload_id': upload.upload_id,
+                                  'part_size': upload.part_size, 'max_part_num': upload.MAX_PART_NUM})
+
+        try:
+            parts, md5 = self.get_complete_data(request)
+        except ValueError as e:
+            return Response(data={'code': 400, 'code_text': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            bucket, obj, created, etag = hManager.complete_multipart_upload(
+                bucket_name=bucket_name, obj_path=objpath, upload_id=upload_id, parts=parts, md5=md5,
+                user=request.user)
+        except HarborError as e:
+            return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
+
+        context = self.get_serializer_context()
+        context.update({'bucket_name': bucket.name, 'bucket': bucket})
+        response = Response(data={'code': 201, 'code_text': _('完成分片上传，创建对象成功'),
+                                  'created': created,
+                                  'etag': etag,
+                                  'bucket_name': bucket.name,
+                                  'dir_path': obj.get_parent_path(),
+                                  'obj': serializers.ObjInfoSerializer(obj, context=context).data},
+                            status=status.HTTP_201_CREATED)
+        response['ETag'] = f'"{etag}"'
+        return response
+
+    @swagger_auto_schema(
+        operation_summary=gettext_lazy('上传一个分片'),
+        operation_id='v1_multipart_update',
+        request_body=no_body,
+        manual_parameters=[
+            openapi.Parameter(
+                name='objpath', in_=openapi.IN_PATH,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("文件对象绝对路径"),
+                required=True
+            ),
+            openapi.Parameter(
+                name='upload_id', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("分片上传ID"),
+                required=True
+            ),
+            openapi.Parameter(
+                name='part_num', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_INTEGER,
+                description=gettext_lazy("分片编号，从1开始"),
+                required=True
+            ),
+            openapi.Parameter(
+                name='Content-MD5', in_=openapi.IN_HEADER,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("分片数据的MD5，base64编码(RFC 1864)，兼容16进制"),
+                required=False
+            )
+        ],
+        responses={
+            status.HTTP_200_OK: """
+                {
+                  "code": 200,
+                  "code_text": "上传分片成功",
+                  "part_num": 1,
+                  "size": 5242880,
+                  "md5": "xxx"
+                }
+            """
+        }
+    )
+    def update(self, request, *args, **kwargs):
+        bucket_name = kwargs.get('bucket_name', '')
+        objpath = kwargs.get(self.lookup_field, '')
+        upload_id = request.query_params.get('upload_id', '')
+        try:
+            part_num = int(request.query_params.get('part_num', 0))
+            size = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return Response(data={'code': 400, 'code_text': _('part_num参数或Content-Length有误')},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            md5 = content_md5_to_hex(request.headers.get('content-md5', ''))
+        except ValueError:
+            return Response(data={'code': 400, 'code_text': _('标头Content-MD5有误')},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        hManager = HarborManager()
+        try:
+            part = hManager.upload_multipart_part(bucket_name=bucket_name, obj_path=objpath, upload_id=upload_id,
+                                                  part_num=part_num, stream=request.stream, size=size, md5=md5,
+                                                  user=request.user)
+        except HarborError as e:
+            return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
+
+        response = Response(data={'code': 200, 'code_text': _('上传分片成功'), 'part_num': part.part_num,
+                                  'size': part.size, 'md5': part.md5})
+        response['ETag'] = f'"{part.md5}"'
+        return response
+
+    @swagger_auto_schema(
+        operation_summary=gettext_lazy('列举已上传的分片'),
+        operation_id='v1_multipart_read',
+        manual_parameters=[
+            openapi.Parameter(
+                name='objpath', in_=openapi.IN_PATH,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("文件对象绝对路径"),
+                required=True
+            ),
+            openapi.Parameter(
+                name='upload_id', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("分片上传ID"),
+                required=True
+            )
+        ],
+        responses={
+            status.HTTP_200_OK: """
+                {
+                  "code": 200,
+                  "upload_id": "xxx",
+                  "part_size": 5242880,
+                  "status": 0,                  # 0: 上传中; 1: 完成中; 2: 取消中
+                  "parts": [
+                    {
+                      "part_num": 1,
+                      "size": 5242880,          # -1: 正在上传
+                      "md5": "xxx",
+                      "modified_time": "2020-03-03T20:52:04.187179+08:00"
+                    }
+                  ]
+                }
+            """
+        }
+    )
+    def retrieve(self, request, *args, **kwargs):
+        bucket_name = kwargs.get('bucket_name', '')
+        objpath = kwargs.get(self.lookup_field, '')
+        upload_id = request.query_params.get('upload_id', '')
+
+        hManager = HarborManager()
+        try:
+            upload, parts = hManager.list_multipart_parts(bucket_name=bucket_name, obj_path=objpath,
+                                                          upload_id=upload_id, user=request.user)
+        except HarborError as e:
+            return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
+
+        return Response(data={'code': 200, 'upload_id': upload.upload_id, 'part_size': upload.part_size,
+                              'status': upload.status,
+                              'parts': [{'part_num': p.part_num, 'size': p.size, 'md5': p.md5,
+                                         'modified_time': p.modified_time} for p in parts]})
+
+    @swagger_auto_schema(
+        operation_summary=gettext_lazy('取消分片上传'),
+        operation_id='v1_multipart_delete',
+        manual_parameters=[
+            openapi.Parameter(
+                name='objpath', in_=openapi.IN_PATH,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("文件对象绝对路径"),
+                required=True
+            ),
+            openapi.Parameter(
+                name='upload_id', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("分片上传ID"),
+                required=True
+            )
+        ],
+        responses={
+            status.HTTP_204_NO_CONTENT: 'OK'
+        }
+    )
+    def destroy(self, request, *args, **kwargs):
+        bucket_name = kwargs.get('bucket_name', '')
+        objpath = kwargs.get(self.lookup_field, '')
+        upload_id = request.query_params.get('upload_id', '')
+
+        hManager = HarborManager()
+        try:
+            hManager.abort_multipart_upload(bucket_name=bucket_name, obj_path=objpath, upload_id=upload_id,
+                                            user=request.user)
+        except HarborError as e:
+            return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @staticmethod
+    def get_complete_data(request):
+        '''
+        完成上传时提交的分片列表和对象MD5
+
+        :return:
+            (parts, md5)    # parts: [(part_num, md5), ] or None
+        :raises: ValueError
+        '''
+        data = request.data
+        if not data:
+            return None, ''
+
+        md5 = data.get('md5', '') or ''
+        parts = data.get('parts', None)
+        if parts is None:
+            return None, md5
+
+        try:
+            parts = [(int(p['part_num']), str(p['md5'])) for p in parts]
+        except (TypeError, KeyError, ValueError):
+            raise ValueError(_('parts参数有误'))
+
+        return parts, md5
+
+    def get_serializer_class(self):
+        """
+        Return the class to use for the serializer.
+        Defaults to using `self.serializer_class`.
+        Custom serializer_class
+        """
         return Serializer
 
 
@@ -2005,10 +3140,14 @@ class MetadataViewSet(CustomGenericViewSet):
         if obj.is_file():
             obj_key = obj.get_obj_key(bucket.id)
             pool_name = bucket.get_pool_name()
-            chunk_size, keys = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.obj_size).get_rados_key_info()
+            ho = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.obj_size, layout=obj.lay)
+            chunk_size, keys = ho.get_rados_key_info()
             info = {
                 'rados': keys,
                 'chunk_size': chunk_size,
+                'layout': obj.lay,
+                'inline': obj.inl is not None,   # 数据内联在元数据中，rados对象不存在
+                'compressed': obj.lay.startswith('v4:'),  # 数据分块压缩存储，rados对象中是压缩数据
                 'size': obj.obj_size,
                 'filename': obj.name
             }
@@ -2076,7 +3215,7 @@ class MetadataViewSet(CustomGenericViewSet):
 
         obj_key = obj.get_obj_key(bucket.id)
         pool_name = bucket.get_pool_name()
-        ho = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.obj_size)
+        ho = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.obj_size, layout=obj.lay)
         rados_key = ho.get_rados_key_info()
         info = {
             'rados': rados_key,
@@ -2163,9 +3302,19 @@ class RefreshMetadataViewSet(CustomGenericViewSet):
         if not obj:
             return Response(data={'code': 404, 'code_text': _('对象不存在')}, status=status.HTTP_404_NOT_FOUND)
 
+        # 内联、条带化、打包、去重、压缩或数据在其他rados key下的对象，rados数据大小不是对象大小，大小以元数据为准
+        if obj.inl is not None or obj.lay.startswith(('v1:', 'v2:', 'v3:', 'v4:', 'v5:')):
+            mtime = obj.upt if obj.upt else obj.ult
+            info = {
+                'size': obj.si,
+                'filename': obj.name,
+                'mtime': mtime.isoformat()
+            }
+            return Response(data={'code': 200, 'code_text': _('更新对象大小元数据成功'), 'info': info})
+
         obj_key = obj.get_obj_key(bucket.id)
         pool_name = bucket.get_pool_name()
-        ho = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.obj_size)
+        ho = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.obj_size, layout=obj.lay)
         ok, ret = ho.get_rados_stat(obj_id=obj_key)
         if not ok:
             return Response(data={'code': 400, 'code_text': f'failed to get size of rados object，{ret}'}, status=status.HTTP_400_BAD_REQUEST)
@@ -2952,10 +4101,14 @@ class ObjKeyViewSet(CustomGenericViewSet):
 
         obj_key = obj.get_obj_key(bucket.id)
         pool_name = bucket.get_pool_name()
-        chunk_size, keys = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.obj_size).get_rados_key_info()
+        ho = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.obj_size, layout=obj.lay)
+        chunk_size, keys = ho.get_rados_key_info()
         info = {
             'rados': keys,
             'chunk_size': chunk_size,
+            'layout': obj.lay,
+            'inline': obj.inl is not None,   # 数据内联在元数据中，rados对象不存在
+            'compressed': obj.lay.startswith('v4:'),  # 数据分块压缩存储，rados对象中是压缩数据
             'size': obj.obj_size,
             'filename': obj.name
         }
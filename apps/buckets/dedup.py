@@ -0,0 +1,108 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F
+
+from utils.oss.pyrados import HarborObject, DedupLayout
+from .models import DedupBlob
+
+
+logger = logging.getLogger('debug')
+
+
+def get_dedup_config():
+    '''
+    对象数据去重配置，settings.CEPH_RADOS['DEDUP']
+
+    :return: dict
+    '''
+    conf = settings.CEPH_RADOS.get('DEDUP', None)
+    return conf if conf else {}
+
+
+def get_dedup_min_size():
+    '''
+    去重的对象大小下限，0不去重
+    '''
+    conf = get_dedup_config()
+    if not conf.get('ENABLE', False):
+        return 0
+
+    return max(conf.get('MIN_SIZE', 4 * 1024 ** 2), 1)
+
+
+def acquire_blob(pool_name: str, md5: str, size: int):
+    '''
+    查找并引用一个数据相同的blob，引用数加1
+
+    :return:
+        DedupLayout()   # 引用blob的对象数据布局
+        None            # 没有数据相同的blob
+    '''
+    with transaction.atomic():
+        blob = DedupBlob.objects.select_for_update().filter(pool_name=pool_name, md5=md5, size=size).first()
+        if blob is None:
+            return None
+
+        DedupBlob.objects.filter(id=blob.id).update(refs=F('refs') + 1)
+
+    return DedupLayout(blob_key=blob.blob_key, inner=blob.lay)
+
+
+def add_blob_ref(layout: DedupLayout):
+    '''
+    增加一个对blob的引用，用于复制去重的对象
+
+    :return:
+        True    # 成功
+        False   # blob不存在(已被回收)
+    '''
+    return DedupBlob.objects.filter(blob_key=layout.blob_key).update(refs=F('refs') + 1) > 0
+
+
+def create_blob(pool_name: str, md5: str, size: int, blob_key: str, layout):
+    '''
+    已写入独立rados key的数据登记为一个blob，引用数为1
+
+    :param blob_key: blob的rados key
+    :param layout: blob的数据布局
+    :return:
+        DedupLayout()   # 引用blob的对象数据布局
+        None            # 已存在数据相同的blob
+    '''
+    try:
+        DedupBlob.objects.create(pool_name=pool_name, md5=md5, size=size, blob_key=blob_key, lay=str(layout),
+                                 refs=1)
+    except IntegrityError:
+        return None
+
+    return DedupLayout(blob_key=blob_key, inner=layout)
+
+
+def release_blob(pool_name: str, layout: DedupLayout):
+    '''
+    释放对blob的引用，引用数减为0时删除blob的rados数据和记录
+
+    :return:
+        True    # blob已删除
+        False   # blob仍被引用，或blob不存在
+    '''
+    with transaction.atomic():
+        blob = DedupBlob.objects.select_for_update().filter(blob_key=layout.blob_key).first()
+        if blob is None:
+            return False
+
+        if blob.refs > 1:
+            DedupBlob.objects.filter(id=blob.id).update(refs=F('refs') - 1)
+            return False
+
+        blob.delete()
+
+    # 删除rados数据失败只记录日志，残留的rados数据不再被引用
+    ho = HarborObject(pool_name=pool_name, obj_id=blob.blob_key, obj_size=blob.size, layout=blob.lay)
+    ok, msg = ho.delete()
+    if not ok:
+        logger.error(f'failed to delete rados data of dedup blob {blob.blob_key}, {msg}')
+
+    return True
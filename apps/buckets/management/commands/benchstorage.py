@@ -0,0 +1,512 @@
+import os
+import csv
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import socket
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+from utils.oss.pyrados import HarborObject, parse_layout
+
+
+WORKLOADS = ('write', 'aio-write', 'write-file', 'seq-read', 'range-read', 'part-boundary', 'small')
+
+CSV_FIELDS = ('workload', 'backend', 'pool', 'layout', 'object_size', 'block_size', 'concurrency', 'ops', 'bytes',
+              'errors', 'seconds', 'mb_per_s', 'ops_per_s', 'lat_avg_ms', 'lat_p50_ms', 'lat_p99_ms', 'lat_max_ms')
+
+
+def parse_size(value: str):
+    '''
+    解析字节大小字符串，支持K、M、G后缀(1024进制)，如'512K'、'4M'、'1G'
+
+    :return: int
+    :raises: ValueError
+    '''
+    s = value.strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if s and s[-1] in units:
+        size = int(float(s[:-1]) * units[s[-1]])
+    else:
+        size = int(s)
+
+    if size <= 0:
+        raise ValueError(f'size "{value}" must be > 0')
+
+    return size
+
+
+def parse_size_list(value: str):
+    return [parse_size(v) for v in value.split(',') if v.strip()]
+
+
+def parse_int_list(value: str):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def percentile(sorted_values, pct):
+    '''
+    最近秩法计算百分位数
+
+    :param sorted_values: 已升序排序的数值列表
+    :param pct: 0-100
+    '''
+    if not sorted_values:
+        return 0.0
+
+    k = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(k, len(sorted_values) - 1)]
+
+
+class Recorder:
+    '''
+    一个测试用例的操作计数和延迟(秒)记录，多线程共享时每个线程使用各自的Recorder，结束后合并
+    '''
+    def __init__(self):
+        self.latencies = []
+        self.bytes = 0
+        self.errors = 0
+
+    def add(self, seconds: float, nbytes: int):
+        self.latencies.append(seconds)
+        self.bytes += nbytes
+
+    def error(self):
+        self.errors += 1
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        self.bytes += other.bytes
+        self.errors += other.errors
+
+
+class Command(BaseCommand):
+    '''
+    存储层(HarborObject)读写吞吐量和延迟基准测试，对配置的存储后端(settings.CEPH_RADOS['BACKEND'])按数据块大小、
+    并发数、对象大小组合测试，结果输出为JSON或CSV，便于比较不同配置和版本的测试结果
+
+    测试场景：
+        write: 按数据块大小顺序同步写入对象(HarborObject.write)
+        aio-write: 按数据块大小顺序提交给异步流水线写入器(同上传处理器FileUploadToCephHandler, 数据块大小即chunk_size)
+        write-file: 写入类文件对象(HarborObject.write_file, 数据块大小即per_size)
+        seq-read: 顺序读取整个对象(HarborObject.read_obj_generator, 数据块大小即block_size)
+        range-read: 随机偏移量读取数据块大小的范围
+        part-boundary: 读取跨越part(条带布局为条带单元)边界的范围，只写入边界附近的数据(稀疏对象)
+        small: 大量小对象的写入、读取和删除
+    '''
+
+    help = """** manage.py benchstorage --pool=obs_test --block-sizes=1M,4M,16M --concurrency=1,4,16 --object-sizes=64M **
+           ** manage.py benchstorage --workloads=small --small-size=4K --small-count=10000 --format=csv --output=small.csv **"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pool', default=None, dest='pool',
+            help='Name of the pool to benchmark, default the first pool in settings.CEPH_RADOS["POOL_NAME"]',
+        )
+        parser.add_argument(
+            '--workloads', default=','.join(WORKLOADS), dest='workloads',
+            help=f'Comma separated workloads, choices: {",".join(WORKLOADS)}',
+        )
+        parser.add_argument(
+            '--block-sizes', default='1M,4M,10M,32M', dest='block_sizes',
+            help='Comma separated block sizes of a read or write call, such as 512K,4M',
+        )
+        parser.add_argument(
+            '--concurrency', default='1,4,16', dest='concurrency',
+            help='Comma separated thread counts, every thread reads or writes its own object',
+        )
+        parser.add_argument(
+            '--object-sizes', default='64M,256M', dest='object_sizes',
+            help='Comma separated object sizes for write, seq-read and range-read workloads',
+        )
+        parser.add_argument(
+            '--range-ops', default=100, dest='range_ops', type=int,
+            help='Number of reads per thread for range-read and part-boundary workloads',
+        )
+        parser.add_argument(
+            '--small-size', default='4K,64K', dest='small_sizes',
+            help='Comma separated object sizes for small workload',
+        )
+        parser.add_argument(
+            '--small-count', default=1000, dest='small_count', type=int,
+            help='Number of objects per thread for small workload',
+        )
+        parser.add_argument(
+            '--layout', default='', dest='layout',
+            help='Object layout string for the test objects, such as v1:4194304:4:2147483648, default old part layout',
+        )
+        parser.add_argument(
+            '--aio-inflight', default=4, dest='aio_inflight', type=int,
+            help='max_inflight of the aio writer in aio-write workload',
+        )
+        parser.add_argument(
+            '--format', default='json', dest='format', choices=('json', 'csv'),
+            help='Output format of results',
+        )
+        parser.add_argument(
+            '--output', default=None, dest='output',
+            help='Output file of results, default stdout',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            workloads = [w.strip() for w in options['workloads'].split(',') if w.strip()]
+            block_sizes = parse_size_list(options['block_sizes'])
+            concurrency = parse_int_list(options['concurrency'])
+            object_sizes = parse_size_list(options['object_sizes'])
+            small_sizes = parse_size_list(options['small_sizes'])
+            self.layout = parse_layout(options['layout'])
+        except ValueError as e:
+            raise CommandError(f'Invalid argument, {str(e)}')
+
+        for w in workloads:
+            if w not in WORKLOADS:
+                raise CommandError(f'Invalid workload "{w}", choices: {",".join(WORKLOADS)}')
+
+        if not block_sizes or not concurrency or min(concurrency) <= 0:
+            raise CommandError('block sizes and concurrency must be given and > 0')
+
+        pool_name = options['pool']
+        if not pool_name:
+            pool_name = settings.CEPH_RADOS['POOL_NAME'][0]
+
+        self.pool_name = pool_name
+        self.backend = settings.CEPH_RADOS.get('BACKEND', 'rados')
+        self.range_ops = max(options['range_ops'], 1)
+        self.aio_inflight = max(options['aio_inflight'], 1)
+        self.run_id = uuid.uuid1().hex[:12]
+        self.results = []
+
+        self.notice(f'Benchmark storage backend "{self.backend}", pool "{pool_name}", '
+                    f'layout "{self.layout}", run id {self.run_id}')
+        started = time.time()
+        for c in concurrency:
+            for object_size in object_sizes:
+                for bs in block_sizes:
+                    if 'write' in workloads:
+                        self.bench_write(object_size, bs, c)
+                    if 'aio-write' in workloads:
+                        self.bench_aio_write(object_size, bs, c)
+                    if 'write-file' in workloads:
+                        self.bench_write_file(object_size, bs, c)
+
+                if 'seq-read' in workloads or 'range-read' in workloads:
+                    self.bench_reads(object_size, block_sizes, c, workloads)
+
+            if 'part-boundary' in workloads:
+                for bs in block_sizes:
+                    self.bench_part_boundary(bs, c)
+
+            if 'small' in workloads:
+                for size in small_sizes:
+                    self.bench_small(size, options['small_count'], c)
+
+        meta = {
+            'run_id': self.run_id,
+            'host': socket.gethostname(),
+            'backend': self.backend,
+            'pool': pool_name,
+            'layout': str(self.layout),
+            'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started)),
+            'seconds': round(time.time() - started, 3),
+        }
+        self.output_results(meta, options['format'], options['output'])
+
+    def notice(self, msg):
+        # 结果输出到stdout时，进度信息输出到stderr，不影响结果的解析
+        self.stderr.write(self.style.NOTICE(msg))
+
+    def new_object(self, name: str, obj_size: int = 0):
+        obj_id = f'bench_{self.run_id}_{name}'
+        return HarborObject(pool_name=self.pool_name, obj_id=obj_id, obj_size=obj_size, layout=self.layout)
+
+    @staticmethod
+    def build_data(size: int):
+        return os.urandom(size)
+
+    def run_threads(self, concurrency: int, func, *args):
+        '''
+        concurrency个线程并发执行func(thread_index, recorder, *args)
+
+        :return:
+            (Recorder(), seconds)
+        '''
+        recorders = [Recorder() for _ in range(concurrency)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(func, i, recorders[i], *args) for i in range(concurrency)]
+            for f in futures:
+                e = f.exception()
+                if e is not None:
+                    recorders[0].error()
+                    self.notice(f'worker error, {str(e)}')
+
+        seconds = time.perf_counter() - start
+        total = Recorder()
+        for r in recorders:
+            total.merge(r)
+
+        return total, seconds
+
+    def add_result(self, workload: str, object_size: int, block_size: int, concurrency: int, rec: Recorder,
+                   seconds: float):
+        lats = sorted(rec.latencies)
+        ops = len(lats)
+        seconds = max(seconds, 1e-9)
+        result = {
+            'workload': workload,
+            'backend': self.backend,
+            'pool': self.pool_name,
+            'layout': str(self.layout),
+            'object_size': object_size,
+            'block_size': block_size,
+            'concurrency': concurrency,
+            'ops': ops,
+            'bytes': rec.bytes,
+            'errors': rec.errors,
+            'seconds': round(seconds, 6),
+            'mb_per_s': round(rec.bytes / 1024 ** 2 / seconds, 3),
+            'ops_per_s': round(ops / seconds, 3),
+            'lat_avg_ms': round(sum(lats) / ops * 1000, 3) if ops else 0.0,
+            'lat_p50_ms': round(percentile(lats, 50) * 1000, 3),
+            'lat_p99_ms': round(percentile(lats, 99) * 1000, 3),
+            'lat_max_ms': round(lats[-1] * 1000, 3) if ops else 0.0,
+        }
+        self.results.append(result)
+        self.notice(f'{workload}: object_size={object_size}, block_size={block_size}, concurrency={concurrency}, '
+                    f'{result["mb_per_s"]} MB/s, {result["ops_per_s"]} ops/s, '
+                          f'p99 {result["lat_p99_ms"]} ms, errors {rec.errors}')
+
+    def delete_objects(self, objs):
+        for ho in objs:
+            ho.delete()
+
+    def _write_worker(self, index, rec, objs, object_size, block_size, data):
+        ho = objs[index]
+        offset = 0
+        while offset < object_size:
+            size = min(block_size, object_size - offset)
+            chunk = data if size == block_size else data[:size]
+            start = time.perf_counter()
+            ok, _ = ho.write(data_block=chunk, offset=offset)
+            if not ok:
+                rec.error()
+                return
+            rec.add(time.perf_counter() - start, size)
+            offset += size
+
+    def bench_write(self, object_size, block_size, concurrency):
+        data = self.build_data(block_size)
+        objs = [self.new_object(f'w{i}') for i in range(concurrency)]
+        rec, seconds = self.run_threads(concurrency, self._write_worker, objs, object_size, block_size, data)
+        self.delete_objects(objs)
+        self.add_result('write', object_size, block_size, concurrency, rec, seconds)
+
+    def _aio_write_worker(self, index, rec, objs, object_size, block_size, data):
+        ho = objs[index]
+        writer = ho.get_aio_writer(max_inflight=self.aio_inflight)
+        offset = 0
+        try:
+            while offset < object_size:
+                size = min(block_size, object_size - offset)
+                chunk = data if size == block_size else data[:size]
+                start = time.perf_counter()
+                writer.write(chunk, offset)
+                rec.add(time.perf_counter() - start, size)
+                offset += size
+
+            # 写入完成的屏障时间计入最后一个数据块
+            start = time.perf_counter()
+            writer.flush()
+            if rec.latencies:
+                rec.latencies[-1] += time.perf_counter() - start
+        except Exception:
+            writer.abort()
+            rec.error()
+
+    def bench_aio_write(self, object_size, block_size, concurrency):
+        data = self.build_data(block_size)
+        objs = [self.new_object(f'aw{i}') for i in range(concurrency)]
+        rec, seconds = self.run_threads(concurrency, self._aio_write_worker, objs, object_size, block_size, data)
+        for ho in objs:
+            ho.reset_obj_id_and_size(obj_size=object_size)
+        self.delete_objects(objs)
+        self.add_result('aio-write', object_size, block_size, concurrency, rec, seconds)
+
+    def _write_file_worker(self, index, rec, objs, file_data, block_size):
+        ho = objs[index]
+        start = time.perf_counter()
+        ok, _ = ho.write_file(offset=0, file=BytesIO(file_data), per_size=block_size)
+        if not ok:
+            rec.error()
+            return
+        rec.add(time.perf_counter() - start, len(file_data))
+
+    def bench_write_file(self, object_size, block_size, concurrency):
+        # 整个对象一次write_file调用，延迟为单个对象的写入时间
+        file_data = self.build_data(object_size)
+        objs = [self.new_object(f'wf{i}', obj_size=object_size) for i in range(concurrency)]
+        rec, seconds = self.run_threads(concurrency, self._write_file_worker, objs, file_data, block_size)
+        self.delete_objects(objs)
+        self.add_result('write-file', object_size, block_size, concurrency, rec, seconds)
+
+    def prepare_objects(self, prefix, concurrency, object_size):
+        '''
+        创建读测试用的对象
+        '''
+        write_size = 16 * 1024 ** 2
+        data = self.build_data(min(write_size, object_size))
+        objs = []
+        for i in range(concurrency):
+            ho = self.new_object(f'{prefix}{i}')
+            writer = ho.get_aio_writer(max_inflight=self.aio_inflight, write_size=write_size)
+            offset = 0
+            while offset < object_size:
+                size = min(len(data), object_size - offset)
+                writer.write(data[:size], offset)
+                offset += size
+            writer.flush()
+            ho.reset_obj_id_and_size(obj_size=object_size)
+            objs.append(ho)
+
+        return objs
+
+    def _seq_read_worker(self, index, rec, objs, block_size):
+        ho = objs[index]
+        start = time.perf_counter()
+        for data in ho.read_obj_generator(block_size=block_size):
+            now = time.perf_counter()
+            rec.add(now - start, len(data))
+            start = now
+
+        if rec.bytes < ho.get_obj_size():
+            rec.error()
+
+    def _range_read_worker(self, index, rec, objs, block_size, offsets):
+        ho = objs[index]
+        for offset in offsets:
+            start = time.perf_counter()
+            ok, data = ho.read(offset=offset, size=block_size)
+            if not ok:
+                rec.error()
+                continue
+            rec.add(time.perf_counter() - start, len(data))
+
+    def bench_reads(self, object_size, block_sizes, concurrency, workloads):
+        try:
+            objs = self.prepare_objects('r', concurrency, object_size)
+        except Exception as e:
+            self.notice(f'failed to prepare objects for read, {str(e)}')
+            return
+
+        try:
+            for bs in block_sizes:
+                if 'seq-read' in workloads:
+                    rec, seconds = self.run_threads(concurrency, self._seq_read_worker, objs, bs)
+                    self.add_result('seq-read', object_size, bs, concurrency, rec, seconds)
+
+                if 'range-read' in workloads:
+                    max_offset = max(object_size - bs, 0)
+                    offsets = [random.randint(0, max_offset) for _ in range(self.range_ops)]
+                    rec, seconds = self.run_threads(concurrency, self._range_read_worker, objs, bs, offsets)
+                    self.add_result('range-read', object_size, bs, concurrency, rec, seconds)
+        finally:
+            self.delete_objects(objs)
+
+    def bench_part_boundary(self, block_size, concurrency):
+        '''
+        读取跨越第一个part(条带单元)边界的数据，只写入边界前后各一个数据块(稀疏对象)
+        '''
+        boundary = self.layout.size_part_by
+        start_oft = max(boundary - block_size, 0)
+        object_size = boundary + block_size
+        data = self.build_data(object_size - start_oft)
+        objs = []
+        for i in range(concurrency):
+            ho = self.new_object(f'pb{i}')
+            ok, msg = ho.write(data_block=data, offset=start_oft)
+            if not ok:
+                self.notice(f'failed to prepare objects for part-boundary, {msg}')
+                self.delete_objects(objs)
+                return
+            objs.append(ho)
+
+        half = block_size // 2
+        offsets = [max(boundary - half, 0)] * self.range_ops
+        try:
+            rec, seconds = self.run_threads(concurrency, self._range_read_worker, objs, block_size, offsets)
+            self.add_result('part-boundary', object_size, block_size, concurrency, rec, seconds)
+        finally:
+            self.delete_objects(objs)
+
+    def _small_worker(self, index, recs, count, data):
+        w_rec, r_rec, d_rec = recs[index]
+        size = len(data)
+        for n in range(count):
+            ho = self.new_object(f's{index}_{n}')
+            start = time.perf_counter()
+            ok, _ = ho.write(data_block=data)
+            if not ok:
+                w_rec.error()
+                continue
+            w_rec.add(time.perf_counter() - start, size)
+
+            start = time.perf_counter()
+            ok, r = ho.read(offset=0, size=size)
+            if ok and len(r) == size:
+                r_rec.add(time.perf_counter() - start, size)
+            else:
+                r_rec.error()
+
+            start = time.perf_counter()
+            ok, _ = ho.delete()
+            if ok:
+                d_rec.add(time.perf_counter() - start, 0)
+            else:
+                d_rec.error()
+
+    def bench_small(self, size, count, concurrency):
+        data = self.build_data(size)
+        recs = [(Recorder(), Recorder(), Recorder()) for _ in range(concurrency)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(self._small_worker, i, recs, count, data) for i in range(concurrency)]
+            for f in futures:
+                e = f.exception()
+                if e is not None:
+                    recs[0][0].error()
+                    self.notice(f'worker error, {str(e)}')
+        seconds = time.perf_counter() - start
+
+        for i, workload in enumerate(('small-write', 'small-read', 'small-delete')):
+            total = Recorder()
+            for r in recs:
+                total.merge(r[i])
+            # 各操作交替执行，按操作耗时占比分摊总时间，以便计算各自的吞吐量
+            op_seconds = sum(total.latencies)
+            all_seconds = sum(sum(x.latencies) for r in recs for x in r) or 1e-9
+            self.add_result(workload, size, size, concurrency, total, seconds * op_seconds / all_seconds)
+
+    def output_results(self, meta, fmt, output):
+        f = open(output, 'w', newline='') if output else sys.stdout
+        try:
+            if fmt == 'csv':
+                writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+                writer.writeheader()
+                for r in self.results:
+                    writer.writerow(r)
+            else:
+                json.dump({'meta': meta, 'results': self.results}, f, indent=2)
+                f.write('\n')
+        finally:
+            if output:
+                f.close()
+
+        if output:
+            self.notice(f'Results have been written to {output}')
@@ -21,7 +21,10 @@ class Command(BaseCommand):
            **  manage.py buckettable --bucket-name=xxx --sql="sql template" **  
            ** sql template example:**  
            ** ALTER TABLE {table_name} ADD md5 CHAR(32) NOT NULL DEFAULT '' COMMENT 'MD5' **  
-           ** ALTER TABLE {table_name} MODIFY COLUMN md5 VARCHAR(200) NOT NULL DEFAULT 'abcd' **"""
+           ** ALTER TABLE {table_name} MODIFY COLUMN md5 VARCHAR(200) NOT NULL DEFAULT 'abcd' **  
+           ** ALTER TABLE {table_name} ADD lay VARCHAR(64) NOT NULL DEFAULT '' **  
+           ** ALTER TABLE {table_name} ADD inl LONGBLOB NULL **  
+           ** ALTER TABLE {table_name} ADD cidx LONGBLOB NULL **"""
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -8,6 +8,7 @@ from django.db.utils import ProgrammingError
 
 from buckets.utils import BucketFileManagement, delete_table_for_model_class
 from buckets.models import Archive
+from buckets.dedup import release_blob
 from utils.oss import HarborObject
 
 
@@ -144,10 +145,13 @@ class Command(BaseCommand):
                 for obj in objs:
                     if obj.is_file():
                         obj_key = obj.get_obj_key(bucket.id)
-                        ho.reset_obj_id_and_size(obj_id=obj_key, obj_size=obj.si)
+                        ho.reset_obj_id_and_size(obj_id=obj_key, obj_size=obj.si, layout=obj.lay)
+                        ho.set_inline(obj.inl)      # 内联对象没有rados数据
                         ok, err = ho.delete(obj_size=obj.si)
                         if ok:
                             obj.delete()
+                            if ho.is_deduped():     # 释放对去重blob的引用
+                                release_blob(pool_name=pool_name, layout=ho.get_layout())
                         else:
                             self.stdout.write(self.style.WARNING(
                                 f"Failed to deleted a object from ceph:"+ err))
@@ -0,0 +1,83 @@
+from datetime import timedelta
+
+from django.utils import timezone
+from django.db.models import Max
+from django.core.management.base import BaseCommand, CommandError
+
+from buckets.utils import BucketFileManagement
+from buckets.models import Bucket, MultipartUpload, MultipartPart
+from utils.oss import HarborObject
+from utils.storagers import PathParser
+
+
+class Command(BaseCommand):
+    '''
+    清理长时间未完成的分片上传，删除已上传的分片数据和上传记录；
+    完成中(完成过程中进程退出)的分片上传，如果对象已使用上传数据，只删除上传记录
+    '''
+    help = 'Abort stale multipart uploads and delete the uploaded data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', default=7, dest='days', type=int,
+            help='Abort multipart uploads created more than this many days ago, default 7.',
+        )
+        parser.add_argument(
+            '--dry-run', default=False, nargs='?', dest='dry_run', const=True,
+            help='Only show the stale multipart uploads.',
+        )
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days < 0:
+            raise CommandError('Invalid param "days".')
+
+        dry_run = options['dry_run']
+        created_before = timezone.now() - timedelta(days=days)
+        uploads = list(MultipartUpload.objects.filter(created_time__lt=created_before).all())
+        aborted = 0
+        for upload in uploads:
+            self.stdout.write(f'{upload.upload_id}: bucket={upload.bucket_name}, path={upload.obj_path}, '
+                              f'status={upload.get_status_display()}, created={upload.created_time}')
+            if dry_run:
+                continue
+
+            if upload.status == MultipartUpload.STATUS_COMPLETING and self.is_data_used(upload):
+                upload.delete()
+                continue
+
+            # 标记为取消中，仍在写入的分片写入完成后删除自己写入的数据
+            MultipartUpload.objects.filter(id=upload.id).update(status=MultipartUpload.STATUS_ABORTING)
+            if self.delete_data(upload):
+                upload.delete()
+                aborted += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully aborted {aborted} multipart uploads'))
+
+    def is_data_used(self, upload):
+        '''
+        上传数据是否已被对象使用
+        '''
+        bucket = Bucket.objects.filter(id=upload.bucket_id).first()
+        if bucket is None:
+            return False
+
+        path, filename = PathParser(filepath=upload.obj_path).get_path_and_filename()
+        bfm = BucketFileManagement(path=path, collection_name=bucket.get_bucket_table_name())
+        try:
+            obj = bfm.get_dir_or_obj_exists(name=filename)
+        except Exception as e:
+            raise CommandError(f'Failed to query object of multipart upload({upload.upload_id}), {str(e)}')
+
+        return bool(obj) and obj.is_file() and obj.lay.startswith(f'v5:{upload.data_key}:')
+
+    def delete_data(self, upload):
+        max_num = MultipartPart.objects.filter(upload=upload).aggregate(m=Max('part_num'))['m'] or 1
+        ho = HarborObject(pool_name=upload.pool_name, obj_id=upload.data_key, obj_size=max_num * upload.part_size,
+                          layout=upload.lay)
+        ok, msg = ho.delete()
+        if not ok:
+            self.stdout.write(self.style.ERROR(f'Failed to delete data of multipart upload({upload.upload_id}), {msg}'))
+            return False
+
+        return True
@@ -0,0 +1,179 @@
+from datetime import timedelta
+
+from django.utils import timezone
+from django.core.management.base import BaseCommand, CommandError
+
+from buckets.utils import BucketFileManagement
+from buckets.models import Bucket, Archive, PackFile
+from buckets.packs import get_pack_config, get_pack_writer
+from utils.oss import HarborObject, RadosError
+from utils.oss.pyrados import PackLayout, parse_layout
+
+
+class Command(BaseCommand):
+    '''
+    压缩小对象打包的pack文件，回收被删除或覆盖的对象占用的pack空间：
+    1、封存进程退出后遗留的写入中的pack文件；
+    2、扫描所有桶表统计每个pack文件被引用的数据量；
+    3、引用数据比例低于阈值的已封存pack文件，其中的对象数据迁移到新的pack文件后标记为退役；
+    4、退役超过等待时间并且没有对象引用的pack文件，删除rados对象和记录
+    '''
+    help = 'Reclaim space of pack files which store small objects'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--live-ratio', default=0.5, dest='live_ratio', type=float,
+            help='Compact sealed pack files whose live data ratio is lower than this value, default 0.5.',
+        )
+        parser.add_argument(
+            '--grace', default=3600, dest='grace', type=int,
+            help='Seconds to wait before deleting retired pack files, in order to finish reading in progress, '
+                 'default 3600.',
+        )
+        parser.add_argument(
+            '--dry-run', default=False, nargs='?', dest='dry_run', const=True,
+            help='Only show the statistics of pack files.',
+        )
+
+    def handle(self, *args, **options):
+        live_ratio = options['live_ratio']
+        grace = options['grace']
+        if not (0 <= live_ratio <= 1) or grace < 0:
+            raise CommandError('Invalid param "live-ratio" or "grace".')
+
+        dry_run = options['dry_run']
+        now = timezone.now()
+        if not dry_run:
+            max_age = get_pack_config().get('PACK_MAX_AGE', 3600)
+            self.seal_stale_packs(created_before=now - timedelta(seconds=max_age + grace))
+
+        refs = self.scan_pack_refs()
+        packs = list(PackFile.objects.filter(status__in=[PackFile.STATUS_SEALED, PackFile.STATUS_RETIRED]).all())
+        for pack in packs:
+            live = sum(length for _, _, length in refs.get(pack.id, []))
+            self.stdout.write(f'pack_{pack.id}: pool={pack.pool_name}, status={pack.get_status_display()}, '
+                              f'size={pack.size}, live={live}, refs={len(refs.get(pack.id, []))}')
+
+        if dry_run:
+            return
+
+        # 刚封存的pack文件可能还有对象正在写入元数据，等待一段时间后再压缩
+        grace_before = now - timedelta(seconds=grace)
+        self._writers = {}
+        relocated = retired = deleted = 0
+        for pack in packs:
+            pack_refs = refs.get(pack.id, [])
+            live = sum(length for _, _, length in pack_refs)
+            if pack.status == PackFile.STATUS_SEALED:
+                if pack.modified_time >= grace_before or (pack_refs and live >= pack.size * live_ratio):
+                    continue
+
+                n, ok = self.relocate_pack(pack=pack, pack_refs=pack_refs)
+                relocated += n
+                if ok:
+                    PackFile.objects.filter(id=pack.id).update(status=PackFile.STATUS_RETIRED, modified_time=timezone.now())
+                    retired += 1
+            else:
+                # 退役的pack文件仍被引用，迁移失败的对象数据重新迁移
+                if pack_refs:
+                    n, _ = self.relocate_pack(pack=pack, pack_refs=pack_refs)
+                    relocated += n
+                    continue
+
+                if pack.modified_time < grace_before and self.delete_pack(pack):
+                    deleted += 1
+
+        # 封存迁移数据写入的pack文件
+        for writer in self._writers.values():
+            writer.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully relocated {relocated} objects, retired {retired} pack files, deleted {deleted} pack files'))
+
+    def seal_stale_packs(self, created_before):
+        '''
+        封存写入进程已退出遗留的写入中的pack文件，大小取rados对象的大小
+        '''
+        for pack in PackFile.objects.filter(status=PackFile.STATUS_OPEN, created_time__lt=created_before).all():
+            ho = HarborObject(pool_name=pack.pool_name, obj_id=PackLayout.build_rados_id(pack.id))
+            ok, ret = ho.get_rados_stat(obj_id=PackLayout.build_rados_id(pack.id))
+            if not ok:
+                self.stdout.write(self.style.ERROR(f'Failed to stat pack_{pack.id}, {ret}'))
+                continue
+
+            size, _ = ret
+            PackFile.objects.filter(id=pack.id, status=PackFile.STATUS_OPEN).update(
+                status=PackFile.STATUS_SEALED, size=size, modified_time=timezone.now())
+            self.stdout.write(self.style.NOTICE(f'Sealed stale pack_{pack.id}, size={size}'))
+
+    def scan_pack_refs(self):
+        '''
+        扫描所有桶(包括已删除归档未清理的桶)的对象，统计pack文件被引用情况
+
+        :return:
+            {pack_id: [(modelclass, obj, length)]}
+        :raises: CommandError   # 有桶表扫描失败时，引用统计不完整，不能回收任何pack文件
+        '''
+        refs = {}
+        buckets = list(Bucket.objects.all()) + list(Archive.objects.all())
+        for bucket in buckets:
+            table_name = bucket.get_bucket_table_name()
+            modelclass = BucketFileManagement(collection_name=table_name).get_obj_model_class()
+            try:
+                objs = modelclass.objects.filter(fod=True, lay__startswith='v2:').only('id', 'si', 'lay').all()
+                for obj in objs:
+                    layout = parse_layout(obj.lay)
+                    refs.setdefault(layout.pack_id, []).append((modelclass, obj, layout.length))
+            except ValueError as e:
+                self.stdout.write(self.style.WARNING(f'Invalid layout in bucket({bucket.name}) table, {str(e)}'))
+            except Exception as e:
+                raise CommandError(f'Failed to scan bucket({bucket.name}) table, {str(e)}')
+
+        return refs
+
+    def relocate_pack(self, pack, pack_refs):
+        '''
+        pack文件中被引用的对象数据迁移到新的pack文件
+
+        :return: (int, bool)
+            迁移的对象数, 是否全部迁移成功
+        '''
+        writer = get_pack_writer(pack.pool_name)
+        self._writers[pack.pool_name] = writer
+
+        ho = HarborObject(pool_name=pack.pool_name, obj_id='')
+        count = 0
+        all_ok = True
+        for modelclass, obj, length in pack_refs:
+            ho.reset_obj_id_and_size(obj_size=length, layout=obj.lay)
+            ok, data = ho.read(offset=0, size=length)
+            if not ok:
+                self.stdout.write(self.style.ERROR(f'Failed to read object(id={obj.id}) in pack_{pack.id}, {data}'))
+                all_ok = False
+                continue
+
+            try:
+                new_layout = writer.append(bytes(data))
+            except RadosError as e:
+                self.stdout.write(self.style.ERROR(f'Failed to write object(id={obj.id}) to new pack, {str(e)}'))
+                all_ok = False
+                continue
+
+            # 对象数据在迁移期间被覆盖或删除时不更新，新pack中的数据作废
+            modelclass.objects.filter(id=obj.id, lay=obj.lay).update(lay=str(new_layout))
+            count += 1
+
+        return count, all_ok
+
+    def delete_pack(self, pack):
+        '''
+        删除退役的pack文件rados对象和记录
+        '''
+        ho = HarborObject(pool_name=pack.pool_name, obj_id=PackLayout.build_rados_id(pack.id))
+        ok, msg = ho.delete(obj_size=max(pack.size, 1))
+        if not ok:
+            self.stdout.write(self.style.ERROR(f'Failed to delete pack_{pack.id}, {msg}'))
+            return False
+
+        pack.delete()
+        return True
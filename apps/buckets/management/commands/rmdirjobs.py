@@ -0,0 +1,128 @@
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+from django.db.models import Q
+from django.core.management.base import BaseCommand, CommandError
+
+from buckets.models import DirDeleteJob
+from api.harbor import HarborManager, get_bulk_delete_conf
+
+
+class Command(BaseCommand):
+    '''
+    执行递归删除目录的后台任务；执行中的任务超过stale-minutes没有更新进度时，视为执行进程已退出，重新执行
+    '''
+    help = 'Run the background jobs of deleting directories recursively'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--job-id', default=None, dest='job_id',
+            help='Only run the job with this id, a failed job will be run again.',
+        )
+        parser.add_argument(
+            '--loop', default=False, nargs='?', dest='loop', const=True,
+            help='Keep polling for new jobs, otherwise exit after the pending jobs are done.',
+        )
+        parser.add_argument(
+            '--interval', default=10, dest='interval', type=int,
+            help='Seconds between polls when looping, default 10.',
+        )
+        parser.add_argument(
+            '--stale-minutes', default=10, dest='stale_minutes', type=int,
+            help='A running job not updated for more than this many minutes is taken over, default 10.',
+        )
+
+    def handle(self, *args, **options):
+        job_id = options['job_id']
+        stale_minutes = options['stale_minutes']
+        if stale_minutes <= 0:
+            raise CommandError('Invalid param "stale-minutes".')
+
+        conf = get_bulk_delete_conf()
+        self._batch_size = conf.get('BATCH_SIZE', 1000)
+        self._max_inflight = conf.get('MAX_INFLIGHT', 32)
+        self._stale = timedelta(minutes=stale_minutes)
+
+        if job_id:
+            job = DirDeleteJob.objects.filter(job_id=job_id).first()
+            if job is None:
+                raise CommandError(f'Job {job_id} not found.')
+            if job.status == DirDeleteJob.STATUS_DONE:
+                raise CommandError(f'Job {job_id} is done.')
+            if not self.claim(job, allow_failed=True):
+                raise CommandError(f'Job {job_id} is running by another worker.')
+
+            self.run_job(job)
+            return
+
+        while True:
+            count = 0
+            while True:
+                job = self.next_job()
+                if job is None:
+                    break
+
+                self.run_job(job)
+                count += 1
+
+            if not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Successfully ran {count} jobs'))
+                break
+
+            time.sleep(max(options['interval'], 1))
+
+    def next_job(self):
+        '''
+        领取一个等待中的任务，或执行进程已退出的任务
+
+        :return:
+            DirDeleteJob() or None
+        '''
+        stale_before = timezone.now() - self._stale
+        jobs = DirDeleteJob.objects.filter(
+            Q(status=DirDeleteJob.STATUS_PENDING) |
+            Q(status=DirDeleteJob.STATUS_RUNNING, modified_time__lt=stale_before)).order_by('id')[:10]
+        for job in jobs:
+            if self.claim(job):
+                return job
+
+        return None
+
+    def claim(self, job, allow_failed: bool = False):
+        '''
+        按任务当前的状态和修改时间更新为执行中，多个执行进程时只有一个能领取成功
+
+        :return: True(领取成功); False
+        '''
+        if job.status == DirDeleteJob.STATUS_RUNNING:
+            if job.modified_time >= timezone.now() - self._stale:
+                return False
+        elif job.status == DirDeleteJob.STATUS_FAILED:
+            if not allow_failed:
+                return False
+        elif job.status != DirDeleteJob.STATUS_PENDING:
+            return False
+
+        now = timezone.now()
+        r = DirDeleteJob.objects.filter(id=job.id, status=job.status, modified_time=job.modified_time).update(
+            status=DirDeleteJob.STATUS_RUNNING, modified_time=now)
+        if r == 0:
+            return False
+
+        job.status = DirDeleteJob.STATUS_RUNNING
+        job.modified_time = now
+        return True
+
+    def run_job(self, job):
+        self.stdout.write(f'{job.job_id}: bucket={job.bucket_name}, path={job.dir_path}, created={job.created_time}')
+        job = HarborManager().run_rmdir_job(job, batch_size=self._batch_size, max_inflight=self._max_inflight)
+        msg = (f'{job.job_id}: {job.get_status_display()}, deleted {job.deleted_objs} objects '
+               f'({job.deleted_size} bytes), {job.deleted_dirs} directories, failed {job.failed_objs} objects')
+        if job.msg:
+            msg += f', {job.msg}'
+
+        if job.status == DirDeleteJob.STATUS_DONE:
+            self.stdout.write(self.style.SUCCESS(msg))
+        else:
+            self.stdout.write(self.style.ERROR(msg))
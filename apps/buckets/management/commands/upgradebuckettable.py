@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+from django.db.backends.mysql.schema import DatabaseSchemaEditor
+
+from buckets.utils import BucketFileManagement
+from buckets.models import Bucket
+
+
+class Command(BaseCommand):
+    '''
+    为已存在的bucket对应的表添加新版本增加的字段，已有的字段跳过，可重复执行；
+    升级部署后、启动服务前必须执行，否则查询未添加字段的桶表会出错
+    '''
+    help = 'Add the columns introduced by newer versions to the existing bucket tables'
+
+    # 新增的字段，按添加顺序
+    NEW_COLUMNS = ('lay', 'inl', 'cidx')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bucket-name', default=None, dest='bucketname',
+            help='Only upgrade the table of the bucket with this name.',
+        )
+        parser.add_argument(
+            '--dry-run', default=False, nargs='?', dest='dry_run', const=True,
+            help='Only show the missing columns of each bucket table.',
+        )
+
+    def handle(self, *args, **options):
+        bucketname = options['bucketname']
+        dry_run = options['dry_run']
+        if bucketname:
+            buckets = Bucket.objects.filter(name=bucketname).all()
+            if not buckets:
+                raise CommandError(f'Bucket {bucketname} not found.')
+        else:
+            buckets = Bucket.objects.all()
+
+        upgraded = 0
+        failed = 0
+        for bucket in buckets:
+            try:
+                columns = self.upgrade_bucket_table(bucket, dry_run=dry_run)
+            except Exception as e:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"error when upgrading table of bucket '{bucket.name}': {str(e)}"))
+                continue
+
+            if columns:
+                upgraded += 1
+                action = 'missing' if dry_run else 'added'
+                self.stdout.write(f"bucket '{bucket.name}': {action} columns {', '.join(columns)}")
+
+        msg = f'Successfully upgraded {upgraded} bucket tables'
+        if failed:
+            self.stdout.write(self.style.ERROR(f'{msg}, failed {failed}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(msg))
+
+    def upgrade_bucket_table(self, bucket, dry_run: bool = False):
+        '''
+        为一个bucket的表添加缺少的字段
+
+        :return:
+            [str, ]     # 缺少(已添加)的字段名
+        '''
+        table_name = bucket.get_bucket_table_name()
+        model_class = BucketFileManagement(collection_name=table_name).get_obj_model_class()
+        using = router.db_for_write(model_class)
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            existing = {c.name for c in connection.introspection.get_table_description(cursor, table_name)}
+
+        missing = [name for name in self.NEW_COLUMNS if name not in existing]
+        if dry_run or not missing:
+            return missing
+
+        with DatabaseSchemaEditor(connection=connection) as schema_editor:
+            for name in missing:
+                schema_editor.add_field(model_class, model_class._meta.get_field(name))
+
+        return missing
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.14 on 2020-10-12 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buckets', '0013_auto_20200902_1011'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackFile',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('pool_name', models.CharField(max_length=32, verbose_name='PoolName')),
+                ('size', models.BigIntegerField(default=0, verbose_name='大小')),
+                ('status', models.SmallIntegerField(choices=[(0, '写入中'), (1, '已封存'), (2, '已退役')], default=0, verbose_name='状态')),
+                ('created_time', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('modified_time', models.DateTimeField(auto_now=True, verbose_name='修改时间')),
+            ],
+            options={
+                'verbose_name': '对象打包文件',
+                'verbose_name_plural': '对象打包文件',
+                'ordering': ['-id'],
+            },
+        ),
+    ]
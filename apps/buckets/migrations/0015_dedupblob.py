@@ -0,0 +1,32 @@
+# Generated by Django 2.2.14 on 2020-10-19 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buckets', '0014_packfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DedupBlob',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('pool_name', models.CharField(max_length=32, verbose_name='PoolName')),
+                ('md5', models.CharField(max_length=32, verbose_name='MD5')),
+                ('size', models.BigIntegerField(verbose_name='大小')),
+                ('blob_key', models.CharField(max_length=64, unique=True, verbose_name='rados key')),
+                ('lay', models.CharField(default='', max_length=64, verbose_name='数据布局')),
+                ('refs', models.IntegerField(default=0, verbose_name='引用数')),
+                ('created_time', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '去重数据块',
+                'verbose_name_plural': '去重数据块',
+                'ordering': ['-id'],
+                'unique_together': {('pool_name', 'md5', 'size')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.14 on 2020-10-23 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buckets', '0015_dedupblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bucket',
+            name='compress',
+            field=models.CharField(blank=True, default='', max_length=16, verbose_name='数据压缩'),
+        ),
+    ]
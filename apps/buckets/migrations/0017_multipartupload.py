@@ -0,0 +1,55 @@
+# Generated by Django 2.2.14 on 2020-10-28 10:05
+
+import buckets.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('buckets', '0016_bucket_compress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MultipartUpload',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('upload_id', models.CharField(default=buckets.models.get_uuid1_hex_string, max_length=32, unique=True, verbose_name='上传ID')),
+                ('bucket_id', models.BigIntegerField(verbose_name='存储桶ID')),
+                ('bucket_name', models.CharField(max_length=63, verbose_name='存储桶名称')),
+                ('pool_name', models.CharField(max_length=32, verbose_name='PoolName')),
+                ('obj_path', models.TextField(verbose_name='对象全路径')),
+                ('part_size', models.BigIntegerField(verbose_name='分片大小')),
+                ('lay', models.CharField(default='', max_length=64, verbose_name='数据布局')),
+                ('status', models.SmallIntegerField(choices=[(0, '上传中'), (1, '完成中'), (2, '取消中')], default=0, verbose_name='状态')),
+                ('created_time', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='用户')),
+            ],
+            options={
+                'verbose_name': '分片上传',
+                'verbose_name_plural': '分片上传',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MultipartPart',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('part_num', models.IntegerField(verbose_name='分片编号')),
+                ('size', models.BigIntegerField(default=-1, verbose_name='大小')),
+                ('md5', models.CharField(default='', max_length=32, verbose_name='MD5')),
+                ('modified_time', models.DateTimeField(auto_now=True, verbose_name='修改时间')),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parts', to='buckets.MultipartUpload', verbose_name='分片上传')),
+            ],
+            options={
+                'verbose_name': '上传分片',
+                'verbose_name_plural': '上传分片',
+                'ordering': ['part_num'],
+                'unique_together': {('upload', 'part_num')},
+            },
+        ),
+    ]
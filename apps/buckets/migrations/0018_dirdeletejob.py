@@ -0,0 +1,42 @@
+# Generated by Django 2.2.14 on 2020-11-05 15:20
+
+import buckets.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('buckets', '0017_multipartupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirDeleteJob',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('job_id', models.CharField(default=buckets.models.get_uuid1_hex_string, max_length=32, unique=True, verbose_name='任务ID')),
+                ('bucket_id', models.BigIntegerField(verbose_name='存储桶ID')),
+                ('bucket_name', models.CharField(max_length=63, verbose_name='存储桶名称')),
+                ('dir_id', models.BigIntegerField(verbose_name='目录ID')),
+                ('dir_path', models.TextField(verbose_name='目录全路径')),
+                ('status', models.SmallIntegerField(choices=[(0, '等待中'), (1, '执行中'), (2, '完成'), (3, '失败')], default=0, verbose_name='状态')),
+                ('deleted_objs', models.BigIntegerField(default=0, verbose_name='已删除对象数')),
+                ('deleted_dirs', models.BigIntegerField(default=0, verbose_name='已删除目录数')),
+                ('deleted_size', models.BigIntegerField(default=0, verbose_name='已删除对象大小')),
+                ('failed_objs', models.BigIntegerField(default=0, verbose_name='删除失败对象数')),
+                ('msg', models.CharField(default='', max_length=255, verbose_name='信息')),
+                ('created_time', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('modified_time', models.DateTimeField(auto_now=True, verbose_name='修改时间')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='用户')),
+            ],
+            options={
+                'verbose_name': '目录删除任务',
+                'verbose_name_plural': '目录删除任务',
+                'ordering': ['-id'],
+            },
+        ),
+    ]
@@ -81,6 +81,7 @@ class Bucket(BucketBase):
     collection_name = models.CharField(max_length=50, default='', blank=True, verbose_name='存储桶对应的表名')
     modified_time = models.DateTimeField(auto_now=True, verbose_name='修改时间')
     remarks = models.CharField(verbose_name='备注', max_length=255, default='')
+    compress = models.CharField(verbose_name='数据压缩', max_length=16, default='', blank=True)  # 压缩算法，空字符串不压缩
 
     class Meta:
         ordering = ['-id']
@@ -360,6 +361,23 @@ class Bucket(BucketBase):
 
         return True
 
+    def set_compress(self, codec: str):
+        """
+        设置桶上传对象数据的压缩算法，只影响之后上传的对象
+
+        :param codec: 压缩算法，见utils.oss.compress.CODECS；空字符串不压缩
+        :return:
+            True    # 设置成功
+            False   # 设置失败
+        """
+        self.compress = codec
+        try:
+            self.save(update_fields=['compress', 'modified_time'])
+        except Exception as e:
+            return False
+
+        return True
+
 
 class Archive(BucketBase):
     '''
@@ -450,6 +468,204 @@ class ApiUsageDescription(models.Model):
         return f'<UsageDescription>{self.title}'
 
 
+class PackFile(models.Model):
+    '''
+    小对象打包的pack文件(rados对象)，见utils.oss.pyrados.PackLayout
+
+    每个进程在每个pool各自追加写入一个打开的pack文件，写满或打开时间超过上限后封存，封存的pack文件由压缩任务回收空间；
+    压缩后不再被引用的pack文件先标记为退役，过一段时间(等待正在进行的读取完成)后再删除rados对象
+    '''
+    STATUS_OPEN = 0
+    STATUS_SEALED = 1
+    STATUS_RETIRED = 2
+    STATUS_CHOICES = (
+        (STATUS_OPEN, '写入中'),
+        (STATUS_SEALED, '已封存'),
+        (STATUS_RETIRED, '已退役'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    pool_name = models.CharField(verbose_name='PoolName', max_length=32)
+    size = models.BigIntegerField(verbose_name='大小', default=0)    # 封存时的大小，写入中时为0
+    status = models.SmallIntegerField(verbose_name='状态', choices=STATUS_CHOICES, default=STATUS_OPEN)
+    created_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    modified_time = models.DateTimeField(auto_now=True, verbose_name='修改时间')
+
+    class Meta:
+        ordering = ['-id']
+        verbose_name = '对象打包文件'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f'pack_{self.id}'
+
+    def __repr__(self):
+        return f'<PackFile>pack_{self.id}'
+
+
+class DedupBlob(models.Model):
+    '''
+    去重共享的对象数据块，见utils.oss.pyrados.DedupLayout
+
+    blob是首个上传此数据的对象复制到独立rados key的数据，同一pool中MD5和大小相同的对象共享一个blob，
+    refs为引用blob的对象数，引用数减为0时删除blob的rados数据和记录
+    '''
+    id = models.BigAutoField(primary_key=True)
+    pool_name = models.CharField(verbose_name='PoolName', max_length=32)
+    md5 = models.CharField(verbose_name='MD5', max_length=32)
+    size = models.BigIntegerField(verbose_name='大小')
+    blob_key = models.CharField(verbose_name='rados key', max_length=64, unique=True)
+    lay = models.CharField(verbose_name='数据布局', max_length=64, default='')   # blob的数据布局，空字符串为旧布局
+    refs = models.IntegerField(verbose_name='引用数', default=0)
+    created_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+
+    class Meta:
+        ordering = ['-id']
+        verbose_name = '去重数据块'
+        verbose_name_plural = verbose_name
+        unique_together = ('pool_name', 'md5', 'size')
+
+    def __str__(self):
+        return self.blob_key
+
+    def __repr__(self):
+        return f'<DedupBlob>{self.blob_key}'
+
+
+class MultipartUpload(models.Model):
+    '''
+    分片(multipart)上传会话，见api.harbor.HarborManager.complete_multipart_upload
+
+    初始化时确定分片大小part_size，分片编号从1开始，第N个分片的数据直接写入上传数据(rados对象key为data_key)的
+    偏移量(N - 1) * part_size处，可多个连接并行上传；完成时对象元数据一次提交，对象数据布局为RelocatedLayout，
+    直接使用上传数据，不需要复制；取消上传时删除上传数据和记录
+    '''
+    STATUS_UPLOADING = 0
+    STATUS_COMPLETING = 1
+    STATUS_ABORTING = 2
+    STATUS_CHOICES = (
+        (STATUS_UPLOADING, '上传中'),
+        (STATUS_COMPLETING, '完成中'),
+        (STATUS_ABORTING, '取消中'),
+    )
+
+    MIN_PART_SIZE = 1024 ** 2           # 1MB
+    MAX_PART_SIZE = 5 * 1024 ** 3       # 5GB
+    MAX_PART_NUM = 10000
+
+    id = models.BigAutoField(primary_key=True)
+    upload_id = models.CharField(verbose_name='上传ID', max_length=32, unique=True, default=get_uuid1_hex_string)
+    user = models.ForeignKey(to=User, null=True, on_delete=models.SET_NULL, verbose_name='用户')
+    bucket_id = models.BigIntegerField(verbose_name='存储桶ID')
+    bucket_name = models.CharField(verbose_name='存储桶名称', max_length=63)
+    pool_name = models.CharField(verbose_name='PoolName', max_length=32)
+    obj_path = models.TextField(verbose_name='对象全路径')
+    part_size = models.BigIntegerField(verbose_name='分片大小')
+    lay = models.CharField(verbose_name='数据布局', max_length=64, default='')   # 上传数据的布局，空字符串为旧布局
+    status = models.SmallIntegerField(verbose_name='状态', choices=STATUS_CHOICES, default=STATUS_UPLOADING)
+    created_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+
+    class Meta:
+        ordering = ['-id']
+        verbose_name = '分片上传'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return self.upload_id
+
+    def __repr__(self):
+        return f'<MultipartUpload>{self.upload_id}'
+
+    @property
+    def data_key(self):
+        '''
+        上传数据的rados对象key，由随机的upload_id构造；完成上传后对象的数据布局引用此key，
+        不能使用自增id，数据库重启后自增id可能重复使用，新的上传会写入或删除已完成对象的数据
+        '''
+        return f'm_{self.upload_id}'
+
+    def part_offset(self, part_num: int):
+        '''分片数据在上传数据中的偏移量'''
+        return (part_num - 1) * self.part_size
+
+
+class MultipartPart(models.Model):
+    '''
+    分片上传的一个分片，size < 0 表示分片正在上传
+    '''
+    id = models.BigAutoField(primary_key=True)
+    upload = models.ForeignKey(to=MultipartUpload, on_delete=models.CASCADE, related_name='parts',
+                               verbose_name='分片上传')
+    part_num = models.IntegerField(verbose_name='分片编号')
+    size = models.BigIntegerField(verbose_name='大小', default=-1)
+    md5 = models.CharField(verbose_name='MD5', max_length=32, default='')
+    modified_time = models.DateTimeField(auto_now=True, verbose_name='修改时间')
+
+    class Meta:
+        ordering = ['part_num']
+        verbose_name = '上传分片'
+        verbose_name_plural = verbose_name
+        unique_together = ('upload', 'part_num')
+
+    def is_uploading(self):
+        return self.size < 0
+
+
+class DirDeleteJob(models.Model):
+    '''
+    递归删除目录的后台任务，见api.harbor.HarborManager.rmdir_recursive和run_rmdir_job
+
+    提交时目录子树所有元数据标记为删除(sds)，查找对象和目录时忽略标记的元数据，目录从父目录中摘除(did设为目录id的负数)，
+    可以立即创建同名目录；任务由manage.py rmdirjobs执行，自底向上按批删除对象(元数据和rados数据)和目录，
+    进度记录在任务中；删除的依据是元数据的删除标记，执行中断后重新执行任务即可继续
+    '''
+    STATUS_PENDING = 0
+    STATUS_RUNNING = 1
+    STATUS_DONE = 2
+    STATUS_FAILED = 3
+    STATUS_CHOICES = (
+        (STATUS_PENDING, '等待中'),
+        (STATUS_RUNNING, '执行中'),
+        (STATUS_DONE, '完成'),
+        (STATUS_FAILED, '失败'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    job_id = models.CharField(verbose_name='任务ID', max_length=32, unique=True, default=get_uuid1_hex_string)
+    user = models.ForeignKey(to=User, null=True, on_delete=models.SET_NULL, verbose_name='用户')
+    bucket_id = models.BigIntegerField(verbose_name='存储桶ID')
+    bucket_name = models.CharField(verbose_name='存储桶名称', max_length=63)
+    dir_id = models.BigIntegerField(verbose_name='目录ID')
+    dir_path = models.TextField(verbose_name='目录全路径')
+    status = models.SmallIntegerField(verbose_name='状态', choices=STATUS_CHOICES, default=STATUS_PENDING)
+    deleted_objs = models.BigIntegerField(verbose_name='已删除对象数', default=0)
+    deleted_dirs = models.BigIntegerField(verbose_name='已删除目录数', default=0)
+    deleted_size = models.BigIntegerField(verbose_name='已删除对象大小', default=0)
+    failed_objs = models.BigIntegerField(verbose_name='删除失败对象数', default=0)
+    msg = models.CharField(verbose_name='信息', max_length=255, default='')
+    created_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    modified_time = models.DateTimeField(auto_now=True, verbose_name='修改时间')    # 执行中时为心跳时间
+
+    class Meta:
+        ordering = ['-id']
+        verbose_name = '目录删除任务'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return self.job_id
+
+    def __repr__(self):
+        return f'<DirDeleteJob>{self.job_id}'
+
+    @property
+    def prefix(self):
+        '''目录子树中元数据全路径的前缀'''
+        return self.dir_path + '/'
+
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+
 SHARE_ACCESS_NO = 0
 SHARE_ACCESS_READONLY = 1
 SHARE_ACCESS_READWRITE = 2
@@ -472,12 +688,21 @@ class BucketFileBase(models.Model):
     @ sst: share_start_time，允许共享且有时间限制，则sst为该文件的共享起始时间，若该doc代表目录，则sst为空;
     @ set: share_end_time，  允许共享且有时间限制，则set为该文件的共享终止时间，若该doc代表目录，则set为空;
     @ sds: soft delete status,软删除,True->删除状态，get_sds_display()可获取可读值
+    @ lay: layout，对象数据在rados中的布局，空字符串为旧布局(按2GB分part)，'v1:...'为条带布局，'v2:...'打包，'v3:...'去重，
+                'v4:...'分块压缩，见utils.oss.pyrados.parse_layout;
+    @ inl: inline data，小对象内联存储在元数据中的数据，不为NULL时对象数据不在rados中，见settings.INLINE_OBJECT_MAX_SIZE;
+    @ cidx: compression index，分块压缩的对象的压缩块索引，见utils.oss.compress.BlockIndex，未压缩的对象为NULL;
+
+    lay、inl、cidx是新增的字段，升级部署后、启动服务前必须为已存在的桶表添加这些字段，否则查询桶表会出错：
+                manage.py upgradebuckettable
     '''
     SOFT_DELETE_STATUS_CHOICES = (
         (True, '删除'),
         (False, '正常'),
     )
 
+    NA_MD5_MOVING = 'moving'    # 目录移动中，目录子树改写全路径时目录的na_md5临时设为此值，按路径查找不到
+
     SHARE_ACCESS_NO = SHARE_ACCESS_NO
     SHARE_ACCESS_READONLY = SHARE_ACCESS_READONLY
     SHARE_ACCESS_READWRITE = SHARE_ACCESS_READWRITE
@@ -504,6 +729,9 @@ class BucketFileBase(models.Model):
     sds = models.BooleanField(default=False, choices=SOFT_DELETE_STATUS_CHOICES) # soft delete status,软删除,True->删除状态
     md5 = models.CharField(default='', max_length=32, verbose_name='md5')  # 该文件的md5码，32位十六进制字符串
     share = models.SmallIntegerField(verbose_name='分享访问权限', choices=SHARE_ACCESS_CHOICES, default=SHARE_ACCESS_NO)
+    lay = models.CharField(default='', max_length=64, verbose_name='数据布局')  # 对象数据布局，空字符串为旧布局
+    inl = models.BinaryField(null=True, blank=True, default=None, verbose_name='内联数据')  # 小对象数据，None: 数据在rados中
+    cidx = models.BinaryField(null=True, blank=True, default=None, verbose_name='压缩块索引')  # None: 数据未压缩
 
     class Meta:
         abstract = True
@@ -0,0 +1,142 @@
+import os
+import time
+import threading
+
+from django.conf import settings
+
+from utils.oss.pyrados import HarborObject, PackLayout, RadosError
+from utils.oss.connections import register_reset_callback
+from .models import PackFile
+
+
+def get_pack_config():
+    '''
+    小对象打包配置，settings.CEPH_RADOS['PACK']
+
+    :return: dict
+    '''
+    conf = settings.CEPH_RADOS.get('PACK', None)
+    return conf if conf else {}
+
+
+def get_pack_max_object_size():
+    '''
+    打包存储的对象大小上限，0不打包
+    '''
+    conf = get_pack_config()
+    if not conf.get('ENABLE', False):
+        return 0
+
+    return conf.get('MAX_OBJECT_SIZE', 1024 ** 2)
+
+
+class PackWriter:
+    '''
+    一个pool的pack文件追加写入器，进程内共享；
+    在锁内分配写入偏移量，在锁外写入数据，多线程可并行写入同一个pack文件
+    '''
+    def __init__(self, pool_name: str, pack_size: int, max_age: int):
+        self.pool_name = pool_name
+        self.pack_size = pack_size
+        self.max_age = max_age
+        self._pack = None
+        self._offset = 0
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _seal(self):
+        if self._pack is None:
+            return
+
+        PackFile.objects.filter(id=self._pack.id).update(status=PackFile.STATUS_SEALED, size=self._offset)
+        self._pack = None
+        self._offset = 0
+
+    def _rotate(self):
+        self._seal()
+        self._pack = PackFile.objects.create(pool_name=self.pool_name)
+        self._offset = 0
+        self._opened = time.time()
+
+    def append(self, data: bytes):
+        '''
+        追加写入一个小对象的数据
+
+        :return:
+            PackLayout()
+        :raises: class:`RadosError`
+        '''
+        size = len(data)
+        with self._lock:
+            if (self._pack is None or self._offset + size > self.pack_size or
+                    time.time() - self._opened > self.max_age):
+                try:
+                    self._rotate()
+                except Exception as e:
+                    raise RadosError(f'failed to create pack file, {str(e)}')
+
+            pack_id = self._pack.id
+            offset = self._offset
+            self._offset += size
+
+        ho = HarborObject(pool_name=self.pool_name, obj_id=PackLayout.build_rados_id(pack_id))
+        ok, msg = ho.write(data_block=data, offset=offset)
+        if not ok:
+            raise RadosError(f'failed to write pack file, {msg}')
+
+        return PackLayout(pack_id=pack_id, offset=offset, length=size)
+
+    def close(self):
+        with self._lock:
+            self._seal()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+_writers_pid = os.getpid()
+
+
+def get_pack_writer(pool_name: str):
+    '''
+    获取进程内共享的pool pack文件写入器，fork后的子进程不能继续写入父进程打开的pack文件
+    '''
+    if _writers_pid != os.getpid():
+        reset_pack_writers()
+
+    writer = _writers.get(pool_name, None)
+    if writer is not None:
+        return writer
+
+    conf = get_pack_config()
+    with _writers_lock:
+        writer = _writers.get(pool_name, None)
+        if writer is None:
+            writer = PackWriter(pool_name=pool_name, pack_size=conf.get('PACK_SIZE', 64 * 1024 ** 2),
+                                max_age=conf.get('PACK_MAX_AGE', 3600))
+            _writers[pool_name] = writer
+
+    return writer
+
+
+def reset_pack_writers():
+    '''
+    fork后子进程中丢弃继承的写入器，父进程打开的pack文件由父进程继续写入
+    '''
+    global _writers, _writers_lock, _writers_pid
+    _writers = {}
+    _writers_lock = threading.Lock()
+    _writers_pid = os.getpid()
+
+
+register_reset_callback(reset_pack_writers)
+
+
+def append_to_pack(pool_name: str, data: bytes):
+    '''
+    小对象数据打包写入pool的pack文件
+
+    :return:
+        PackLayout()
+    :raises: class:`RadosError`
+    '''
+    return get_pack_writer(pool_name).append(data)
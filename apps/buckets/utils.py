@@ -208,11 +208,12 @@ class BucketFileManagement:
 
         model_class = self.get_obj_model_class()
         try:
+            # 列举时不加载内联数据
             if dir_id:
-                files = model_class.objects.filter(did=dir_id).all()
+                files = model_class.objects.filter(did=dir_id).defer('inl', 'cidx').all()
             else:
                 #存储桶下文件目录,did=0表示是存储桶下的文件目录
-                files = model_class.objects.filter(did=self.ROOT_DIR_ID).all()
+                files = model_class.objects.filter(did=self.ROOT_DIR_ID).defer('inl', 'cidx').all()
         except Exception as e:
             logger.error('In get_cur_dir_files:' + str(e))
             return False, None
@@ -366,7 +367,7 @@ class BucketFileManagement:
 
     def get_obj(self, path:str):
         '''
-        获取目录或对象
+        获取目录或对象，忽略标记为删除的(递归删除中的目录子树)；移动中的目录na_md5为NA_MD5_MOVING，也查找不到
 
         :param path: 目录或对象路径
         :return:
@@ -378,7 +379,7 @@ class BucketFileManagement:
         na_md5 = get_str_hexMD5(path)
         model_class = self.get_obj_model_class()
         try:
-            obj = model_class.objects.get(Q(na_md5=na_md5) | Q(na_md5__isnull=True), na=path)
+            obj = model_class.objects.get(Q(na_md5=na_md5) | Q(na_md5__isnull=True), na=path, sds=False)
         except model_class.DoesNotExist as e:
             return None
         except MultipleObjectsReturned as e:
@@ -10,6 +10,7 @@ router = DefaultRouter(trailing_slash=False)
 router.register(r'obs', views.ObsViewSet, base_name='obs')
 router.register(r'list', views.ShareDirViewSet, base_name='list')
 router.register(r'sd', views.ShareDownloadViewSet, base_name='download')
+router.register(r'export', views.ShareDirExportViewSet, base_name='export')
 
 
 urlpatterns = [
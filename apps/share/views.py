@@ -1,10 +1,8 @@
-import re
 from collections import OrderedDict
 
 from django.shortcuts import render, redirect
 from django.views import View
-from django.http import FileResponse, QueryDict
-from django.utils.http import urlquote
+from django.http import QueryDict
 from django.contrib.auth.models import AnonymousUser
 from django.utils.translation import gettext as _
 from django.utils.translation import gettext_lazy
@@ -24,6 +22,8 @@ from utils.jwt_token import JWTokenTool2, InvalidToken
 from utils.view import CustomGenericViewSet
 from . import serializers
 from api.harbor import HarborError, HarborManager
+from api.downloads import build_download_response
+from api.archives import build_dir_archive_response
 from .forms import SharePasswordForm
 
 
@@ -40,7 +40,8 @@ class ObsViewSet(viewsets.GenericViewSet):
     retrieve:
     浏览器端下载文件对象，公共文件对象或当前用户(如果用户登录了)文件对象下载，没有权限下载非公共文件对象或不属于当前用户文件对象
 
-        * 支持断点续传，通过HTTP头 Range和Content-Range
+        * 支持断点续传，通过HTTP头 Range和Content-Range，支持多个范围(响应multipart/byteranges)、后缀范围和If-Range
+        * 响应带ETag、Last-Modified和Cache-Control，支持条件请求If-None-Match和If-Modified-Since，未修改时返回304
         * 跨域访问和安全
             跨域又需要传递token进行权限认证，我们推荐token通过header传递，不推荐在url中传递token,处理不当会增加token泄露等安全问题的风险。
             我们支持token通过url参数传递，auth-token和jwt token两种token对应参数名称分别为token和jwt。出于安全考虑，请不要直接把token明文写到前端<a>标签href属性中，以防token泄密。请动态拼接token到url，比如如下方式：
@@ -58,10 +59,12 @@ class ObsViewSet(viewsets.GenericViewSet):
         >>Http Code: 状态码206 Partial Content：
                 返回FileResponse对象,bytes数据流；
 
+        >>Http Code: 状态码304 Not Modified：对象未修改，没有响应体；
+
         >>Http Code: 状态码416 Requested Range Not Satisfiable:
             {
                 'code': 416,
-                'code_text': 'Header Ranges is invalid'
+                'code_text': 'Header Range is invalid'
             }
 
         >>Http Code: 状态码400：文件路径参数有误：对应参数错误信息;
@@ -126,33 +129,7 @@ class ObsViewSet(viewsets.GenericViewSet):
         except InvalidError as e:
             return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
 
-        filesize = fileobj.si
-        filename = fileobj.name
-        # 是否是断点续传部分读取
-        ranges = request.headers.get('range')
-        if ranges:
-            try:
-                offset, end = self.get_offset_and_end(ranges, filesize=filesize)
-            except InvalidError as e:
-                return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
-
-            generator = hManager._get_obj_generator(bucket=bucket, obj=fileobj, offset=offset, end=end)
-            response = FileResponse(generator, status=status.HTTP_206_PARTIAL_CONTENT)
-            response['Content-Ranges'] = f'bytes {offset}-{end}/{filesize}'
-            response['Content-Length'] = end - offset + 1
-        else:
-            generator = hManager._get_obj_generator(bucket=bucket, obj=fileobj)
-            response = FileResponse(generator)
-            response['Content-Length'] = filesize
-
-            # 增加一次下载次数
-            fileobj.download_cound_increase()
-
-        filename = urlquote(filename)  # 中文文件名需要
-        response['Accept-Ranges'] = 'bytes'  # 接受类型，支持断点续传
-        response['Content-Type'] = 'application/octet-stream'  # 注意格式
-        response['Content-Disposition'] = f"attachment;filename*=utf-8''{filename}"  # 注意filename 这个是下载后的名字
-        return response
+        return build_download_response(request=request, bucket=bucket, obj=fileobj)
 
     def get_serializer(self, *args, **kwargs):
         """
@@ -173,55 +150,6 @@ class ObsViewSet(viewsets.GenericViewSet):
         """
         return Serializer
 
-    def get_offset_and_end(self, hRange:str, filesize:int):
-        '''
-        获取读取开始偏移量和结束偏移量
-
-        :param hRange: range Header
-        :param filesize: 对象大小
-        :return:
-            (offset:int, end:int)
-
-        :raise InvalidError
-        '''
-        start, end = self.parse_header_ranges(hRange)
-        # 无法解析header ranges,返回整个对象
-        if start is None and end is None:
-            raise InvalidError(code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, msg='Header Ranges is invalid')
-
-        # 读最后end个字节
-        if (start is None) and isinstance(end, int):
-            offset = max(filesize - end, 0)
-            end = filesize - 1
-        else:
-            offset = start
-            if end is None:
-                end = filesize - 1
-            else:
-                end = min(end, filesize - 1)
-
-        return offset, end
-
-    def parse_header_ranges(self, ranges):
-        '''
-        parse Range header string
-
-        :param ranges: 'bytes={start}-{end}'  下载第M－N字节范围的内容
-        :return: (M, N)
-            start: int or None
-            end: int or None
-        '''
-        m = re.match(r'bytes=(\d*)-(\d*)', ranges)
-        if not m:
-            return None, None
-        items = m.groups()
-
-        start = int(items[0]) if items[0] else None
-        end = int(items[1]) if items[1] else None
-        if isinstance(start, int) and isinstance(end, int) and start > end:
-            return None, None
-        return start, end
-
     def has_access_permission(self, request, bucket, obj):
         '''
         当前已认证用户或未认证用户是否有访问对象的权限
@@ -321,7 +249,8 @@ class ShareDownloadViewSet(CustomGenericViewSet):
     retrieve:
     下载分享的目录下载的文件对象
 
-        * 支持断点续传，通过HTTP头 Range和Content-Range
+        * 支持断点续传，通过HTTP头 Range和Content-Range，支持多个范围(响应multipart/byteranges)、后缀范围和If-Range
+        * 响应带ETag、Last-Modified和Cache-Control，支持条件请求If-None-Match和If-Modified-Since，未修改时返回304
 
         >>Http Code: 状态码200：
                 返回FileResponse对象,bytes数据流；
@@ -329,10 +258,12 @@ class ShareDownloadViewSet(CustomGenericViewSet):
         >>Http Code: 状态码206 Partial Content：
                 返回FileResponse对象,bytes数据流；
 
+        >>Http Code: 状态码304 Not Modified：对象未修改，没有响应体；
+
         >>Http Code: 状态码416 Requested Range Not Satisfiable:
             {
                 'code': 416,
-                'code_text': 'Header Ranges is invalid'
+                'code_text': 'Header Range is invalid'
             }
 
         >>Http Code: 状态码400：文件路径参数有误：对应参数错误信息;
@@ -411,33 +342,7 @@ class ShareDownloadViewSet(CustomGenericViewSet):
         except InvalidError as e:
             return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
 
-        filesize = fileobj.si
-        filename = fileobj.name
-        # 是否是断点续传部分读取
-        ranges = request.headers.get('range')
-        if ranges:
-            try:
-                offset, end = self.get_offset_and_end(ranges, filesize=filesize)
-            except InvalidError as e:
-                return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
-
-            generator = hManager._get_obj_generator(bucket=bucket, obj=fileobj, offset=offset, end=end)
-            response = FileResponse(generator, status=status.HTTP_206_PARTIAL_CONTENT)
-            response['Content-Ranges'] = f'bytes {offset}-{end}/{filesize}'
-            response['Content-Length'] = end - offset + 1
-        else:
-            generator = hManager._get_obj_generator(bucket=bucket, obj=fileobj)
-            response = FileResponse(generator)
-            response['Content-Length'] = filesize
-
-            # 增加一次下载次数
-            fileobj.download_cound_increase()
-
-        filename = urlquote(filename)  # 中文文件名需要
-        response['Accept-Ranges'] = 'bytes'  # 接受类型，支持断点续传
-        response['Content-Type'] = 'application/octet-stream'  # 注意格式
-        response['Content-Disposition'] = f"attachment;filename*=utf-8''{filename}"  # 注意filename 这个是下载后的名字
-        return response
+        return build_download_response(request=request, bucket=bucket, obj=fileobj)
 
     def get_serializer(self, *args, **kwargs):
         """
@@ -458,55 +363,6 @@ class ShareDownloadViewSet(CustomGenericViewSet):
         """
         return Serializer
 
-    def get_offset_and_end(self, hRange:str, filesize:int):
-        '''
-        获取读取开始偏移量和结束偏移量
-
-        :param hRange: range Header
-        :param filesize: 对象大小
-        :return:
-            (offset:int, end:int)
-
-        :raise InvalidError
-        '''
-        start, end = self.parse_header_ranges(hRange)
-        # 无法解析header ranges,返回整个对象
-        if start is None and end is None:
-            InvalidError(code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, msg='Header Ranges is invalid')
-
-        # 读最后end个字节
-        if (start is None) and isinstance(end, int):
-            offset = max(filesize - end, 0)
-            end = filesize - 1
-        else:
-            offset = start
-            if end is None:
-                end = filesize - 1
-            else:
-                end = min(end, filesize - 1)
-
-        return offset, end
-
-    def parse_header_ranges(self, ranges):
-        '''
-        parse Range header string
-
-        :param ranges: 'bytes={start}-{end}'  下载第M－N字节范围的内容
-        :return: (M, N)
-            start: int or None
-            end: int or None
-        '''
-        m = re.match(r'bytes=(\d*)-(\d*)', ranges)
-        if not m:
-            return None, None
-        items = m.groups()
-
-        start = int(items[0]) if items[0] else None
-        end = int(items[1]) if items[1] else None
-        if isinstance(start, int) and isinstance(end, int) and start > end:
-            return None, None
-        return start, end
-
     def has_access_permission(self, request, bucket, base_dir:str):
         '''
         是否有访问对象的权限
@@ -612,54 +468,13 @@ class ShareDirViewSet(CustomGenericViewSet):
         subpath = request.query_params.get('subpath', '')
         share_code = request.query_params.get('p', None)
 
-        pp = PathParser(filepath=share_base)
-        bucket_name, dir_base = pp.get_bucket_and_dirpath()
-        if not bucket_name:
-            return Response(data={'code': 400, 'code_text': _('分享路径无效')}, status=status.HTTP_400_BAD_REQUEST)
-
-        # 存储桶验证和获取桶对象
-        hManager = HarborManager()
         try:
-            bucket = hManager.get_bucket(bucket_name=bucket_name)
-            if not bucket:
-                return Response(data={'code': 404, 'code_text': _('存储桶不存在')}, status=status.HTTP_404_NOT_FOUND)
-
-            if dir_base:
-                base_obj = hManager.get_metadata_obj(table_name=bucket.get_bucket_table_name(), path=dir_base)
-                if not base_obj:
-                    return Response(data={'code': 404, 'code_text': _('分享根目录不存在')}, status=status.HTTP_404_NOT_FOUND)
-            else:
-                base_obj = None
-
-            # 是否有文件对象的访问权限
-            if not self.has_access_permission(bucket=bucket, base_dir_obj=base_obj):
-                return Response(data={'code': 403, 'code_text': _('您没有访问权限')}, status=status.HTTP_403_FORBIDDEN)
-
-            # 分享根路径存在，检查分享密码
-            if base_obj and base_obj.has_share_password():
-                if (share_code is None) or (not base_obj.check_share_password(password=share_code)):
-                    return Response(data={'code': 401, 'code_text': _('共享密码无效')}, status=status.HTTP_401_UNAUTHORIZED)
-
-            if subpath: # 是否list子目录
-                if dir_base:
-                    sub_path = f'{dir_base}/{subpath}'
-                else:
-                    sub_path = subpath
-                sub_obj = hManager.get_metadata_obj(table_name=bucket.get_bucket_table_name(), path=sub_path)
-                if not sub_obj or (sub_obj and sub_obj.is_file()):
-                    return Response(data={'code': 404, 'msg': _('子目录不存在')}, status=status.HTTP_404_NOT_FOUND)
-            else:
-                sub_obj = None
+            bucket, dir_obj = self.get_share_dir(request, share_base=share_base)
         except HarborError as e:
             return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
 
-        if sub_obj:
-            list_dir_id = sub_obj.id
-        elif base_obj:
-            list_dir_id = base_obj.id
-        else:
-            list_dir_id = BucketFileManagement.ROOT_DIR_ID
-
+        bucket_name = bucket.name
+        list_dir_id = dir_obj.id if dir_obj else BucketFileManagement.ROOT_DIR_ID
         collection_name = bucket.get_bucket_table_name()
         bfm = BucketFileManagement(collection_name=collection_name)
         ok, files = bfm.get_cur_dir_files(cur_dir_id=list_dir_id)
@@ -690,6 +505,55 @@ class ShareDirViewSet(CustomGenericViewSet):
         """
         return serializers.ShareObjInfoSerializer
 
+    def get_share_dir(self, request, share_base: str):
+        '''
+        解析分享路径，验证访问权限和分享密码，获取要访问的分享目录，或其下参数subpath指定的子目录
+
+        :param share_base: 分享根目录,以存储桶名称开头的目录的绝对路径
+        :return:
+            (bucket, dir_obj)   # dir_obj为None时是分享的存储桶根目录
+        :raises: HarborError
+        '''
+        subpath = request.query_params.get('subpath', '')
+        share_code = request.query_params.get('p', None)
+
+        pp = PathParser(filepath=share_base)
+        bucket_name, dir_base = pp.get_bucket_and_dirpath()
+        if not bucket_name:
+            raise HarborError(code=status.HTTP_400_BAD_REQUEST, msg=_('分享路径无效'))
+
+        # 存储桶验证和获取桶对象
+        hManager = HarborManager()
+        bucket = hManager.get_bucket(bucket_name=bucket_name)
+        if not bucket:
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg=_('存储桶不存在'))
+
+        if dir_base:
+            base_obj = hManager.get_metadata_obj(table_name=bucket.get_bucket_table_name(), path=dir_base)
+            if not base_obj or not base_obj.is_dir():
+                raise HarborError(code=status.HTTP_404_NOT_FOUND, msg=_('分享根目录不存在'))
+        else:
+            base_obj = None
+
+        # 是否有文件对象的访问权限
+        if not self.has_access_permission(bucket=bucket, base_dir_obj=base_obj):
+            raise HarborError(code=status.HTTP_403_FORBIDDEN, msg=_('您没有访问权限'))
+
+        # 分享根路径存在，检查分享密码
+        if base_obj and base_obj.has_share_password():
+            if (share_code is None) or (not base_obj.check_share_password(password=share_code)):
+                raise HarborError(code=status.HTTP_401_UNAUTHORIZED, msg=_('共享密码无效'))
+
+        if not subpath:
+            return bucket, base_obj
+
+        sub_path = f'{dir_base}/{subpath}' if dir_base else subpath
+        sub_obj = hManager.get_metadata_obj(table_name=bucket.get_bucket_table_name(), path=sub_path)
+        if not sub_obj or sub_obj.is_file():
+            raise HarborError(code=status.HTTP_404_NOT_FOUND, msg=_('子目录不存在'))
+
+        return bucket, sub_obj
+
     def has_access_permission(self, bucket, base_dir_obj):
         '''
         是否有访问对象的权限
@@ -715,6 +579,71 @@ class ShareDirViewSet(CustomGenericViewSet):
         return False
 
 
+class ShareDirExportViewSet(ShareDirViewSet):
+    '''
+    分享目录打包下载视图集
+
+    retrieve:
+    打包下载分享目录或分享目录下的子目录
+
+        参数archive_type指定格式tar(默认)或zip(不压缩)，数据流式生成，响应没有Content-Length
+
+        >>Http Code: 状态码200：tar或zip数据流
+        >>Http Code: 状态码400：参数有误
+        >>Http Code: 状态码401：共享密码无效
+        >>Http Code: 状态码403：您没有访问权限
+        >>Http Code: 状态码404：找不到资源;
+    '''
+    pagination_class = None
+
+    @swagger_auto_schema(
+        operation_summary=gettext_lazy('打包下载分享目录'),
+        manual_parameters=[
+            openapi.Parameter(
+                name='share_base', in_=openapi.IN_PATH,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("分享根目录,以存储桶名称开头的目录的绝对路径"),
+                required=True
+            ),
+            openapi.Parameter(
+                name='subpath', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("子目录路径，打包下载此子目录"),
+                required=False
+            ),
+            openapi.Parameter(
+                name='p', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("分享密码"),
+                required=False
+            ),
+            openapi.Parameter(
+                name='archive_type', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("归档文件格式，tar或zip"),
+                required=False
+            )
+        ],
+        responses={
+            status.HTTP_200_OK: "Content-Type: application/x-tar or application/zip"
+        }
+    )
+    def retrieve(self, request, *args, **kwargs):
+        share_base = kwargs.get(self.lookup_field, '')
+        archive_type = request.query_params.get('archive_type', 'tar').lower()
+
+        try:
+            bucket, dir_obj = self.get_share_dir(request, share_base=share_base)
+            if dir_obj:
+                return build_dir_archive_response(bucket=bucket, dir_id=dir_obj.id, name=dir_obj.name,
+                                                  archive_type=archive_type)
+
+            return build_dir_archive_response(bucket=bucket, dir_id=BucketFileManagement.ROOT_DIR_ID,
+                                              name=bucket.name, archive_type=archive_type)
+        except HarborError as e:
+            return Response(data={'code': e.code, 'code_text': e.msg}, status=e.code)
+
+
 class ShareView(View):
     '''
     list分享目录视图
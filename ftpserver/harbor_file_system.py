@@ -241,11 +241,14 @@ class HarborFileSystem(AbstractedFS):
 
     def rename(self, src, dst):
         # print('function: rename', 'src: ' + src, 'dst ' + dst)
-        new_name = os.path.basename(dst)
+        src_dir, src_name = os.path.split(src)
+        dst_dir, new_name = os.path.split(dst)
+        rename = new_name if new_name != src_name else None
+        move = dst_dir if dst_dir != src_dir else None
         try:
-            self.client.ftp_rename(self.bucket_name, src[1:], new_name)
+            self.client.ftp_move_rename(self.bucket_name, src[1:], rename=rename, move=move)
         except HarborError as error:
-            raise FilesystemError('rename dir is not supported')
+            raise FilesystemError(error.msg)
         except Exception as error:
             raise FilesystemError(str(error))
 
@@ -370,11 +373,19 @@ class DownLoader(object):
         # except StopIteration as error:
         except Exception as error:
             return b''
+
+        # 跨part读取的数据块是memoryview
+        if isinstance(data, memoryview):
+            data = data.tobytes()
         return data
 
     def close(self):
         self.closed = True
-        # pass
+        # 停止后台预读
+        try:
+            self.obj_generator.close()
+        except Exception:
+            pass
 
 
 if __name__ == '__main__':
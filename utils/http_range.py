@@ -0,0 +1,165 @@
+'''
+HTTP Range请求(RFC 7233)解析：多范围、后缀范围、If-Range，多范围响应体multipart/byteranges
+'''
+import binascii
+import os
+from datetime import datetime
+
+from django.utils.http import parse_http_date_safe
+
+
+MAX_RANGES = 64     # 一个请求最多的范围数，超过时忽略Range头，返回整个对象
+
+
+class RangeNotSatisfiable(Exception):
+    '''
+    Range头中没有可满足的范围，应返回416
+    '''
+    pass
+
+
+def parse_range_header(header: str, size: int):
+    '''
+    解析Range头，如：'bytes=0-499'、'bytes=500-'、'bytes=-500'、'bytes=0-0,-1'
+
+    :param header: Range头
+    :param size: 对象大小
+    :return:
+        None                        # 无效的Range头(语法错误、非bytes单位或范围过多)，应忽略，返回整个对象
+        [(start:int, end:int), ]    # 可满足的范围，end包含；重叠的范围已合并
+    :raises: RangeNotSatisfiable
+    '''
+    unit, sep, specs = header.partition('=')
+    if not sep or unit.strip().lower() != 'bytes':
+        return None
+
+    ranges = []
+    for spec in specs.split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+
+        first, sep, last = spec.partition('-')
+        first = first.strip()
+        last = last.strip()
+        if not sep or (first and not first.isdigit()) or (last and not last.isdigit()) or not (first or last):
+            return None
+
+        if first:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            if start >= size:      # 不可满足的范围
+                continue
+            end = min(int(last), size - 1) if last else size - 1
+            ranges.append((start, end))
+        else:
+            suffix = int(last)
+            if suffix <= 0 or size <= 0:
+                continue
+            ranges.append((max(size - suffix, 0), size - 1))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges = coalesce_ranges(ranges)
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    return ranges
+
+
+def coalesce_ranges(ranges: list):
+    '''
+    范围有重叠或相邻时，排序后合并；没有时保持请求的顺序
+
+    :param ranges: [(start, end), ]
+    :return: [(start, end), ]
+    '''
+    if len(ranges) <= 1:
+        return ranges
+
+    ordered = sorted(ranges)
+    merged = [ordered[0]]
+    for start, end in ordered[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+
+    if len(merged) == len(ranges):
+        return ranges
+
+    return merged
+
+
+def if_range_match(header: str, etag: str, last_modified: datetime):
+    '''
+    If-Range头是否和对象当前的版本匹配，匹配时Range有效，否则忽略Range返回整个对象；
+    实体标签强比较，日期必须和Last-Modified完全相同
+
+    :param header: If-Range头，None或空表示没有此头
+    :param etag: 对象的强ETag，如'"xxx"'；空表示没有ETag
+    :param last_modified: 对象最后修改时间
+    :return: True or False
+    '''
+    if not header:
+        return True
+
+    header = header.strip()
+    if header.startswith(('"', 'W/')):
+        return bool(etag) and not header.startswith('W/') and header == etag
+
+    ts = parse_http_date_safe(header)
+    if ts is None or last_modified is None:
+        return False
+
+    return ts == int(last_modified.timestamp())
+
+
+class MultipartByteranges:
+    '''
+    多范围响应体multipart/byteranges的生成器，每个范围的数据由read(start, end)返回的迭代器读取
+    '''
+    def __init__(self, ranges: list, size: int, read, content_type: str = 'application/octet-stream'):
+        '''
+        :param ranges: [(start, end), ]
+        :param size: 对象大小
+        :param read: 读取范围数据的函数，read(start, end)返回bytes的可迭代对象
+        :param content_type: 每个部分的Content-Type
+        '''
+        self.ranges = ranges
+        self.size = size
+        self.read = read
+        self.part_content_type = content_type
+        self.boundary = binascii.hexlify(os.urandom(12)).decode()
+
+    @property
+    def content_type(self):
+        '''响应的Content-Type'''
+        return f'multipart/byteranges; boundary={self.boundary}'
+
+    def _part_header(self, start: int, end: int):
+        return (f'\r\n--{self.boundary}\r\n'
+                f'Content-Type: {self.part_content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{self.size}\r\n\r\n').encode()
+
+    def _closing(self):
+        return f'\r\n--{self.boundary}--\r\n'.encode()
+
+    @property
+    def content_length(self):
+        '''响应体总长度'''
+        length = len(self._closing())
+        for start, end in self.ranges:
+            length += len(self._part_header(start, end)) + end - start + 1
+
+        return length
+
+    def __iter__(self):
+        for start, end in self.ranges:
+            yield self._part_header(start, end)
+            yield from self.read(start, end)
+
+        yield self._closing()
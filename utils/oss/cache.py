@@ -0,0 +1,334 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .connections import register_reset_callback
+
+
+def build_cache_key(obj_key: str, upt, size: int):
+    '''
+    对象数据缓存的key，包含对象修改时间和大小，对象修改后key随之改变，旧缓存自然失效
+
+    :param obj_key: 对象rados key, obj.get_obj_key(bucket.id)
+    :param upt: 对象修改时间, datetime or None
+    :param size: 对象大小
+    '''
+    ts = upt.timestamp() if upt else 0
+    return f'{obj_key}:{ts:.6f}:{size}'
+
+
+class FrequencySketch:
+    '''
+    TinyLFU的访问频率估计，Count-Min Sketch，4行计数器；
+    记录次数达到样本数(10倍宽度)后所有计数器减半，使频率随时间衰减
+    '''
+    depth = 4
+
+    def __init__(self, width: int = 8192):
+        self.width = width
+        self._rows = [[0] * width for _ in range(self.depth)]
+        self._additions = 0
+        self._sample_size = 10 * width
+
+    def _indexes(self, key):
+        h = hashlib.md5(key.encode()).digest()
+        return [int.from_bytes(h[i * 4: i * 4 + 4], 'little') % self.width for i in range(self.depth)]
+
+    def increment(self, key):
+        for row, i in zip(self._rows, self._indexes(key)):
+            if row[i] < 255:
+                row[i] += 1
+
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            self._reset()
+
+    def frequency(self, key):
+        return min(row[i] for row, i in zip(self._rows, self._indexes(key)))
+
+    def _reset(self):
+        for row in self._rows:
+            for i in range(self.width):
+                row[i] >>= 1
+
+        self._additions //= 2
+
+
+class DiskTier:
+    '''
+    本地磁盘缓存层，每个缓存对象一个文件，文件名为key的sha1；
+    写入先写临时文件再改名，多进程可共享同一目录；容量按本进程索引的文件统计(LRU淘汰)，多进程时为近似值
+    '''
+    def __init__(self, root_dir: str, capacity: int):
+        self.root_dir = root_dir
+        self.capacity = capacity
+        self._index = OrderedDict()     # {key: size}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _path(self, key: str):
+        name = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.root_dir, name[:2], name)
+
+    def get(self, key: str):
+        '''
+        :return: bytes or None
+        '''
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                size = self._index.pop(key, None)
+                if size is not None:
+                    self._bytes -= size
+            return None
+
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+            else:   # 其他进程缓存的
+                self._index[key] = len(data)
+                self._bytes += len(data)
+
+        return data
+
+    def put(self, key: str, data: bytes):
+        '''
+        :return: 淘汰的缓存数
+        :raises: OSError
+        '''
+        size = len(data)
+        if size > self.capacity:
+            return 0
+
+        if key in self._index:
+            return 0
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        removes = []
+        with self._lock:
+            if key not in self._index:
+                self._index[key] = size
+                self._bytes += size
+
+            while self._bytes > self.capacity and self._index:
+                k, s = self._index.popitem(last=False)
+                self._bytes -= s
+                removes.append(k)
+
+        for k in removes:
+            try:
+                os.remove(self._path(k))
+            except OSError:
+                pass
+
+        return len(removes)
+
+    def stats(self):
+        with self._lock:
+            return {'disk_bytes': self._bytes, 'disk_items': len(self._index)}
+
+
+class ObjectCache:
+    '''
+    热点对象数据缓存，进程内内存层(LRU淘汰，TinyLFU准入)和可选的本地磁盘层；
+    只缓存不大于max_object_size的对象，key见build_cache_key()
+
+    内存已满时，新对象的访问频率高于LRU淘汰候选对象才准入，避免一次性访问的对象冲掉热点对象；
+    磁盘层不做准入过滤，内存层未准入或已淘汰的对象仍可从磁盘层读取
+    '''
+    def __init__(self, memory_size: int, max_object_size: int, disk_dir: str = '', disk_size: int = 0):
+        self.memory_size = memory_size
+        self.max_object_size = max_object_size
+        self._memory = OrderedDict()    # {key: bytes}
+        self._memory_bytes = 0
+        self._sketch = FrequencySketch()
+        self._disk = DiskTier(root_dir=disk_dir, capacity=disk_size) if disk_dir and disk_size > 0 else None
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'admissions': 0, 'rejections': 0,
+                          'memory_evictions': 0, 'disk_evictions': 0, 'disk_errors': 0}
+
+    def cacheable(self, size: int):
+        return 0 < size <= self.max_object_size
+
+    def get(self, key: str):
+        '''
+        :return: bytes or None
+        '''
+        with self._lock:
+            self._sketch.increment(key)
+            data = self._memory.get(key, None)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return data
+
+        if self._disk is not None:
+            data = self._disk.get(key)
+            if data is not None:
+                with self._lock:
+                    self._counters['disk_hits'] += 1
+                    self._admit(key, data)
+                return data
+
+        with self._lock:
+            self._counters['misses'] += 1
+
+        return None
+
+    def put(self, key: str, data: bytes):
+        if not self.cacheable(len(data)):
+            return
+
+        with self._lock:
+            self._admit(key, data)
+
+        if self._disk is not None:
+            try:
+                evictions = self._disk.put(key, data)
+            except OSError:
+                evictions = 0
+                with self._lock:
+                    self._counters['disk_errors'] += 1
+
+            with self._lock:
+                self._counters['disk_evictions'] += evictions
+
+    def _admit(self, key, data):
+        '''调用者需持有锁'''
+        size = len(data)
+        if key in self._memory or size > self.memory_size:
+            return
+
+        # 淘汰LRU候选对象，直到空间足够；新对象频率不高于候选对象时拒绝准入
+        freq = self._sketch.frequency(key)
+        victims = []
+        free = self.memory_size - self._memory_bytes
+        for k, v in self._memory.items():
+            if free >= size:
+                break
+            if self._sketch.frequency(k) >= freq:
+                self._counters['rejections'] += 1
+                return
+            victims.append(k)
+            free += len(v)
+
+        for k in victims:
+            self._memory_bytes -= len(self._memory.pop(k))
+            self._counters['memory_evictions'] += 1
+
+        self._memory[key] = data
+        self._memory_bytes += size
+        self._counters['admissions'] += 1
+
+    def read_generator(self, key: str, obj_size: int, load, offset: int = 0, end: int = None,
+                       block_size: int = 10 * 1024 ** 2):
+        '''
+        通过缓存读取对象数据的生成器；缓存未命中时，完整读取对象的数据边返回边收集，读取完整后放入缓存
+
+        :param key: 缓存key
+        :param obj_size: 对象大小
+        :param load: 读取对象数据的函数, load(offset, end) -> generator
+        :param offset: 读起始偏移量
+        :param end: 读结束偏移量(包含)；None表示对象结尾
+        :param block_size: 每次返回数据块长度
+        :return: generator
+        '''
+        end_oft = obj_size if end is None else min(end + 1, obj_size)
+        data = self.get(key)
+        if data is not None:
+            view = memoryview(data)
+            for start in range(max(offset, 0), end_oft, block_size):
+                yield view[start:min(start + block_size, end_oft)]
+            return
+
+        # 部分读取不缓存
+        if offset > 0 or end_oft < obj_size:
+            yield from load(offset, end)
+            return
+
+        buf = bytearray()
+        for block in load(offset, end):
+            buf += block
+            yield block
+
+        if len(buf) == obj_size:
+            self.put(key, bytes(buf))
+
+    def stats(self):
+        '''
+        缓存计数统计
+
+        :return: {
+                'memory_hits': int,     # 内存层命中次数
+                'disk_hits': int,       # 磁盘层命中次数
+                'misses': int,          # 未命中次数
+                'admissions': int,      # 准入内存层次数
+                'rejections': int,      # TinyLFU拒绝准入次数
+                'memory_evictions': int,    # 内存层淘汰次数
+                'disk_evictions': int,  # 磁盘层淘汰次数
+                'disk_errors': int,     # 磁盘层写入错误次数
+                'memory_bytes': int,    # 内存层当前缓存字节数
+                'memory_items': int,    # 内存层当前缓存对象数
+                'disk_bytes': int,
+                'disk_items': int
+            }
+        '''
+        with self._lock:
+            d = dict(self._counters)
+            d['memory_bytes'] = self._memory_bytes
+            d['memory_items'] = len(self._memory)
+            d.update(self._disk.stats() if self._disk is not None else {'disk_bytes': 0, 'disk_items': 0})
+
+        return d
+
+
+_object_cache = None
+_object_cache_lock = threading.Lock()
+
+
+def get_object_cache():
+    '''
+    进程共享的对象缓存，由settings.OBJECT_CACHE配置，未启用时返回None
+
+    :return:
+        ObjectCache() or None
+    '''
+    global _object_cache
+    conf = getattr(settings, 'OBJECT_CACHE', None)
+    if not conf or not conf.get('ENABLE', False):
+        return None
+
+    if _object_cache is None:
+        with _object_cache_lock:
+            if _object_cache is None:
+                _object_cache = ObjectCache(memory_size=conf.get('MEMORY_SIZE', 128 * 1024 ** 2),
+                                            max_object_size=conf.get('MAX_OBJECT_SIZE', 8 * 1024 ** 2),
+                                            disk_dir=conf.get('DISK_DIR', ''),
+                                            disk_size=conf.get('DISK_SIZE', 0))
+
+    return _object_cache
+
+
+def reset_object_cache():
+    '''
+    fork后子进程中丢弃继承的缓存（锁状态不确定）
+    '''
+    global _object_cache, _object_cache_lock
+    _object_cache = None
+    _object_cache_lock = threading.Lock()
+
+
+register_reset_callback(reset_object_cache)
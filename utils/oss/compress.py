@@ -0,0 +1,140 @@
+'''
+对象数据分块压缩，每个数据块独立压缩，范围读取时只需要解压涉及的数据块；
+块索引记录每个块存储的长度，最高位为1表示此块压缩无收益，按原数据存储
+'''
+import zlib
+import lzma
+import struct
+
+
+CODECS = ('zlib', 'lzma')
+RAW_FLAG = 1 << 31
+
+
+def compress_block(codec: str, data) -> bytes:
+    '''
+    :raises: ValueError     # 不支持的压缩算法
+    '''
+    if codec == 'zlib':
+        return zlib.compress(data, 6)
+    if codec == 'lzma':
+        return lzma.compress(data, preset=1)
+
+    raise ValueError(f'unsupported compression codec "{codec}"')
+
+
+def decompress_block(codec: str, data) -> bytes:
+    '''
+    :raises: ValueError     # 不支持的压缩算法或数据损坏
+    '''
+    try:
+        if codec == 'zlib':
+            return zlib.decompress(data)
+        if codec == 'lzma':
+            return lzma.decompress(data)
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ValueError(f'failed to decompress data block, {str(e)}')
+
+    raise ValueError(f'unsupported compression codec "{codec}"')
+
+
+class BlockIndex:
+    '''
+    压缩块索引，第i块对应原数据[i * block_size, (i + 1) * block_size)，存储在压缩数据中的偏移量为之前所有块存储长度之和
+    '''
+    def __init__(self, lengths=None):
+        self._lengths = []      # 存储长度，最高位为RAW_FLAG
+        self._offsets = [0]     # 存储偏移量前缀和
+        for n in (lengths or []):
+            self._append(n)
+
+    def _append(self, n: int):
+        self._lengths.append(n)
+        self._offsets.append(self._offsets[-1] + (n & ~RAW_FLAG))
+
+    def append(self, stored_len: int, raw: bool = False):
+        self._append(stored_len | RAW_FLAG if raw else stored_len)
+
+    def __len__(self):
+        return len(self._lengths)
+
+    @property
+    def stored_size(self):
+        '''压缩数据总长度'''
+        return self._offsets[-1]
+
+    def block(self, i: int):
+        '''
+        :return:
+            (stored_offset, stored_len, raw)
+        :raises: IndexError
+        '''
+        n = self._lengths[i]
+        return self._offsets[i], n & ~RAW_FLAG, bool(n & RAW_FLAG)
+
+    def to_bytes(self) -> bytes:
+        return struct.pack(f'<{len(self._lengths)}I', *self._lengths)
+
+    @classmethod
+    def from_bytes(cls, data):
+        '''
+        :raises: ValueError
+        '''
+        data = bytes(data)
+        if len(data) % 4 != 0:
+            raise ValueError('invalid compression block index')
+
+        return cls(lengths=struct.unpack(f'<{len(data) // 4}I', data))
+
+
+class BlockCompressor:
+    '''
+    顺序输入的数据按块压缩，输出每个块存储的数据，并记录块索引
+    '''
+    def __init__(self, codec: str, block_size: int):
+        '''
+        :raises: ValueError
+        '''
+        if codec not in CODECS:
+            raise ValueError(f'unsupported compression codec "{codec}"')
+        if block_size <= 0:
+            raise ValueError('block_size must be > 0')
+
+        self.codec = codec
+        self.block_size = block_size
+        self.index = BlockIndex()
+        self._buffer = bytearray()
+
+    def _compress(self, data):
+        z = compress_block(self.codec, data)
+        if len(z) < len(data):
+            self.index.append(len(z))
+            return z
+
+        self.index.append(len(data), raw=True)
+        return bytes(data)
+
+    def feed(self, data):
+        '''
+        :return:
+            [bytes, ]   # 已满的块存储的数据
+        '''
+        self._buffer += data
+        blocks = []
+        while len(self._buffer) >= self.block_size:
+            blocks.append(self._compress(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+
+        return blocks
+
+    def finish(self):
+        '''
+        :return:
+            [bytes, ]   # 最后一个不满的块存储的数据
+        '''
+        if not self._buffer:
+            return []
+
+        block = self._compress(self._buffer)
+        self._buffer = bytearray()
+        return [block]
@@ -1,38 +1,265 @@
+import os
 import threading
+from collections import OrderedDict
 
-import rados
+try:
+    import rados
+except ImportError:     # 未安装librados python包时，只能使用本地文件系统存储后端
+    from . import radoscompat as rados
 from django.conf import settings
 
 
 class ConnectionHandler:
-    def __init__(self):
-        self._connections = threading.local()
+    '''
+    进程级ceph集群连接池
 
-    def __getitem__(self, alias):
-        if hasattr(self._connections, alias):
-            return getattr(self._connections, alias)
+    每个进程每个集群别名(alias)只维护一个长连接rados.Rados()，多线程共享；
+    连接不可用时重新连接；进程fork后子进程丢弃从父进程继承的连接，重新建立
 
-        return None
+    每个连接按pool缓存打开的IoCtx（LRU，有数量上限），连接丢弃或重置时缓存的IoCtx一并失效；
+    淘汰的IoCtx只是移除引用，正在使用它的线程不受影响，无引用后由rados.Ioctx自行关闭
+    '''
+    def __init__(self, max_ioctx: int = 32):
+        self._connections = {}      # {alias: rados.Rados()}
+        self._ioctxs = OrderedDict()    # {(alias, pool_name): rados.Ioctx()}
+        self._max_ioctx = max_ioctx
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+        self._counters = {'connects': 0, 'reuses': 0, 'failures': 0, 'resets': 0,
+                          'ioctx_opens': 0, 'ioctx_hits': 0}
+
+    def __getitem__(self, alias):
+        self._check_pid()
+        return self._connections.get(alias, None)
 
     def __setitem__(self, key, value):
-        setattr(self._connections, key, value)
+        self._check_pid()
+        with self._lock:
+            self._connections[key] = value
 
     def __delitem__(self, key):
-        delattr(self._connections, key)
+        with self._lock:
+            self._connections.pop(key, None)
+
+    def __iter__(self):
+        return iter(list(self._connections.keys()))
+
+    def __contains__(self, alias):
+        return alias in self._connections
 
     def all(self):
         return [self[alias] for alias in self]
 
+    def _check_pid(self):
+        '''
+        fork后的子进程中，继承自父进程的连接不能使用，丢弃
+        '''
+        if self._pid != os.getpid():
+            self.reset_after_fork()
+
+    def _incr(self, name: str, step: int = 1):
+        with self._lock:
+            self._counters[name] += step
+
+    def get(self, alias: str, **conn_kwargs):
+        '''
+        获取指定集群别名的连接，连接不存在或不可用时创建新连接
+
+        :param alias: 集群别名
+        :param conn_kwargs: 创建连接的参数，见new_connection()
+        :return:
+            rados.Rados()
+        :raises: rados.Error
+        '''
+        conn = self[alias]
+        if conn is not None and is_connection_usable(conn):
+            self._incr('reuses')
+            return conn
+
+        with self._lock:
+            # 其他线程可能已重建连接
+            conn = self._connections.get(alias, None)
+            if conn is not None:
+                if is_connection_usable(conn):
+                    self._counters['reuses'] += 1
+                    return conn
+
+                self._connections.pop(alias, None)
+                self._invalidate_ioctx(alias)
+                self._shutdown(conn)
+
+            try:
+                conn = new_connection(**conn_kwargs)
+            except rados.Error as e:
+                self._counters['failures'] += 1
+                raise e
+
+            self._counters['connects'] += 1
+            self._connections[alias] = conn
+            return conn
+
+    def discard(self, alias: str, conn=None):
+        '''
+        连接出错时丢弃连接，下次获取时会重新连接
+
+        :param alias: 集群别名
+        :param conn: 出错的连接；不为None时，只有池中连接是此连接时才丢弃，防止丢弃其他线程已重建的连接
+        '''
+        with self._lock:
+            cur = self._connections.get(alias, None)
+            if cur is None:
+                return
+
+            if conn is not None and cur is not conn:
+                return
+
+            self._connections.pop(alias, None)
+            self._invalidate_ioctx(alias)
+            self._counters['failures'] += 1
+
+        self._shutdown(cur)
+
+    def get_ioctx(self, alias: str, pool_name: str, **conn_kwargs):
+        '''
+        获取指定集群连接的pool的IoCtx，优先使用缓存；
+        返回的IoCtx是多线程共享的，使用者不能关闭(close)它
+
+        :param alias: 集群别名
+        :param pool_name: pool名
+        :param conn_kwargs: 创建连接的参数，见new_connection()
+        :return:
+            rados.Ioctx()
+        :raises: rados.Error
+        '''
+        cluster = self.get(alias, **conn_kwargs)
+        key = (alias, pool_name)
+        with self._lock:
+            ioctx = self._ioctxs.get(key, None)
+            if ioctx is not None:
+                self._ioctxs.move_to_end(key)
+                self._counters['ioctx_hits'] += 1
+                return ioctx
+
+            ioctx = cluster.open_ioctx(pool_name)
+            self._counters['ioctx_opens'] += 1
+            self._ioctxs[key] = ioctx
+            while len(self._ioctxs) > self._max_ioctx:
+                self._ioctxs.popitem(last=False)
+
+            return ioctx
+
+    def discard_ioctx(self, alias: str, pool_name: str, ioctx=None):
+        '''
+        IoCtx出错时从缓存中移除
+
+        :param ioctx: 不为None时，只有缓存中的是此IoCtx时才移除
+        '''
+        key = (alias, pool_name)
+        with self._lock:
+            cur = self._ioctxs.get(key, None)
+            if cur is None:
+                return
+
+            if ioctx is None or cur is ioctx:
+                self._ioctxs.pop(key, None)
+
+    def _invalidate_ioctx(self, alias: str):
+        with self._lock:
+            for key in [k for k in self._ioctxs.keys() if k[0] == alias]:
+                self._ioctxs.pop(key, None)
+
     def close_all(self):
-        for alias in self:
+        with self._lock:
+            conns = list(self._connections.values())
+            self._connections.clear()
+            self._ioctxs.clear()
+
+        for conn in conns:
+            self._shutdown(conn)
+
+    def reset_after_fork(self):
+        '''
+        fork后子进程中调用，丢弃继承自父进程的连接（不能shutdown，连接的后台线程属于父进程）
+        '''
+        self._lock = threading.RLock()
+        self._connections = {}
+        self._ioctxs = OrderedDict()
+        self._pid = os.getpid()
+        self._counters['resets'] += 1
+        for callback in _reset_callbacks:
             try:
-                connection = getattr(self._connections, alias)
-            except AttributeError:
-                continue
-            connection.shutdown()
+                callback()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _shutdown(conn):
+        try:
+            conn.shutdown()
+        except Exception:
+            pass
+
+    def stats(self):
+        '''
+        连接计数统计
+
+        :return: {
+                'connects': int,    # 新建连接次数
+                'reuses': int,      # 复用连接次数
+                'failures': int,    # 连接失败或出错次数
+                'resets': int,      # fork后重置次数
+                'ioctx_opens': int, # 打开IoCtx次数
+                'ioctx_hits': int,  # IoCtx缓存命中次数
+                'alive': int,       # 当前连接数
+                'ioctx_cached': int # 当前缓存的IoCtx数
+            }
+        '''
+        with self._lock:
+            d = dict(self._counters)
+            d['alive'] = len(self._connections)
+            d['ioctx_cached'] = len(self._ioctxs)
+
+        return d
+
 
+connection_pools = ConnectionHandler(max_ioctx=settings.CEPH_RADOS.get('IOCTX_CACHE_SIZE', 32))
+_reset_callbacks = []
 
-connection_pools = ConnectionHandler()
+
+def register_reset_callback(callback):
+    '''
+    注册连接池重置(fork)时的回调函数，用于清理依赖集群连接的缓存
+    '''
+    if callback not in _reset_callbacks:
+        _reset_callbacks.append(callback)
+
+
+def reset_connections():
+    '''
+    fork后子进程中重置连接池，uwsgi postfork或ftp子进程启动时调用
+    '''
+    connection_pools.reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_connections)
+
+
+def is_connection_usable(conn):
+    '''
+    连接是否可用
+    '''
+    try:
+        return conn.state == 'connected'
+    except Exception:
+        return False
+
+
+def build_alias(cluster_name: str, username: str, conf_file: str, keyring_file: str = ''):
+    '''
+    由集群连接配置构造集群别名
+    '''
+    return f'{cluster_name}:{username}:{conf_file}:{keyring_file}'
 
 
 def get_ceph_setting(alias:str='default'):
@@ -49,18 +276,46 @@ def get_connection(alias:str='default'):
     获取指定ceph集群的链接
 
     :return:
-        failed: None
         success: Rados()
-    :raises: class:`RadosError`
+    :raises: rados.Error
+    '''
+    s = get_ceph_setting(alias)
+    return connection_pools.get(alias, **s)
+
+
+def get_connection_by_conf(cluster_name: str, username: str, conf_file: str, keyring_file: str = ''):
+    '''
+    按集群连接配置获取进程共享的ceph集群链接
+
+    :return:
+        (alias, Rados())
+    :raises: rados.Error
+    '''
+    alias = build_alias(cluster_name=cluster_name, username=username, conf_file=conf_file, keyring_file=keyring_file)
+    conn = connection_pools.get(alias, cluster_name=cluster_name, username=username,
+                                conf_file=conf_file, keyring_file=keyring_file)
+    return alias, conn
+
+
+def get_ioctx_by_conf(pool_name: str, cluster_name: str, username: str, conf_file: str, keyring_file: str = ''):
     '''
-    conn = connection_pools[alias]
-    if conn and conn.state == 'connected':
-        return conn
+    按集群连接配置获取进程共享的pool IoCtx，使用者不能关闭(close)它
 
-    s = get_ceph_setting()
-    conn = new_connection(**s)
-    connection_pools[alias] = conn
-    return connection_pools[alias]
+    :return:
+        (alias, Ioctx())
+    :raises: rados.Error
+    '''
+    alias = build_alias(cluster_name=cluster_name, username=username, conf_file=conf_file, keyring_file=keyring_file)
+    ioctx = connection_pools.get_ioctx(alias, pool_name=pool_name, cluster_name=cluster_name, username=username,
+                                       conf_file=conf_file, keyring_file=keyring_file)
+    return alias, ioctx
+
+
+def get_connection_stats():
+    '''
+    连接池计数统计，见ConnectionHandler.stats()
+    '''
+    return connection_pools.stats()
 
 
 def new_connection(cluster_name:str, username: str, conf_file:str, keyring_file:str, **kwargs):
@@ -80,7 +335,11 @@ def new_connection(cluster_name:str, username: str, conf_file:str, keyring_file:
     try:
         cluster.connect(timeout=5)
     except rados.Error as e:
+        try:
+            cluster.shutdown()
+        except Exception:
+            pass
         msg = e.args[0] if e.args else 'error connecting to the cluster'
-        raise rados.Error(message=msg, errno=e.errno)
+        raise rados.Error(msg, errno=e.errno)
 
     return cluster
@@ -0,0 +1,254 @@
+import os
+import mmap
+import time
+import errno
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .pyrados import rados, RadosAPI, RadosError
+from .connections import register_reset_callback
+
+
+class LocalCompletion:
+    '''
+    本地文件异步操作完成对象，接口同rados.Completion
+    '''
+    def __init__(self, future):
+        self._future = future
+
+    def is_complete(self):
+        return self._future.done()
+
+    def wait_for_complete(self):
+        self._future.exception()
+
+    def wait_for_complete_and_cb(self):
+        self._future.exception()
+
+    def get_return_value(self):
+        e = self._future.exception()
+        if e is None:
+            return self._future.result()
+
+        if isinstance(e, rados.ObjectNotFound):
+            return -errno.ENOENT
+
+        err = getattr(e, 'errno', None)
+        return -err if isinstance(err, int) and err > 0 else -errno.EIO
+
+
+class LocalIoctx:
+    '''
+    本地文件系统的pool输入/输出上下文，接口同rados.Ioctx的子集；
+    每个rados对象对应pool目录下的一个稀疏文件，写入用pwrite，读取通过mmap
+    '''
+    _executor = None
+    _executor_lock = threading.Lock()
+    max_workers = 16
+
+    def __init__(self, pool_path: str):
+        self._pool_path = pool_path
+        os.makedirs(pool_path, exist_ok=True)
+
+    @classmethod
+    def get_executor(cls):
+        if cls._executor is None:
+            with cls._executor_lock:
+                if cls._executor is None:
+                    cls._executor = ThreadPoolExecutor(max_workers=cls.max_workers)
+
+        return cls._executor
+
+    @classmethod
+    def reset_executor(cls):
+        '''fork后子进程中线程池不可用，丢弃'''
+        cls._executor = None
+        cls._executor_lock = threading.Lock()
+
+    def _key_path(self, key: str):
+        # 按key的hash分散到256个子目录
+        sub = hashlib.md5(key.encode()).hexdigest()[:2]
+        return os.path.join(self._pool_path, sub, key)
+
+    def write(self, key: str, data, offset: int = 0):
+        path = self._key_path(key)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        except OSError as e:
+            raise rados.Error(str(e), errno=e.errno)
+
+        try:
+            view = memoryview(data)
+            while view:
+                n = os.pwrite(fd, view, offset)
+                view = view[n:]
+                offset += n
+        except OSError as e:
+            raise rados.Error(str(e), errno=e.errno)
+        finally:
+            os.close(fd)
+
+        return 0
+
+    def read(self, key: str, length: int = 8192, offset: int = 0):
+        try:
+            fd = os.open(self._key_path(key), os.O_RDONLY)
+        except FileNotFoundError:
+            raise rados.ObjectNotFound(f'object {key} not found', errno=errno.ENOENT)
+        except OSError as e:
+            raise rados.Error(str(e), errno=e.errno)
+
+        try:
+            size = os.fstat(fd).st_size
+            if offset >= size or length <= 0:
+                return bytes()
+
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                return mm[offset:offset + length]
+        except OSError as e:
+            raise rados.Error(str(e), errno=e.errno)
+        finally:
+            os.close(fd)
+
+    def aio_write(self, key: str, data, offset: int = 0, oncomplete=None, onsafe=None):
+        future = self.get_executor().submit(self.write, key, data, offset)
+        return LocalCompletion(future)
+
+    def aio_read(self, key: str, length: int, offset: int, oncomplete=None):
+        completion = LocalCompletion(future=None)
+
+        def task():
+            data = self.read(key, length=length, offset=offset)
+            if oncomplete:
+                oncomplete(completion, data)
+            return len(data)
+
+        completion._future = self.get_executor().submit(task)
+        return completion
+
+    def remove_object(self, key: str):
+        try:
+            os.remove(self._key_path(key))
+        except FileNotFoundError:
+            raise rados.ObjectNotFound(f'object {key} not found', errno=errno.ENOENT)
+        except OSError as e:
+            raise rados.Error(str(e), errno=e.errno)
+
+        return True
+
+    def aio_remove(self, key: str, oncomplete=None, onsafe=None):
+        future = self.get_executor().submit(self.remove_object, key)
+        return LocalCompletion(future)
+
+    def stat(self, key: str):
+        '''
+        :return: (size, time.struct_time)
+        '''
+        try:
+            st = os.stat(self._key_path(key))
+        except FileNotFoundError:
+            raise rados.ObjectNotFound(f'object {key} not found', errno=errno.ENOENT)
+        except OSError as e:
+            raise rados.Error(str(e), errno=e.errno)
+
+        return st.st_size, time.localtime(st.st_mtime)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        return False
+
+
+register_reset_callback(LocalIoctx.reset_executor)
+
+
+class LocalFSAPI(RadosAPI):
+    '''
+    本地文件系统存储后端，实现RadosAPI的接口，用于开发测试环境和无ceph集群时的吞吐量基准测试；
+    数据目录下每个pool一个子目录，对象数据布局(part、条带)同ceph后端
+    '''
+    _ioctxs = {}
+    _ioctxs_lock = threading.Lock()
+
+    def __init__(self, pool_name, root_dir, *args, **kwargs):
+        ''':raises: class:`RadosError`'''
+        if not root_dir:
+            raise RadosError("参数有误，本地存储后端数据目录未配置")
+
+        self._cluster_name = 'localfs'
+        self._user_name = ''
+        self._pool_name = pool_name
+        self._alias = None
+        self._conf_file = ''
+        self._keyring_file = ''
+        self._root_dir = root_dir
+
+    def get_cluster(self):
+        return self
+
+    def clear_cluster(self, cluster=None):
+        pass
+
+    def get_ioctx(self, pool_name: str = None, try_times: int = 3):
+        pool_name = pool_name if pool_name else self._pool_name
+        key = (self._root_dir, pool_name)
+        ioctx = self._ioctxs.get(key, None)
+        if ioctx is not None:
+            return ioctx
+
+        with self._ioctxs_lock:
+            ioctx = self._ioctxs.get(key, None)
+            if ioctx is None:
+                try:
+                    ioctx = LocalIoctx(pool_path=os.path.join(self._root_dir, pool_name))
+                except OSError as e:
+                    raise RadosError(f'Failed to open_ioctx, pool={pool_name},{str(e)}')
+                self._ioctxs[key] = ioctx
+
+        return ioctx
+
+    def discard_ioctx(self, ioctx, pool_name: str = None):
+        pass
+
+    def _open_ioctx(self, pool_name: str, try_times: int = 0):
+        return self.get_ioctx(pool_name)
+
+    def get_cluster_stats(self):
+        '''
+        获取数据目录所在文件系统总容量和已使用容量
+
+        :returns: dict - contains the following keys:
+            - ``kb`` (int) - total space
+            - ``kb_used`` (int) - space used
+            - ``kb_avail`` (int) - free space available
+            - ``num_objects`` (int) - number of objects, 不统计为0
+        '''
+        try:
+            st = os.statvfs(self._root_dir)
+        except OSError as e:
+            raise RadosError(f'Failed to get local storage stats, {str(e)}', errno=e.errno)
+
+        kb = st.f_blocks * st.f_frsize // 1024
+        kb_avail = st.f_bavail * st.f_frsize // 1024
+        kb_free = st.f_bfree * st.f_frsize // 1024
+        return {'kb': kb, 'kb_used': kb - kb_free, 'kb_avail': kb_avail, 'num_objects': 0}
+
+    def command(self, prefix, **kwargs):
+        return {'err': 'not supported by localfs storage backend'}
+
+    def mgr_command(self, prefix, format='json', **kwargs):
+        raise RadosError('not supported by localfs storage backend')
+
+    def mon_command(self, prefix, format='json', **kwargs):
+        raise RadosError('not supported by localfs storage backend')
+
+    def get_ceph_io_status(self):
+        return {'bw_rd': 0.0, 'bw_wr': 0.0, 'bw': 0.0, 'op_rd': 0, 'op_wr': 0, 'op': 0}
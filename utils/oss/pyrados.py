@@ -1,13 +1,25 @@
 import os
 import math
+import errno
+import queue
+import threading
+import contextlib
+from collections import deque
 import json
 import datetime
 import pytz
 
-import rados
+try:
+    import rados
+except ImportError:     # 未安装librados python包时，只能使用本地文件系统存储后端
+    from . import radoscompat as rados
 
 from django.conf import settings
 
+from .connections import (connection_pools, get_connection_by_conf, get_ioctx_by_conf, is_connection_usable,
+                          build_alias)
+from .compress import CODECS, BlockIndex, BlockCompressor, decompress_block
+
 
 class RadosError(rados.Error):
     '''def __init__(self, message, errno=None)'''
@@ -163,6 +175,376 @@ class HarborObjectStructure:
         return self.parts_id[-1]
 
 
+class PartLayout:
+    '''
+    对象数据布局(版本0)：对象数据按MAXSIZE_PER_RADOS_OBJ(2GB)依次分为多个part(rados对象)，见HarborObjectStructure；
+    布局字符串为空字符串
+    '''
+    version = 0
+
+    def write_tasks(self, obj_id, offset, bytes_len):
+        '''
+        :return:
+            [(rados_id, offset, slice_start, slice_end), ]，见write_part_tasks()
+        '''
+        return write_part_tasks(obj_id=obj_id, offset=offset, bytes_len=bytes_len)
+
+    def read_tasks(self, obj_id, offset, bytes_len):
+        '''
+        :return:
+            [(rados_id, offset, read_len), ]，按读取数据的顺序，见read_part_tasks()
+        '''
+        tasks = self.write_tasks(obj_id=obj_id, offset=offset, bytes_len=bytes_len)
+        return [(rados_id, off, end - start) for rados_id, off, start, end in tasks]
+
+    def rados_ids(self, obj_id, obj_size):
+        '''
+        指定大小的对象数据涉及的所有rados对象id
+        '''
+        return HarborObjectStructure(obj_id=obj_id, obj_size=obj_size).parts_id
+
+    @property
+    def size_part_by(self):
+        return MAXSIZE_PER_RADOS_OBJ
+
+    def __str__(self):
+        return ''
+
+
+class StripeLayout(PartLayout):
+    '''
+    条带化的对象数据布局(版本1)，类似RAID-0：
+    对象数据按条带单元(stripe_unit)依次轮流分布到stripe_count个rados对象上，这stripe_count个rados对象组成一个对象集(object set)，
+    对象集中每个rados对象最大object_size，对象集写满后使用下一个对象集；
+    rados对象id为f'{obj_id}_s{objectno}'
+
+    布局字符串格式：'v1:{stripe_unit}:{stripe_count}:{object_size}'
+    '''
+    version = 1
+
+    def __init__(self, stripe_unit: int, stripe_count: int, object_size: int = MAXSIZE_PER_RADOS_OBJ):
+        '''
+        :raises: ValueError
+        '''
+        if stripe_unit <= 0 or stripe_count <= 0 or object_size <= 0:
+            raise ValueError('stripe_unit, stripe_count and object_size must be > 0')
+
+        if object_size % stripe_unit != 0:
+            raise ValueError('object_size must be a multiple of stripe_unit')
+
+        self.stripe_unit = stripe_unit
+        self.stripe_count = stripe_count
+        self.object_size = object_size
+        self._stripes_per_object = object_size // stripe_unit
+
+    @staticmethod
+    def build_rados_id(obj_id, objectno):
+        return f'{obj_id}_s{objectno}'
+
+    def write_tasks(self, obj_id, offset, bytes_len):
+        if offset < 0 or bytes_len < 0:
+            raise ValueError('“offset”和“rd_wr_size”不能小于0')
+
+        su = self.stripe_unit
+        sc = self.stripe_count
+        tasks = []
+        pos = 0
+        while pos < bytes_len:
+            blockno, block_off = divmod(offset + pos, su)
+            stripeno, stripepos = divmod(blockno, sc)
+            objsetno, stripe_in_obj = divmod(stripeno, self._stripes_per_object)
+            objectno = objsetno * sc + stripepos
+            size = min(su - block_off, bytes_len - pos)
+            tasks.append((self.build_rados_id(obj_id, objectno), stripe_in_obj * su + block_off, pos, pos + size))
+            pos += size
+
+        return tasks
+
+    def rados_ids(self, obj_id, obj_size):
+        if obj_size <= 0:
+            return [self.build_rados_id(obj_id, 0)]
+
+        su = self.stripe_unit
+        sc = self.stripe_count
+        blocks = int(math.ceil(obj_size / su))
+        blocks_per_set = sc * self._stripes_per_object
+        last_set, blocks_in_last = divmod(blocks - 1, blocks_per_set)
+        count = last_set * sc + min(sc, blocks_in_last + 1)
+        return [self.build_rados_id(obj_id, n) for n in range(count)]
+
+    @property
+    def size_part_by(self):
+        return self.stripe_unit
+
+    def __str__(self):
+        return f'v{self.version}:{self.stripe_unit}:{self.stripe_count}:{self.object_size}'
+
+
+class PackLayout(PartLayout):
+    '''
+    小对象打包布局(版本2)：多个小对象的数据依次追加写入一个共享的pack文件(rados对象)，对象数据是pack文件中的一段；
+    打包的对象是只读的，写入前需要先转为其他布局；pack文件由多个对象共享，删除对象不删除pack文件，由压缩任务回收空间；
+    pack文件rados对象id为f'pack_{pack_id}'
+
+    布局字符串格式：'v2:{pack_id}:{offset}:{length}'
+    '''
+    version = 2
+
+    def __init__(self, pack_id: int, offset: int, length: int):
+        '''
+        :raises: ValueError
+        '''
+        if pack_id <= 0 or offset < 0 or length < 0:
+            raise ValueError('pack_id must be > 0, offset and length must be >= 0')
+
+        self.pack_id = pack_id
+        self.offset = offset
+        self.length = length
+
+    @staticmethod
+    def build_rados_id(pack_id):
+        return f'pack_{pack_id}'
+
+    @property
+    def pack_rados_id(self):
+        return self.build_rados_id(self.pack_id)
+
+    def write_tasks(self, obj_id, offset, bytes_len):
+        raise ValueError('packed object is read only')
+
+    def read_tasks(self, obj_id, offset, bytes_len):
+        if offset < 0 or bytes_len < 0:
+            raise ValueError('“offset”和“rd_wr_size”不能小于0')
+
+        size = max(min(bytes_len, self.length - offset), 0)
+        return [(self.pack_rados_id, self.offset + offset, size)]
+
+    def rados_ids(self, obj_id, obj_size):
+        '''
+        对象独占的rados对象，打包的对象没有独占的rados对象
+        '''
+        return []
+
+    @property
+    def size_part_by(self):
+        return self.length
+
+    def __str__(self):
+        return f'v{self.version}:{self.pack_id}:{self.offset}:{self.length}'
+
+
+class DedupLayout(PartLayout):
+    '''
+    去重共享数据布局(版本3)：多个相同数据(MD5和大小相同)的对象共享一份数据(数据块blob)，对象数据就是blob的数据；
+    blob是首个上传此数据的对象复制出的rados数据，rados对象id为独立的blob_key(不是任何对象的key)，按inner布局存储；
+    共享数据的对象是只读的，写入前需要先复制为独占数据；删除对象不删除blob，blob按引用计数回收
+
+    布局字符串格式：'v3:{blob_key}:{inner布局字符串}'
+    '''
+    version = 3
+
+    def __init__(self, blob_key: str, inner=None):
+        '''
+        :param blob_key: blob的rados对象key
+        :param inner: blob的数据布局，布局字符串或PartLayout()
+        :raises: ValueError
+        '''
+        if not blob_key or ':' in blob_key:
+            raise ValueError('invalid blob key')
+
+        inner = parse_layout(inner)
+        if isinstance(inner, (PackLayout, DedupLayout, CompressedLayout, RelocatedLayout)):
+            raise ValueError('inner layout of blob must be a part or stripe layout')
+
+        self.blob_key = blob_key
+        self.inner = inner
+
+    def write_tasks(self, obj_id, offset, bytes_len):
+        raise ValueError('deduplicated object is read only')
+
+    def read_tasks(self, obj_id, offset, bytes_len):
+        return self.inner.read_tasks(obj_id=self.blob_key, offset=offset, bytes_len=bytes_len)
+
+    def rados_ids(self, obj_id, obj_size):
+        '''
+        对象独占的rados对象，共享数据的对象没有独占的rados对象
+        '''
+        return []
+
+    def blob_rados_ids(self, obj_size):
+        '''
+        blob的所有rados对象id，blob不再被引用时删除
+        '''
+        return self.inner.rados_ids(obj_id=self.blob_key, obj_size=obj_size)
+
+    @property
+    def size_part_by(self):
+        return self.inner.size_part_by
+
+    def __str__(self):
+        return f'v{self.version}:{self.blob_key}:{self.inner}'
+
+
+class CompressedLayout(PartLayout):
+    '''
+    分块压缩的数据布局(版本4)：对象数据按block_size分块独立压缩，压缩后的数据依次存储，按内层布局(inner)分布到
+    rados对象f'{obj_id}_z'...上(和未压缩数据的rados对象不同名)，块索引存储在对象元数据中，见utils.oss.compress；
+    布局映射的是压缩数据的偏移量，压缩的对象是只读的，写入前需要先解压为其他布局
+
+    布局字符串格式：'v4:{codec}:{block_size}:{inner布局字符串}'
+    '''
+    version = 4
+
+    def __init__(self, codec: str, block_size: int, inner=None):
+        '''
+        :param codec: 压缩算法，见utils.oss.compress.CODECS
+        :param block_size: 压缩块大小(原数据)
+        :param inner: 压缩数据的布局，布局字符串或PartLayout()
+        :raises: ValueError
+        '''
+        block_size = int(block_size)
+        if codec not in CODECS or block_size <= 0:
+            raise ValueError('invalid compression codec or block_size')
+
+        inner = parse_layout(inner)
+        if isinstance(inner, (PackLayout, DedupLayout, CompressedLayout, RelocatedLayout)):
+            raise ValueError('inner layout of compressed data must be a part or stripe layout')
+
+        self.codec = codec
+        self.block_size = block_size
+        self.inner = inner
+
+    @staticmethod
+    def build_data_id(obj_id):
+        return f'{obj_id}_z'
+
+    def write_tasks(self, obj_id, offset, bytes_len):
+        return self.inner.write_tasks(obj_id=self.build_data_id(obj_id), offset=offset, bytes_len=bytes_len)
+
+    def read_tasks(self, obj_id, offset, bytes_len):
+        return self.inner.read_tasks(obj_id=self.build_data_id(obj_id), offset=offset, bytes_len=bytes_len)
+
+    def rados_ids(self, obj_id, obj_size):
+        '''
+        压缩数据不大于原数据，按原数据大小计算涉及的rados对象
+        '''
+        return self.inner.rados_ids(obj_id=self.build_data_id(obj_id), obj_size=obj_size)
+
+    @property
+    def size_part_by(self):
+        return self.inner.size_part_by
+
+    def __str__(self):
+        return f'v{self.version}:{self.codec}:{self.block_size}:{self.inner}'
+
+
+class RelocatedLayout(PartLayout):
+    '''
+    数据在其他rados key下的布局(版本5)：对象数据在对象创建前已写入，rados对象key为data_key而不是对象key，按内层布局(inner)存储，
+    如分片上传(multipart)的数据；数据是对象独占的，读写和删除同内层布局，只是rados对象key不同
+
+    布局字符串格式：'v5:{data_key}:{inner布局字符串}'
+    '''
+    version = 5
+
+    def __init__(self, data_key: str, inner=None):
+        '''
+        :param data_key: 数据的rados对象key
+        :param inner: 数据的布局，布局字符串或PartLayout()
+        :raises: ValueError
+        '''
+        if not data_key or ':' in data_key:
+            raise ValueError('invalid data key')
+
+        inner = parse_layout(inner)
+        if isinstance(inner, (PackLayout, DedupLayout, CompressedLayout, RelocatedLayout)):
+            raise ValueError('inner layout of relocated data must be a part or stripe layout')
+
+        self.data_key = data_key
+        self.inner = inner
+
+    def write_tasks(self, obj_id, offset, bytes_len):
+        return self.inner.write_tasks(obj_id=self.data_key, offset=offset, bytes_len=bytes_len)
+
+    def read_tasks(self, obj_id, offset, bytes_len):
+        return self.inner.read_tasks(obj_id=self.data_key, offset=offset, bytes_len=bytes_len)
+
+    def rados_ids(self, obj_id, obj_size):
+        return self.inner.rados_ids(obj_id=self.data_key, obj_size=obj_size)
+
+    @property
+    def size_part_by(self):
+        return self.inner.size_part_by
+
+    def __str__(self):
+        return f'v{self.version}:{self.data_key}:{self.inner}'
+
+
+DEFAULT_LAYOUT = PartLayout()
+
+
+def parse_layout(layout):
+    '''
+    解析对象数据布局
+
+    :param layout: 布局字符串，或PartLayout()；空字符串或None为旧布局(版本0)
+    :return:
+        PartLayout() or StripeLayout() or PackLayout() or DedupLayout() or CompressedLayout() or RelocatedLayout()
+    :raises: ValueError
+    '''
+    if isinstance(layout, PartLayout):
+        return layout
+
+    if not layout:
+        return DEFAULT_LAYOUT
+
+    try:
+        if layout.startswith('v3:'):
+            _, blob_key, inner = layout.split(':', 2)
+            return DedupLayout(blob_key=blob_key, inner=inner)
+
+        if layout.startswith('v4:'):
+            _, codec, block_size, inner = layout.split(':', 3)
+            return CompressedLayout(codec=codec, block_size=block_size, inner=inner)
+
+        if layout.startswith('v5:'):
+            _, data_key, inner = layout.split(':', 2)
+            return RelocatedLayout(data_key=data_key, inner=inner)
+
+        version, *args = layout.split(':')
+        if version == 'v1':
+            return StripeLayout(*[int(a) for a in args])
+        if version == 'v2':
+            return PackLayout(*[int(a) for a in args])
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'invalid object layout "{layout}", {str(e)}')
+
+    raise ValueError(f'invalid object layout "{layout}"')
+
+
+def get_new_object_layout(pool_name: str, bucket_name: str = ''):
+    '''
+    新建对象使用的数据布局字符串，由settings.CEPH_RADOS['STRIPE_LAYOUT']按桶名或pool名配置(stripe_unit, stripe_count)，桶名优先；
+    未配置时使用旧布局
+
+    :return: str
+    '''
+    conf = settings.CEPH_RADOS.get('STRIPE_LAYOUT', None)
+    if not conf:
+        return ''
+
+    stripe = conf.get('BUCKETS', {}).get(bucket_name, None) if bucket_name else None
+    if stripe is None:
+        stripe = conf.get('POOLS', {}).get(pool_name, None)
+
+    if not stripe:
+        return ''
+
+    stripe_unit, stripe_count = stripe[0], stripe[1]
+    object_size = stripe[2] if len(stripe) > 2 else MAXSIZE_PER_RADOS_OBJ
+    return str(StripeLayout(stripe_unit=stripe_unit, stripe_count=stripe_count, object_size=object_size))
+
+
 class CephClusterCommand(dict):
     '''
     执行ceph 命令
@@ -183,7 +565,58 @@ class CephClusterCommand(dict):
                 self.update(json.loads(buf))
 
 
-class RadosAPI:
+class StorageAPIBase:
+    '''
+    对象数据存储后端接口，HarborObject通过此接口读写对象数据；
+    实现类：RadosAPI(ceph集群)，LocalFSAPI(本地文件系统，见localfs.py)，由settings.CEPH_RADOS['BACKEND']选择
+    '''
+
+    def get_cluster(self):
+        '''获取存储集群的连接'''
+        raise NotImplementedError('`get_cluster()` must be implemented.')
+
+    def clear_cluster(self, cluster=None):
+        '''释放或丢弃出错的存储集群连接'''
+        raise NotImplementedError('`clear_cluster()` must be implemented.')
+
+    def get_ioctx(self, pool_name: str = None, try_times: int = 3):
+        '''获取pool的输入/输出上下文'''
+        raise NotImplementedError('`get_ioctx()` must be implemented.')
+
+    def discard_ioctx(self, ioctx, pool_name: str = None):
+        '''丢弃出错的输入/输出上下文'''
+        raise NotImplementedError('`discard_ioctx()` must be implemented.')
+
+    def write(self, obj_id, offset, data: bytes, layout=None):
+        '''向对象写入数据'''
+        raise NotImplementedError('`write()` must be implemented.')
+
+    def write_file(self, obj_id, offset, file, per_size=20 * 1024 ** 2, layout=None):
+        '''向对象写入一个类文件数据'''
+        raise NotImplementedError('`write_file()` must be implemented.')
+
+    def read(self, obj_id, offset, read_size, ioctx=None, layout=None):
+        '''读对象数据'''
+        raise NotImplementedError('`read()` must be implemented.')
+
+    def delete(self, obj_id, obj_size, layout=None):
+        '''删除对象'''
+        raise NotImplementedError('`delete()` must be implemented.')
+
+    def rados_stat(self, obj_id):
+        '''获取rados对象大小和修改时间'''
+        raise NotImplementedError('`rados_stat()` must be implemented.')
+
+    def get_cluster_stats(self):
+        '''获取存储总容量和已使用容量'''
+        raise NotImplementedError('`get_cluster_stats()` must be implemented.')
+
+    def get_ceph_io_status(self):
+        '''获取存储io状态'''
+        raise NotImplementedError('`get_ceph_io_status()` must be implemented.')
+
+
+class RadosAPI(StorageAPIBase):
     '''
     ceph cluster rados对象接口封装
     '''
@@ -193,7 +626,7 @@ class RadosAPI:
         self._cluster_name = cluster_name
         self._user_name = user_name
         self._pool_name = pool_name
-        self._cluster = None  # rados.Rados()
+        self._alias = None      # 进程共享集群连接的别名
 
         if not os.path.exists(conf_file):
             raise RadosError("参数有误，配置文件路径不存在")
@@ -211,36 +644,33 @@ class RadosAPI:
         self.clear_cluster()
         return False  # __exit__返回的是False，有异常不被忽略会向上抛出。
 
-    def __del__(self):
-        self.clear_cluster()
-
     def get_cluster(self):
         '''
-        获取已连接到ceph集群的句柄handle
+        获取已连接到ceph集群的句柄handle，集群连接是进程内共享的长连接
+
         :return:
-            failed: None
             success: Rados()
         :raises: class:`RadosError`
         '''
-        if not self._cluster:
-            conf = dict(keyring=self._keyring_file) if self._keyring_file else None
-            self._cluster = rados.Rados(name=self._user_name, clustername=self._cluster_name, conffile=self._conf_file,
-                                        conf=conf)
-            try:
-                self._cluster.connect(timeout=5)
-            except rados.Error as e:
-                msg = e.args[0] if e.args else 'error connecting to the cluster'
-                raise RadosError(msg, errno=e.errno)
+        try:
+            self._alias, cluster = get_connection_by_conf(cluster_name=self._cluster_name, username=self._user_name,
+                                                          conf_file=self._conf_file, keyring_file=self._keyring_file)
+        except rados.Error as e:
+            msg = e.args[0] if e.args else 'error connecting to the cluster'
+            raise RadosError(msg, errno=e.errno)
 
-        return self._cluster
+        return cluster
 
     def clear_cluster(self, cluster=None):
-        if cluster:
-            cluster.shutdown()
+        '''
+        集群连接是进程内共享的，不在此关闭；
+        传入cluster时表示使用此连接时出错，只有连接本身已不可用时才从连接池丢弃，下次获取时重新连接；
+        pool不存在、无权限等打开pool的错误不影响连接，不能因此关闭其他线程正在使用的连接
 
-        if self._cluster is not None:
-            self._cluster.shutdown()
-            self._cluster = None
+        :param cluster: 出错的集群连接
+        '''
+        if cluster is not None and self._alias and not is_connection_usable(cluster):
+            connection_pools.discard(self._alias, cluster)
 
     def _open_ioctx(self, pool_name: str, try_times: int = 0):
         """
@@ -256,6 +686,8 @@ class RadosAPI:
         cluster = self.get_cluster()
         try:
             return cluster.open_ioctx(pool_name)
+        except rados.ObjectNotFound as e:
+            raise RadosError(f'Failed to open_ioctx, pool={pool_name},{str(e)}', errno=errno.ENOENT)
         except rados.Error as e:
             self.clear_cluster(cluster)
             if try_times >= 2:
@@ -265,18 +697,80 @@ class RadosAPI:
 
         return self._open_ioctx(pool_name=pool_name, try_times=(try_times + 1))
 
-    def _io_write(self, ioctx, obj_id, offset, data: bytes):
+    def get_ioctx(self, pool_name: str = None, try_times: int = 3):
+        """
+        获取pool的IoCtx，IoCtx在进程内按pool缓存共享，使用者不能关闭(close)它
+
+        :param pool_name: ceph pool名，默认为当前pool
+        :param try_times: 打开失败尝试的次数
+        :return:
+            rados.Ioctx()
+
+        :raises: class:`RadosError`
+        """
+        pool_name = pool_name if pool_name else self._pool_name
+        alias = build_alias(cluster_name=self._cluster_name, username=self._user_name,
+                            conf_file=self._conf_file, keyring_file=self._keyring_file)
+        err = None
+        for _ in range(try_times):
+            try:
+                self._alias, ioctx = get_ioctx_by_conf(pool_name=pool_name, cluster_name=self._cluster_name,
+                                                       username=self._user_name, conf_file=self._conf_file,
+                                                       keyring_file=self._keyring_file)
+                return ioctx
+            except rados.ObjectNotFound as e:   # pool不存在，重试无意义
+                raise RadosError(f'Failed to open_ioctx, pool={pool_name},{str(e)}', errno=errno.ENOENT)
+            except rados.Error as e:
+                err = e
+                # 只丢弃已不可用的连接，且只丢弃出错的这个连接，防止丢弃其他线程已重建的连接
+                conn = connection_pools[alias]
+                if conn is not None and not is_connection_usable(conn):
+                    connection_pools.discard(alias, conn=conn)
+            except Exception as e:
+                raise RadosError(f'Failed to open_ioctx, pool={pool_name},{str(e)}')
+
+        raise RadosError(f'Failed to open_ioctx, pool={pool_name},{str(err)}')
+
+    def discard_ioctx(self, ioctx, pool_name: str = None):
+        """
+        出错的IoCtx从缓存移除，不再复用
+        """
+        pool_name = pool_name if pool_name else self._pool_name
+        if self._alias:
+            connection_pools.discard_ioctx(self._alias, pool_name=pool_name, ioctx=ioctx)
+
+    @contextlib.contextmanager
+    def _ioctx(self, pool_name: str):
+        """
+        进程共享的IoCtx上下文，退出时不关闭IoCtx，发生错误时从缓存移除
+
+        :raises: class:`RadosError`
+        """
+        ioctx = self.get_ioctx(pool_name)
+        try:
+            yield ioctx
+        except rados.ObjectNotFound:
+            raise
+        except rados.Error:
+            self.discard_ioctx(ioctx, pool_name=pool_name)
+            raise
+
+    def _io_write(self, ioctx, obj_id, offset, data: bytes, layout=None):
         '''
-        向对象写入数据
+        向对象写入数据，数据涉及多个rados对象时并行写入
 
         :param obj_id: 对象id
         :param offset: 数据写入偏移量
         :param data: 数据，bytes
+        :param layout: 对象数据布局，默认旧布局
         :return:
             success: True
         :raises: class:`RadosError`
         '''
-        tasks = write_part_tasks(obj_id, offset=offset, bytes_len=len(data))
+        layout = layout if layout is not None else DEFAULT_LAYOUT
+        tasks = layout.write_tasks(obj_id, offset=offset, bytes_len=len(data))
+        if len(tasks) > 1:
+            return self._io_aio_write_tasks(ioctx=ioctx, data=data, tasks=tasks)
 
         for obj_key, off, start, end in tasks:
             try:
@@ -289,27 +783,55 @@ class RadosAPI:
 
         return True
 
-    def write(self, obj_id, offset, data: bytes):
+    def _io_aio_write_tasks(self, ioctx, data: bytes, tasks):
+        '''
+        并行异步写入数据到多个rados对象
+
+        :param tasks: [(rados_id, offset, slice_start, slice_end), ]
+        :return:
+            success: True
+        :raises: class:`RadosError`
+        '''
+        completions = []
+        try:
+            for obj_key, off, start, end in tasks:
+                c = ioctx.aio_write(obj_key, data[start:end], offset=off)
+                completions.append((obj_key, c))
+        except rados.Error as e:
+            msg = e.args[0] if e.args else 'Failed to write bytes to rados object'
+            raise RadosError(msg, errno=e.errno)
+        finally:
+            for _, c in completions:
+                c.wait_for_complete()
+
+        for obj_key, c in completions:
+            if c.get_return_value() < 0:
+                raise RadosError(f'Failed to write bytes to rados object {obj_key}')
+
+        return True
+
+    def write(self, obj_id, offset, data: bytes, layout=None):
         '''
         向对象写入数据
 
         :param obj_id: 对象id
         :param offset: 数据写入偏移量
         :param data: 数据，bytes
+        :param layout: 对象数据布局，默认旧布局
         :return:
             success: True
         :raises: class:`RadosError`
         '''
-        with self._open_ioctx(self._pool_name) as ioctx:
+        with self._ioctx(self._pool_name) as ioctx:
             try:
-                self._io_write(ioctx=ioctx, obj_id=obj_id, offset=offset, data=data)
+                self._io_write(ioctx=ioctx, obj_id=obj_id, offset=offset, data=data, layout=layout)
             except rados.Error as e:
                 msg = e.args[0] if e.args else f'Failed to open_ioctx({self._pool_name})'
                 raise RadosError(msg, errno=e.errno)
 
         return True
 
-    def _io_write_file(self, ioctx, obj_id, offset, file, per_size=20 * 1024 ** 2):
+    def _io_write_file(self, ioctx, obj_id, offset, file, per_size=20 * 1024 ** 2, layout=None):
         '''
         向对象写入一个类文件数据
 
@@ -317,6 +839,7 @@ class RadosAPI:
         :param offset: 文件数据写入对象偏移量
         :param file: 类文件
         :param per_size: 每次从文件读取数据的大小,默认20MB
+        :param layout: 对象数据布局，默认旧布局
         :return:
             success: True
         :raises: class:`RadosError`
@@ -336,16 +859,16 @@ class RadosAPI:
             chunk = file.read(per_size)
             if chunk:
                 try:
-                    self._io_write(ioctx=ioctx, obj_id=obj_id, offset=offset + file_offset, data=chunk)
+                    self._io_write(ioctx=ioctx, obj_id=obj_id, offset=offset + file_offset, data=chunk, layout=layout)
                 except RadosError:
                     # 写入失败再尝试一次
-                    self._io_write(ioctx=ioctx, obj_id=obj_id, offset=offset + file_offset, data=chunk)
+                    self._io_write(ioctx=ioctx, obj_id=obj_id, offset=offset + file_offset, data=chunk, layout=layout)
 
                 file_offset += len(chunk)  # 更新已写入大小
             else:
                 raise RadosError('read error when write a file to rados')
 
-    def write_file(self, obj_id, offset, file, per_size=20 * 1024 ** 2):
+    def write_file(self, obj_id, offset, file, per_size=20 * 1024 ** 2, layout=None):
         '''
         向对象写入一个类文件数据
 
@@ -353,94 +876,158 @@ class RadosAPI:
         :param offset: 文件数据写入对象偏移量
         :param file: 类文件
         :param per_size: 每次从文件读取数据的大小,默认20MB
+        :param layout: 对象数据布局，默认旧布局
         :return:
             success: True
         :raises: class:`RadosError`
         '''
-        with self._open_ioctx(self._pool_name) as ioctx:
+        with self._ioctx(self._pool_name) as ioctx:
             try:
-                self._io_write_file(ioctx=ioctx, obj_id=obj_id, offset=offset, file=file, per_size=per_size)
+                self._io_write_file(ioctx=ioctx, obj_id=obj_id, offset=offset, file=file, per_size=per_size,
+                                    layout=layout)
             except rados.Error as e:
                 msg = e.args[0] if e.args else f'Failed to open_ioctx({self._pool_name})'
                 raise RadosError(msg, errno=e.errno)
 
         return True
 
-    def _rados_read(self, ioctx, obj_id, offset, read_size):
+    def _rados_read(self, ioctx, obj_id, offset, read_size, missing_ok: bool = True):
         '''
         从rados对象指定偏移量开始读取指定长度的字节数据
         :param ioctx: 输入/输出上下文
         :param obj_id: 对象id
         :param offset: 对象偏移量
         :param read_size: 要读取的字节长度
+        :param missing_ok: True(rados对象不存在时返回补0的数据)；False(抛出RadosNotFound)
         :return:
-            success; bytes
+            success; bytes or memoryview
         :raises: class:`RadosError`
         '''
         try:
             data = ioctx.read(obj_id, length=read_size, offset=offset)
         except rados.ObjectNotFound as e:
+            if not missing_ok:
+                raise RadosNotFound(f'rados object {obj_id} not found', errno=errno.ENOENT)
             return bytes(read_size)  # rados对象不存在，构造一个指定长度的bytes
         except rados.Error as e:
             msg = e.args[0] if e.args else 'Failed to read bytes from rados object'
             raise RadosError(msg, errno=e.errno)
 
-        # 读取数据不足，补足
+        # 读取数据不足，在预分配的缓冲区中补0
         read_len = len(data)
         if read_len < read_size:
-            data += bytes(read_size - read_len)
+            buf = bytearray(read_size)
+            buf[:read_len] = data
+            return memoryview(buf)
 
         return data
 
-    def read(self, obj_id, offset, read_size):
+    def _rados_aio_read_parts(self, ioctx, tasks, read_size):
+        '''
+        并行异步读取多个rados对象(part或条带)的数据，直接填充到预分配的缓冲区；
+        缓冲区初始全为0，rados对象不存在或数据不足的部分保持为0
+
+        :param ioctx: 输入/输出上下文
+        :param tasks: [(part_id, offset, read_len), ]，按读取数据的顺序，见PartLayout.read_tasks()
+        :param read_size: 要读取的字节总长度
+        :return:
+            success; memoryview
+        :raises: class:`RadosError`
+        '''
+        view = memoryview(bytearray(read_size))
+
+        def build_oncomplete(start, size):
+            def oncomplete(completion, data):
+                if data:
+                    n = min(len(data), size)
+                    view[start:start + n] = memoryview(data)[:n]
+            return oncomplete
+
+        completions = []
+        pos = 0
+        try:
+            for part_id, off, size in tasks:
+                c = ioctx.aio_read(part_id, size, off, build_oncomplete(pos, size))
+                completions.append((part_id, c))
+                pos += size
+        finally:
+            for _, c in completions:
+                c.wait_for_complete_and_cb()
+
+        for part_id, c in completions:
+            r = c.get_return_value()
+            if r < 0 and r != -errno.ENOENT:
+                raise RadosError(f'Failed to read bytes from rados object {part_id}', errno=-r)
+
+        return view
+
+    def _io_read(self, ioctx, obj_id, offset, read_size, layout=None):
+        '''
+        读对象数据，数据跨多个part或条带时并行读取
+
+        :param ioctx: 输入/输出上下文
+        :param obj_id: 对象id
+        :param offset: 数据读取偏移量
+        :param read_size: 读取数据byte大小
+        :param layout: 对象数据布局，默认旧布局
+        :return:
+            success; bytes or memoryview
+        :raises: class:`RadosError`
+        '''
+        layout = layout if layout is not None else DEFAULT_LAYOUT
+        tasks = layout.read_tasks(obj_id, offset=offset, bytes_len=read_size)
+        # 要读取的数据在一个rados对象上
+        if len(tasks) == 1:
+            obj_key, off, size = tasks[0]
+            # 共享的pack文件或blob不存在(已被回收)时不能补0返回
+            missing_ok = not isinstance(layout, (PackLayout, DedupLayout))
+            return self._rados_read(ioctx=ioctx, obj_id=obj_key, read_size=size, offset=off, missing_ok=missing_ok)
+
+        return self._rados_aio_read_parts(ioctx=ioctx, tasks=tasks, read_size=read_size)
+
+    def read(self, obj_id, offset, read_size, ioctx=None, layout=None):
         '''
         读对象数据
 
         :param obj_id: 对象id
         :param offset: 数据读取偏移量
         :param read_size: 读取数据byte大小
+        :param ioctx: 输入/输出上下文，流式读取时由调用者持有同一个IoCtx；None时使用当前pool的IoCtx
+        :param layout: 对象数据布局，默认旧布局
         :return:
-            success; bytes
+            success; bytes or memoryview
         :raises: class:`RadosError`
         '''
         if offset < 0 or read_size <= 0:
             return bytes()
 
-        tasks = read_part_tasks(obj_id, offset=offset, bytes_len=read_size)
-        with self._open_ioctx(self._pool_name) as ioctx:
-            try:
-                # 要读取的数据在一个rados对象上
-                if len(tasks) == 1:
-                    obj_key, off, size = tasks[0]
-                    return self._rados_read(ioctx=ioctx, obj_id=obj_key, read_size=size, offset=off)
-
-                ret_data = bytes()
-                for obj_key, off, size in tasks:
-                    data = self._rados_read(ioctx=ioctx, obj_id=obj_key, read_size=size, offset=off)
-                    ret_data += data
-
-                return ret_data
+        try:
+            if ioctx is not None:
+                return self._io_read(ioctx=ioctx, obj_id=obj_id, offset=offset, read_size=read_size, layout=layout)
 
-            except rados.Error as e:
-                msg = e.args[0] if e.args else f'Failed to open_ioctx({self._pool_name})'
-                raise RadosError(msg, errno=e.errno)
-            except Exception as e:
-                raise RadosError(str(e))
+            with self._ioctx(self._pool_name) as ioctx:
+                return self._io_read(ioctx=ioctx, obj_id=obj_id, offset=offset, read_size=read_size, layout=layout)
+        except rados.Error as e:
+            msg = e.args[0] if e.args else f'Failed to open_ioctx({self._pool_name})'
+            raise RadosError(msg, errno=e.errno)
+        except Exception as e:
+            raise RadosError(str(e))
 
-    def delete(self, obj_id, obj_size):
+    def delete(self, obj_id, obj_size, layout=None):
         '''
         删除对象
 
         :param obj_id: 对象id
         :param obj_size: 对象大小
+        :param layout: 对象数据布局，默认旧布局
         :return:
             success: True
         :raises: class:`RadosError`
         '''
         try:
-            with self._open_ioctx(self._pool_name) as ioctx:
-                hos = HarborObjectStructure(obj_id=obj_id, obj_size=obj_size)
-                for part_id in hos.parts_id:
+            with self._ioctx(self._pool_name) as ioctx:
+                layout = layout if layout is not None else DEFAULT_LAYOUT
+                for part_id in layout.rados_ids(obj_id=obj_id, obj_size=obj_size):
                     try:
                         ok = ioctx.remove_object(part_id)
                         if ok is True:
@@ -459,6 +1046,56 @@ class RadosAPI:
         except Exception as e:
             raise RadosError(str(e))
 
+    def delete_many(self, objects, max_inflight: int = 32):
+        '''
+        批量删除对象，所有rados对象通过aio_remove异步删除，同时在途的删除最多max_inflight个，超过时等待最早的删除完成；
+        rados对象不存在视为删除成功
+
+        :param objects: [(obj_id, obj_size, layout), ]
+        :param max_inflight: 同时在途的异步删除最大数
+        :return:
+            {index: str}    # 删除失败的对象在objects中的索引和错误描述，全部成功时为空
+        :raises: class:`RadosError`     # 获取IoCtx失败
+        '''
+        errors = {}
+        inflight = deque()      # [(completion, index, part_id)]
+        max_inflight = max(max_inflight, 1)
+
+        def wait_oldest():
+            completion, index, part_id = inflight.popleft()
+            try:
+                completion.wait_for_complete()
+                r = completion.get_return_value()
+            except rados.Error as e:
+                r = -(e.errno or errno.EIO)
+
+            if r < 0 and r != -errno.ENOENT:
+                errors.setdefault(index, f'Failed to remove rados object {part_id}, errno={-r}')
+
+        try:
+            with self._ioctx(self._pool_name) as ioctx:
+                for index, (obj_id, obj_size, layout) in enumerate(objects):
+                    layout = layout if layout is not None else DEFAULT_LAYOUT
+                    for part_id in layout.rados_ids(obj_id=obj_id, obj_size=obj_size):
+                        while len(inflight) >= max_inflight:
+                            wait_oldest()
+
+                        try:
+                            completion = ioctx.aio_remove(part_id)
+                        except rados.ObjectNotFound:
+                            continue
+                        except rados.Error as e:
+                            msg = e.args[0] if e.args else f'Failed to remove rados object {part_id}'
+                            errors.setdefault(index, msg)
+                            continue
+
+                        inflight.append((completion, index, part_id))
+        finally:
+            while inflight:
+                wait_oldest()
+
+        return errors
+
     def rados_stat(self, obj_id):
         '''
         获取rados对象大小和修改时间
@@ -469,7 +1106,7 @@ class RadosAPI:
         :raises: class:`RadosError`, `RadosNotFound`
         '''
         try:
-            with self._open_ioctx(self._pool_name) as ioctx:
+            with self._ioctx(self._pool_name) as ioctx:
                 size, t = ioctx.stat(obj_id)
         except rados.ObjectNotFound:
             raise RadosNotFound('rados对象不存在')
@@ -615,6 +1252,267 @@ class RadosAPI:
         return data
 
 
+class RadosAioWriter:
+    '''
+    rados对象异步流水线写入
+
+    顺序到达的小数据块先合并缓存，缓存数据达到写入块大小(按write_size对齐)时通过aio_write异步写入，
+    同时在途的异步写最多max_inflight个，超过时等待最早的写完成；
+    flush()写入剩余缓存数据并等待所有异步写完成，是完成屏障(barrier)
+    '''
+    def __init__(self, rados: RadosAPI, obj_id: str, max_inflight: int = 4, write_size: int = 16 * 1024 ** 2,
+                 layout=None):
+        '''
+        :param rados: RadosAPI()
+        :param obj_id: 对象id
+        :param max_inflight: 同时在途的异步写最大数
+        :param write_size: 合并写入块大小
+        :param layout: 对象数据布局，默认旧布局
+        :raises: class:`RadosError`
+        '''
+        self._rados = rados
+        self._obj_id = obj_id
+        self._layout = layout if layout is not None else DEFAULT_LAYOUT
+        self._max_inflight = max(max_inflight, 1)
+        write_size = max(write_size, 1)
+        # 条带布局时，合并写入块按整条带对齐，一次写入并行分布到条带的各个rados对象
+        if isinstance(self._layout, StripeLayout):
+            stripe_size = self._layout.stripe_unit * self._layout.stripe_count
+            write_size = max(write_size // stripe_size, 1) * stripe_size
+            self._max_inflight = max(self._max_inflight, self._layout.stripe_count)
+        self._write_size = write_size
+        self._ioctx = rados.get_ioctx()
+        self._buffer = bytearray()
+        self._buf_offset = 0        # 缓存数据在对象中的偏移量
+        self._inflight = deque()    # [(completion, part_id, part_offset, data)]
+        self._error = None
+
+    @property
+    def pending(self):
+        '''缓存的和在途的写入数'''
+        return len(self._inflight) + (1 if self._buffer else 0)
+
+    def write(self, data, offset: int):
+        '''
+        写入数据，数据被缓存或异步写入，写入错误在之后的write()或flush()时抛出
+
+        :param data: bytes
+        :param offset: 数据写入对象的偏移量
+        :raises: class:`RadosWriteError`
+        '''
+        if self._error is not None:
+            raise self._error
+
+        if offset < 0:
+            raise RadosWriteError('offset must be >=0')
+
+        if not data:
+            return
+
+        # 和缓存数据不连续，先写出缓存数据
+        if self._buffer and offset != self._buf_offset + len(self._buffer):
+            self._submit_buffer(len(self._buffer))
+
+        if not self._buffer:
+            self._buf_offset = offset
+
+        self._buffer += data
+        # 写出到下一个write_size对齐边界的数据
+        while self._buffer:
+            boundary = (self._buf_offset // self._write_size + 1) * self._write_size
+            size = boundary - self._buf_offset
+            if len(self._buffer) < size:
+                break
+
+            self._submit_buffer(size)
+
+    def flush(self):
+        '''
+        写入剩余缓存数据，并等待所有异步写完成
+
+        :raises: class:`RadosWriteError`
+        '''
+        if self._error is None and self._buffer:
+            self._submit_buffer(len(self._buffer))
+
+        while self._inflight:
+            self._wait_oldest()
+
+        if self._error is not None:
+            raise self._error
+
+    def abort(self):
+        '''
+        丢弃缓存数据，等待在途的异步写完成，不抛出错误
+        '''
+        self._buffer = bytearray()
+        while self._inflight:
+            completion, *_ = self._inflight.popleft()
+            try:
+                completion.wait_for_complete()
+            except Exception:
+                pass
+
+    def _submit_buffer(self, size: int):
+        data = bytes(self._buffer[:size])
+        offset = self._buf_offset
+        del self._buffer[:size]
+        self._buf_offset = offset + size
+
+        tasks = self._layout.write_tasks(self._obj_id, offset=offset, bytes_len=len(data))
+        for part_id, off, start, end in tasks:
+            while len(self._inflight) >= self._max_inflight:
+                self._wait_oldest()
+
+            chunk = data if (start == 0 and end == len(data)) else data[start:end]
+            try:
+                completion = self._ioctx.aio_write(part_id, chunk, offset=off)
+            except rados.Error:
+                # 提交异步写失败，同步写入
+                self._sync_write(part_id, off, chunk)
+                continue
+
+            self._inflight.append((completion, part_id, off, chunk))
+
+    def _wait_oldest(self):
+        completion, part_id, off, chunk = self._inflight.popleft()
+        try:
+            completion.wait_for_complete()
+            r = completion.get_return_value()
+        except rados.Error:
+            r = -1
+
+        if r < 0:
+            # 异步写失败，同步再尝试一次
+            self._sync_write(part_id, off, chunk)
+
+    def _sync_write(self, part_id, off, chunk):
+        try:
+            r = self._ioctx.write(part_id, chunk, offset=off)
+            if r != 0:
+                raise RadosWriteError('Failed to write bytes to rados object')
+        except rados.Error as e:
+            self._rados.discard_ioctx(self._ioctx)
+            msg = e.args[0] if e.args else 'Failed to write bytes to rados object'
+            self._error = RadosWriteError(msg, errno=getattr(e, 'errno', None))
+
+
+class CompressWriter:
+    '''
+    对象数据分块压缩写入，接口同RadosAioWriter；只支持从偏移量0开始顺序写入，
+    数据按块压缩后通过RadosAioWriter流水线写入压缩数据，flush()后由get_index()获取块索引
+    '''
+    def __init__(self, writer: RadosAioWriter, codec: str, block_size: int):
+        '''
+        :param writer: 压缩数据的写入器，布局为CompressedLayout
+        :raises: ValueError
+        '''
+        self._writer = writer
+        self._compressor = BlockCompressor(codec=codec, block_size=block_size)
+        self._raw_size = 0
+        self._stored_size = 0
+        self._finished = False
+
+    @property
+    def pending(self):
+        return self._writer.pending
+
+    def _write_blocks(self, blocks):
+        for block in blocks:
+            self._writer.write(block, offset=self._stored_size)
+            self._stored_size += len(block)
+
+    def write(self, data, offset: int):
+        '''
+        :raises: class:`RadosWriteError`
+        '''
+        if self._finished or offset != self._raw_size:
+            raise RadosWriteError('compressed object only supports sequential writing')
+
+        self._raw_size += len(data)
+        self._write_blocks(self._compressor.feed(data))
+
+    def flush(self):
+        '''
+        压缩写入最后一个块，并等待所有异步写完成；之后不能再写入
+
+        :raises: class:`RadosWriteError`
+        '''
+        if not self._finished:
+            self._finished = True
+            self._write_blocks(self._compressor.finish())
+
+        self._writer.flush()
+
+    def abort(self):
+        self._finished = True
+        self._writer.abort()
+
+    def get_index(self):
+        '''
+        :return: bytes  # 块索引，存储在对象元数据中
+        '''
+        return self._compressor.index.to_bytes()
+
+
+class _ReadAheadError:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+_READ_AHEAD_END = object()
+
+
+def read_ahead_generator(blocks, depth: int = 2):
+    '''
+    预读生成器，后台线程从数据块生成器blocks迭代读取数据块放入有界队列(最多depth个)，
+    使存储读取和向客户端发送数据重叠进行；
+
+    生成器关闭(如客户端断开连接)时通知后台线程停止读取；生成器开始迭代时才启动后台线程
+
+    :param blocks: 数据块生成器，如HarborObject.read_obj_generator()
+    :param depth: 预读队列深度，最多预读的数据块数
+    :return: generator
+    '''
+    q = queue.Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def worker():
+        try:
+            for block in blocks:
+                if not put(block):
+                    break
+        except Exception as e:
+            put(_ReadAheadError(e))
+        finally:
+            blocks.close()
+            put(_READ_AHEAD_END)
+
+    t = threading.Thread(target=worker, name='harbor-read-ahead', daemon=True)
+    t.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _READ_AHEAD_END:
+                break
+            if isinstance(item, _ReadAheadError):
+                raise item.exc
+
+            yield item
+    finally:
+        stop.set()
+
+
 class HarborObjectBase:
     '''
     HarborObject读写相关的封装类，要实现此基类的方法
@@ -636,7 +1534,7 @@ class HarborObjectBase:
         '''删除对象'''
         raise NotImplementedError('`delete()` must be implemented.')
 
-    def read_obj_generator(self, offset=0, end=None, block_size=10 * 1024 ** 2):
+    def read_obj_generator(self, offset=0, end=None, block_size=10 * 1024 ** 2, read_ahead: int = 0):
         '''读取对象生成器'''
         raise NotImplementedError('`read_obj_generator()` must be implemented.')
 
@@ -678,7 +1576,13 @@ class HarborObject:
     iHarbor对象操作接口封装，
     '''
     def __init__(self, pool_name, obj_id, obj_size=0,cluster_name=None,  user_name=None, conf_file='',
-                 keyring_file='', *args, **kwargs):
+                 keyring_file='', layout=None, inline=None, cindex=None, *args, **kwargs):
+        '''
+        :param layout: 对象数据布局字符串(对象元数据lay)，或PartLayout()；默认旧布局
+        :param inline: 内联在元数据中的对象数据(对象元数据inl)，不为None时读取和删除不访问rados
+        :param cindex: 压缩块索引(对象元数据cidx)，分块压缩的对象读取时需要
+        :raises: ValueError     # 无效的layout
+        '''
         self._cluster_name = cluster_name if cluster_name else settings.CEPH_RADOS.get('CLUSTER_NAME', 'ceph')
         self._user_name = user_name if user_name else settings.CEPH_RADOS.get('USER_NAME', '')
         self._conf_file = conf_file if os.path.exists(conf_file) else settings.CEPH_RADOS.get('CONF_FILE_PATH', '')
@@ -687,13 +1591,76 @@ class HarborObject:
         self._pool_name = pool_name
         self._obj_id = obj_id
         self._obj_size = obj_size
+        self._layout = parse_layout(layout)
+        self._inline = bytes(inline) if inline is not None else None
+        self._cindex = cindex
+        self._block_index = None
         self._rados = None
 
-    def reset_obj_id_and_size(self, obj_id=None, obj_size=None):
+    def reset_obj_id_and_size(self, obj_id=None, obj_size=None, layout=None, cindex=None):
         if obj_id is not None:
             self._obj_id = obj_id
         if obj_size is not None:
             self._obj_size = obj_size
+        if layout is not None:
+            self._layout = parse_layout(layout)
+            self._cindex = cindex
+            self._block_index = None
+
+    def get_layout(self):
+        '''获取对象数据布局'''
+        return self._layout
+
+    def get_pool_name(self):
+        return self._pool_name
+
+    def get_obj_id(self):
+        return self._obj_id
+
+    def is_packed(self):
+        '''对象数据是否打包在pack文件中'''
+        return isinstance(self._layout, PackLayout)
+
+    def is_deduped(self):
+        '''对象数据是否是去重共享的blob'''
+        return isinstance(self._layout, DedupLayout)
+
+    def is_relocated(self):
+        '''对象数据是否在其他rados key下(如分片上传的数据)'''
+        return isinstance(self._layout, RelocatedLayout)
+
+    def is_compressed(self):
+        '''对象数据是否分块压缩'''
+        return isinstance(self._layout, CompressedLayout)
+
+    def is_read_only(self):
+        '''对象数据布局是否只读(打包、去重或压缩)，写入前需要先复制为可写的布局'''
+        return isinstance(self._layout, (PackLayout, DedupLayout, CompressedLayout))
+
+    def get_block_index(self):
+        '''
+        压缩块索引
+
+        :return:
+            BlockIndex()
+        :raises: ValueError
+        '''
+        if self._block_index is None:
+            if self._cindex is None:
+                raise ValueError('block index of compressed object is missing')
+            self._block_index = BlockIndex.from_bytes(self._cindex)
+
+        return self._block_index
+
+    def is_inline(self):
+        '''对象数据是否内联在元数据中'''
+        return self._inline is not None
+
+    def set_inline(self, inline):
+        '''
+        设置内联的对象数据，None表示对象数据在rados中
+        '''
+        self._inline = bytes(inline) if inline is not None else None
 
     def get_obj_size(self):
         '''获取对象大小'''
@@ -708,18 +1675,24 @@ class HarborObject:
 
     def get_rados_api(self):
         '''
-        获取RadosAPI对象
+        获取存储后端接口对象，由settings.CEPH_RADOS['BACKEND']选择，默认ceph
 
         :return:
-            RadosAPI()  # success
+            RadosAPI() or LocalFSAPI()  # success
 
         :raises: class:`RadosError`
         '''
         if not self._rados:
+            backend = settings.CEPH_RADOS.get('BACKEND', 'rados')
             try:
-                self._rados = RadosAPI(cluster_name=self._cluster_name, user_name=self._user_name,
-                                       pool_name=self._pool_name,
-                                       conf_file=self._conf_file, keyring_file=self._keyring_file)
+                if backend == 'localfs':
+                    from .localfs import LocalFSAPI
+                    self._rados = LocalFSAPI(pool_name=self._pool_name,
+                                             root_dir=settings.CEPH_RADOS.get('LOCAL_ROOT', ''))
+                else:
+                    self._rados = RadosAPI(cluster_name=self._cluster_name, user_name=self._user_name,
+                                           pool_name=self._pool_name,
+                                           conf_file=self._conf_file, keyring_file=self._keyring_file)
             except RadosError as e:
                 raise e
 
@@ -732,7 +1705,7 @@ class HarborObject:
         :param offset: 偏移位置
         :param size: 读取长度
         :return: Tuple
-            正常时：(True, bytes) bytes是读取的数据
+            正常时：(True, bytes) bytes是读取的数据, 数据跨part或需补0时为memoryview
             错误时：(False, error_msg) error_msg是错误描述
         '''
         if offset < 0 or size < 0:
@@ -744,10 +1717,18 @@ class HarborObject:
             return True, bytes()
         # 读取数据超出对象大小，计算可读取大小
         read_size = (obj_size - offset) if (offset + size) > obj_size else size
+        if self._inline is not None:
+            return True, self._inline[offset:offset + read_size]
+
+        if self.is_compressed():
+            data = b''.join(self._read_compressed_blocks(offset=offset, end_oft=offset + read_size))
+            if len(data) != read_size:
+                return False, 'failed to read compressed object'
+            return True, data
 
         try:
             rados = self.get_rados_api()
-            data = rados.read(obj_id=self._obj_id, offset=offset, read_size=read_size)
+            data = rados.read(obj_id=self._obj_id, offset=offset, read_size=read_size, layout=self._layout)
         except RadosError as e:
             return False, str(e)
 
@@ -765,6 +1746,9 @@ class HarborObject:
         if offset < 0 or not isinstance(data_block, bytes):
             return False, 'offset must be >=0 and data input must be bytes'
 
+        if self.is_compressed():
+            return False, 'compressed object is read only'
+
         block_size = len(data_block)
         if chunk_size is None:  # 未明确指定分片写入，则一次输入
             chunk_size = block_size
@@ -782,7 +1766,7 @@ class HarborObject:
             if chunk:
                 try:
                     rados = self.get_rados_api()
-                    rados.write(obj_id=self._obj_id, offset=offset, data=chunk)
+                    rados.write(obj_id=self._obj_id, offset=offset, data=chunk, layout=self._layout)
                 except (RadosError, Exception) as e:
                     return False, str(e)
 
@@ -803,9 +1787,12 @@ class HarborObject:
                 （True, msg）无误
                  (False msg) 错误
         '''
+        if self.is_compressed():
+            return False, 'compressed object is read only'
+
         try:
             rados = self.get_rados_api()
-            rados.write_file(obj_id=self._obj_id, offset=offset, file=file)
+            rados.write_file(obj_id=self._obj_id, offset=offset, file=file, per_size=per_size, layout=self._layout)
         except (RadosError, Exception) as e:
             return False, str(e)
 
@@ -813,6 +1800,42 @@ class HarborObject:
         self._obj_size = max(offset + file_size, self._obj_size)
         return True, 'success to write file'
 
+    def copy_to(self, dst, block_size: int = 32 * 1024 ** 2, read_ahead: int = 2, max_inflight: int = 4):
+        '''
+        对象数据复制到另一个对象，目标对象可以在不同pool、使用不同数据布局；
+        后台线程预读源对象数据块，异步流水线写入目标对象，读和写重叠进行，数据不经过客户端
+
+        :param dst: 目标对象HarborObject()，不能是内联、打包或去重的对象
+        :param block_size: 每次读写数据块大小
+        :param read_ahead: 预读数据块数
+        :param max_inflight: 同时在途的异步写最大数
+        :return:
+            (True, msg)     # 复制成功
+            (False, msg)    # 复制失败，目标对象可能已写入部分数据
+        '''
+        obj_size = self.get_obj_size()
+        writer = None
+        gen = self.read_obj_generator(block_size=block_size, read_ahead=read_ahead)
+        offset = 0
+        try:
+            writer = dst.get_aio_writer(max_inflight=max_inflight, write_size=block_size)
+            for data in gen:
+                writer.write(data, offset=offset)
+                offset += len(data)
+            writer.flush()
+        except (RadosError, ValueError) as e:
+            if writer is not None:
+                writer.abort()
+            return False, str(e)
+        finally:
+            gen.close()
+
+        if offset != obj_size:
+            return False, 'failed to read data of source object'
+
+        dst._obj_size = max(offset, dst._obj_size)
+        return True, 'success to copy object'
+
     def delete(self, obj_size=None):
         '''
         删除对象
@@ -821,24 +1844,63 @@ class HarborObject:
             错误时：(False, str) str是错误描述
         '''
         size = obj_size if isinstance(obj_size, int) else self.get_obj_size()
+        if self._inline is not None:    # 没有rados数据
+            self._inline = None
+            self._obj_size = 0
+            return True, 'delete success'
 
         try:
             rados = self.get_rados_api()
-            rados.delete(obj_id=self._obj_id, obj_size=size)
+            rados.delete(obj_id=self._obj_id, obj_size=size, layout=self._layout)
         except (RadosError, Exception) as e:
             return False, str(e)
 
         self._obj_size = 0
         return True, 'delete success'
 
-    def read_obj_generator(self, offset=0, end=None, block_size=10 * 1024 ** 2):
+    @staticmethod
+    def delete_many(objects, max_inflight: int = 32):
+        '''
+        批量删除同一个pool中的多个对象，rados数据并行异步删除，见RadosAPI.delete_many()
+
+        :param objects: [HarborObject(), ]，obj_size需要是对象大小
+        :param max_inflight: 同时在途的异步删除最大数
+        :return:
+            {index: str}    # 删除失败的对象在objects中的索引和错误描述，全部成功时为空
+        '''
+        indexes = []
+        items = []
+        for i, ho in enumerate(objects):
+            if ho._inline is None:      # 内联的对象没有rados数据
+                indexes.append(i)
+                items.append((ho._obj_id, ho._obj_size, ho._layout))
+
+        if not items:
+            return {}
+
+        try:
+            errors = objects[indexes[0]].get_rados_api().delete_many(items, max_inflight=max_inflight)
+        except Exception as e:
+            return {i: str(e) for i in indexes}
+
+        return {indexes[i]: msg for i, msg in errors.items()}
+
+    def read_obj_generator(self, offset=0, end=None, block_size=10 * 1024 ** 2, read_ahead: int = 0):
         '''
         读取对象生成器
         :param offset: 读起始偏移量；type: int
         :param end: 读结束偏移量(包含)；type: int；None:表示对象结尾；
         :param block_size: 每次读取数据块长度；type: int
+        :param read_ahead: 预读数据块数，>0时后台线程预读，见read_ahead_generator()；type: int
         :return:
         '''
+        generator = self._read_obj_blocks(offset=offset, end=end, block_size=block_size)
+        if read_ahead > 0 and self._inline is None:
+            return read_ahead_generator(generator, depth=read_ahead)
+
+        return generator
+
+    def _read_obj_blocks(self, offset=0, end=None, block_size=10 * 1024 ** 2):
         obj_size = self.get_obj_size()
         if isinstance(end, int):
             end_oft = min(end + 1, obj_size)  # 包括end,不大于对象大小
@@ -846,15 +1908,41 @@ class HarborObject:
             end_oft = obj_size
 
         oft = max(offset, 0)
+        if oft >= end_oft:
+            return
+
+        if self._inline is not None:
+            view = memoryview(self._inline)
+            for start in range(oft, end_oft, block_size):
+                yield view[start:min(start + block_size, end_oft)]
+            return
+
+        if self.is_compressed():
+            yield from self._read_compressed_blocks(offset=oft, end_oft=end_oft)
+            return
+
+        # 整个读取过程持有同一个IoCtx，避免每个数据块都打开IoCtx
+        try:
+            rados = self.get_rados_api()
+            ioctx = rados.get_ioctx()
+        except RadosError:
+            return
+
         while True:
             # 下载完成
             if oft >= end_oft:
                 break
 
             size = min(end_oft - oft, block_size)
-            ok, data_block = self.read(offset=oft, size=size)
-            # 读取发生错误，尝试再读一次
-            if not ok:
+            try:
+                data_block = rados.read(obj_id=self._obj_id, offset=oft, read_size=size, ioctx=ioctx,
+                                        layout=self._layout)
+                ok = True
+            except RadosError:
+                # 读取发生错误，IoCtx可能已失效，重新获取IoCtx再读一次
+                if ioctx is not None:
+                    rados.discard_ioctx(ioctx)
+                    ioctx = None
                 ok, data_block = self.read(offset=oft, size=size)
 
             if ok and data_block:
@@ -864,6 +1952,33 @@ class HarborObject:
             else:
                 break
 
+    def _read_compressed_blocks(self, offset, end_oft):
+        '''
+        读取分块压缩的对象数据，只读取和解压[offset, end_oft)涉及的压缩块，每次返回一个压缩块的数据；
+        读取错误时结束
+        '''
+        layout = self._layout
+        bs = layout.block_size
+        try:
+            index = self.get_block_index()
+            rados = self.get_rados_api()
+            ioctx = rados.get_ioctx()
+        except (RadosError, ValueError):
+            return
+
+        for i in range(offset // bs, (end_oft - 1) // bs + 1):
+            try:
+                stored_offset, stored_len, raw = index.block(i)
+                data = rados.read(obj_id=self._obj_id, offset=stored_offset, read_size=stored_len, ioctx=ioctx,
+                                  layout=layout)
+                if not raw:
+                    data = decompress_block(layout.codec, data)
+            except (RadosError, ValueError, IndexError):
+                return
+
+            start = i * bs
+            yield memoryview(data)[max(offset - start, 0):min(end_oft - start, len(data))]
+
     def write_obj_generator(self):
         '''
         写入对象生成器
@@ -880,6 +1995,25 @@ class HarborObject:
             offset, data = yield ok
             ok, _ = self.write(offset=offset, data_block=data)
 
+    def get_aio_writer(self, max_inflight: int = 4, write_size: int = 16 * 1024 ** 2):
+        '''
+        获取对象异步流水线写入器
+
+        :param max_inflight: 同时在途的异步写最大数
+        :param write_size: 合并写入块大小
+        :return:
+            RadosAioWriter() or CompressWriter()
+        :raises: class:`RadosError`
+        '''
+        rados = self.get_rados_api()
+        writer = RadosAioWriter(rados=rados, obj_id=self._obj_id, max_inflight=max_inflight, write_size=write_size,
+                                layout=self._layout)
+        # 分块压缩的对象，顺序写入的数据压缩后写入
+        if self.is_compressed():
+            return CompressWriter(writer=writer, codec=self._layout.codec, block_size=self._layout.block_size)
+
+        return writer
+
     def get_cluster_stats(self):
         '''
         获取ceph集群总容量和已使用容量
@@ -920,13 +2054,18 @@ class HarborObject:
 
         :return:
                int, [item, ...]   # item: str; format = iharbor:{cluster_name}/{pool_name}/{rados-key}
+               条带布局时int为条带单元大小，rados对象按条带轮流分布，见StripeLayout；
+               去重共享数据的对象为blob的rados对象
         '''
-        hos = HarborObjectStructure(obj_id=self._obj_id, obj_size=self._obj_size)
-        parts = hos.parts_id
+        layout = self._layout
+        if isinstance(layout, DedupLayout):
+            parts = layout.blob_rados_ids(obj_size=self._obj_size)
+        else:
+            parts = layout.rados_ids(obj_id=self._obj_id, obj_size=self._obj_size)
         cn = self._cluster_name
         pn = self._pool_name
         info = [f'iharbor:{cn}/{pn}/{k}' for k in parts]
-        return hos.size_part_by, info
+        return layout.size_part_by, info
 
     def get_rados_stat(self, obj_id: str):
         """
@@ -968,6 +2107,10 @@ class FileWrapper:
     def size(self):
         return self._ho.get_obj_size()
 
+    def set_inline(self, inline):
+        '''文件数据内联在对象元数据中，见HarborObject.set_inline()'''
+        self._ho.set_inline(inline)
+
     @size.setter
     def size(self, value):
         self._ho.reset_obj_id_and_size(obj_size=value)
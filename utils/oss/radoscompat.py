@@ -0,0 +1,20 @@
+'''
+未安装librados python包(rados)时的替代，只提供异常类型，以便使用本地文件系统存储后端(localfs)；
+使用ceph存储后端时必须安装rados包
+'''
+
+
+class Error(Exception):
+    '''def __init__(self, message, errno=None)'''
+    def __init__(self, message, errno=None):
+        super().__init__(message)
+        self.errno = errno
+
+
+class ObjectNotFound(Error):
+    pass
+
+
+class Rados:
+    def __init__(self, *args, **kwargs):
+        raise Error('the python package "rados" of librados is not installed')
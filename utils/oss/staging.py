@@ -0,0 +1,290 @@
+'''
+热点对象下载的本地磁盘暂存层：热点对象的数据从rados读取一次写入本地磁盘(SSD)文件，之后的下载由前端web服务器
+(nginx X-Accel-Redirect、X-Sendfile)或uwsgi offload线程直接发送文件，不占用uwsgi工作线程
+
+nginx配置示例(settings.DOWNLOAD_STAGING['OFFLOAD'] = 'nginx'，'NGINX_LOCATION' = '/_staging/')：
+    location /_staging/ {
+        internal;
+        alias /data/iharbor_staging/;
+    }
+
+暂存文件路径为{root}/{sha1(obj_key)[:2]}/{sha1(obj_key)}/{sha1(cache_key)}，cache_key包含对象修改时间和大小(见
+cache.build_cache_key)，对象修改后旧文件不再被使用；同一对象的文件在一个目录中，对象删除或覆盖时删除整个目录
+'''
+import os
+import time
+import shutil
+import hashlib
+import threading
+
+from django.conf import settings
+
+from .cache import FrequencySketch
+from .connections import register_reset_callback
+
+
+class StagingArea:
+    '''
+    本地磁盘暂存区，多进程共享同一目录；文件修改时间记录最近一次使用时间，超过ttl未使用或总大小超过容量时，
+    由后台线程按最近使用时间淘汰
+    '''
+    evict_interval = 60     # 两次淘汰扫描的最小间隔(秒)
+
+    def __init__(self, root_dir: str, capacity: int, ttl: int, min_object_size: int, max_object_size: int,
+                 min_hits: int = 2):
+        self.root_dir = root_dir
+        self.capacity = capacity
+        self.ttl = ttl
+        self.min_object_size = min_object_size
+        self.max_object_size = max_object_size
+        self.min_hits = min_hits
+        self._sketch = FrequencySketch()
+        self._lock = threading.Lock()
+        self._evicting = False
+        self._last_evict = 0
+        os.makedirs(root_dir, exist_ok=True)
+
+    @staticmethod
+    def _hash(s: str):
+        return hashlib.sha1(s.encode()).hexdigest()
+
+    def _obj_dir(self, obj_key: str):
+        name = self._hash(obj_key)
+        return os.path.join(self.root_dir, name[:2], name)
+
+    def relpath(self, obj_key: str, key: str):
+        '''
+        暂存文件相对于暂存区根目录的路径
+        '''
+        name = self._hash(obj_key)
+        return f'{name[:2]}/{name}/{self._hash(key)}'
+
+    def path(self, obj_key: str, key: str):
+        return os.path.join(self.root_dir, self.relpath(obj_key=obj_key, key=key))
+
+    def stageable(self, size: int):
+        return self.min_object_size <= size <= self.max_object_size
+
+    def lookup(self, obj_key: str, key: str, size: int):
+        '''
+        查找对象的暂存文件，找到时更新文件修改时间(最近使用时间)；未找到时记录一次访问
+
+        :param obj_key: 对象rados key
+        :param key: 缓存key, cache.build_cache_key()
+        :param size: 对象大小
+        :return:
+            str     # 暂存文件路径
+            None    # 未暂存
+        '''
+        path = self.path(obj_key=obj_key, key=key)
+        try:
+            os.utime(path)
+            if os.path.getsize(path) == size:
+                return path
+        except OSError:
+            pass
+
+        with self._lock:
+            self._sketch.increment(key)
+
+        return None
+
+    def is_hot(self, key: str):
+        '''
+        对象访问次数是否达到暂存的次数下限
+        '''
+        with self._lock:
+            return self._sketch.frequency(key) >= self.min_hits
+
+    def stage_generator(self, obj_key: str, key: str, size: int, generator):
+        '''
+        读取对象完整数据的生成器，边返回数据边写入暂存文件，数据完整时改名为暂存文件，并删除对象的其他版本的暂存文件；
+        写入暂存文件出错时只放弃暂存，不影响数据返回
+
+        :param generator: 读取对象完整数据的生成器
+        :return: generator
+        '''
+        obj_dir = self._obj_dir(obj_key)
+        path = self.path(obj_key=obj_key, key=key)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        f = None
+        try:
+            os.makedirs(obj_dir, exist_ok=True)
+            f = open(tmp, 'wb')
+        except OSError:
+            pass
+
+        written = 0
+        try:
+            for block in generator:
+                if f is not None:
+                    try:
+                        f.write(block)
+                        written += len(block)
+                    except OSError:
+                        f.close()
+                        f = None
+                        self._remove(tmp)
+                yield block
+        finally:
+            if f is not None:
+                f.close()
+                if written == size:
+                    self._replace(tmp, path, obj_dir)
+                else:
+                    self._remove(tmp)
+
+        self.maybe_evict()
+
+    def _replace(self, tmp: str, path: str, obj_dir: str):
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            self._remove(tmp)
+            return
+
+        # 删除对象修改前的版本
+        name = os.path.basename(path)
+        try:
+            for n in os.listdir(obj_dir):
+                if n != name and not n.endswith('.tmp'):
+                    self._remove(os.path.join(obj_dir, n))
+        except OSError:
+            pass
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def invalidate(self, obj_key: str):
+        '''
+        删除对象所有的暂存文件，对象删除或覆盖时调用
+        '''
+        shutil.rmtree(self._obj_dir(obj_key), ignore_errors=True)
+
+    def maybe_evict(self):
+        '''
+        距上次淘汰扫描超过evict_interval时，启动后台线程淘汰暂存文件
+        '''
+        now = time.time()
+        with self._lock:
+            if self._evicting or now - self._last_evict < self.evict_interval:
+                return
+            self._evicting = True
+            self._last_evict = now
+
+        threading.Thread(target=self._evict_worker, daemon=True).start()
+
+    def _evict_worker(self):
+        try:
+            self.evict()
+        finally:
+            with self._lock:
+                self._evicting = False
+
+    def evict(self):
+        '''
+        删除超过ttl未使用的暂存文件和遗留的临时文件，总大小超过容量时按最近使用时间删除，直到不超过容量的90%
+
+        :return: 删除的文件数
+        '''
+        now = time.time()
+        files = []
+        removed = 0
+        for dirpath, dirnames, filenames in os.walk(self.root_dir):
+            for n in filenames:
+                path = os.path.join(dirpath, n)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+
+                if now - st.st_mtime > self.ttl:
+                    self._remove(path)
+                    removed += 1
+                elif not n.endswith('.tmp'):
+                    files.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        if total > self.capacity:
+            files.sort()
+            target = self.capacity * 0.9
+            for _, size, path in files:
+                if total <= target:
+                    break
+                self._remove(path)
+                total -= size
+                removed += 1
+
+        # 删除空的对象目录
+        for dirpath, dirnames, filenames in os.walk(self.root_dir, topdown=False):
+            if dirpath != self.root_dir and not filenames and not dirnames:
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass
+
+        return removed
+
+
+_staging_area = None
+_staging_area_lock = threading.Lock()
+
+
+def get_staging_conf():
+    '''
+    下载暂存层配置，settings.DOWNLOAD_STAGING
+
+    :return: dict
+    '''
+    conf = getattr(settings, 'DOWNLOAD_STAGING', None)
+    return conf if conf else {}
+
+
+def get_staging_area():
+    '''
+    进程共享的下载暂存区，由settings.DOWNLOAD_STAGING配置，未启用时返回None
+
+    :return:
+        StagingArea() or None
+    '''
+    global _staging_area
+    conf = get_staging_conf()
+    if not conf.get('ENABLE', False) or not conf.get('DIR', ''):
+        return None
+
+    if _staging_area is None:
+        with _staging_area_lock:
+            if _staging_area is None:
+                _staging_area = StagingArea(root_dir=conf['DIR'],
+                                            capacity=conf.get('SIZE', 100 * 1024 ** 3),
+                                            ttl=conf.get('TTL', 24 * 3600),
+                                            min_object_size=conf.get('MIN_OBJECT_SIZE', 1024 ** 2),
+                                            max_object_size=conf.get('MAX_OBJECT_SIZE', 4 * 1024 ** 3),
+                                            min_hits=conf.get('MIN_HITS', 2))
+
+    return _staging_area
+
+
+def invalidate_staged(obj_key: str):
+    '''
+    删除对象的暂存文件，未启用暂存层时忽略
+    '''
+    area = get_staging_area()
+    if area is not None:
+        area.invalidate(obj_key)
+
+
+def reset_staging_area():
+    '''
+    fork后子进程中丢弃继承的暂存区实例（锁状态不确定）
+    '''
+    global _staging_area, _staging_area_lock
+    _staging_area = None
+    _staging_area_lock = threading.Lock()
+
+
+register_reset_callback(reset_staging_area)
@@ -8,6 +8,8 @@ from utils.md5 import offset_chunks
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "webserver.settings")
 from .pyrados import HarborObject, get_size
+from .cache import ObjectCache
+from .compress import BlockIndex, BlockCompressor, decompress_block
 
 
 def random_string(length: int = 10):
@@ -100,5 +102,82 @@ class TestHarborObject(unittest.TestCase):
         self.assertTrue(ok, msg='delete rados error.')
 
 
+class TestObjectCache(unittest.TestCase):
+    def test_read_generator(self):
+        cache = ObjectCache(memory_size=1024, max_object_size=512)
+        data = os.urandom(500)
+        loads = []
+
+        def load(offset, end):
+            loads.append((offset, end))
+            yield data[:300]
+            yield data[300:]
+
+        r = b''.join(cache.read_generator(key='k', obj_size=500, load=load, block_size=128))
+        self.assertEqual(r, data)
+        r = b''.join(cache.read_generator(key='k', obj_size=500, load=load, offset=100, end=299, block_size=128))
+        self.assertEqual(r, data[100:300])
+        self.assertEqual(len(loads), 1, msg='cache miss')
+        self.assertEqual(cache.stats()['memory_hits'], 1)
+
+    def test_tinylfu_admission(self):
+        cache = ObjectCache(memory_size=1000, max_object_size=600)
+        for _ in range(3):
+            cache.get('hot')
+        cache.put('hot', b'h' * 600)
+        cache.get('cold')
+        cache.put('cold', b'c' * 600)      # 访问频率低于hot，拒绝准入
+        self.assertIsNotNone(cache.get('hot'))
+        self.assertIsNone(cache.get('cold'))
+        self.assertEqual(cache.stats()['rejections'], 1)
+
+
+class TestBlockCompressor(unittest.TestCase):
+    def compress(self, codec: str, data: bytes, block_size: int, feed_size: int):
+        c = BlockCompressor(codec=codec, block_size=block_size)
+        stored = b''
+        for i in range(0, len(data), feed_size):
+            stored += b''.join(c.feed(data[i:i + feed_size]))
+        stored += b''.join(c.finish())
+        return c.index, stored
+
+    def decompress(self, codec: str, index, stored: bytes):
+        data = b''
+        for i in range(len(index)):
+            offset, length, raw = index.block(i)
+            block = stored[offset:offset + length]
+            data += block if raw else decompress_block(codec, block)
+
+        return data
+
+    def test_round_trip(self):
+        data = b'harbor' * 5000 + os.urandom(3000)     # 可压缩的块和压缩无收益的块
+        for codec in ('zlib', 'lzma'):
+            index, stored = self.compress(codec, data, block_size=4096, feed_size=1000)
+            self.assertEqual(len(index), (len(data) + 4095) // 4096)
+            self.assertEqual(index.stored_size, len(stored))
+            self.assertEqual(self.decompress(codec, index, stored), data)
+            self.assertTrue(index.block(len(index) - 1)[2], msg='random data block should be stored raw')
+            self.assertFalse(index.block(0)[2])
+
+    def test_index_bytes(self):
+        index, stored = self.compress('zlib', b'a' * 10000 + os.urandom(5000), block_size=4096, feed_size=4096)
+        index2 = BlockIndex.from_bytes(index.to_bytes())
+        self.assertEqual(len(index2), len(index))
+        for i in range(len(index)):
+            self.assertEqual(index2.block(i), index.block(i))
+        self.assertEqual(self.decompress('zlib', index2, stored)[:10000], b'a' * 10000)
+        with self.assertRaises(ValueError):
+            BlockIndex.from_bytes(b'abc')
+
+    def test_empty_and_invalid(self):
+        index, stored = self.compress('zlib', b'', block_size=4096, feed_size=4096)
+        self.assertEqual((len(index), stored), (0, b''))
+        with self.assertRaises(ValueError):
+            BlockCompressor(codec='gzip', block_size=4096)
+        with self.assertRaises(ValueError):
+            decompress_block('zlib', b'not zlib data')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,12 +1,13 @@
 import os
+import hashlib
 
 from django.conf import settings
-from django.core.files.uploadhandler import FileUploadHandler
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
 from django.core.files.uploadedfile import UploadedFile
 from django.core.exceptions import RequestDataTooBig
 from django.utils.translation import gettext
 
-from utils.oss.pyrados import HarborObject, FileWrapper
+from utils.oss.pyrados import HarborObject, FileWrapper, RadosError, StripeLayout, parse_layout
 from utils.md5 import FileMD5Handler
 
 
@@ -177,55 +178,173 @@ class CephUploadFile(UploadedFile):
     """
     DEFAULT_CHUNK_SIZE = 5 * 2**20     # default 5MB
 
-    def __init__(self, file, field_name, name, content_type, size, charset, file_md5='', content_type_extra=None):
+    def __init__(self, file, field_name, name, content_type, size, charset, file_md5='', content_type_extra=None,
+                 buffered_data=None, compress_index=None):
         super().__init__(file, name, content_type, size, charset, content_type_extra)
         self.field_name = field_name
         self.file_md5 = file_md5
+        self.buffered_data = buffered_data      # 小文件数据未写入ceph，需内联或打包存储; None: 数据已写入ceph
+        self.compress_index = compress_index    # 数据分块压缩写入ceph时的压缩块索引; None: 数据未压缩
 
     def open(self, mode=None):
         self.file.seek(0)
         return self
 
 
+def get_upload_max_size(layout, raw: bool = False):
+    """
+    上传一个完整对象的大小限制
+
+    multipart/form-data上传由CUSTOM_UPLOAD_MAX_FILE_SIZE限制；
+    raw上传(请求体是对象数据)不经过multipart解析，条带布局的对象数据分散在多个rados对象中，由CUSTOM_UPLOAD_RAW_MAX_FILE_SIZE
+    限制，其他布局仍由CUSTOM_UPLOAD_MAX_FILE_SIZE限制
+
+    :param layout: 对象数据布局
+    :param raw: True(raw上传)
+    :return:
+        int
+        None    # 无限制
+    """
+    max_size = getattr(settings, 'CUSTOM_UPLOAD_MAX_FILE_SIZE', 10 * 2 ** 30)    # default 10GB
+    if not raw:
+        return max_size
+
+    try:
+        layout = parse_layout(layout)
+    except ValueError:
+        return max_size
+
+    if isinstance(getattr(layout, 'inner', layout), StripeLayout):
+        return getattr(settings, 'CUSTOM_UPLOAD_RAW_MAX_FILE_SIZE', None)
+
+    return max_size
+
+
 class FileUploadToCephHandler(FileUploadHandler):
     """
     直接存储到ceph的自定义文件上传处理器
+
+    数据块通过aio异步流水线写入ceph，接收网络数据和写入存储并行，file_complete时等待所有写入完成；
+    buffer_max_size > 0时，不大于此大小的小文件数据只缓存在内存中不写入ceph，由上传文件的buffered_data返回，
+    由调用者内联存储在元数据中或打包写入pack文件；
+    layout为分块压缩布局时，数据压缩后写入ceph，压缩块索引由上传文件的compress_index返回，由调用者保存；
+    请求体是对象数据时，由receive_raw_stream()直接读取请求体，不经过Django的multipart解析
     """
     chunk_size = 5 * 2 ** 20    # 5MB
+    raw_read_size = 8 * 2 ** 20     # raw上传每次从请求体读取的数据大小8MB
+    aio_max_inflight = 4        # 同时在途的异步写最大数
+    aio_write_size = 16 * 2 ** 20   # 合并写入块大小16MB
 
-    def __init__(self, request=None, pool_name='', obj_key=''):
+    def __init__(self, request=None, pool_name='', obj_key='', layout='', buffer_max_size=0, compute_md5=False):
         super().__init__(request=request)
         self.pool_name = pool_name
         self.obj_key = obj_key
+        self.layout = layout        # 对象数据布局
+        self.buffer_max_size = buffer_max_size
+        self.small_buffer = None    # 小文件数据缓存
+        self.compute_md5 = compute_md5  # 没有标头Content-MD5时也计算MD5
         self.file = None
+        self.writer = None
         self.file_md5_handler = None
+        self.raw = False            # raw上传
 
     def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
         """
         Handle the raw input from the client.
         """
-        max_size = getattr(settings, 'CUSTOM_UPLOAD_MAX_FILE_SIZE', 10 * 2 ** 30)    # default 10GB
+        max_size = get_upload_max_size(layout=self.layout, raw=self.raw)
         if max_size is None:
             return
         if content_length > max_size:
             raise RequestDataTooBig(gettext('上传文件超过大小限制'))
 
+    def receive_raw_stream(self, stream, content_length: int, file_name: str,
+                           content_type: str = 'application/octet-stream'):
+        """
+        请求体是对象数据(application/octet-stream)时，从请求体流(wsgi.input)按大块顺序读取数据写入ceph，同时计算MD5，
+        不经过Django的multipart解析
+
+        :param stream: 请求体流，有read(size)方法
+        :param content_length: 请求体长度
+        :param file_name: 文件名
+        :return:
+            CephUploadFile()
+        :raises: RequestDataTooBig, IOError
+        """
+        self.raw = True
+        self.compute_md5 = True
+        self.handle_raw_input(None, None, content_length, None)
+        self.new_file(field_name='file', file_name=file_name, content_type=content_type,
+                      content_length=content_length)
+        pos = 0
+        while pos < content_length:
+            data = stream.read(min(self.raw_read_size, content_length - pos))
+            if not data:
+                break
+
+            self.receive_data_chunk(data, pos)
+            pos += len(data)
+
+        if pos != content_length:
+            raise IOError(gettext('上传数据不完整'))
+
+        return self.file_complete(pos)
+
     def new_file(self, *args, **kwargs):
         """
         Create the file object to append to as data is coming in.
         """
         super().new_file(*args, **kwargs)
-        self.file = FileWrapper(HarborObject(pool_name=self.pool_name, obj_id=self.obj_key))
+        ho = HarborObject(pool_name=self.pool_name, obj_id=self.obj_key, layout=self.layout)
+        self.file = FileWrapper(ho)
+        try:
+            self.writer = ho.get_aio_writer(max_inflight=self.aio_max_inflight, write_size=self.aio_write_size)
+        except RadosError as e:
+            raise IOError(f'failed to open harbor object for writing, {str(e)}')
+        self.small_buffer = bytearray() if self.buffer_max_size > 0 else None
         if self.request:
-            if self.request.headers.get('Content-MD5', ''):
+            if self.compute_md5 or self.request.headers.get('Content-MD5', ''):
                 self.file_md5_handler = FileMD5Handler()
 
     def receive_data_chunk(self, raw_data, start):
-        self.file.write(raw_data, offset=start)
+        if self.small_buffer is not None:
+            if start + len(raw_data) <= self.buffer_max_size:
+                self.small_buffer[start:start + len(raw_data)] = raw_data
+                if self.file_md5_handler:
+                    self.file_md5_handler.update(offset=start, data=raw_data)
+                return
+
+            # 超过缓存大小，已缓存的数据转为写入ceph
+            buffered, self.small_buffer = bytes(self.small_buffer), None
+            if buffered:
+                try:
+                    self.writer.write(buffered, offset=0)
+                except RadosError as e:
+                    raise IOError(f'failed write data to harbor object, {str(e)}')
+
+        try:
+            self.writer.write(raw_data, offset=start)
+        except RadosError as e:
+            raise IOError(f'failed write data to harbor object, {str(e)}')
+
         if self.file_md5_handler:
             self.file_md5_handler.update(offset=start, data=raw_data)
 
     def file_complete(self, file_size):
+        # 等待所有异步写入完成
+        try:
+            self.writer.flush()
+        except RadosError as e:
+            raise IOError(f'failed write data to harbor object, {str(e)}')
+
+        buffered_data = None
+        compress_index = None
+        if self.small_buffer is not None:
+            buffered_data = bytes(self.small_buffer)
+            self.file.set_inline(buffered_data)
+        elif hasattr(self.writer, 'get_index'):
+            compress_index = self.writer.get_index()
+
         self.file.seek(0)
         self.file.size = file_size
         return CephUploadFile(
@@ -236,9 +355,18 @@ class FileUploadToCephHandler(FileUploadHandler):
             size=file_size,
             charset=self.charset,
             file_md5=self.file_md5(),
-            content_type_extra=self.content_type_extra
+            content_type_extra=self.content_type_extra,
+            buffered_data=buffered_data,
+            compress_index=compress_index
         )
 
+    def abort_writes(self):
+        """
+        上传出错时，丢弃未写入的数据并等待在途的异步写完成，之后才能安全的删除对象数据
+        """
+        if self.writer is not None:
+            self.writer.abort()
+
     def file_md5(self):
         fmh = self.file_md5_handler
         if fmh:
@@ -246,3 +374,89 @@ class FileUploadToCephHandler(FileUploadHandler):
 
         return ''
 
+
+class ChunkUploadToCephHandler(FileUploadHandler):
+    """
+    分块上传(向对象offset处写入一块数据)直接写入ceph的上传处理器
+
+    文件字段field_name的数据边接收边通过aio异步流水线写入对象offset处，同时计算MD5，不在本地内存或临时文件中缓存；
+    接收的数据超过size时立即中止；其他文件字段交给之后的上传处理器；
+    对象元数据由调用者在上传前更新，上传失败时由调用者回滚
+    """
+    aio_max_inflight = 4        # 同时在途的异步写最大数
+    aio_write_size = 16 * 2 ** 20   # 合并写入块大小16MB
+
+    def __init__(self, request=None, rados=None, offset: int = 0, size: int = 0, field_name: str = 'chunk'):
+        """
+        :param rados: 对象的HarborObject()
+        :param offset: 数据块写入对象的偏移量
+        :param size: 数据块大小
+        :param field_name: 数据块的文件字段名
+        """
+        super().__init__(request=request)
+        self.rados = rados
+        self.offset = offset
+        self.size = size
+        self.target_field = field_name
+        self.active = False
+        self.writer = None
+        self.md5_hash = None
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        if field_name != self.target_field or self.writer is not None:
+            self.active = False
+            return
+
+        try:
+            self.writer = self.rados.get_aio_writer(max_inflight=self.aio_max_inflight, write_size=self.aio_write_size)
+        except RadosError as e:
+            raise IOError(f'failed to open harbor object for writing, {str(e)}')
+
+        self.active = True
+        self.md5_hash = hashlib.md5()
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+
+        if start + len(raw_data) > self.size:
+            raise IOError(gettext('文件块大小超过chunk_size'))
+
+        try:
+            self.writer.write(raw_data, offset=self.offset + start)
+        except RadosError as e:
+            raise IOError(f'failed write data to harbor object, {str(e)}')
+
+        self.md5_hash.update(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+
+        self.active = False
+        try:
+            self.writer.flush()
+        except RadosError as e:
+            raise IOError(f'failed write data to harbor object, {str(e)}')
+
+        return CephUploadFile(
+            file=FileWrapper(self.rados),
+            field_name=self.field_name,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            file_md5=self.md5_hash.hexdigest(),
+            content_type_extra=self.content_type_extra
+        )
+
+    def abort_writes(self):
+        """
+        上传出错时，丢弃未写入的数据并等待在途的异步写完成
+        """
+        if self.writer is not None:
+            self.writer.abort()
+
@@ -0,0 +1,60 @@
+import os
+import unittest
+from datetime import datetime, timezone
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "webserver.settings")
+from django.utils.http import http_date
+
+from .http_range import parse_range_header, coalesce_ranges, if_range_match, RangeNotSatisfiable, MAX_RANGES
+
+
+class TestParseRangeHeader(unittest.TestCase):
+    def test_single(self):
+        self.assertEqual(parse_range_header('bytes=0-499', 1000), [(0, 499)])
+        self.assertEqual(parse_range_header('bytes=500-', 1000), [(500, 999)])
+        self.assertEqual(parse_range_header('bytes=900-2000', 1000), [(900, 999)])
+
+    def test_suffix(self):
+        self.assertEqual(parse_range_header('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=-2000', 1000), [(0, 999)])
+        self.assertEqual(parse_range_header('bytes=0-0,-1', 1000), [(0, 0), (999, 999)])
+
+    def test_unsatisfiable(self):
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header('bytes=1000-', 1000)
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header('bytes=-0', 1000)
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header('bytes=-10', 0)
+        # 部分范围可满足时只返回可满足的范围
+        self.assertEqual(parse_range_header('bytes=2000-3000,0-9', 1000), [(0, 9)])
+
+    def test_invalid_ignored(self):
+        for header in ('items=0-9', 'bytes=9-0', 'bytes=a-9', 'bytes=-', 'bytes 0-9'):
+            self.assertIsNone(parse_range_header(header, 1000), msg=header)
+
+        too_many = 'bytes=' + ','.join(f'{i * 10}-{i * 10}' for i in range(MAX_RANGES + 1))
+        self.assertIsNone(parse_range_header(too_many, 10000))
+
+    def test_coalesce(self):
+        self.assertEqual(parse_range_header('bytes=0-99,50-149,150-199', 1000), [(0, 199)])
+        self.assertEqual(parse_range_header('bytes=500-599,0-99', 1000), [(500, 599), (0, 99)])  # 不重叠时保持顺序
+        self.assertEqual(coalesce_ranges([(500, 599), (0, 99), (90, 120)]), [(0, 120), (500, 599)])
+
+
+class TestIfRange(unittest.TestCase):
+    def test_etag(self):
+        self.assertTrue(if_range_match('', '"abc"', None))
+        self.assertTrue(if_range_match('"abc"', '"abc"', None))
+        self.assertFalse(if_range_match('"abd"', '"abc"', None))
+        self.assertFalse(if_range_match('W/"abc"', '"abc"', None))     # 弱标签不能用于If-Range
+
+    def test_date(self):
+        mtime = datetime(2020, 3, 4, 8, 5, 28, tzinfo=timezone.utc)
+        self.assertTrue(if_range_match(http_date(mtime.timestamp()), '"abc"', mtime))
+        self.assertFalse(if_range_match(http_date(mtime.timestamp() - 1), '"abc"', mtime))
+        self.assertFalse(if_range_match('not a date', '"abc"', mtime))
+
+
+if __name__ == '__main__':
+    unittest.main()
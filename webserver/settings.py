@@ -237,6 +237,67 @@ CEPH_RADOS = {
     'CONF_FILE_PATH': '/etc/ceph/ceph.conf',
     'KEYRING_FILE_PATH': '/etc/ceph/ceph.client.obs.keyring',
     'POOL_NAME': ('obs',),
+    # 对象数据存储后端，'rados': ceph集群(默认)；'localfs': 本地文件系统(稀疏文件)，用于开发测试和基准测试
+    'BACKEND': 'rados',
+    'LOCAL_ROOT': '/data/iharbor',     # localfs后端的数据目录
+    # 下载对象时后台线程预读的数据块数，存储读取与网络发送重叠进行，0不预读；每个下载最多多占用(READ_AHEAD_DEPTH * 数据块大小)内存
+    'READ_AHEAD_DEPTH': 2,
+    # 新建对象的条带布局(stripe_unit, stripe_count[, object_size])，按桶名或pool名配置，桶名优先；
+    # 未配置的使用旧布局(按2GB分part)，已存在的对象保持原布局
+    'STRIPE_LAYOUT': {
+        'BUCKETS': {},  # {'bucket_name': (4 * 1024 ** 2, 4)}
+        'POOLS': {},    # {'pool_name': (4 * 1024 ** 2, 4)}
+    },
+    # 小对象打包，首次写入的小对象数据追加写入共享的pack文件(rados对象)，减少rados对象数量；
+    # 被删除或覆盖的对象占用的pack空间由compactpacks命令回收
+    'PACK': {
+        'ENABLE': False,
+        'MAX_OBJECT_SIZE': 1024 ** 2,   # 不大于此大小的对象打包
+        'PACK_SIZE': 64 * 1024 ** 2,    # pack文件大小上限，写满后封存
+        'PACK_MAX_AGE': 3600,           # pack文件打开写入的最长时间(秒)，超过后封存
+    },
+    # 对象数据去重，上传完成的对象MD5和大小与同一pool中已有数据相同时，共享一份数据(blob)，按引用计数回收
+    'DEDUP': {
+        'ENABLE': False,
+        'MIN_SIZE': 4 * 1024 ** 2,      # 不小于此大小的对象去重
+        'VERIFY': True,                 # 共享数据前比较数据内容，避免MD5碰撞
+        'ALLOW_UPFRONT': False,         # 允许只提供MD5和大小秒传；知道MD5和大小即可获得数据，多用户时慎用
+    },
+    # 启用了数据压缩的桶(Bucket.compress)，上传的对象数据按此块大小分块压缩，范围读取只解压涉及的块
+    'COMPRESS_BLOCK_SIZE': 1024 ** 2,
+}
+
+# 热点对象缓存，公共和分享下载的小对象数据缓存在每个进程的内存中，可选本地磁盘层(多进程共享目录)；
+# 缓存key包含对象修改时间和大小，对象修改后旧缓存自然失效
+OBJECT_CACHE = {
+    'ENABLE': False,
+    'MEMORY_SIZE': 128 * 1024 ** 2,     # 每个进程内存层容量
+    'MAX_OBJECT_SIZE': 8 * 1024 ** 2,   # 大于此大小的对象不缓存
+    'DISK_DIR': '',                     # 磁盘层目录，为空不使用磁盘层
+    'DISK_SIZE': 10 * 1024 ** 3,        # 磁盘层容量
+}
+
+# 对象下载响应的Cache-Control，公共权限桶的对象允许浏览器和CDN等共享缓存缓存max-age秒；
+# 其他对象只允许私有缓存，每次使用前通过ETag/Last-Modified验证(未修改时返回304)
+DOWNLOAD_CACHE_CONTROL = {
+    'PUBLIC': 'public, max-age=3600',
+    'PRIVATE': 'private, no-cache',
+}
+
+# 下载暂存层，公共权限桶的热点对象数据写入本地磁盘(SSD)文件，之后的完整下载由web服务器或uwsgi offload线程发送文件，
+# 不占用uwsgi工作线程；对象删除或覆盖时删除暂存文件，见utils.oss.staging
+DOWNLOAD_STAGING = {
+    'ENABLE': False,
+    'DIR': '/data/iharbor_staging',
+    'SIZE': 100 * 1024 ** 3,            # 暂存区容量
+    'TTL': 24 * 3600,                   # 暂存文件超过此时间(秒)未使用时删除
+    'MIN_OBJECT_SIZE': 1024 ** 2,       # 暂存的对象大小范围，更小的对象由热点对象缓存(OBJECT_CACHE)处理
+    'MAX_OBJECT_SIZE': 4 * 1024 ** 3,
+    'MIN_HITS': 2,                      # 对象访问次数(进程内估计)达到此值后暂存
+    # 'nginx': X-Accel-Redirect，nginx需配置internal location映射到DIR；'sendfile': X-Sendfile(apache、lighttpd)；
+    # 'uwsgi': wsgi.file_wrapper发送，uwsgi需配置offload-threads，范围请求不使用暂存文件
+    'OFFLOAD': 'nginx',
+    'NGINX_LOCATION': '/_staging/',
 }
 
 # 日志配置
@@ -425,6 +486,29 @@ SWAGGER_SETTINGS = {
 
 # 自定义文件上传处理文件大小限制, type: int
 CUSTOM_UPLOAD_MAX_FILE_SIZE = 10 * 2**30  # 10GB; None: 无限制
+# 请求体是对象数据(application/octet-stream)上传条带布局的对象时的大小限制, type: int; None: 无限制
+CUSTOM_UPLOAD_RAW_MAX_FILE_SIZE = None
+
+# 归档文件(tar/zip)上传解压：WORKERS并行写入rados的线程数；BATCH_SIZE每批插入元数据的对象数；MAX_ENTRIES一个归档的条目数上限；
+# ZIP_MAX_SIZE zip归档文件大小上限(zip需要先写入临时文件再解压)，None不限制；EXPORT_READ_AHEAD目录打包下载时读取对象数据的后台预读块数
+ARCHIVE_UPLOAD = {
+    'WORKERS': 8,
+    'BATCH_SIZE': 500,
+    'MAX_ENTRIES': 100000,
+    'ZIP_MAX_SIZE': 10 * 2**30,     # 10GB
+    'EXPORT_READ_AHEAD': 2,
+}
+
+# 批量删除对象：BATCH_SIZE每批查询和删除元数据的对象数；MAX_KEYS一次请求最多删除的对象数；MAX_INFLIGHT同时在途的rados异步删除数
+BULK_DELETE = {
+    'BATCH_SIZE': 1000,
+    'MAX_KEYS': 10000,
+    'MAX_INFLIGHT': 32,
+}
+
+# 不大于此大小(字节)的小对象数据内联存储在元数据中(桶表inl字段)，读写不访问rados；对象增大超过此大小时转存到rados；0: 不内联；
+# 启用前已存在的桶表需要先添加inl字段: manage.py upgradebuckettable，建议值4 * 1024
+INLINE_OBJECT_MAX_SIZE = 0
 
 # 导入安全相关的settings
 from .security_settings import *
@@ -14,3 +14,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "webserver.settings")
 
 application = get_wsgi_application()
+
+# uwsgi master加载应用后fork工作进程，工作进程中重置继承的ceph集群连接
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    pass
+else:
+    from utils.oss.connections import reset_connections
+    postfork(reset_connections)